@@ -1,4 +1,5 @@
 from .experimental_results.result_location import ResearchDataLocation
 from .trace_data.alibaba_gpu_2020 import Alibaba2020TraceData
+from .trace_data.cluster_simulator import ClusterSimulator
 
-__all__ = ["Alibaba2020TraceData", "ResearchDataLocation"]
+__all__ = ["Alibaba2020TraceData", "ClusterSimulator", "ResearchDataLocation"]
@@ -1,13 +1,151 @@
+import hashlib
+import json
+import operator
 import os
+import re
 import tarfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urljoin
 
+import numpy as np
 import pandas as pd
 import requests
+from pandas.api.extensions import ExtensionDtype, take
+from pandas.api.types import union_categoricals
+from pandas.tseries.frequencies import to_offset
 
 
 class Alibaba2020TraceData:
     _instances = {}  # Dictionary to store the instance
+    # bump to invalidate the cache files when the way they are built changes
+    CacheVersion = 1
+    # text columns stored as categoricals in the cache files
+    CategoryColumns = (
+        "status",
+        "status_task",
+        "status_instance",
+        "gpu_type",
+        "gpu_type_machine",
+        "gpu_type_spec",
+        "gpu_name",
+        "workload",
+    )
+    # the dtypes of the columns of every table, the times are float64 s since epoch
+    Schemas = {
+        "pai_job_table": {
+            "job_name": "str",
+            "inst_id": "str",
+            "user": "category",
+            "status": "category",
+            "start_time": "float64",
+            "end_time": "float64",
+        },
+        "pai_task_table": {
+            "job_name": "str",
+            "task_name": "category",
+            "inst_num": "float32",
+            "status": "category",
+            "start_time": "float64",
+            "end_time": "float64",
+            "plan_cpu": "float32",
+            "plan_mem": "float32",
+            "plan_gpu": "float32",
+            "gpu_type": "category",
+        },
+        "pai_instance_table": {
+            "job_name": "str",
+            "task_name": "category",
+            "inst_name": "str",
+            "worker_name": "str",
+            "inst_id": "str",
+            "status": "category",
+            "start_time": "float64",
+            "end_time": "float64",
+            "machine": "category",
+        },
+        "pai_machine_spec": {
+            "machine": "category",
+            "gpu_type": "category",
+            "cap_cpu": "float32",
+            "cap_mem": "float32",
+            "cap_gpu": "float32",
+        },
+        "pai_group_tag_table": {
+            "inst_id": "str",
+            "user": "category",
+            "gpu_type_spec": "category",
+            "group": "category",
+            "workload": "category",
+        },
+        "pai_sensor_table": {
+            "job_name": "str",
+            "task_name": "category",
+            "worker_name": "str",
+            "inst_id": "str",
+            "machine": "category",
+            "gpu_name": "category",
+            "cpu_usage": "float32",
+            "gpu_wrk_util": "float32",
+            "avg_mem": "float32",
+            "max_mem": "float32",
+            "avg_gpu_wrk_mem": "float32",
+            "max_gpu_wrk_mem": "float32",
+            # bytes and counts outgrow the precision of float32
+            "read": "float64",
+            "write": "float64",
+            "read_count": "float64",
+            "write_count": "float64",
+        },
+        "pai_machine_metric": {
+            "worker_name": "str",
+            "machine": "category",
+            "start_time": "float64",
+            "end_time": "float64",
+            "machine_cpu_iowait": "float32",
+            "machine_cpu_kernel": "float32",
+            "machine_cpu_usr": "float32",
+            "machine_gpu": "float32",
+            "machine_load_1": "float32",
+            "machine_net_receive": "float32",
+            "machine_num_worker": "float32",
+            "machine_cpu": "float32",
+        },
+    }
+    # the tables merged into the job table, in order: type, join keys and join type
+    MergePlan = (
+        ("task", ("job_name",), "inner"),
+        ("instance", ("job_name", "task_name"), "inner"),
+        ("machine", ("machine",), "left"),
+        ("sensor", ("worker_name",), "left"),
+        ("group", ("inst_id", "user"), "left"),
+    )
+    # the duplicated columns dropped from the merged table
+    MergedDropColumns = (
+        "inst_id_instance",
+        "gpu_type_machine",
+        "job_name_sensor",
+        "task_name_sensor",
+        "inst_id_sensor",
+        "machine_sensor",
+    )
+    # the columns computed after the merge and the merged columns they are computed from
+    DerivedColumns = {
+        "run_time": ("end_time", "start_time"),
+        "wait_time": ("start_time_instance", "start_time"),
+        "hours": ("start_date",),
+        "end_hours": ("end_date",),
+    }
+    # a whole GPU in the integer units of the occupancy sweeps, 1/100 of a % of plan_gpu
+    GpuUnits = 10_000
+    # the tables too large to parse at once, read in chunks of this many rows
+    ChunkedTables = ("pai_sensor_table", "pai_machine_metric")
+    ChunkSize = 1_000_000
+    # where the tarballs and the header files of the tables are published
+    TraceLink = "https://aliopentrace.oss-cn-beijing.aliyuncs.com/v2020GPUTraces"
+    HeaderLink = "https://raw.githubusercontent.com/alibaba/clusterdata/master/cluster-trace-gpu-v2020/data"
+    # the bytes written at once while streaming a download
+    DownloadChunkSize = 1 << 20
 
     def __new__(cls, *args, **kwargs):
         """Singleton pattern to ensure only one instance of the class is created."""
@@ -85,8 +223,7 @@ class Alibaba2020TraceData:
         """
         if data_name not in self._data_name.values():
             raise ValueError(f"Data name {data_name} is not valid.")
-        _base_link = "https://aliopentrace.oss-cn-beijing.aliyuncs.com/v2020GPUTraces"
-        return f"{_base_link}/{data_name}.tar.gz"
+        return f"{self.TraceLink}/{data_name}.tar.gz"
 
     def _build_2020_trace_header_link(self, data_name: str):
         """Build the link to download the header file of the trace data.
@@ -100,26 +237,141 @@ class Alibaba2020TraceData:
         """
         if data_name not in self._data_name.values():
             raise ValueError(f"Data name {data_name} is not valid.")
-        _base_link = "https://raw.githubusercontent.com/alibaba/clusterdata/master/cluster-trace-gpu-v2020/data"
-        return f"{_base_link}/{data_name}.header"
+        return f"{self.HeaderLink}/{data_name}.header"
 
-    def _build_cache_file(self, data_type: str) -> str:
+    @staticmethod
+    def _pyarrow_enabled() -> bool:
+        """Whether pyarrow is installed, to parse the csv files and store the cache files in Parquet."""
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _sources(self, data_type: str) -> List[str]:
+        """The files a type of data is built from.
+
+        Args:
+            data_type (str): The type of the data.
+
+        Returns:
+            List[str]: The csv, or the tarball when it was not extracted, and header files
+                of the trace tables the data is built from.
+
+        """
+        if data_type in self._data_name.keys():
+            _names = [self._data_name[data_type]]
+        else:
+            # the merged tables and everything derived from them
+            _names = [
+                self._data_name[t]
+                for t in ["job", "task", "instance", "machine", "sensor", "group"]
+            ]
+        _files = []
+        for name in _names:
+            _csv = os.path.join(self.target_dir, f"{name}.csv")
+            _tar = os.path.join(self.target_dir, f"{name}.tar.gz")
+            # a table streamed from its tarball has no csv file
+            if not os.path.isfile(_csv) and os.path.isfile(_tar):
+                _csv = _tar
+            _files += [_csv, os.path.join(self.target_dir, f"{name}.header")]
+        return _files
+
+    @staticmethod
+    def _sha256(file_path: str) -> str:
+        """Get the sha256 hex digest of a file, read in chunks."""
+        _hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                _hash.update(chunk)
+        return _hash.hexdigest()
+
+    def _checksum(self, file_path: str) -> str:
+        """Get the sha256 of a file, remembered until its size or modification time changes.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            str: The hex digest, or "missing" when the file does not exist.
+
+        """
+        if not os.path.isfile(file_path):
+            return "missing"
+        _stat = os.stat(file_path)
+        _memo_file = os.path.join(self.cache_dir, "checksums.json")
+        _memo = {}
+        if os.path.isfile(_memo_file):
+            with open(_memo_file, "r") as f:
+                _memo = json.load(f)
+        _key = os.path.abspath(file_path)
+        _size, _mtime, _digest = _memo.get(_key, (None, None, None))
+        if _size == _stat.st_size and _mtime == _stat.st_mtime_ns:
+            return _digest
+        print(f"Computing the checksum of {file_path}...")
+        _memo[_key] = (_stat.st_size, _stat.st_mtime_ns, self._sha256(file_path))
+        with open(_memo_file, "w") as f:
+            json.dump(_memo, f)
+        return _memo[_key][2]
+
+    def _cache_key(self, data_type: str) -> str:
+        """Build the key of a cache file from the checksums of the files it is built from.
+
+        Args:
+            data_type (str): The type of the data.
+
+        Returns:
+            str: The key of the cache file.
+
+        """
+        _hash = hashlib.sha256(f"v{self.CacheVersion}".encode())
+        for file_path in self._sources(data_type):
+            _hash.update(self._checksum(file_path).encode())
+        return _hash.hexdigest()[:16]
+
+    def _build_cache_file(self, data_type: str, key: Optional[str] = None) -> str:
         """Build the cache file path.
 
         Args:
             data_type (str): The type of the data.
+            key (str, optional): The key of the cache file. Default is None, which builds
+                the key from the current source files.
 
         Returns:
             str: The cache file path.
 
         """
-        file_name = f"{data_type}_cache.csv"
+        key = key or self._cache_key(data_type)
+        extension = "parquet" if self._pyarrow_enabled() else "pkl"
+        file_name = f"{data_type}_{key}.{extension}"
         dir_path = self.cache_dir
         return os.path.join(dir_path, file_name)
 
+    def _typed(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Store the low-cardinality text columns as categoricals.
+
+        Args:
+            data (pd.DataFrame): The data to store.
+
+        Returns:
+            pd.DataFrame: The data with categorical columns.
+
+        """
+        _columns = {
+            column: "category"
+            for column in data.columns
+            if column in self.CategoryColumns
+            and not isinstance(data[column].dtype, pd.CategoricalDtype)
+        }
+        return data.astype(_columns) if len(_columns) > 0 else data
+
     def _store_cache(self, data_type: str, data: pd.DataFrame, cache_file: bool = True):
         """Store the data into cache file or memory.
 
+        The cache file is Parquet, or a pickle when pyarrow is not installed, so the dtypes,
+        categoricals and timezones survive the round trip. Its name holds the checksum of
+        the files the data is built from, the files built from older sources are removed.
+
         Args:
             data_type (str): The type of the data.
             data (pd.DataFrame): The data to store.
@@ -128,43 +380,87 @@ class Alibaba2020TraceData:
         Returns:
 
         """
+        data = self._typed(data)
         if cache_file:
             cache_file = self._build_cache_file(data_type)
-            data.to_csv(cache_file, index=True)
+            if cache_file.endswith(".parquet"):
+                data.to_parquet(cache_file, engine="pyarrow", index=True)
+            else:
+                data.to_pickle(cache_file)
             if os.path.isfile(cache_file):
                 print(f"{data_type} cache file have been saved.")
             else:
                 raise ValueError(f"Failed to save {data_type} cache file.")
+            self._remove_stale_cache(data_type, cache_file)
         self._cache[data_type] = data
 
-    def _get_cache(self, data_type: str) -> pd.DataFrame:
+    def _remove_stale_cache(self, data_type: str, cache_file: str):
+        """Remove the cache files of a type of data built from older sources.
+
+        Args:
+            data_type (str): The type of the data.
+            cache_file (str): The current cache file, which is kept.
+
+        Returns:
+            None
+
+        """
+        _pattern = re.compile(
+            rf"^{re.escape(data_type)}_[0-9a-f]{{16}}\.(parquet|pkl)$"
+        )
+        for file_name in os.listdir(self.cache_dir):
+            _stale = os.path.join(self.cache_dir, file_name)
+            if _pattern.match(file_name) and _stale != cache_file:
+                os.remove(_stale)
+
+    def _get_cache(
+        self, data_type: str, columns: Optional[List[str]] = None
+    ) -> Optional[pd.DataFrame]:
         """Get the cache data from memory or cache file.
 
         Args:
             data_type (str): The type of the data.
+            columns (List[str], optional): The columns to load. Default is None, which loads
+                all of them. Only these columns are read from a Parquet cache file.
 
         Returns:
             pd.DataFrame: The cache data.
 
         """
-        cache_file = self._build_cache_file(data_type)
-        if data_type not in self._cache.keys() and os.path.isfile(cache_file):
-            print(f"Loading {data_type} cache file...")
-            _cache = pd.read_csv(cache_file, index_col=0)
-        elif data_type in self._cache.keys():
+        if data_type in self._cache.keys():
             print(f"Loading {data_type} cache from memory...")
             _cache = self._cache[data_type]
+            return _cache if columns is None else _cache[columns]
+        cache_file = self._build_cache_file(data_type)
+        if os.path.isfile(cache_file):
+            print(f"Loading {data_type} cache file...")
+            if cache_file.endswith(".parquet"):
+                _cache = pd.read_parquet(cache_file, engine="pyarrow", columns=columns)
+            else:
+                _cache = pd.read_pickle(cache_file)
+                _cache = _cache if columns is None else _cache[columns]
+            if columns is None:
+                self._cache[data_type] = _cache
         else:
             print(f"{data_type} cache not found.")
             _cache = None
         return _cache
 
-    def download_single_trace_data(self, data_name: str, force=False):
+    def download_single_trace_data(
+        self,
+        data_name: str,
+        force=False,
+        checksum: Optional[str] = None,
+        extract: bool = True,
+    ):
         """Download a single trace data.
 
         Args:
             data_name (str): The name of the trace data.
             force (bool): Whether to force download the data.
+            checksum (str): The expected sha256 of the tarball. Default is None, which skips the verification.
+            extract (bool): Whether to extract the csv file. Default is True. Otherwise the csv file is
+                streamed from the tarball into the cache file when the data is loaded.
 
         Returns:
             None
@@ -178,47 +474,173 @@ class Alibaba2020TraceData:
             print(f"{file_name} have been downloaded.")
         else:
             print(f"Downloading {file_name}...")
-            self.download(url, file_path)
-        print(f"Extracting {file_name}...")
-        self.extract(file_path, self.target_dir)
+            self.download(url, file_path, force=force, checksum=checksum)
+        if extract:
+            print(f"Extracting {file_name}...")
+            self.extract(file_path, self.target_dir)
         header_file_name = file_name.replace(".tar.gz", ".header")
         header_url = urljoin(header_link, header_file_name)
         print(f"Downloading {header_file_name}...")
-        self.download(header_url, os.path.join(self.target_dir, header_file_name))
+        self.download(
+            header_url, os.path.join(self.target_dir, header_file_name), force=force
+        )
+
+    def download_all_trace_data(
+        self,
+        force=False,
+        max_workers: int = 4,
+        checksums: Optional[Dict[str, str]] = None,
+        extract: bool = True,
+    ):
+        """Download all trace data concurrently.
+
+        Every table is downloaded and then extracted by its own worker, so the extraction of a table
+        overlaps with the downloads of the others.
+
+        Args:
+            force (bool): Whether to force download the data.
+            max_workers (int): The number of tables downloaded at once. Default is 4.
+            checksums (Dict[str, str]): The expected sha256 of the tarball of every data name.
+                Default is None, which skips the verification.
+            extract (bool): Whether to extract the csv files, see `download_single_trace_data`.
+                Default is True.
 
-    def download_all_trace_data(self):
-        """Download all trace data."""
-        for data_name in self._data_name.values():
-            self.download_single_trace_data(data_name)
+        Returns:
+            None
+
+        """
+        _checksums = checksums or {}
+        _failures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            _futures = {
+                executor.submit(
+                    self.download_single_trace_data,
+                    data_name,
+                    force,
+                    _checksums.get(data_name),
+                    extract,
+                ): data_name
+                for data_name in self._data_name.values()
+            }
+            for future in as_completed(_futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Failed to download {_futures[future]}: {e}")
+                    _failures[_futures[future]] = e
+        if len(_failures) > 0:
+            raise RuntimeError(
+                f"Failed to download {sorted(_failures)}, run again to resume them."
+            )
 
-    def download(self, url, targe_file, force=False):
+    def download(
+        self,
+        url,
+        targe_file,
+        force=False,
+        checksum: Optional[str] = None,
+        retries: int = 3,
+        timeout: float = 60,
+    ):
         """Download the file from the url.
 
+        The body is streamed in chunks to a `.part` file next to the target, which is renamed to the
+        target once complete. An interrupted download is resumed from the end of the `.part` file
+        with an HTTP range request, by the next attempt or the next call.
+
         Args:
             url (str): The url to download the file.
             targe_file (str): The file path to store the downloaded file.
             force (bool): Whether to force download the file.
+            checksum (str): The expected sha256 of the file. Default is None, which skips the verification.
+            retries (int): The number of times an interrupted download is resumed. Default is 3.
+            timeout (float): The timeout of connecting and of every read, in seconds. Default is 60.
 
         Returns:
             None
+
+        Raises:
+            ValueError: The downloaded file does not match the checksum, it is removed.
         """
         if os.path.isfile(targe_file) and not force:
             return
-        response = requests.get(url)
-        with open(targe_file, "wb") as file:
-            file.write(response.content)
+        _part_file = f"{targe_file}.part"
+        if force and os.path.isfile(_part_file):
+            os.remove(_part_file)
+        for _attempt in range(retries + 1):
+            try:
+                self._download_part(url, _part_file, timeout)
+                break
+            except requests.RequestException as e:
+                if _attempt == retries:
+                    raise
+                print(f"Download of {url} interrupted ({e}), resuming...")
+        if checksum is not None:
+            _digest = self._sha256(_part_file)
+            if _digest != checksum.lower():
+                os.remove(_part_file)
+                raise ValueError(
+                    f"The checksum {_digest} of {url} does not match {checksum}."
+                )
+        os.replace(_part_file, targe_file)
+
+    def _download_part(self, url: str, part_file: str, timeout: float):
+        """Stream the rest of a download into its `.part` file.
+
+        Args:
+            url (str): The url to download the file.
+            part_file (str): The partial file, appended from its end.
+            timeout (float): The timeout of connecting and of every read, in seconds.
+
+        Returns:
+            None
+
+        """
+        _offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        _headers = {"Range": f"bytes={_offset}-"} if _offset > 0 else {}
+        with requests.get(
+            url, headers=_headers, stream=True, timeout=timeout
+        ) as response:
+            if response.status_code == 416:
+                # nothing past the part, it is complete unless the remote file shrank
+                _range = response.headers.get("Content-Range", "")
+                if _range == f"bytes */{_offset}":
+                    return
+                os.remove(part_file)
+                raise requests.HTTPError(
+                    f"{url} changed since the partial download, restarting.",
+                    response=response,
+                )
+            response.raise_for_status()
+            _mode = "wb"
+            if response.status_code == 206:
+                _range = response.headers.get("Content-Range", "")
+                if not _range.startswith(f"bytes {_offset}-"):
+                    os.remove(part_file)
+                    raise requests.HTTPError(
+                        f"Unexpected range {_range} of {url}.", response=response
+                    )
+                _mode = "ab"
+            # a server ignoring the range sends the whole file with 200, the part restarts
+            with open(part_file, _mode) as file:
+                for chunk in response.iter_content(self.DownloadChunkSize):
+                    file.write(chunk)
 
     def extract(self, tar_file, target_dir):
         """Extract the tar file to the target directory."""
         with tarfile.open(tar_file) as tar:
             tar.extractall(target_dir)
 
-    def get_df(self, data_type, force=False) -> pd.DataFrame:
+    def get_df(
+        self, data_type, force=False, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
         """Get the data frame of the trace data.
 
         Args:
             data_type (str): The type of the data.
             force (bool): Whether to force get the data.
+            columns (List[str], optional): The columns to get. Default is None, which gets
+                all of them.
 
         Returns:
             pd.DataFrame: The data frame of the trace data.
@@ -234,13 +656,15 @@ class Alibaba2020TraceData:
             _func = self._get_modified_merged_df
         elif data_type == "time_series":
             _func = self._get_time_series_data
+        elif data_type == "machine_occupancy":
+            _func = self._get_machine_occupancy_data
         else:
             raise ValueError(
-                f"Data type {data_type} is not valid. Only support {self._data_name.keys()} and 'merged' and 'modified_merged'."
+                f"Data type {data_type} is not valid. Only support {self._data_name.keys()} and 'merged', 'modified_merged', 'time_series' and 'machine_occupancy'."
             )
 
-        _cache = self._get_cache(data_type)
-        if force or _cache is None:
+        _cache = None if force else self._get_cache(data_type, columns)
+        if _cache is None:
             print(f"Constructing {data_type} data...")
             if data_name is None:
                 _cache = _func()
@@ -248,331 +672,1147 @@ class Alibaba2020TraceData:
             else:
                 _cache = _func(data_name)
                 self._store_cache(data_type, _cache, cache_file=False)
-        return self._get_cache(data_type)
+        return self._get_cache(data_type, columns)
 
-    def _get_df_from_csv(self, data_name: str) -> pd.DataFrame:
-        """Get the data frame from the csv file.
+    def _read_csv(
+        self,
+        csv_file: str,
+        header: List[str],
+        dtype: dict,
+        columns: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Parse a csv file with the dtypes of its columns.
+
+        The large tables are parsed in chunks whose categories are unified before they
+        are concatenated, so the text of one chunk at most is held as python objects.
+
+        Args:
+            csv_file (str): The csv file.
+            header (List[str]): The names of the columns.
+            dtype (dict): The dtypes of the columns.
+            columns (List[str], optional): The columns to parse. Default is None, which
+                parses all of them.
+
+        Returns:
+            pd.DataFrame: The data frame of the csv file.
+
+        """
+        if columns is not None:
+            dtype = {k: v for k, v in dtype.items() if k in columns}
+        data_name = os.path.splitext(os.path.basename(csv_file))[0]
+        if data_name not in self.ChunkedTables:
+            # the pyarrow parser cannot select the columns of a csv without a header
+            _pyarrow = self._pyarrow_enabled() and columns is None
+            return pd.read_csv(
+                csv_file,
+                header=None,
+                names=header,
+                usecols=columns,
+                dtype=dtype,
+                engine="pyarrow" if _pyarrow else "c",
+            )
+        chunks = list(
+            pd.read_csv(
+                csv_file,
+                header=None,
+                names=header,
+                usecols=columns,
+                dtype=dtype,
+                chunksize=self.ChunkSize,
+            )
+        )
+        return self._concat_chunks(chunks, dtype)
+
+    @staticmethod
+    def _concat_chunks(chunks: List[pd.DataFrame], dtype: dict) -> pd.DataFrame:
+        """Concatenate the chunks of a csv file, with their categories unified.
+
+        Args:
+            chunks (List[pd.DataFrame]): The chunks.
+            dtype (dict): The dtypes of the columns.
+
+        Returns:
+            pd.DataFrame: The data frame of the csv file.
+
+        """
+        if len(chunks) == 0:
+            return pd.DataFrame({k: pd.Series(dtype=v) for k, v in dtype.items()})
+        for column in [k for k, v in dtype.items() if v == "category"]:
+            _categories = union_categoricals(
+                [chunk[column] for chunk in chunks]
+            ).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(_categories)
+        return pd.concat(chunks, ignore_index=True)
+
+    def _read_header(self, data_name: str) -> Tuple[List[str], dict]:
+        """Read the names of the columns of a table and their dtypes.
 
         Args:
             data_name (str): The name of the data.
 
         Returns:
-            pd.DataFrame: The data frame of the trace data.
+            Tuple[List[str], dict]: The names of the columns and the dtypes of those in the schema.
 
         """
-        print(f"Loading {data_name} dataframes...")
-        csv_file = os.path.join(self.target_dir, f"{data_name}.csv")
         header_file = os.path.join(self.target_dir, f"{data_name}.header")
-        if not os.path.isfile(csv_file) or not os.path.isfile(header_file):
-            self.download_single_trace_data(data_name)
         with open(header_file, "r") as f:
             header = f.read().replace("\n", "").split(",")
-        df = pd.read_csv(csv_file, header=None, names=header)
+        _schema = self.Schemas.get(data_name, {})
+        # the columns missing from the schema are left to the parser
+        dtype = {column: _schema[column] for column in header if column in _schema}
+        return header, dtype
+
+    def _with_dates(self, df: pd.DataFrame, data_name: str) -> pd.DataFrame:
+        """Add the dates of the start and end times of the job, task and instance tables.
+
+        Args:
+            df (pd.DataFrame): The data frame of the table.
+            data_name (str): The name of the data.
+
+        Returns:
+            pd.DataFrame: The data frame with the dates.
+
+        """
         if data_name in [
             self._data_name["job"],
             self._data_name["task"],
             self._data_name["instance"],
         ]:
-            df["start_date"] = df["start_time"].apply(
-                pd.Timestamp, unit="s", tz="Asia/Shanghai"
+            for column, date_column in [
+                ("start_time", "start_date"),
+                ("end_time", "end_date"),
+            ]:
+                df[date_column] = pd.to_datetime(
+                    df[column], unit="s", utc=True
+                ).dt.tz_convert("Asia/Shanghai")
+        return df
+
+    def _get_df_from_csv(self, data_name: str) -> pd.DataFrame:
+        """Get the data frame from the csv file.
+
+        A table whose tarball was not extracted is streamed from it, see `_get_df_from_tar`.
+
+        Args:
+            data_name (str): The name of the data.
+
+        Returns:
+            pd.DataFrame: The data frame of the trace data.
+
+        """
+        print(f"Loading {data_name} dataframes...")
+        csv_file = os.path.join(self.target_dir, f"{data_name}.csv")
+        tar_file = os.path.join(self.target_dir, f"{data_name}.tar.gz")
+        header_file = os.path.join(self.target_dir, f"{data_name}.header")
+        if not os.path.isfile(header_file) or not (
+            os.path.isfile(csv_file) or os.path.isfile(tar_file)
+        ):
+            self.download_single_trace_data(data_name, extract=False)
+        if not os.path.isfile(csv_file):
+            return self._get_df_from_tar(data_name)
+        header, dtype = self._read_header(data_name)
+        df = self._read_csv(csv_file, header, dtype)
+        return self._with_dates(df, data_name)
+
+    def _get_keys(self, data_type: str, keys: List[str]) -> pd.DataFrame:
+        """Get the key columns of a trace table without the other columns.
+
+        The keys are taken from the table in memory, or read alone from its cache file or
+        csv file. Only a table left in its tarball is loaded as a whole, see `get_df`.
+
+        Args:
+            data_type (str): The type of the data, one of the trace tables.
+            keys (List[str]): The key columns.
+
+        Returns:
+            pd.DataFrame: The key columns of the table.
+
+        """
+        if data_type in self._cache or os.path.isfile(
+            self._build_cache_file(data_type)
+        ):
+            return self._get_cache(data_type, keys)
+        data_name = self._data_name[data_type]
+        csv_file = os.path.join(self.target_dir, f"{data_name}.csv")
+        header_file = os.path.join(self.target_dir, f"{data_name}.header")
+        if not (os.path.isfile(csv_file) and os.path.isfile(header_file)):
+            return self.get_df(data_type, columns=keys)
+        print(f"Loading {data_type} keys {keys}...")
+        header, dtype = self._read_header(data_name)
+        return self._read_csv(csv_file, header, dtype, columns=keys)
+
+    def _get_df_from_tar(self, data_name: str) -> pd.DataFrame:
+        """Get the data frame by streaming the csv file out of the tarball.
+
+        The decompressed csv is parsed in chunks of `ChunkSize` rows as it is read and never
+        written to disk. With pyarrow every chunk is appended to the Parquet cache file of the
+        table, which is then read back, so one chunk at most is held as python objects.
+
+        Args:
+            data_name (str): The name of the data.
+
+        Returns:
+            pd.DataFrame: The data frame of the trace data.
+
+        """
+        data_type = next(k for k, v in self._data_name.items() if v == data_name)
+        tar_file = os.path.join(self.target_dir, f"{data_name}.tar.gz")
+        header, dtype = self._read_header(data_name)
+        print(f"Streaming {data_name}.csv from {data_name}.tar.gz...")
+        # the members are read lazily, the gzip is decompressed front to back as they are read
+        with tarfile.open(tar_file, mode="r:gz") as tar:
+            member = next(
+                (
+                    m
+                    for m in tar
+                    if m.isfile() and os.path.basename(m.name) == f"{data_name}.csv"
+                ),
+                None,
             )
-            df["end_date"] = df["end_time"].apply(
-                pd.Timestamp, unit="s", tz="Asia/Shanghai"
+            if member is None:
+                raise ValueError(f"{tar_file} has no {data_name}.csv.")
+            chunks = (
+                self._with_dates(chunk, data_name)
+                for chunk in pd.read_csv(
+                    tar.extractfile(member),
+                    header=None,
+                    names=header,
+                    dtype=dtype,
+                    chunksize=self.ChunkSize,
+                )
             )
-        return df
+            if not self._pyarrow_enabled():
+                return self._concat_chunks(list(chunks), dtype)
+            cache_file = self._build_cache_file(data_type)
+            self._write_parquet(chunks, cache_file)
+        self._remove_stale_cache(data_type, cache_file)
+        return pd.read_parquet(cache_file, engine="pyarrow")
 
-    def _get_merged_df(self) -> pd.DataFrame:
-        print("Loading dataframes and preprocessing Job....")
-        job_df = self.get_df("job")
-        print("Loading dataframes and preprocessing Task....")
-        task_df = self.get_df("task")
-        print("Loading dataframes and preprocessing Instance....")
-        instance_df = self.get_df("instance")
-        print("Loading dataframes and preprocessing Other....")
-        machine_df = self.get_df("machine")
-        sensor_df = self.get_df("sensor")
-        group_df = self.get_df("group")
+    @staticmethod
+    def _write_parquet(chunks, cache_file: str):
+        """Append data frames of the same columns to a Parquet file, one row group each.
 
-        print("Merging dataframes...")
-        print("Merging job and task...")
-        merged_df = job_df.merge(task_df, on="job_name", suffixes=("", "_task"))
-        print("Merging job and task and instance...")
-        merged_df = merged_df.merge(
-            instance_df, on=["job_name", "task_name"], suffixes=("", "_instance")
-        )
-        print("Merging job and task and instance and machine...")
-        merged_df = merged_df.merge(
-            machine_df, on="machine", how="left", suffixes=("", "_machine")
-        )
-        print("Merging job and task and instance and machine and sensor...")
-        merged_df = merged_df.merge(
-            sensor_df, on="worker_name", how="left", suffixes=("", "_sensor")
-        )
-        merged_df = merged_df.merge(
-            group_df, on=["inst_id", "user"], how="left", suffixes=("", "_group")
-        )
-        merged_df.drop(
-            columns=[
-                "inst_id_instance",
-                "gpu_type_machine",
-                "job_name_sensor",
-                "task_name_sensor",
-                "inst_id_sensor",
-                "machine_sensor",
-            ],
-            inplace=True,
-        )
-        merged_df["run_time"] = merged_df["end_time"] - merged_df["start_time"]
-        merged_df["wait_time"] = (
-            merged_df["start_time_instance"] - merged_df["start_time"]
-        )
-        merged_df["hours"] = merged_df.start_date.apply(
-            lambda d: d.dayofyear * 24 + d.hour
-        )
-        merged_df["end_hours"] = merged_df.end_date.apply(
-            lambda d: d.dayofyear * 24 + d.hour
+        The categoricals are stored as dictionaries with 32-bit indices whatever the number of
+        categories of a chunk, so every chunk has the schema of the first one. The file is
+        written under a temporary name and only renamed once complete.
+
+        Args:
+            chunks (Iterable[pd.DataFrame]): The data frames.
+            cache_file (str): The Parquet file.
+
+        Returns:
+            None
+
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        _tmp_file = f"{cache_file}.tmp"
+        writer, schema = None, None
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    schema = pa.schema(
+                        [
+                            (
+                                pa.field(f.name, pa.dictionary(pa.int32(), pa.string()))
+                                if pa.types.is_dictionary(f.type)
+                                else f
+                            )
+                            for f in pa.Schema.from_pandas(chunk, preserve_index=False)
+                        ]
+                    )
+                    writer = pq.ParquetWriter(_tmp_file, schema)
+                writer.write_table(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                )
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            if os.path.isfile(_tmp_file):
+                os.remove(_tmp_file)
+            raise
+        if writer is None:
+            raise ValueError(f"No rows to write into {cache_file}.")
+        writer.close()
+        os.replace(_tmp_file, cache_file)
+
+    def _table_columns(self, data_type: str) -> List[str]:
+        """The columns of a trace table once loaded, following its schema.
+
+        Args:
+            data_type (str): The type of the table.
+
+        Returns:
+            List[str]: The columns of the table.
+
+        """
+        _columns = list(self.Schemas[self._data_name[data_type]])
+        if data_type in ["job", "task", "instance"]:
+            _columns += ["start_date", "end_date"]
+        return _columns
+
+    def _merged_columns(
+        self, columns: Optional[Dict[str, List[str]]] = None
+    ) -> Dict[str, Tuple[str, str]]:
+        """Find the table and column every column of the merged table comes from.
+
+        A column clashing with a column merged before it gets the suffix of its table, as
+        the merges of `MergePlan` name them.
+
+        Args:
+            columns (Dict[str, List[str]], optional): The columns of the tables to merge,
+                keyed by their type. Default is None, which merges every table with the
+                columns of its schema.
+
+        Returns:
+            Dict[str, Tuple[str, str]]: The type of the table and the name of the column in
+                the table, keyed by the name of the column in the merged table.
+
+        """
+        if columns is None:
+            columns = {
+                data_type: self._table_columns(data_type)
+                for data_type in ["job"] + [t for t, _, _ in self.MergePlan]
+            }
+        _owners = {c: ("job", c) for c in columns["job"]}
+        for data_type, keys, _ in self.MergePlan:
+            if data_type not in columns:
+                continue
+            for column in columns[data_type]:
+                if column in keys:
+                    continue
+                _name = column if column not in _owners else f"{column}_{data_type}"
+                _owners[_name] = (data_type, column)
+        return _owners
+
+    @staticmethod
+    def _take(series: pd.Series, positions: np.ndarray) -> Any:
+        """Take the values of a column at row positions, -1 gives a missing value."""
+        _fill = bool((positions < 0).any())
+        if isinstance(series.dtype, ExtensionDtype):
+            return series.array.take(positions, allow_fill=_fill)
+        return take(series.to_numpy(), positions, allow_fill=_fill)
+
+    def _merge(
+        self, tables: Dict[str, pd.DataFrame], drop: Tuple[str, ...] = ()
+    ) -> pd.DataFrame:
+        """Merge the trace tables along `MergePlan`, skipping the tables not given.
+
+        The joins run on narrow frames of the join keys and the row positions of the tables,
+        which yields the position of every merged row in every table. The merged table is
+        then assembled column by column by taking those rows, so no intermediate wide table
+        is built and the dropped columns are never copied. The rows come in the order of a
+        chain of `pd.merge` calls.
+
+        Args:
+            tables (Dict[str, pd.DataFrame]): The tables keyed by their type.
+            drop (Tuple[str, ...]): The columns of the merged table to leave out.
+
+        Returns:
+            pd.DataFrame: The merged table.
+
+        """
+        _owners = self._merged_columns(
+            {t: list(df.columns) for t, df in tables.items()}
         )
+        _steps = [step for step in self.MergePlan if step[0] in tables]
+        # the key columns every table brings into the narrow frame
+        _keys: Dict[str, List[str]] = {data_type: [] for data_type in tables}
+        for _, keys, _ in _steps:
+            for key in keys:
+                _type, _column = _owners[key]
+                if _column not in _keys[_type]:
+                    _keys[_type].append(_column)
+        _rows = tables["job"][_keys["job"]].reset_index(drop=True)
+        _rows["__job"] = np.arange(len(_rows))
+        for data_type, keys, how in _steps:
+            print(f"Merging {data_type}...")
+            _table = tables[data_type]
+            _right = _table[list(dict.fromkeys(list(keys) + _keys[data_type]))]
+            _right = _right.reset_index(drop=True)
+            _right[f"__{data_type}"] = np.arange(len(_right))
+            _rows = _rows.merge(_right, on=list(keys), how=how)
+            if how == "left":
+                _rows[f"__{data_type}"] = (
+                    _rows[f"__{data_type}"].fillna(-1).astype(np.int64)
+                )
+        _data = {}
+        for name, (data_type, column) in _owners.items():
+            if name in drop:
+                continue
+            _positions = _rows[f"__{data_type}"].to_numpy()
+            _data[name] = self._take(tables[data_type][column], _positions)
+        return pd.DataFrame(_data, copy=False)
+
+    @staticmethod
+    def _derive(merged_df: pd.DataFrame, column: str) -> pd.Series:
+        """Compute a column of `DerivedColumns` from the merged table.
+
+        Args:
+            merged_df (pd.DataFrame): The merged table.
+            column (str): The derived column.
+
+        Returns:
+            pd.Series: The values of the column.
+
+        """
+        if column == "run_time":
+            return merged_df["end_time"] - merged_df["start_time"]
+        if column == "wait_time":
+            return merged_df["start_time_instance"] - merged_df["start_time"]
+        if column in ["hours", "end_hours"]:
+            _dates = merged_df["start_date" if column == "hours" else "end_date"]
+            _hours = _dates.dt.dayofyear * 24 + _dates.dt.hour
+            return _hours if _hours.hasnans else _hours.astype(np.int64)
+        raise ValueError(f"Column {column} is not a derived column.")
+
+    def _get_merged_df(self) -> pd.DataFrame:
+        tables = {}
+        for data_type in ["job", "task", "instance", "machine", "sensor", "group"]:
+            print(f"Loading dataframes and preprocessing {data_type}....")
+            tables[data_type] = self.get_df(data_type)
         # imitate the author's method to filter the data
         # original data has tons of rubbishs before 600 hours
-        merged_df = merged_df.query(f"hours >= {self._offset}")
+        _job = tables["job"]
+        tables["job"] = _job[self._derive(_job, "hours") >= self._offset]
+
+        print("Merging dataframes...")
+        merged_df = self._merge(tables, drop=self.MergedDropColumns)
+        for column in self.DerivedColumns:
+            merged_df[column] = self._derive(merged_df, column)
         return merged_df
 
+    def query(self) -> "TraceQuery":
+        """Start a lazy query of the merged table, see `TraceQuery`.
+
+        Returns:
+            TraceQuery: The query selecting every row and column of the merged table.
+
+        """
+        return TraceQuery(self)
+
     def _get_modified_merged_df(self) -> pd.DataFrame:
-        merged = self.get_df("merged").copy()
-        # Fill the missing end_time and end_date when the status is "Running"
-        print("Fill end_time and end_date when the status is 'Running'...")
+        """Fill the end of the running and unfinished instances and recompute their times.
+
+        Every mask is computed once and the end candidates are coalesced column-wise, the
+        merged table is copied once when the waiting rows with an end are dropped.
+
+        Returns:
+            pd.DataFrame: The merged table with the filled ends, the run time, the wait
+                time and the pure run time.
+
+        """
+        merged = self.get_df("merged")
         max_time = merged["end_time"].max()
         max_date = merged["end_date"].max()
-        merged.loc[
-            (merged.status == "Running")
-            & (merged.status_task == "Running")
-            & (merged.status_instance == "Running"),
-            "end_time",
-        ] = max_time
-        merged.loc[
-            (merged.status == "Running")
-            & (merged.status_task == "Running")
-            & (merged.status_instance == "Running"),
-            "end_date",
-        ] = max_date
-        merged.loc[
-            (merged.status == "Running")
-            & (merged.status_task == "Running")
-            & (merged.status_instance == "Running"),
-            "end_date_task",
-        ] = max_date
-        merged.loc[
-            (merged.status == "Running")
-            & (merged.status_task == "Running")
-            & (merged.status_instance == "Running"),
-            "end_time_task",
-        ] = max_time
-        merged.loc[
-            (merged.status == "Running")
-            & (merged.status_task == "Running")
-            & (merged.status_instance == "Running"),
-            "end_date_instance",
-        ] = max_date
-        merged.loc[
+        # Drop all rows which is in waiting status and the has a value in end_time
+        # The end_time should be NaN when the status is "Waiting"
+        _keep = ~((merged.status == "Waiting") & merged.end_time.notna())
+        # the columns assigned below replace the ones of the cached merged table
+        merged = merged[_keep].copy(deep=False)
+
+        # Fill the missing end_time and end_date when the status is "Running"
+        print("Fill end_time and end_date when the status is 'Running'...")
+        running = (
             (merged.status == "Running")
             & (merged.status_task == "Running")
-            & (merged.status_instance == "Running"),
-            "end_time_instance",
-        ] = max_time
+            & (merged.status_instance == "Running")
+        )
+        for suffix in ["", "_task", "_instance"]:
+            merged[f"end_time{suffix}"] = merged[f"end_time{suffix}"].mask(
+                running, max_time
+            )
+            merged[f"end_date{suffix}"] = merged[f"end_date{suffix}"].mask(
+                running, max_date
+            )
+
         print("Fill missing values...")
-        # Drop all rows which is in waiting status and the has a value in end_time
-        # The end_time should be NaN when the status is "Waiting"
-        merged = merged[~((merged.status == "Waiting") & pd.notna(merged.end_time))]
-        # fill the missing end_time and end_date
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_date_instance), "end_date"
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_date_instance),
+        # the first known of the end and start dates of the instance and the task
+        end_date = merged["end_date"]
+        for column in [
             "end_date_instance",
-        ]
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_date_task), "end_date"
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_date_task), "end_date_task"
-        ]
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_date_instance),
-            "end_date",
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_date_instance),
+            "end_date_task",
             "start_date_instance",
-        ]
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_date_task), "end_date"
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_date_task),
             "start_date_task",
-        ]
+        ]:
+            end_date = end_date.fillna(merged[column])
+        merged["end_date"] = end_date
+        # without any of them, the last known of the same candidates in time wins
+        unresolved = end_date.isna()
+        if unresolved.any():
+            end_time = merged["start_time_task"]
+            for column in [
+                "start_time_instance",
+                "end_time_task",
+                "end_time_instance",
+                "end_time",
+            ]:
+                end_time = end_time.fillna(merged[column])
+            merged["end_time"] = merged["end_time"].mask(unresolved, end_time)
 
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_time_instance), "end_time"
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_time_instance),
-            "end_time_instance",
-        ]
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_time_task), "end_time"
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.end_time_task), "end_time_task"
-        ]
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_time_instance),
-            "end_time",
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_time_instance),
-            "start_time_instance",
-        ]
-        merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_time_task), "end_time"
-        ] = merged.loc[
-            merged.end_date.isnull() & pd.notnull(merged.start_time_task),
-            "start_time_task",
-        ]
         print("Calculating run time and wait time...")
         merged["run_time"] = merged["end_time"] - merged["start_time"]
-        merged["wait_time"] = merged["start_time_instance"] - merged["start_time"]
-        print("Recalculate wait time when the status is 'Interrupted'...")
         # Re-calculate the wait time when the status is "Interrupted"
-        merged.loc[merged.status_instance == "Interrupted", "wait_time"] = (
-            merged.loc[merged.status_instance == "Interrupted", "start_time_task"]
-            - merged.loc[merged.status_instance == "Interrupted", "start_time"]
+        merged["wait_time"] = (
+            merged["start_time_instance"].mask(
+                merged.status_instance == "Interrupted", merged["start_time_task"]
+            )
+            - merged["start_time"]
         )
-        print("Fill missing values...")
         # Calculate the pure run time, which is the time that the job is actually running without waiting
         merged["pure_run_time"] = merged["run_time"] - merged["wait_time"]
 
         return merged
 
-    def _get_time_series_data(self) -> pd.DataFrame:
-        merged = self.get_df("modified_merged").copy()
-        new_data = merged[
+    @staticmethod
+    def _wall_time(dates: pd.Series) -> np.ndarray:
+        """Convert dates to ns of the local wall time, NaT becomes the minimum of int64.
+
+        Args:
+            dates (pd.Series): The dates, naive or timezone-aware.
+
+        Returns:
+            np.ndarray: The int64 ns since epoch of the local wall time.
+
+        """
+        _dates = pd.to_datetime(dates)
+        if _dates.dt.tz is not None:
+            # bins follow the local hours and days, as the strftime of the timestamps did
+            _dates = _dates.dt.tz_localize(None)
+        return _dates.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    @staticmethod
+    def _add_ranges(
+        counts: np.ndarray,
+        first: np.ndarray,
+        length: np.ndarray,
+        values: np.ndarray,
+    ):
+        """Add values to the bins [first, first + length) of the difference array.
+
+        Args:
+            counts (np.ndarray): The difference array with one extra bin at the end.
+            first (np.ndarray): The first bin of every range.
+            length (np.ndarray): The number of bins of every range.
+            values (np.ndarray): The value to add to every bin of a range.
+
+        """
+        _bins = len(counts) - 1
+        _start = np.clip(first, 0, _bins)
+        _stop = np.clip(first + length, 0, _bins)
+        np.add.at(counts, _start, values)
+        np.add.at(counts, _stop, -values)
+
+    def _get_time_series_data(self, bin_width: str = "h") -> pd.DataFrame:
+        """Count the queued and running instances and their planned resources per time bin.
+
+        An instance queues from the submission of its job until the instance starts, or until
+        its task starts or ends when it never did, and holds its planned resources from the
+        start of the instance until the end of the job. A range covers the bins of
+        `start`, `start + bin_width`, ... up to its end, as `pd.date_range` would.
+
+        Every range adds its value at its first bin and subtracts it after its last bin of a
+        difference array, the cumulative sum of which is the series, so the cost is linear
+        in the number of instances and bins.
+
+        Args:
+            bin_width (str): The width of a bin as a fixed pandas frequency,
+                e.g. "h", "15min" or "D". Default is "h".
+
+        Returns:
+            pd.DataFrame: The bin start `time`, `gpu_counts`, `cpu_counts`,
+                `memory_counts`, `queue` and `running` of every bin.
+
+        """
+        merged = self.get_df("modified_merged")
+        new_data = merged.loc[
+            merged["status"] != "Waiting",
             [
                 "start_date",
                 "end_date",
                 "start_date_task",
                 "end_date_task",
                 "start_date_instance",
-                "end_date_instance",
-                "status",
-                "status_task",
-                "status_instance",
-                "run_time",
-                "wait_time",
                 "plan_gpu",
                 "plan_cpu",
                 "plan_mem",
                 "gpu_name",
-            ]
-        ]
-        # new_data = new_data[~(new_data.status == "Waiting")]
-        # new_data = new_data[~(new_data.status_task == "Waiting")]
-        # new_data = new_data[~(new_data.status_instance == "Waiting")]
-        # time_range = pd.date_range(new_data["start_date"].min(), new_data["end_date"].max(), freq="h").strftime("%Y-%m-%d %H:00:00")
-        # gpu_counts = pd.Series(0.0, index=time_range)
-        # cpu_counts = pd.Series(0.0, index=time_range)
-        # memory_counts = pd.Series(0.0, index=time_range)
-        # queue = pd.Series(0.0, index=time_range)
-        # for _, row in new_data.iterrows():
-        #     if pd.isnull(row["start_date_instance"]):
-        #         if pd.isnull(row["end_date_task"]):
-        #             q_time_range = pd.date_range(row["start_date"], row["start_date_task"], freq="h").strftime("%Y-%m-%d %H:00:00")
-        #         else:
-        #             q_time_range = pd.date_range(row["start_date"], row["end_date_task"], freq="h").strftime("%Y-%m-%d %H:00:00")
-        #     else:
-        #         q_time_range = pd.date_range(row["start_date"], row["start_date_instance"], freq="h").strftime("%Y-%m-%d %H:00:00")
-        #
-        #     queue[q_time_range] += 1
-        #
-        #     if pd.notnull(row["start_date_instance"]):
-        #         g_time_range = pd.date_range(row["start_date_instance"], row["end_date"], freq="h").strftime("%Y-%m-%d %H:00:00")
-        #         if pd.notnull(row["plan_gpu"]) and pd.notnull(row["gpu_name"]):
-        #             if pd.isnull(row["plan_gpu"]) and pd.notnull(row["gpu_name"]):
-        #                 gpu_counts[g_time_range] += 1
-        #             else:
-        #                 if row["plan_gpu"] >= 100:
-        #                     gpu_counts[g_time_range] += 1
-        #                 else:
-        #                     gpu_counts[g_time_range] += row["plan_gpu"]/100
-        #
-        #     if pd.notnull(row["start_date_instance"]):
-        #         c_time_range = pd.date_range(row["start_date_instance"], row["end_date"], freq="h").strftime("%Y-%m-%d %H:00:00")
-        #         if pd.notnull(row["plan_cpu"]):
-        #             cpu_counts[c_time_range] += row["plan_cpu"]
-        #
-        #     if pd.notnull(row["start_date_instance"]):
-        #         c_time_range = pd.date_range(row["start_date_instance"], row["end_date"], freq="h").strftime("%Y-%m-%d %H:00:00")
-        #         if pd.notnull(row["plan_mem"]):
-        #             memory_counts[c_time_range] += row["plan_mem"]
-        #
-        # gpu_counts_df = gpu_counts.reset_index(name="gpu_counts")
-        # cpu_counts_df = cpu_counts.reset_index(name="cpu_counts")
-        # memory_counts_df = memory_counts.reset_index(name="memory_counts")
-        # queue_df = queue.reset_index(name="queue")
-        #
-        # merged_df = queue_df.merge(gpu_counts_df, on="index", how="left")
-        # merged_df = merged_df.merge(cpu_counts_df, on="index", how="left")
-        # merged_df = merged_df.merge(memory_counts_df, on="index", how="left")
-
-        # Filter out all rows that are in waiting status
-        new_data = new_data[
-            ~new_data["status"].isin(["Waiting", "status_task", "status_instance"])
+            ],
         ]
+        _width = to_offset(bin_width).nanos
+        _nat = np.iinfo(np.int64).min
+        start = self._wall_time(new_data["start_date"])
+        end = self._wall_time(new_data["end_date"])
+        start_task = self._wall_time(new_data["start_date_task"])
+        end_task = self._wall_time(new_data["end_date_task"])
+        start_instance = self._wall_time(new_data["start_date_instance"])
+
+        # The time range covers the bins from the first submission to the last end
+        _origin = start[start != _nat].min() // _width
+        _bins = (end[end != _nat].max() - start[start != _nat].min()) // _width + 1
+        time_range = pd.to_datetime((_origin + np.arange(_bins)) * _width)
+
+        def _ranges(_from: np.ndarray, _to: np.ndarray):
+            _valid = (_from != _nat) & (_to != _nat) & (_to >= _from)
+            _first = np.where(_valid, _from // _width - _origin, 0)
+            _length = np.where(_valid, (_to - _from) // _width + 1, 0)
+            return _valid, _first, _length
+
+        # The queue ends when the instance starts, otherwise when the task ends or starts
+        queue_end = np.where(
+            start_instance != _nat,
+            start_instance,
+            np.where(end_task != _nat, end_task, start_task),
+        )
+        queue_end = np.where(queue_end != _nat, queue_end, end)
+        _valid, _first, _length = _ranges(start, queue_end)
+        queue = np.zeros(_bins + 1)
+        self._add_ranges(queue, _first[_valid], _length[_valid], np.ones(_valid.sum()))
+
+        # The resources are only allocated when the instance is running
+        _valid, _first, _length = _ranges(start_instance, end)
+        _first, _length = _first[_valid], _length[_valid]
+        _plan_gpu = new_data["plan_gpu"].to_numpy(dtype=np.float64)[_valid]
+        gpu = np.where(
+            new_data["gpu_name"].notna().to_numpy()[_valid],
+            np.where(np.isnan(_plan_gpu), 100, np.minimum(_plan_gpu, 100)),
+            0,
+        )
+        series = {}
+        for name, values in [
+            ("gpu_counts", gpu),
+            ("cpu_counts", new_data["plan_cpu"].to_numpy(dtype=np.float64)[_valid]),
+            ("memory_counts", new_data["plan_mem"].to_numpy(dtype=np.float64)[_valid]),
+        ]:
+            # a missing plan makes the bins it covers missing instead of the rest of the series
+            _missing = np.isnan(values)
+            _counts = np.zeros(_bins + 1)
+            self._add_ranges(
+                _counts, _first[~_missing], _length[~_missing], values[~_missing]
+            )
+            _gaps = np.zeros(_bins + 1)
+            self._add_ranges(
+                _gaps, _first[_missing], _length[_missing], np.ones(_missing.sum())
+            )
+            series[name] = np.where(
+                np.cumsum(_gaps[:-1]) > 0, np.nan, np.cumsum(_counts[:-1])
+            )
+        running = np.zeros(_bins + 1)
+        self._add_ranges(running, _first, _length, np.ones(len(_first)))
+
+        return pd.DataFrame(
+            {
+                "time": time_range,
+                **series,
+                "queue": np.cumsum(queue[:-1]),
+                "running": np.cumsum(running[:-1]),
+            }
+        )
 
-        # Set the time range
-        time_range = pd.date_range(
-            new_data["start_date"].min(), new_data["end_date"].max(), freq="h"
-        ).strftime("%Y-%m-%d %H:00:00")
-        index_df = pd.DataFrame(index=time_range)
-
-        # 初始化计数列
-        index_df["gpu_counts"] = 0.0
-        index_df["cpu_counts"] = 0.0
-        index_df["memory_counts"] = 0.0
-        index_df["queue"] = 0.0
-        index_df["running"] = 0.0
-
-        # loop all rows, each row represents an instance
-        for _, row in new_data.iterrows():
-            start_date = row["start_date"]
-            if pd.isnull(row["start_date_instance"]):
-                if pd.isnull(row["end_date_task"]):
-                    end_date = row["start_date_task"]
-                else:
-                    end_date = row["end_date_task"]
-            else:
-                end_date = row["start_date_instance"]
-            if pd.isnull(end_date):
-                end_date = row["end_date"]
+    def get_time_series(
+        self, bin_width: str = "h", force: bool = False
+    ) -> pd.DataFrame:
+        """Get the time series of the trace with bins of any fixed width.
+
+        Args:
+            bin_width (str): The width of a bin as a fixed pandas frequency,
+                e.g. "h", "15min" or "D". Default is "h".
+            force (bool): Whether to force rebuilding the time series.
+
+        Returns:
+            pd.DataFrame: The time series, see `_get_time_series_data`.
+
+        """
+        if bin_width == "h":
+            return self.get_df("time_series", force=force)
+        data_type = f"time_series_{bin_width}"
+        _cache = None if force else self._get_cache(data_type)
+        if _cache is None:
+            print(f"Constructing {data_type} data...")
+            _cache = self._get_time_series_data(bin_width)
+            self._store_cache(data_type, _cache, cache_file=True)
+        return _cache
+
+    def _get_machine_occupancy_data(self) -> pd.DataFrame:
+        """Reconstruct the GPUs planned on every machine over time.
+
+        Every instance with a machine and a `plan_gpu` holds it from the start of the
+        instance until its end, or the end of its job when it has none. The starts and ends
+        of all instances are sorted once by machine, time and change, the releases of a
+        time first, and summed up. As the changes of a machine sum up to nothing, one
+        cumulative sum over all machines restarts at every machine. The sums are integers
+        of `GpuUnits`, so the fractional shares add up exactly.
+
+        Returns:
+            pd.DataFrame: The state of a machine from every `time` one of its instances
+                starts or ends: its `machine`, `gpu_type` and `capacity` from the machine
+                spec, the `allocated` GPUs, the `shared` GPUs planned by the instances
+                with a `plan_gpu` below 100 and the number of `instances`. The time is the
+                local wall time, as the one of the time series.
+
+        """
+        merged = self.get_df("modified_merged")
+        spec = self.get_df("machine")
+        _machines = spec["machine"].astype(str)
+        plan_gpu = merged["plan_gpu"].to_numpy(dtype=np.float64)
+        _nat = np.iinfo(np.int64).min
+        start = self._wall_time(merged["start_date_instance"])
+        end = self._wall_time(merged["end_date_instance"])
+        end = np.where(end != _nat, end, self._wall_time(merged["end_date"]))
+        code = pd.Index(_machines).get_indexer(merged["machine"].astype(object))
+        _valid = (
+            (plan_gpu > 0)
+            & (start != _nat)
+            & (end != _nat)
+            & (end >= start)
+            & (code >= 0)
+        )
+        _unknown = ((code < 0) & merged["machine"].notna().to_numpy()).sum()
+        if _unknown > 0:
+            print(f"Skip {_unknown} instances on machines without a spec...")
+        code, start, end = code[_valid], start[_valid], end[_valid]
+        units = np.rint(plan_gpu[_valid] * self.GpuUnits / 100).astype(np.int64)
+        shared = np.where(plan_gpu[_valid] < 100, units, 0)
+
+        _machine = np.concatenate([code, code])
+        _time = np.concatenate([start, end])
+        _change = np.concatenate([units, -units])
+        _order = np.lexsort((_change, _time, _machine))
+        _machine, _time = _machine[_order], _time[_order]
+        allocated = np.cumsum(_change[_order])
+        shared = np.cumsum(np.concatenate([shared, -shared])[_order])
+        instances = np.cumsum(
+            np.concatenate([np.ones(len(code)), -np.ones(len(code))])[_order]
+        ).astype(np.int64)
+        # the state after the last change of a machine at a time
+        _last = np.ones(len(_machine), dtype=bool)
+        _last[:-1] = (_machine[1:] != _machine[:-1]) | (_time[1:] != _time[:-1])
+        _machine = _machine[_last]
+        _capacity = spec["cap_gpu"].to_numpy(dtype=np.float64, na_value=0.0)
+        return pd.DataFrame(
+            {
+                "machine": pd.Categorical.from_codes(_machine, categories=_machines),
+                "gpu_type": spec["gpu_type"].astype(object).to_numpy()[_machine],
+                "time": pd.to_datetime(_time[_last]),
+                "capacity": _capacity[_machine],
+                "allocated": allocated[_last] / self.GpuUnits,
+                "shared": shared[_last] / self.GpuUnits,
+                "instances": instances[_last],
+            }
+        )
+
+    @classmethod
+    def _occupancy_metrics(
+        cls, allocated: np.ndarray, capacity: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """The GPU metrics of machines in a state, in `GpuUnits`.
+
+        The GPUs of a machine are taken as packed: the allocation fills whole GPUs and at
+        most one GPU is shared with the idle capacity, which is fragmented as it cannot
+        take an instance of a whole GPU.
+
+        Args:
+            allocated (np.ndarray): The allocated units of the machines.
+            capacity (np.ndarray): The capacity units of the machines.
+
+        Returns:
+            Dict[str, np.ndarray]: The idle, fragmented and occupied units and whether a
+                machine is busy.
+
+        """
+        idle = np.maximum(capacity - allocated, 0)
+        _touched = -(-allocated // cls.GpuUnits) * cls.GpuUnits
+        return {
+            "idle": idle,
+            "fragmented": idle % cls.GpuUnits,
+            "occupied": np.minimum(_touched, capacity),
+            "busy_machines": (allocated > 0).astype(np.int64) * cls.GpuUnits,
+        }
+
+    def _get_gpu_occupancy_data(self, bin_width: str = "h") -> pd.DataFrame:
+        """Average the GPU occupancy of the machines of every GPU type per time bin.
+
+        The metrics of a machine only change at the times of the machine occupancy, so the
+        change of each metric of a GPU type is the change of the machine at that time.
+        Sorting the changes by time and summing them up gives the step function of the
+        type, whose integral at the bin edges gives the time-weighted mean of every bin.
+        The cost is the sort of the machine occupancy.
+
+        Args:
+            bin_width (str): The width of a bin as a fixed pandas frequency,
+                e.g. "h", "15min" or "D". Default is "h".
 
-            q_time_range = pd.date_range(start_date, end_date, freq="h").strftime(
-                "%Y-%m-%d %H:00:00"
+        Returns:
+            pd.DataFrame: The bin start `time` and `gpu_type` and the mean `capacity`,
+                `allocated`, `idle`, `fragmented` (idle in partially allocated GPUs),
+                `occupied` (GPUs with an allocation), `shared` GPUs, `busy_machines` and
+                `instances` of every bin, with the `utilisation` (allocated / capacity),
+                `fragmentation` (fragmented / idle) and `sharing_ratio` (shared /
+                allocated).
+
+        """
+        occupancy = self.get_df("machine_occupancy")
+        spec = self.get_df("machine")
+        _width = to_offset(bin_width).nanos
+        _time = self._wall_time(occupancy["time"])
+        _origin = _time.min() // _width
+        _bins = _time.max() // _width - _origin + 1
+        # the bin edges in s from the first one, where the precision of float64 suffices
+        _edges = np.arange(_bins + 1) * (_width / 1e9)
+        _seconds = (_time - _origin * _width) / 1e9
+
+        _machine = occupancy["machine"].cat.codes.to_numpy().astype(np.int64)
+        _capacity = np.rint(
+            occupancy["capacity"].to_numpy(dtype=np.float64) * self.GpuUnits
+        ).astype(np.int64)
+        _state = {
+            "allocated": np.rint(
+                occupancy["allocated"].to_numpy(dtype=np.float64) * self.GpuUnits
+            ).astype(np.int64),
+            "shared": np.rint(
+                occupancy["shared"].to_numpy(dtype=np.float64) * self.GpuUnits
+            ).astype(np.int64),
+            "instances": occupancy["instances"].to_numpy(dtype=np.int64)
+            * self.GpuUnits,
+        }
+        _state.update(self._occupancy_metrics(_state["allocated"], _capacity))
+        # a machine starts idle, the change of a metric is the difference of its states
+        _first = np.ones(len(_machine), dtype=bool)
+        _first[1:] = _machine[1:] != _machine[:-1]
+        _idle = self._occupancy_metrics(np.zeros_like(_capacity), _capacity)
+        _changes = {}
+        for name, values in _state.items():
+            _before = np.empty_like(values)
+            _before[1:] = values[:-1]
+            _before[_first] = _idle[name][_first] if name in _idle else 0
+            _changes[name] = values - _before
+
+        _types = occupancy["gpu_type"].astype(object).to_numpy()
+        _spec_types = spec["gpu_type"].astype(object).to_numpy()
+        _spec_capacity = np.rint(
+            spec["cap_gpu"].to_numpy(dtype=np.float64, na_value=0.0) * self.GpuUnits
+        ).astype(np.int64)
+        series = []
+        for gpu_type in pd.unique(_spec_types):
+            _of_type = _types == gpu_type
+            _capacity_of_type = _spec_capacity[_spec_types == gpu_type]
+            _initial = {name: 0.0 for name in _state}
+            for name, values in self._occupancy_metrics(
+                np.zeros_like(_capacity_of_type), _capacity_of_type
+            ).items():
+                _initial[name] = float(values.sum())
+            _order = np.argsort(_seconds[_of_type], kind="stable")
+            _times = _seconds[_of_type][_order]
+            _means = {
+                "capacity": np.full(_bins, _capacity_of_type.sum() / self.GpuUnits)
+            }
+            for name in _state:
+                _values = (
+                    np.cumsum(_changes[name][_of_type][_order]) + _initial[name]
+                ).astype(np.float64)
+                _means[name] = (
+                    self._bin_means(_times, _values, _initial[name], _edges)
+                    / self.GpuUnits
+                )
+            series.append(
+                pd.DataFrame(
+                    {
+                        "time": pd.to_datetime((_origin + np.arange(_bins)) * _width),
+                        "gpu_type": gpu_type,
+                        **{
+                            name: _means[name]
+                            for name in [
+                                "capacity",
+                                "allocated",
+                                "idle",
+                                "fragmented",
+                                "occupied",
+                                "shared",
+                                "busy_machines",
+                                "instances",
+                            ]
+                        },
+                    }
+                )
             )
-            index_df.loc[q_time_range, "queue"] += 1
-
-            if pd.notnull(row["start_date_instance"]):
-                # The resources are only allocated when the instance is running
-                g_time_range = pd.date_range(
-                    row["start_date_instance"], row["end_date"], freq="h"
-                ).strftime("%Y-%m-%d %H:00:00")
-                if pd.notnull(row["gpu_name"]):
-                    if pd.isnull(row["plan_gpu"]):
-                        gpu_increment = 100
-                    else:
-                        gpu_increment = (
-                            100 if row["plan_gpu"] >= 100 else row["plan_gpu"]
-                        )
-                else:
-                    gpu_increment = 0
-                index_df.loc[g_time_range, "gpu_counts"] += gpu_increment
-                index_df.loc[g_time_range, "cpu_counts"] += row.get("plan_cpu", 0)
-                index_df.loc[g_time_range, "memory_counts"] += row.get("plan_mem", 0)
-                index_df.loc[g_time_range, "running"] += 1
-
-        index_df = index_df.reset_index().rename(columns={"index": "time"})
-        index_df["time"] = pd.to_datetime(index_df["time"])
-        return index_df
+        result = pd.concat(series, ignore_index=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result["utilisation"] = result["allocated"] / result["capacity"]
+            result["fragmentation"] = result["fragmented"] / result["idle"]
+            result["sharing_ratio"] = result["shared"] / result["allocated"]
+        return result
+
+    @staticmethod
+    def _bin_means(
+        times: np.ndarray, values: np.ndarray, initial: float, edges: np.ndarray
+    ) -> np.ndarray:
+        """The time-weighted means of a step function over bins.
+
+        Args:
+            times (np.ndarray): The sorted times of the steps.
+            values (np.ndarray): The value from every step on, the last of a time holds.
+            initial (float): The value before the first step.
+            edges (np.ndarray): The sorted edges of the bins.
+
+        Returns:
+            np.ndarray: The mean of every bin.
+
+        """
+        if len(times) == 0:
+            return np.full(len(edges) - 1, initial)
+        # the integral from the first step to every step
+        _integral = np.zeros(len(times))
+        _integral[1:] = np.cumsum(values[:-1] * np.diff(times))
+        _k = np.searchsorted(times, edges, side="right") - 1
+        _at = np.maximum(_k, 0)
+        _edge_integral = np.where(
+            _k < 0,
+            initial * (edges - times[0]),
+            _integral[_at] + values[_at] * (edges - times[_at]),
+        )
+        return np.diff(_edge_integral) / np.diff(edges)
+
+    def get_gpu_occupancy(
+        self, bin_width: str = "h", force: bool = False
+    ) -> pd.DataFrame:
+        """Get the GPU occupancy, fragmentation and sharing of every GPU type over time.
+
+        Args:
+            bin_width (str): The width of a bin as a fixed pandas frequency,
+                e.g. "h", "15min" or "D". Default is "h".
+            force (bool): Whether to force rebuilding the occupancy.
+
+        Returns:
+            pd.DataFrame: The occupancy, see `_get_gpu_occupancy_data`.
+
+        """
+        data_type = f"gpu_occupancy_{bin_width}"
+        _cache = None if force else self._get_cache(data_type)
+        if _cache is None:
+            print(f"Constructing {data_type} data...")
+            if force:
+                self.get_df("machine_occupancy", force=True)
+            _cache = self._get_gpu_occupancy_data(bin_width)
+            self._store_cache(data_type, _cache, cache_file=True)
+        return _cache
+
+
+class TraceQuery:
+    # the comparisons of a filter, named as the filters of `pd.read_parquet`
+    Operators = {
+        "==": operator.eq,
+        "!=": operator.ne,
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "in": lambda series, value: series.isin(value),
+        "not in": lambda series, value: ~series.isin(value),
+    }
+
+    def __init__(
+        self,
+        trace: Alibaba2020TraceData,
+        columns: Optional[List[str]] = None,
+        filters: Tuple[Tuple[str, str, Any], ...] = (),
+    ):
+        """A lazy query of the merged table of the Alibaba 2020 GPU trace.
+
+        Nothing is loaded until `collect`. A merged table in memory is filtered directly, a
+        Parquet cache file of it is read with the filters and the columns of the query.
+        Otherwise only the columns the query needs are taken from the trace tables, the
+        filters on the job, task and instance tables are applied before the merges, which
+        then only touch the jobs left, and the machine, sensor and group tables are not
+        merged at all when the query needs none of their columns.
+
+        Args:
+            trace (Alibaba2020TraceData): The trace data.
+            columns (List[str], optional): The columns to select. Default is None, which
+                selects all of the columns of the merged table.
+            filters (Tuple[Tuple[str, str, Any], ...]): The filters as (column, operator,
+                value), see `Operators`.
+
+        Examples:
+            >>> trace = Alibaba2020TraceData("/data/alibaba")
+            >>> wait_times = (
+            ...     trace.query()
+            ...     .where("gpu_type", "==", "V100")
+            ...     .between("2020-07-01", "2020-08-01")
+            ...     .select("job_name", "wait_time")
+            ...     .collect()
+            ... )
+        """
+        self.trace = trace
+        self.columns = list(columns) if columns is not None else None
+        self.filters = tuple(filters)
+
+    def select(self, *columns: str) -> "TraceQuery":
+        """Select the columns of the merged table to get."""
+        return TraceQuery(self.trace, list(columns), self.filters)
+
+    def where(self, column: str, op: str, value: Any) -> "TraceQuery":
+        """Keep the rows whose column compares to the value.
+
+        Args:
+            column (str): A column of the merged table.
+            op (str): The comparison, one of `Operators`.
+            value (Any): The value to compare to, a list for "in" and "not in".
+
+        Returns:
+            TraceQuery: The query with the filter.
+
+        """
+        if op not in self.Operators:
+            raise ValueError(
+                f"Operator {op} is not valid. Only support {list(self.Operators)}."
+            )
+        return TraceQuery(
+            self.trace, self.columns, self.filters + ((column, op, value),)
+        )
+
+    def between(self, start: Any, end: Any) -> "TraceQuery":
+        """Keep the jobs submitted in a time window.
+
+        Args:
+            start (Any): The start of the window, inclusive, as seconds since epoch or a
+                timestamp, naive timestamps are in the Asia/Shanghai timezone.
+            end (Any): The end of the window, exclusive, as `start`.
+
+        Returns:
+            TraceQuery: The query with the window.
+
+        """
+
+        def _seconds(value: Any) -> float:
+            if isinstance(value, (int, float)):
+                return float(value)
+            _timestamp = pd.Timestamp(value)
+            if _timestamp.tz is None:
+                _timestamp = _timestamp.tz_localize("Asia/Shanghai")
+            return _timestamp.timestamp()
+
+        return self.where("start_time", ">=", _seconds(start)).where(
+            "start_time", "<", _seconds(end)
+        )
+
+    @classmethod
+    def _compare(cls, series: pd.Series, op: str, value: Any) -> pd.Series:
+        """The mask of a filter, which drops the nulls for every operator.
+
+        The nulls never pass a filter, as in the comparisons of SQL, so a query gets the
+        same rows whichever table it is run on.
+
+        Args:
+            series (pd.Series): The column to compare.
+            op (str): The comparison, one of `Operators`.
+            value (Any): The value to compare to.
+
+        Returns:
+            pd.Series: The boolean mask of the rows passing the filter.
+
+        """
+        _mask = cls.Operators[op](series, value)
+        return _mask.fillna(False).astype(bool) & series.notna()
+
+    def _apply(self, merged_df: pd.DataFrame) -> pd.DataFrame:
+        _mask = pd.Series(True, index=merged_df.index)
+        for column, op, value in self.filters:
+            _mask &= self._compare(merged_df[column], op, value)
+        _selected = merged_df[_mask]
+        return _selected if self.columns is None else _selected[self.columns]
+
+    def collect(self) -> pd.DataFrame:
+        """Run the query.
+
+        Returns:
+            pd.DataFrame: The selected columns of the rows of the merged table which pass
+                every filter.
+
+        """
+        _trace = self.trace
+        if "merged" in _trace._cache:
+            return self._apply(_trace._cache["merged"])
+        cache_file = _trace._build_cache_file("merged")
+        if os.path.isfile(cache_file) and cache_file.endswith(".parquet"):
+            print("Querying merged cache file...")
+            _columns = None
+            if self.columns is not None:
+                _filtered = [column for column, _, _ in self.filters]
+                _columns = list(dict.fromkeys(self.columns + _filtered))
+            # the filters skip the row groups and rows, but pyarrow keeps the nulls for
+            # "not in", so the masks are applied again
+            return self._apply(
+                pd.read_parquet(
+                    cache_file,
+                    engine="pyarrow",
+                    columns=_columns,
+                    filters=[list(f) for f in self.filters] or None,
+                )
+            )
+        return self._pushdown()
+
+    def _pushdown(self) -> pd.DataFrame:
+        _trace = self.trace
+        _owners = {
+            k: v
+            for k, v in _trace._merged_columns().items()
+            if k not in _trace.MergedDropColumns
+        }
+        _derived = _trace.DerivedColumns
+        _columns = self.columns or list(_owners) + list(_derived)
+        _needed = set(_columns) | {column for column, _, _ in self.filters}
+        _unknown = _needed - set(_owners) - set(_derived)
+        if len(_unknown) > 0:
+            raise ValueError(f"Columns {sorted(_unknown)} are not in the merged table.")
+        for column in list(_needed):
+            _needed.update(_derived.get(column, ()))
+        # the rows before the offset hours are dropped from the merged table
+        _needed.add("start_date")
+
+        # the columns of every table, renamed to their names in the merged table
+        _renames: Dict[str, Dict[str, str]] = {"job": {}}
+        for column in _needed - set(_derived):
+            _type, _column = _owners[column]
+            _renames.setdefault(_type, {})[_column] = column
+        for data_type, keys, how in _trace.MergePlan:
+            if data_type not in _renames and how == "left":
+                # a left join only changes the rows when its keys are duplicated
+                _keys = _trace._get_keys(data_type, list(keys))
+                if not _keys.duplicated().any():
+                    continue
+            _renames.setdefault(data_type, {})
+            for key in keys:
+                _type, _column = _owners[key]
+                _renames[_type][_column] = key
+                _renames[data_type][key] = key
+
+        _inner = [t for t, _, how in _trace.MergePlan if how == "inner"] + ["job"]
+        tables = {}
+        for data_type, renames in _renames.items():
+            print(f"Loading {data_type} columns {sorted(renames.values())}...")
+            _table = _trace.get_df(data_type, columns=list(renames)).rename(
+                columns=renames
+            )
+            if data_type in _inner:
+                _mask = pd.Series(True, index=_table.index)
+                for column, op, value in self.filters:
+                    if column in renames.values() and column not in _derived:
+                        _mask &= self._compare(_table[column], op, value)
+                if data_type == "job":
+                    _mask &= _trace._derive(_table, "hours") >= _trace._offset
+                _table = _table[_mask]
+            tables[data_type] = _table
+        # only the jobs left in all of the inner tables are merged
+        tables["task"] = tables["task"][
+            tables["task"]["job_name"].isin(tables["job"]["job_name"])
+        ]
+        tables["instance"] = tables["instance"][
+            tables["instance"]["job_name"].isin(tables["task"]["job_name"])
+        ]
+
+        merged_df = _trace._merge(tables)
+        for column in _derived:
+            if column in _needed:
+                merged_df[column] = _trace._derive(merged_df, column)
+        return self._apply(merged_df)
@@ -0,0 +1,580 @@
+import bisect
+import heapq
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+# the slack of a capacity comparison, the free capacity is a float accumulating releases
+Tolerance = 1e-6
+
+
+class Cluster:
+    def __init__(self, machines: pd.DataFrame):
+        """The capacity of the machines of a cluster, held in arrays indexed by machine.
+
+        Args:
+            machines (pd.DataFrame): The machines with the columns of `pai_machine_spec`:
+                machine, gpu_type, cap_cpu (cores), cap_mem (GB) and cap_gpu (GPUs).
+                Repeat or drop rows to resize the cluster.
+
+        """
+        self.names = machines["machine"].astype(str).to_numpy()
+        _types = pd.Categorical(machines["gpu_type"].astype(str))
+        self.gpu_types = list(_types.categories)
+        self.type_codes = _types.codes.astype(np.int64)
+        # the rows are cpu, memory and gpu, so a dimension over all machines is contiguous
+        self.capacity = np.ascontiguousarray(
+            machines[["cap_cpu", "cap_mem", "cap_gpu"]]
+            .to_numpy(dtype=np.float64, na_value=0.0)
+            .T
+        )
+        self.free = self.capacity.copy()
+        # the sum of the demands placed on the machines
+        self.used = np.zeros(3)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def reset(self):
+        self.free = self.capacity.copy()
+        self.used = np.zeros(3)
+
+    def allocate(self, machine: int, demand: np.ndarray):
+        self.free[:, machine] -= demand
+        self.used += demand
+
+    def release(self, machine: int, demand: np.ndarray):
+        self.free[:, machine] += demand
+        self.used -= demand
+
+    def type_code(self, gpu_type) -> int:
+        """The code of a GPU type, -1 when no machine has it."""
+        try:
+            return self.gpu_types.index(str(gpu_type))
+        except ValueError:
+            return -1
+
+    def candidates(self, demand: np.ndarray, type_code: int = -1) -> np.ndarray:
+        """The machines with room for a demand.
+
+        Args:
+            demand (np.ndarray): The cpu, memory and gpu of the demand.
+            type_code (int): The GPU type the machines must have, -1 for any.
+
+        Returns:
+            np.ndarray: The indices of the machines, in order.
+
+        """
+        _free = self.free
+        _fits = (
+            (_free[0] >= demand[0] - Tolerance)
+            & (_free[1] >= demand[1] - Tolerance)
+            & (_free[2] >= demand[2] - Tolerance)
+        )
+        if type_code >= 0:
+            _fits &= self.type_codes == type_code
+        return np.flatnonzero(_fits)
+
+    def max_capacity(self, type_code: int = -1) -> np.ndarray:
+        """The largest cpu, memory and gpu of a machine of a GPU type, -1 for any."""
+        _capacity = self.capacity
+        if type_code >= 0:
+            _capacity = _capacity[:, self.type_codes == type_code]
+        if _capacity.shape[1] == 0:
+            return np.zeros(3)
+        return _capacity.max(axis=1)
+
+
+class SchedulingPolicy(ABC):
+    """The order the pending instances are tried in and the machine each is placed on.
+
+    A policy gives every instance a static priority when it arrives, the pending instance
+    with the lowest one is tried first, and picks a machine among those with room for it.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def priority(self, arrival: np.ndarray, duration: np.ndarray) -> np.ndarray:
+        """The priorities of the instances, lower first. Ties go to the earlier arrival.
+
+        Args:
+            arrival (np.ndarray): The arrival times of the instances.
+            duration (np.ndarray): The run times of the instances.
+
+        Returns:
+            np.ndarray: The priorities.
+
+        """
+        pass
+
+    def place(
+        self, cluster: Cluster, candidates: np.ndarray, demand: np.ndarray
+    ) -> int:
+        """Pick the machine of an instance.
+
+        Args:
+            cluster (Cluster): The cluster.
+            candidates (np.ndarray): The machines with room for the instance, not empty.
+            demand (np.ndarray): The cpu, memory and gpu of the instance.
+
+        Returns:
+            int: The index of the machine.
+
+        """
+        return int(candidates[0])
+
+
+class FifoPolicy(SchedulingPolicy):
+    """First come first served, on the first machine with room."""
+
+    name = "fifo"
+
+    def priority(self, arrival: np.ndarray, duration: np.ndarray) -> np.ndarray:
+        return arrival
+
+
+class SjfPolicy(SchedulingPolicy):
+    """Shortest job first by the run time of the trace, on the first machine with room."""
+
+    name = "sjf"
+
+    def priority(self, arrival: np.ndarray, duration: np.ndarray) -> np.ndarray:
+        return duration
+
+
+class BestFitPolicy(FifoPolicy):
+    """First come first served, on the machine left with the fewest free GPUs.
+
+    Packing the GPUs keeps whole machines free for the large instances. Ties go to the
+    machine left with the fewest free cpu.
+    """
+
+    name = "best_fit"
+
+    def place(
+        self, cluster: Cluster, candidates: np.ndarray, demand: np.ndarray
+    ) -> int:
+        _gpu = cluster.free[2, candidates]
+        _tight = candidates[_gpu <= _gpu.min() + Tolerance]
+        return int(_tight[np.argmin(cluster.free[0, _tight])])
+
+
+Policies = {policy.name: policy for policy in [FifoPolicy, SjfPolicy, BestFitPolicy]}
+
+
+class SimulationResult:
+    def __init__(
+        self,
+        instances: pd.DataFrame,
+        usage: pd.DataFrame,
+        capacity: np.ndarray,
+        policy: str,
+    ):
+        """The schedule of a replay.
+
+        Args:
+            instances (pd.DataFrame): Every instance with its job_name, arrival, duration,
+                start, end, wait and machine. The start, end and wait of a rejected
+                instance, which no machine has room for, are NaN and its machine is missing.
+            usage (pd.DataFrame): The used cpu, memory and gpu and the number of pending
+                instances after the events of every time.
+            capacity (np.ndarray): The cpu, memory and gpu of the cluster.
+            policy (str): The name of the scheduling policy.
+
+        """
+        self.instances = instances
+        self.usage = usage
+        self.capacity = capacity
+        self.policy = policy
+
+    def jobs(self) -> pd.DataFrame:
+        """The arrival, end and completion time of every job with a scheduled instance."""
+        _scheduled = self.instances[self.instances["machine"].notna()]
+        _jobs = _scheduled.groupby("job_name", sort=False, observed=True).agg(
+            arrival=("arrival", "min"), end=("end", "max")
+        )
+        _jobs["completion_time"] = _jobs["end"] - _jobs["arrival"]
+        return _jobs
+
+    def utilisation(self) -> Dict[str, float]:
+        """The time-weighted mean usage of the cpu, memory and gpu over the replay, in %."""
+        _time = self.usage["time"].to_numpy()
+        if len(_time) < 2:
+            return {"cpu": 0.0, "mem": 0.0, "gpu": 0.0}
+        _span = np.diff(_time)
+        _utilisation = {}
+        for i, name in enumerate(["cpu", "mem", "gpu"]):
+            _used = self.usage[f"used_{name}"].to_numpy()[:-1]
+            _total = self.capacity[i] * (_time[-1] - _time[0])
+            _utilisation[name] = (
+                float(100 * (_used * _span).sum() / _total) if _total > 0 else 0.0
+            )
+        return _utilisation
+
+    def summary(self) -> dict:
+        """The wait times, job completion times, makespan and utilisation of the replay.
+
+        Examples:
+            {
+                "policy": "fifo",
+                "instances": 1000,
+                "rejected": 2,
+                "mean_wait": 12.5,  # unit: s
+                "p50_wait": 0.0,
+                "p95_wait": 80.0,
+                "p99_wait": 300.0,
+                "mean_completion_time": 3600.0,
+                "makespan": 86400.0,
+                "utilisation": {"cpu": 20.1, "mem": 15.2, "gpu": 40.3},  # unit: %
+            }
+        """
+        _wait = self.instances["wait"].dropna().to_numpy()
+        _p50, _p95, _p99 = (
+            np.percentile(_wait, [50, 95, 99]) if len(_wait) > 0 else [np.nan] * 3
+        )
+        _jobs = self.jobs()
+        return {
+            "policy": self.policy,
+            "instances": len(self.instances),
+            "rejected": int(self.instances["machine"].isna().sum()),
+            "mean_wait": float(_wait.mean()) if len(_wait) > 0 else np.nan,
+            "p50_wait": float(_p50),
+            "p95_wait": float(_p95),
+            "p99_wait": float(_p99),
+            "mean_completion_time": float(_jobs["completion_time"].mean()),
+            "makespan": float(
+                self.instances["end"].max() - self.instances["arrival"].min()
+            ),
+            "utilisation": self.utilisation(),
+        }
+
+
+class ClusterSimulator:
+    # the columns of the merged table an instance is built from
+    Columns = (
+        "job_name",
+        "start_time",
+        "start_time_instance",
+        "end_time_instance",
+        "plan_cpu",
+        "plan_mem",
+        "plan_gpu",
+        "gpu_type",
+    )
+
+    def __init__(
+        self,
+        instances: pd.DataFrame,
+        machines: pd.DataFrame,
+        policy: Union[str, SchedulingPolicy] = "fifo",
+        window: Optional[int] = 256,
+        match_gpu_type: bool = True,
+    ):
+        """An event-driven replay of the instances of a trace on a cluster.
+
+        Every instance arrives when its job is submitted, waits in a queue ordered by the
+        policy and runs for its run time in the trace on the machine the policy picks. The
+        events live in a heap and the free capacity of the machines in arrays, so finding
+        the machines with room for an instance is one vectorised comparison.
+
+        The instances are placed one by one, a job is not gang scheduled. The GPUs of a
+        machine are one pool, a `plan_gpu` below 100 takes a share of it.
+
+        Args:
+            instances (pd.DataFrame): The instances with the `Columns` of the merged table,
+                the rows without an instance start or end are dropped. The plan_cpu is in
+                % of a core, the plan_mem in GB and the plan_gpu in % of a GPU.
+            machines (pd.DataFrame): The machines, see `Cluster`.
+            policy (Union[str, SchedulingPolicy]): The scheduling policy, fifo, sjf,
+                best_fit or an instance of a `SchedulingPolicy`. Default is fifo.
+            window (int, optional): The number of pending instances which do not fit
+                that are skipped at every event to try the next ones, in the order of the
+                policy. Default is 256, 1 blocks the queue behind its head and None tries
+                all of them.
+            match_gpu_type (bool): Whether an instance only runs on the machines of the GPU
+                type of its task, when a machine has that type. Default is True.
+
+        Examples:
+            >>> trace = Alibaba2020TraceData("/data/alibaba")
+            >>> simulator = ClusterSimulator.from_trace(trace, policy="best_fit")
+            >>> simulator.run().summary()
+        """
+        if window is not None and window < 1:
+            raise ValueError(f"The window must be at least 1, got {window}.")
+        self.policy = Policies[policy]() if isinstance(policy, str) else policy
+        self.window = window
+        self.cluster = Cluster(machines)
+        _valid = (
+            instances["start_time"].notna()
+            & instances["start_time_instance"].notna()
+            & instances["end_time_instance"].notna()
+        )
+        if not _valid.all():
+            print(f"Drop {int((~_valid).sum())} instances without a start or end...")
+        _instances = instances[_valid]
+        # ties of the arrival keep the order of the table
+        _order = np.argsort(_instances["start_time"].to_numpy(), kind="stable")
+        _instances = _instances.iloc[_order]
+        self.job_names = _instances["job_name"].to_numpy()
+        self.arrival = _instances["start_time"].to_numpy(dtype=np.float64)
+        self.duration = np.maximum(
+            _instances["end_time_instance"].to_numpy(dtype=np.float64)
+            - _instances["start_time_instance"].to_numpy(dtype=np.float64),
+            0.0,
+        )
+        # the cpu in cores, the memory in GB and the gpu in GPUs, like the machines
+        self.demand = np.ascontiguousarray(
+            np.stack(
+                [
+                    _instances["plan_cpu"].to_numpy(dtype=np.float64, na_value=0.0)
+                    / 100,
+                    _instances["plan_mem"].to_numpy(dtype=np.float64, na_value=0.0),
+                    _instances["plan_gpu"].to_numpy(dtype=np.float64, na_value=0.0)
+                    / 100,
+                ]
+            )
+        )
+        if match_gpu_type:
+            _types = pd.Categorical(_instances["gpu_type"].astype(object))
+            _codes = np.array(
+                [self.cluster.type_code(t) for t in _types.categories] + [-1],
+                dtype=np.int64,
+            )
+            # a missing type takes the code -1, the last one
+            self.type_codes = _codes[_types.codes]
+        else:
+            self.type_codes = np.full(len(_instances), -1, dtype=np.int64)
+
+    @classmethod
+    def from_trace(cls, trace, **kwargs) -> "ClusterSimulator":
+        """Replay the instances of a trace on its machines.
+
+        Only the `Columns` of the merged table are loaded, through `trace.query`.
+
+        Args:
+            trace (Alibaba2020TraceData): The trace data.
+            **kwargs: The options of `ClusterSimulator`.
+
+        Returns:
+            ClusterSimulator: The simulator.
+
+        """
+        _instances = trace.query().select(*cls.Columns).collect()
+        return cls(_instances, trace.get_df("machine"), **kwargs)
+
+    def run(self) -> SimulationResult:
+        """Replay the instances.
+
+        Returns:
+            SimulationResult: The schedule.
+
+        """
+        _cluster = self.cluster
+        _cluster.reset()
+        _count = len(self.arrival)
+        _priority = np.asarray(
+            self.policy.priority(self.arrival, self.duration), dtype=np.float64
+        )
+        _start = np.full(_count, np.nan)
+        _machine = np.full(_count, -1, dtype=np.int64)
+        # an instance larger than every machine of its type would wait forever
+        _max = {
+            code: _cluster.max_capacity(code) for code in np.unique(self.type_codes)
+        }
+        _rejected = np.zeros(_count, dtype=bool)
+        for code, capacity in _max.items():
+            _of_type = self.type_codes == code
+            _rejected[_of_type] = (
+                self.demand[:, _of_type] > capacity[:, None] + Tolerance
+            ).any(axis=0)
+        # the usage after the events of every time, there are at most two per instance
+        _times = np.empty(2 * _count + 1)
+        _used = np.empty((2 * _count + 1, 3))
+        _waiting = np.empty(2 * _count + 1, dtype=np.int64)
+        _samples = 0
+        _finishes = []  # heap of (end, instance)
+        # the instances not tried since the last release, a heap of (priority, arrival, instance)
+        _pending = []
+        # the instances which did not fit at the last pass, in order, up to the window
+        _blocked = []
+        _next = 0
+        while _next < _count or len(_finishes) > 0:
+            _now = self.arrival[_next] if _next < _count else np.inf
+            if len(_finishes) > 0 and _finishes[0][0] <= _now:
+                _now = _finishes[0][0]
+            # the capacity released at a time is available to the arrivals at that time
+            _released = []
+            while len(_finishes) > 0 and _finishes[0][0] <= _now:
+                _, i = heapq.heappop(_finishes)
+                _cluster.release(_machine[i], self.demand[:, i])
+                _released.append(_machine[i])
+            _arrivals = []
+            while _next < _count and self.arrival[_next] <= _now:
+                if not _rejected[_next]:
+                    _arrivals.append((_priority[_next], self.arrival[_next], _next))
+                _next += 1
+            _arrivals.sort()
+            _state = (_now, _finishes, _start, _machine)
+            if len(_released) == 0:
+                self._schedule_arrivals(_arrivals, _pending, _blocked, _state)
+            else:
+                self._schedule(_released, _arrivals, _pending, _blocked, _state)
+            _times[_samples] = _now
+            _used[_samples] = _cluster.used
+            _waiting[_samples] = len(_pending) + len(_blocked)
+            _samples += 1
+        _placed = _machine >= 0
+        _instances = pd.DataFrame(
+            {
+                "job_name": self.job_names,
+                "arrival": self.arrival,
+                "duration": self.duration,
+                "start": _start,
+                "end": _start + self.duration,
+                "wait": _start - self.arrival,
+                "machine": np.where(
+                    _placed, _cluster.names[np.maximum(_machine, 0)], None
+                ),
+            }
+        )
+        _usage = pd.DataFrame(
+            {
+                "time": _times[:_samples],
+                "used_cpu": _used[:_samples, 0],
+                "used_mem": _used[:_samples, 1],
+                "used_gpu": _used[:_samples, 2],
+                "pending": _waiting[:_samples],
+            }
+        )
+        return SimulationResult(
+            _instances, _usage, _cluster.capacity.sum(axis=1), self.policy.name
+        )
+
+    def _place(self, i: int, failed: set, state: tuple) -> bool:
+        """Place an instance on the machine the policy picks, if one has room for it.
+
+        Args:
+            i (int): The instance.
+            failed (set): The demands which did not fit in the pass, added to on a failure.
+            state (tuple): The time of the pass, the heap of the running instances and the
+                start times and machines of the instances, filled on a success.
+
+        Returns:
+            bool: Whether the instance was placed.
+
+        """
+        _now, _finishes, _start, _machine = state
+        _demand = self.demand[:, i]
+        _key = (self.type_codes[i], _demand[0], _demand[1], _demand[2])
+        if _key in failed:
+            return False
+        _candidates = self.cluster.candidates(_demand, self.type_codes[i])
+        if len(_candidates) == 0:
+            failed.add(_key)
+            return False
+        _chosen = self.policy.place(self.cluster, _candidates, _demand)
+        self.cluster.allocate(_chosen, _demand)
+        _start[i] = _now
+        _machine[i] = _chosen
+        heapq.heappush(_finishes, (_now + self.duration[i], i))
+        return True
+
+    def _schedule_arrivals(
+        self, arrivals: list, pending: list, blocked: list, state: tuple
+    ):
+        """Place the instances arriving at a time without a release.
+
+        The capacity only shrank since the last pass, so the blocked instances still do not
+        fit and the pass still stops at the last of them. Only the arrivals ahead of it are
+        tried, a failure pushes the last blocked instance out of the window.
+
+        Args:
+            arrivals (list): The entries of the arrivals, in order.
+            pending (list): The heap of the instances not tried since the last release.
+            blocked (list): The instances which did not fit, in order, updated in place.
+            state (tuple): See `_place`.
+
+        Returns:
+            None
+
+        """
+        _failed = set()
+        for _entry in arrivals:
+            if (
+                self.window is not None
+                and len(blocked) >= self.window
+                and _entry > blocked[-1]
+            ):
+                heapq.heappush(pending, _entry)
+                continue
+            if self._place(_entry[2], _failed, state):
+                continue
+            bisect.insort(blocked, _entry)
+            if self.window is not None and len(blocked) > self.window:
+                heapq.heappush(pending, blocked.pop())
+
+    def _schedule(
+        self,
+        released: list,
+        arrivals: list,
+        pending: list,
+        blocked: list,
+        state: tuple,
+    ):
+        """Place the pending instances which fit after a release, in the order of the policy.
+
+        The pass stops at the `window`-th instance which does not fit. A blocked instance
+        can only fit on a released machine, those which do not are skipped with a single
+        vectorised comparison. A demand which did not fit is not tried again in the same
+        pass, as nothing is released during it.
+
+        Args:
+            released (list): The machines released at the time of the pass.
+            arrivals (list): The entries of the arrivals, in order.
+            pending (list): The heap of the instances not tried since the last release.
+            blocked (list): The instances which did not fit, in order, updated in place.
+            state (tuple): See `_place`.
+
+        Returns:
+            None
+
+        """
+        for _entry in arrivals:
+            heapq.heappush(pending, _entry)
+        _old = list(blocked)
+        _maybe = self._fit_released(_old, released)
+        blocked.clear()
+        _failed = set()
+        j = 0
+        while self.window is None or len(blocked) < self.window:
+            if j < len(_old) and (len(pending) == 0 or _old[j] < pending[0]):
+                _entry = _old[j]
+                j += 1
+                if not _maybe[j - 1]:
+                    blocked.append(_entry)
+                    continue
+            elif len(pending) > 0:
+                _entry = heapq.heappop(pending)
+            else:
+                break
+            if not self._place(_entry[2], _failed, state):
+                blocked.append(_entry)
+        # the blocked instances past the window are tried again after the next release
+        for _entry in _old[j:]:
+            heapq.heappush(pending, _entry)
+
+    def _fit_released(self, entries: list, released: list) -> np.ndarray:
+        """Whether a released machine has room for each instance of the entries."""
+        if len(entries) == 0:
+            return np.zeros(0, dtype=bool)
+        _index = np.array([entry[2] for entry in entries], dtype=np.int64)
+        _machines = np.unique(released)
+        _free = self.cluster.free[:, _machines]
+        _demand = self.demand[:, _index]
+        _fits = (_free[:, None, :] >= _demand[:, :, None] - Tolerance).all(axis=0)
+        _types = self.type_codes[_index][:, None]
+        _fits &= (_types < 0) | (_types == self.cluster.type_codes[_machines][None, :])
+        return _fits.any(axis=1)
@@ -1,3 +1,4 @@
+from .monitor.async_monitor import AsyncHostMonitor
 from .monitor.host_monitor import HostMonitor
 
-__all__ = ["HostMonitor"]
+__all__ = ["AsyncHostMonitor", "HostMonitor"]
@@ -0,0 +1,69 @@
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval:
+    def __init__(
+        self,
+        min_interval: int = 10,
+        max_interval: int = 1000,
+        threshold: float = 5.0,
+        decay: float = 1.5,
+    ):
+        """Sample fast while the utilisation changes and slow down while it is steady
+
+        After every sample the CPU utilisation and the utilisation of every GPU are compared
+        with the previous sample. When any of them moved by more than `threshold` points the
+        interval drops to `min_interval`, otherwise it grows by `decay` up to `max_interval`.
+
+        Args:
+            min_interval (int): The interval while the metrics change, in ms. Defaults to 10 ms
+            max_interval (int): The interval while the metrics are steady, in ms.
+                Defaults to 1000 ms
+            threshold (float): The change of utilisation, in percentage points, which counts
+                as a burst. Defaults to 5
+            decay (float): The factor the interval grows by after every steady sample.
+                Defaults to 1.5
+        """
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError(
+                f"Invalid interval range: [{min_interval}, {max_interval}] ms"
+            )
+        if decay < 1:
+            raise ValueError(f"The decay must be at least 1, got {decay}")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.decay = decay
+        self._last: Optional[List[float]] = None
+
+    @staticmethod
+    def signals(metric: dict) -> List[float]:
+        """The utilisations watched for changes in a metric record"""
+        _signals = [metric["cpu"]["utilisation"]]
+        for gpu in metric.get("gpu", {}).values():
+            _utilisation = gpu.get("info", {}).get("gpu_utilisation")
+            if _utilisation is not None:
+                _signals.append(_utilisation)
+        return _signals
+
+    def next_interval(self, metric: dict, interval: float) -> float:
+        """Choose the interval of the next sample
+
+        Args:
+            metric (dict): The last metric record
+            interval (float): The current interval, in ms
+
+        Returns:
+            float: The next interval, in ms
+        """
+        _signals = self.signals(metric)
+        _last, self._last = self._last, _signals
+        if _last is None or len(_last) != len(_signals):
+            return self.min_interval
+        _change = max(abs(a - b) for a, b in zip(_last, _signals))
+        if _change > self.threshold:
+            return self.min_interval
+        return min(max(interval, self.min_interval) * self.decay, self.max_interval)
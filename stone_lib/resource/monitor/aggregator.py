@@ -0,0 +1,559 @@
+import collections
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .rollup import flatten_record
+
+logger = logging.getLogger(__name__)
+
+# a frame is its kind, the length of its payload and the payload
+FrameHeader = struct.Struct("!BI")
+# a batch payload starts with its schema id and its number of rows, followed by the
+# float64 timestamps and the float64 row-major values, all big-endian
+BatchHeader = struct.Struct("!II")
+FrameHello = 1
+FrameSchema = 2
+FrameBatch = 3
+# the receive buffer of a frame is never larger, a longer frame drops the connection
+MaxFrameSize = 64 * 1024 * 1024
+
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(address: Address) -> Tuple[int, Union[str, Tuple[str, int]]]:
+    """Resolve a TCP or Unix socket address
+
+    Args:
+        address (Address): "unix:///path/to/socket", "tcp://host:port", "host:port" or a
+            (host, port) tuple
+
+    Returns:
+        Tuple[int, Union[str, Tuple[str, int]]]: The socket family and the socket address
+    """
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    if address.startswith("unix://"):
+        return socket.AF_UNIX, address[len("unix://") :]
+    if address.startswith("tcp://"):
+        address = address[len("tcp://") :]
+    host, _, port = address.rpartition(":")
+    if host == "" or port == "":
+        raise ValueError(f"Invalid address: {address}")
+    return socket.AF_INET, (host, int(port))
+
+
+def encode_frame(kind: int, payload: bytes) -> bytes:
+    return FrameHeader.pack(kind, len(payload)) + payload
+
+
+def encode_batch(schema_id: int, timestamps: np.ndarray, values: np.ndarray) -> bytes:
+    """Encode rows of the same schema
+
+    Args:
+        schema_id (int): The id of the schema sent before on the connection
+        timestamps (np.ndarray): The timestamps of the rows, in ms, shape (rows,)
+        values (np.ndarray): The values of the rows, shape (rows, keys)
+
+    Returns:
+        bytes: The batch payload
+    """
+    return (
+        BatchHeader.pack(schema_id, len(timestamps))
+        + timestamps.astype(">f8").tobytes()
+        + values.astype(">f8").tobytes()
+    )
+
+
+def decode_batch(payload: bytes, num_keys: int) -> Tuple[int, np.ndarray, np.ndarray]:
+    _schema_id, _rows = BatchHeader.unpack_from(payload)
+    _data = np.frombuffer(payload, dtype=">f8", offset=BatchHeader.size)
+    _timestamps = _data[:_rows].astype(np.float64)
+    _values = _data[_rows:].astype(np.float64).reshape(_rows, num_keys)
+    return _schema_id, _timestamps, _values
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    _buffer = bytearray(size)
+    _view = memoryview(_buffer)
+    _read = 0
+    while _read < size:
+        _n = sock.recv_into(_view[_read:], size - _read)
+        if _n == 0:
+            return None
+        _read += _n
+    return bytes(_buffer)
+
+
+class MonitorStreamer:
+    def __init__(
+        self,
+        address: Address,
+        node: Optional[str] = None,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        queue_size: int = 64,
+        max_backoff: float = 5.0,
+        timeout: float = 5.0,
+    ):
+        """Stream the metric records of a node to a `MonitorAggregator`
+
+        The records are flattened into rows and batched per schema, the batches are sent by
+        a background thread so a slow or missing aggregator never blocks the sampling. At most
+        `queue_size` batches wait to be sent, the oldest one is dropped when it is full. The
+        connection is retried with an exponential backoff and every batch waiting is sent
+        once it is back.
+
+        Args:
+            address (Address): The address of the aggregator, see `parse_address`
+            node (str, optional): The name of the node. Defaults to the host name
+            batch_size (int): The maximum number of records in a batch. Defaults to 100
+            flush_interval (float): The maximum time a record waits to be sent, in seconds.
+                Defaults to 1 s
+            queue_size (int): The maximum number of batches waiting. Defaults to 64
+            max_backoff (float): The maximum delay between two connection attempts, in
+                seconds. Defaults to 5 s
+            timeout (float): The timeout of the socket operations and of the final flush
+                in `stop`, in seconds. Defaults to 5 s
+        """
+        self.address = address
+        self.node = node or socket.gethostname()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._family, self._address = parse_address(address)
+        self._queue: Deque[Tuple[Tuple[str, ...], np.ndarray, np.ndarray]] = (
+            collections.deque()
+        )
+        self._queue_size = queue_size
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._keys: Optional[Tuple[str, ...]] = None
+        self._rows: List[Tuple[float, List[float]]] = []
+        self._first_row = 0.0
+        self._socket: Optional[socket.socket] = None
+        self._schemas: Dict[Tuple[str, ...], int] = {}
+        self._dropped = 0
+        self._sent = 0
+
+    def __call__(self, record: dict):
+        self.send(record)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def dropped(self) -> int:
+        """The number of batches dropped because the aggregator could not keep up"""
+        return self._dropped
+
+    @property
+    def sent(self) -> int:
+        """The number of records sent"""
+        return self._sent
+
+    @property
+    def connected(self) -> bool:
+        return self._socket is not None
+
+    def send(self, record: dict):
+        """Queue a metric record
+
+        Args:
+            record (dict): The metric record, it must have a timestamp in ms
+        """
+        _flat = flatten_record({k: v for k, v in record.items() if k != "timestamp"})
+        _keys = tuple(_flat)
+        with self._lock:
+            if _keys != self._keys:
+                self._seal()
+                self._keys = _keys
+            if len(self._rows) == 0:
+                self._first_row = time.monotonic()
+            self._rows.append((record["timestamp"], list(_flat.values())))
+            if len(self._rows) >= self.batch_size:
+                self._seal()
+                self._wakeup.set()
+
+    def _seal(self):
+        # called with the lock held
+        if len(self._rows) == 0:
+            return
+        _timestamps = np.array([row[0] for row in self._rows], dtype=np.float64)
+        _values = np.array([row[1] for row in self._rows], dtype=np.float64).reshape(
+            len(self._rows), len(self._keys)
+        )
+        self._rows = []
+        if len(self._queue) >= self._queue_size:
+            self._queue.popleft()
+            self._dropped += 1
+        self._queue.append((self._keys, _timestamps, _values))
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError(f"Streamer of {self.node} is already running")
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"monitor_streamer_{self.node}", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"[{self.node}]Stream the metrics to {self.address}")
+
+    def stop(self):
+        """Send the records waiting, for at most `timeout` seconds, and disconnect"""
+        if self._thread is None:
+            return
+        with self._lock:
+            self._seal()
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        if len(self._queue) > 0:
+            logger.warning(
+                f"[{self.node}]{len(self._queue)} batches could not be sent to {self.address}"
+            )
+        if self._dropped > 0:
+            logger.warning(f"[{self.node}]{self._dropped} batches were dropped")
+
+    def _connect(self):
+        _socket = socket.socket(self._family, socket.SOCK_STREAM)
+        try:
+            _socket.settimeout(self.timeout)
+            _socket.connect(self._address)
+            _hello = json.dumps({"node": self.node}).encode()
+            _socket.sendall(encode_frame(FrameHello, _hello))
+        except OSError:
+            _socket.close()
+            raise
+        self._socket = _socket
+        # the schema ids are scoped to a connection
+        self._schemas = {}
+        logger.info(f"[{self.node}]Connected to {self.address}")
+
+    def _disconnect(self, graceful: bool = False):
+        if self._socket is None:
+            return
+        if graceful:
+            # the aggregator closes the connection once it has stored every batch
+            try:
+                self._socket.shutdown(socket.SHUT_WR)
+                while self._socket.recv(1024):
+                    pass
+            except OSError:
+                pass
+        self._socket.close()
+        self._socket = None
+
+    def _send_batch(self, keys: Tuple[str, ...], timestamps, values):
+        _frames = b""
+        _schema_id = self._schemas.get(keys)
+        if _schema_id is None:
+            _schema_id = len(self._schemas)
+            _schema = json.dumps({"id": _schema_id, "keys": list(keys)}).encode()
+            _frames += encode_frame(FrameSchema, _schema)
+        _frames += encode_frame(
+            FrameBatch, encode_batch(_schema_id, timestamps, values)
+        )
+        # a blocking send is the backpressure of the aggregator, records keep being
+        # queued meanwhile
+        self._socket.sendall(_frames)
+        self._schemas[keys] = _schema_id
+
+    def _flush(self):
+        while True:
+            with self._lock:
+                if len(self._queue) == 0:
+                    return
+                _batch = self._queue[0]
+            if self._socket is None:
+                self._connect()
+            self._send_batch(*_batch)
+            with self._lock:
+                # the batch may have been dropped while it was sent
+                if len(self._queue) > 0 and self._queue[0] is _batch:
+                    self._queue.popleft()
+                self._sent += len(_batch[1])
+
+    def _run(self):
+        _backoff = 0.1
+        _deadline = None
+        while True:
+            if self._stopping.is_set() and _deadline is None:
+                _deadline = time.monotonic() + self.timeout
+            with self._lock:
+                if (
+                    len(self._rows) > 0
+                    and time.monotonic() - self._first_row >= self.flush_interval
+                ):
+                    self._seal()
+            try:
+                self._flush()
+                _backoff = 0.1
+            except OSError as e:
+                self._disconnect()
+                logger.warning(
+                    f"[{self.node}]Cannot send to {self.address}: {e}, "
+                    f"retry in {_backoff:.1f} s"
+                )
+                if _deadline is not None and time.monotonic() >= _deadline:
+                    break
+                self._wakeup.wait(_backoff)
+                self._wakeup.clear()
+                _backoff = min(_backoff * 2, self.max_backoff)
+                continue
+            if self._stopping.is_set():
+                with self._lock:
+                    _done = len(self._queue) == 0 and len(self._rows) == 0
+                if _done or time.monotonic() >= _deadline:
+                    break
+                continue
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+        self._disconnect(graceful=True)
+
+
+class ColumnarStore:
+    def __init__(self, resolution: float = 100):
+        """The samples of all nodes, aligned on a common time grid
+
+        Every node keeps its batches as columns, they are only aligned when they are read.
+
+        Args:
+            resolution (float): The step of the time grid, in ms. Defaults to 100 ms
+        """
+        self.resolution = resolution
+        self._lock = threading.Lock()
+        self._chunks: Dict[
+            str, List[Tuple[Tuple[str, ...], np.ndarray, np.ndarray]]
+        ] = {}
+
+    def add(
+        self,
+        node: str,
+        keys: Tuple[str, ...],
+        timestamps: np.ndarray,
+        values: np.ndarray,
+    ):
+        with self._lock:
+            self._chunks.setdefault(node, []).append((keys, timestamps, values))
+
+    @property
+    def nodes(self) -> List[str]:
+        with self._lock:
+            return sorted(self._chunks)
+
+    def num_rows(self, node: str) -> int:
+        with self._lock:
+            return sum(len(chunk[1]) for chunk in self._chunks.get(node, []))
+
+    def node_frame(self, node: str) -> pd.DataFrame:
+        """The samples of a node, indexed by their time on the grid
+
+        Samples falling into the same step are averaged.
+
+        Returns:
+            pd.DataFrame: One column per metric, indexed by the time of the step in ms
+        """
+        with self._lock:
+            _chunks = list(self._chunks.get(node, []))
+        if len(_chunks) == 0:
+            return pd.DataFrame()
+        _frames = [
+            pd.DataFrame(values, columns=list(keys), index=timestamps)
+            for keys, timestamps, values in _chunks
+        ]
+        _frame = pd.concat(_frames)
+        _grid = np.floor(_frame.index.to_numpy() / self.resolution) * self.resolution
+        _frame = _frame.groupby(_grid).mean()
+        _frame.index.name = "time"
+        return _frame
+
+    def to_frame(self) -> pd.DataFrame:
+        """The samples of all nodes on the common time grid
+
+        Returns:
+            pd.DataFrame: Columns indexed by (node, metric), rows by the time of the step
+                in ms, NaN where a node has no sample in a step
+        """
+        _nodes = self.nodes
+        if len(_nodes) == 0:
+            return pd.DataFrame()
+        _frame = pd.concat(
+            [self.node_frame(node) for node in _nodes], axis=1, keys=_nodes
+        )
+        return _frame.sort_index()
+
+
+class _AggregatorHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.server.aggregator._register(self.request)
+
+    def finish(self):
+        self.server.aggregator._unregister(self.request)
+
+    def handle(self):
+        _aggregator: "MonitorAggregator" = self.server.aggregator
+        _node = None
+        _schemas: Dict[int, Tuple[str, ...]] = {}
+        while True:
+            try:
+                _header = _recv_exact(self.request, FrameHeader.size)
+            except OSError:
+                break
+            if _header is None:
+                break
+            _kind, _length = FrameHeader.unpack(_header)
+            if _length > MaxFrameSize:
+                logger.warning(
+                    f"Frame of {_length} bytes from {_node} exceeds {MaxFrameSize} bytes, disconnect"
+                )
+                break
+            _payload = _recv_exact(self.request, _length)
+            if _payload is None:
+                break
+            if _kind == FrameHello:
+                _node = json.loads(_payload)["node"]
+                logger.info(f"Node {_node} is connected")
+            elif _kind == FrameSchema:
+                _schema = json.loads(_payload)
+                _schemas[_schema["id"]] = tuple(_schema["keys"])
+            elif _kind == FrameBatch and _node is not None:
+                # a batch which cannot be decoded is skipped, the next ones still can
+                try:
+                    _schema_id = BatchHeader.unpack_from(_payload)[0]
+                except struct.error as e:
+                    logger.warning(f"Skip a malformed batch from {_node}: {e}")
+                    continue
+                _keys = _schemas.get(_schema_id)
+                if _keys is None:
+                    logger.warning(
+                        f"Skip a batch of unknown schema {_schema_id} from {_node}"
+                    )
+                    continue
+                try:
+                    _, _timestamps, _values = decode_batch(_payload, len(_keys))
+                except ValueError as e:
+                    logger.warning(
+                        f"Skip a batch of schema {_schema_id} from {_node} which does not match it: {e}"
+                    )
+                    continue
+                _aggregator.store.add(_node, _keys, _timestamps, _values)
+            else:
+                logger.warning(f"Unexpected frame {_kind} from {_node}, disconnect")
+                break
+        logger.info(f"Node {_node} is disconnected")
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MonitorAggregator:
+    def __init__(self, address: Address, resolution: float = 100):
+        """Receive the records streamed by `MonitorStreamer` from many nodes
+
+        Args:
+            address (Address): The address to listen on, see `parse_address`. A TCP port 0
+                picks a free port
+            resolution (float): The step of the common time grid, in ms. Defaults to 100 ms
+
+        Examples:
+            with MonitorAggregator("tcp://0.0.0.0:9500") as aggregator:
+                ...
+            frame = aggregator.store.to_frame()
+        """
+        self.store = ColumnarStore(resolution=resolution)
+        self._family, self._address = parse_address(address)
+        self._server: Optional[socketserver.BaseServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._connections_lock = threading.Lock()
+        self._connections = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _register(self, connection: socket.socket):
+        with self._connections_lock:
+            self._connections.add(connection)
+
+    def _unregister(self, connection: socket.socket):
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+    @property
+    def num_connections(self) -> int:
+        with self._connections_lock:
+            return len(self._connections)
+
+    @property
+    def address(self) -> str:
+        """The address the streamers connect to"""
+        if self._family == socket.AF_UNIX:
+            return f"unix://{self._address}"
+        return f"tcp://{self._address[0]}:{self._address[1]}"
+
+    def start(self):
+        if self._server is not None:
+            raise RuntimeError(f"The aggregator is already listening on {self.address}")
+        if self._family == socket.AF_UNIX:
+            if os.path.exists(self._address):
+                os.remove(self._address)
+            self._server = _UnixServer(self._address, _AggregatorHandler)
+        else:
+            self._server = _TCPServer(self._address, _AggregatorHandler)
+            self._address = self._server.server_address[:2]
+        self._server.aggregator = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            # the poll interval bounds how long `stop` waits for the server
+            kwargs={"poll_interval": 0.1},
+            name="monitor_aggregator",
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info(f"Aggregate the metrics on {self.address}")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        # the handlers of the connected nodes would block on their next read otherwise
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self._server = None
+        self._thread = None
+        if self._family == socket.AF_UNIX and os.path.exists(self._address):
+            os.remove(self._address)
+        logger.info(f"Stop aggregating the metrics on {self.address}")
@@ -0,0 +1,207 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional, Union
+
+from .host_monitor import HostMetrics
+
+logger = logging.getLogger(__name__)
+
+Sink = Callable[[dict], Union[None, Awaitable[None]]]
+
+
+class AsyncHostMonitor:
+    def __init__(
+        self,
+        interval: int = 10,
+        gpu_enable: bool = True,
+        data_dir: Optional[str] = None,
+        file_name: Optional[str] = None,
+        sinks: Optional[List[Sink]] = None,
+        queue_size: int = 1024,
+        name: Optional[str] = None,
+        nvml_offload: bool = False,
+        **metrics_options,
+    ):
+        """An asyncio based host monitor which samples inside the running event loop
+
+        The sampler runs as a task on the event loop, so no extra threads are needed: the
+        cgroup and /proc files it reads never block. Only the NVML calls may stall on a busy
+        driver, `nvml_offload` moves them to the default executor. Every
+        record is handed over to the sinks through a bounded queue, which means a slow sink
+        never delays the next sample. When the queue is full the oldest record is dropped.
+
+        Args:
+            interval (int): The interval to monitor the system, in ms. Defaults to 10 ms
+            gpu_enable (bool): Whether to monitor the GPUs. Defaults to True
+            data_dir (str, optional): The directory to save the records when the monitor stops.
+                Defaults to None, which means the records are not saved to a file.
+            file_name (str, optional): The file name of the saved records.
+                Defaults to None, which generates a random name.
+            sinks (List[Sink], optional): Callables or coroutine functions receiving every record
+            queue_size (int): The maximum number of records waiting for the sinks. Defaults to 1024
+            name (str, optional): The name of the monitor, used in logs
+            nvml_offload (bool): Whether to read the GPUs in the default executor instead
+                of on the event loop. Defaults to False
+            **metrics_options: The options of the sampling, e.g. `process_enable` or
+                `cgroup_stats`, passed as they are to `HostMetrics`. With `rollup_windows`
+                the rollups are saved alongside the records, a `RollupSink` can also be
+                given to `sinks` to consume them while sampling
+
+        Examples:
+            async with AsyncHostMonitor(interval=100, gpu_enable=False) as monitor:
+                await serve()
+            records = monitor.metrics.get_records()
+
+        """
+        self.name = name or f"async_monitor_{str(uuid.uuid4())[:8]}"
+        self._interval_ms = interval
+        self._gpu_enable = gpu_enable
+        self._metrics_options = metrics_options
+        self._nvml_offload = nvml_offload
+        self._data_dir = data_dir
+        self._file_name = file_name or f"host_monitor_{str(uuid.uuid4())[:10]}"
+        self._sinks: List[Sink] = list(sinks or [])
+        self._queue_size = queue_size
+        self._metrics: Optional[HostMetrics] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._sampler: Optional[asyncio.Task] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._dropped = 0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    @property
+    def metrics(self) -> Optional[HostMetrics]:
+        return self._metrics
+
+    @property
+    def is_running(self) -> bool:
+        return self._sampler is not None and not self._sampler.done()
+
+    @property
+    def dropped(self) -> int:
+        """The number of records dropped because the sinks could not keep up"""
+        return self._dropped
+
+    def add_sink(self, sink: Sink):
+        """Register a sink, it is called with every new record
+
+        Args:
+            sink (Sink): A callable or a coroutine function taking the record dict
+
+        """
+        self._sinks.append(sink)
+
+    async def start(self):
+        if self.is_running:
+            raise RuntimeError(f"Monitor {self.name} is already running")
+        self._metrics = HostMetrics(
+            interval=self._interval_ms,
+            gpu_enable=self._gpu_enable,
+            uuid=self.name,
+            **self._metrics_options,
+        )
+        self._stop_event = asyncio.Event()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        self._sampler = asyncio.create_task(self._sample_loop())
+        logger.info(f"Start async monitor: {self.name}")
+
+    async def stop(self):
+        """Stop sampling, flush the sinks and save the records
+
+        The sampler wakes up as soon as the stop is requested, so stopping takes at most
+        one sample instead of waiting for a fixed delay. The monitor is still shut down
+        properly when the awaiting task is cancelled in the meantime.
+        """
+        if self._sampler is None:
+            return
+        logger.info(f"Stop async monitor: {self.name}")
+        self._stop_event.set()
+        try:
+            await asyncio.shield(self._sampler)
+        finally:
+            self._sampler = None
+            self._metrics.close()
+            await self._queue.put(None)
+            await asyncio.shield(self._dispatcher)
+            self._dispatcher = None
+            if self._dropped > 0:
+                logger.warning(
+                    f"[{self.name}]{self._dropped} records were dropped by slow sinks"
+                )
+            self._save()
+
+    def _save(self):
+        if self._data_dir is None or self._metrics is None:
+            return
+        if len(self._metrics.get_records()) == 0:
+            logger.warning(f"[{self.name}]No record to save")
+            return
+        file_path = os.path.join(self._data_dir, self._file_name)
+        self._metrics.save(file_path)
+
+    async def _sample_loop(self):
+        _previous = self._metrics.snapshot()
+        _deadline = time.monotonic() + self._metrics.interval
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    await asyncio.wait_for(
+                        self._stop_event.wait(),
+                        timeout=max(_deadline - time.monotonic(), 0),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                _current = self._metrics.snapshot()
+                _elapsed = (_current["time"] - _previous["time"]) / 1e9
+                if _elapsed > 0:
+                    if self._nvml_offload and self._metrics.gpu is not None:
+                        _gpus = await asyncio.to_thread(self._metrics.read_gpus)
+                    else:
+                        _gpus = self._metrics.read_gpus()
+                    _metric = self._metrics.compose(
+                        _previous, _current, _elapsed, _gpus
+                    )
+                    self._metrics.append(_metric)
+                    self._metrics.end_sample(_elapsed, _metric)
+                    self._publish(_metric)
+                _previous = _current
+                # schedule against a fixed cadence so the sampling cost does not drift it
+                _deadline += self._metrics.interval
+                if _deadline < time.monotonic():
+                    _deadline = time.monotonic() + self._metrics.interval
+        except asyncio.CancelledError:
+            logger.warning(f"[{self.name}]Sampling task is cancelled")
+            raise
+
+    def _publish(self, metric: dict):
+        if len(self._sinks) == 0:
+            return
+        if self._queue.full():
+            self._queue.get_nowait()
+            self._dropped += 1
+        self._queue.put_nowait(metric)
+
+    async def _dispatch_loop(self):
+        while True:
+            _metric = await self._queue.get()
+            if _metric is None:
+                break
+            for sink in self._sinks:
+                try:
+                    _result = sink(_metric)
+                    if inspect.isawaitable(_result):
+                        await _result
+                except Exception as e:
+                    logger.error(f"[{self.name}]Sink {sink} failed with error: {e}")
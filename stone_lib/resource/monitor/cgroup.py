@@ -1,7 +1,7 @@
 import logging
 import os
 from abc import ABC, abstractmethod
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 
 logger = logging.getLogger()
 
@@ -19,6 +19,9 @@ class _CGroupAbc(ABC):
         """
         return self._cgroup_dir
 
+    def _file_path(self, file_name: str) -> str:
+        return os.path.join(self.cgroup_dir, file_name)
+
     def _get_cgroup_data(
         self, file_name: str, key: Optional[str] = None, index: Optional[int] = None
     ) -> Optional[str]:
@@ -34,7 +37,7 @@ class _CGroupAbc(ABC):
 
         """
         _index = index or 1
-        _file_path = os.path.join(self.cgroup_dir, file_name)
+        _file_path = self._file_path(file_name)
         logger.debug(
             f"Get data from file {_file_path} with key {key} and index {_index}"
         )
@@ -55,9 +58,79 @@ class _CGroupAbc(ABC):
 
         return _result
 
+    def _read_file(self, file_name: str) -> Optional[str]:
+        """Read a whole cgroup file at once
+
+        Args:
+            file_name (str): cgroup file name
+
+        Returns:
+            Optional[str]: content of the file, None if the file does not exist
+        """
+        try:
+            with open(self._file_path(file_name), "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            logger.debug(f"File {file_name} not found in {self.cgroup_dir}")
+            return None
+
+    def _read_flat_keyed(self, file_name: str) -> Dict[str, int]:
+        """Parse a file of "key value" lines, e.g. cpu.stat or memory.stat
+
+        Returns:
+            Dict[str, int]: key to value, empty if the file does not exist
+        """
+        _data = self._read_file(file_name)
+        if _data is None:
+            return {}
+        _result = {}
+        for line in _data.splitlines():
+            _fields = line.split()
+            if len(_fields) == 2:
+                _result[_fields[0]] = int(_fields[1])
+        return _result
+
+    def _read_nested_keyed(
+        self, file_name: str
+    ) -> Optional[Dict[str, Dict[str, float]]]:
+        """Parse a file of "name key=value ..." lines, e.g. cpu.pressure or io.stat
+
+        Returns:
+            Optional[Dict[str, Dict[str, float]]]: name to key to value, None if the file
+                does not exist
+
+        Examples:
+            "some avg10=0.00 avg60=0.00 avg300=0.00 total=0" is parsed to
+            {"some": {"avg10": 0.0, "avg60": 0.0, "avg300": 0.0, "total": 0.0}}
+        """
+        _data = self._read_file(file_name)
+        if _data is None:
+            return None
+        _result = {}
+        for line in _data.splitlines():
+            _fields = line.split()
+            if len(_fields) == 0:
+                continue
+            _values = {}
+            for field in _fields[1:]:
+                key, _, value = field.partition("=")
+                _values[key] = float(value)
+            _result[_fields[0]] = _values
+        return _result
+
+    @staticmethod
+    def _parse_memory_max(value: Optional[str]) -> Union[int, float]:
+        """Convert the memory limit read from the cgroup file, -1 if there is none"""
+        _max = value
+        if type(_max) is float or type(_max) is int:
+            _max = float(_max * 100)
+        else:
+            _max = -1
+        return _max
+
     @abstractmethod
     def cpu_usage(self) -> int:
-        """Get the CPU usage in nanoseconds"""
+        """Get the CPU usage in microseconds"""
         pass
 
     @abstractmethod
@@ -80,6 +153,34 @@ class _CGroupAbc(ABC):
         """Get the maximum memory in percentage"""
         pass
 
+    @abstractmethod
+    def stats(self) -> dict:
+        """Read the CPU, throttling, memory, io and pressure statistics, one read per file
+
+        Returns:
+            dict: The raw cumulative counters, None when a file is not available
+
+        Examples:
+            {
+                "cpu": {
+                    "usage": 100,  # unit: us
+                    "user": 80,  # unit: us
+                    "system": 20,  # unit: us
+                    "nr_periods": 10,
+                    "nr_throttled": 2,
+                    "throttled": 500,  # unit: us
+                },
+                "memory": {"usage": 1024, "anon": 512, "file": 256, "kernel": 64},  # unit: bytes
+                "io": {"8:0": {"rbytes": 1024, "wbytes": 0, "rios": 1, "wios": 0}},
+                "pressure": {
+                    "cpu": {"some": {"avg10": 0.0, "avg60": 0.0, "avg300": 0.0, "total": 0.0}},
+                    "memory": None,
+                    "io": None,
+                },
+            }
+        """
+        pass
+
 
 class CGroupV2(_CGroupAbc):
     def cpu_usage(self) -> int:
@@ -95,17 +196,74 @@ class CGroupV2(_CGroupAbc):
         return int(self._get_cgroup_data("memory.current"))
 
     def memory_max(self) -> float:
-        _max = self._get_cgroup_data("memory.max")
-        if type(_max) is float or type(_max) is int:
-            _max = float(_max * 100)
-        else:
-            _max = -1
-        return _max
+        return self._parse_memory_max(self._get_cgroup_data("memory.max"))
+
+    def stats(self) -> dict:
+        _cpu = self._read_flat_keyed("cpu.stat")
+        _memory = self._read_flat_keyed("memory.stat")
+        _current = self._read_file("memory.current")
+        _max = self._read_file("memory.max")
+        _kernel = _memory.get("kernel")
+        if _kernel is None and len(_memory) > 0:
+            # the "kernel" entry only exists since linux 5.18
+            _kernel = sum(
+                _memory.get(key, 0)
+                for key in ("kernel_stack", "pagetables", "percpu", "sock", "slab")
+            )
+        _io = self._read_nested_keyed("io.stat") or {}
+        return {
+            "cpu": {
+                "usage": _cpu.get("usage_usec"),
+                "user": _cpu.get("user_usec"),
+                "system": _cpu.get("system_usec"),
+                "nr_periods": _cpu.get("nr_periods"),
+                "nr_throttled": _cpu.get("nr_throttled"),
+                "throttled": _cpu.get("throttled_usec"),
+            },
+            "memory": {
+                "usage": int(_current) if _current is not None else None,
+                "max": self._parse_memory_max(
+                    _max.strip() if _max is not None else None
+                ),
+                "anon": _memory.get("anon"),
+                "file": _memory.get("file"),
+                "kernel": _kernel,
+            },
+            "io": {
+                device: {
+                    key: int(value.get(key, 0))
+                    for key in ("rbytes", "wbytes", "rios", "wios")
+                }
+                for device, value in _io.items()
+            },
+            "pressure": {
+                resource: self._read_nested_keyed(f"{resource}.pressure")
+                for resource in ("cpu", "memory", "io")
+            },
+        }
 
 
 class CGroupV1(_CGroupAbc):
+    def __init__(self, cgroup_dir: str, paths: Optional[Dict[str, str]] = None):
+        """The controllers of cgroup v1, each mounted in its own directory of the root
+
+        Args:
+            cgroup_dir (str): The root of the cgroup hierarchies
+            paths (Dict[str, str], optional): The cgroup of every controller, relative to
+                the directory of the controller. Defaults to None, which reads the root cgroups
+        """
+        super().__init__(cgroup_dir)
+        self._paths = paths or {}
+
+    def _file_path(self, file_name: str) -> str:
+        # the file names are prefixed with their controller, e.g. memory/memory.stat
+        controller, _, name = file_name.partition("/")
+        _path = self._paths.get(controller, "").lstrip("/")
+        return os.path.join(self.cgroup_dir, controller, _path, name)
+
     def cpu_usage(self) -> int:
-        return int(self._get_cgroup_data("cpuacct/cpuacct.usage"))
+        # cpuacct.usage is in nanoseconds, align it with the microseconds of cgroup v2
+        return int(self._get_cgroup_data("cpuacct/cpuacct.usage")) // 1000
 
     def cpu_system(self) -> int:
         return int(self._get_cgroup_data("cpuacct/cpuacct.stat", "system"))
@@ -117,25 +275,139 @@ class CGroupV1(_CGroupAbc):
         return int(self._get_cgroup_data("memory/memory.usage_in_bytes"))
 
     def memory_max(self) -> float:
-        _max = self._get_cgroup_data("memory/memory.limit_in_bytes")
-        if type(_max) is float or type(_max) is int:
-            _max = float(_max * 100)
-        else:
-            _max = -1
-        return _max
+        return self._parse_memory_max(
+            self._get_cgroup_data("memory/memory.limit_in_bytes")
+        )
+
+    def _read_blkio(self, file_name: str) -> Dict[str, Dict[str, int]]:
+        """Parse the "device operation value" lines of the blkio controller"""
+        _data = self._read_file(file_name)
+        _result = {}
+        for line in (_data or "").splitlines():
+            _fields = line.split()
+            if len(_fields) == 3:
+                _result.setdefault(_fields[0], {})[_fields[1]] = int(_fields[2])
+        return _result
+
+    def stats(self) -> dict:
+        _usage = self._read_file("cpuacct/cpuacct.usage")
+        # cpuacct.stat is in USER_HZ ticks
+        _ticks = self._read_flat_keyed("cpuacct/cpuacct.stat")
+        _tick_usec = 1000000 / os.sysconf("SC_CLK_TCK")
+        _cpu = self._read_flat_keyed("cpu/cpu.stat")
+        _memory = self._read_flat_keyed("memory/memory.stat")
+        _current = self._read_file("memory/memory.usage_in_bytes")
+        _max = self._read_file("memory/memory.limit_in_bytes")
+        _kernel = self._read_file("memory/memory.kmem.usage_in_bytes")
+        _bytes = self._read_blkio("blkio/blkio.throttle.io_service_bytes")
+        _ios = self._read_blkio("blkio/blkio.throttle.io_serviced")
+        _throttled = _cpu.get("throttled_time")
+        return {
+            "cpu": {
+                "usage": int(_usage) // 1000 if _usage is not None else None,
+                "user": (
+                    int(_ticks["user"] * _tick_usec) if "user" in _ticks else None
+                ),
+                "system": (
+                    int(_ticks["system"] * _tick_usec) if "system" in _ticks else None
+                ),
+                "nr_periods": _cpu.get("nr_periods"),
+                "nr_throttled": _cpu.get("nr_throttled"),
+                "throttled": _throttled // 1000 if _throttled is not None else None,
+            },
+            "memory": {
+                "usage": int(_current) if _current is not None else None,
+                "max": self._parse_memory_max(
+                    _max.strip() if _max is not None else None
+                ),
+                "anon": _memory.get("rss"),
+                "file": _memory.get("cache"),
+                "kernel": int(_kernel) if _kernel is not None else None,
+            },
+            "io": {
+                device: {
+                    "rbytes": _bytes.get(device, {}).get("Read", 0),
+                    "wbytes": _bytes.get(device, {}).get("Write", 0),
+                    "rios": _ios.get(device, {}).get("Read", 0),
+                    "wios": _ios.get(device, {}).get("Write", 0),
+                }
+                for device in sorted(set(_bytes) | set(_ios))
+            },
+            # pressure stall information is only provided by cgroup v2
+            "pressure": {"cpu": None, "memory": None, "io": None},
+        }
 
 
 class CGroupMonitor:
+    CGroupRoot = "/sys/fs/cgroup"
     V2Controller = "/sys/fs/cgroup/cgroup.controllers"
 
-    def __init__(self, pid: Optional[int] = None):
-        default_cgroup = "/sys/fs/cgroup"
+    def __init__(
+        self,
+        pid: Optional[int] = None,
+        cgroup_dir: Optional[str] = None,
+        proc_dir: str = "/proc",
+    ):
+        """Monitor the resource usage of a cgroup
+
+        Args:
+            pid (int, optional): Monitor the cgroup the process belongs to. Defaults to None,
+                which monitors the cgroup directory.
+            cgroup_dir (str, optional): The root of the cgroup hierarchy. Defaults to /sys/fs/cgroup
+            proc_dir (str): The proc filesystem used to look up the cgroup of `pid`. Defaults to /proc
+        """
+        default_cgroup = cgroup_dir or self.CGroupRoot
+        # the cgroup of every cgroup v1 controller, relative to its directory
+        self._v1_paths: Dict[str, str] = {}
+        if cgroup_dir is None:
+            self._is_v2 = os.path.exists(self.V2Controller)
+        else:
+            self._is_v2 = os.path.exists(os.path.join(cgroup_dir, "cgroup.controllers"))
         if pid is not None:
             logger.info(f"Try to get cgroup for process id: {pid}")
-            default_cgroup = f"/proc/{pid}/cgroup"
+            default_cgroup = self.resolve_cgroup_dir(pid, default_cgroup, proc_dir)
             logger.info(f"The cgroup path changes to {default_cgroup}")
         self._cgroup = default_cgroup
-        self._is_v2 = os.path.exists(self.V2Controller)
+
+    @property
+    def cgroup_dir(self) -> str:
+        """The cgroup directory, the one of the cpuacct controller for a cgroup v1 process"""
+        if "cpuacct" in self._v1_paths:
+            return os.path.join(
+                self._cgroup, "cpuacct", self._v1_paths["cpuacct"].lstrip("/")
+            )
+        return self._cgroup
+
+    def resolve_cgroup_dir(self, pid: int, root: str, proc_dir: str = "/proc") -> str:
+        """Find the cgroup directory of a process from /proc/<pid>/cgroup
+
+        The unified hierarchy (cgroup v2) resolves to one directory. The cgroup v1
+        controllers are mounted separately, the root is kept and the cgroup of every
+        controller is kept apart to read the files of the process.
+
+        Args:
+            pid (int): The process id
+            root (str): The root of the cgroup hierarchy
+            proc_dir (str): The proc filesystem. Defaults to /proc
+
+        Returns:
+            str: The cgroup directory of the process
+        """
+        with open(os.path.join(proc_dir, str(pid), "cgroup"), "r") as f:
+            lines = f.readlines()
+        for line in lines:
+            # an entry is "<hierarchy id>:<controllers>:<path>"
+            _, controllers, path = line.strip().split(":", 2)
+            if self._is_v2 and controllers == "":
+                return os.path.join(root, path.lstrip("/"))
+            if not self._is_v2:
+                for controller in controllers.split(","):
+                    self._v1_paths[controller] = path
+        if not self._is_v2 and {"cpuacct", "memory"} <= set(self._v1_paths):
+            return root
+        raise KeyError(
+            f"cgroup {'v2' if self._is_v2 else 'v1'} entry not found for process {pid}"
+        )
 
     def _get_cgroup(self) -> _CGroupAbc:
         """Get a right verion of cgroup
@@ -147,11 +419,11 @@ class CGroupMonitor:
         if self._is_v2:
             _cgroup = CGroupV2(self._cgroup)
         else:
-            _cgroup = CGroupV1(self._cgroup)
+            _cgroup = CGroupV1(self._cgroup, self._v1_paths)
         return _cgroup
 
     def cpu_usage(self) -> int:
-        """Get the CPU usage in nanoseconds"""
+        """Get the CPU usage in microseconds"""
         return self._get_cgroup().cpu_usage()
 
     def cpu_system(self) -> int:
@@ -170,6 +442,110 @@ class CGroupMonitor:
         """Get the maximum memory in percentage"""
         return self._get_cgroup().memory_max()
 
+    def stats(self) -> dict:
+        """Read the CPU, throttling, memory, io and pressure statistics, one read per file"""
+        return self._get_cgroup().stats()
+
+    @staticmethod
+    def compose_stats(previous: dict, current: dict, interval: float) -> dict:
+        """Build the cgroup statistics record from two `stats` snapshots
+
+        Args:
+            previous (dict): The statistics read at the start of the sample
+            current (dict): The statistics read at the end of the sample
+            interval (float): The elapsed time between both snapshots, in seconds
+
+        Returns:
+            dict: The cgroup statistics record
+
+        Examples:
+            {
+                "throttling": {
+                    "periods": 10,
+                    "throttled": 2,
+                    "throttled_time": 0.5,  # unit: ms
+                },
+                "memory": {"anon": 1.0, "file": 0.5, "kernel": 0.1},  # unit: MB
+                "io": {"8:0": {"read": 1.0, "write": 0.0, "rios": 10.0, "wios": 0.0}},  # unit: MB/s, ops/s
+                "pressure": {
+                    "cpu": {
+                        "some": {"avg10": 1.5, "stall": 2.0},  # unit: percentage
+                        "full": {"avg10": 0.0, "stall": 0.0},
+                    },
+                    "memory": None,
+                    "io": None,
+                },
+            }
+        """
+
+        def _delta(key, prev, cur):
+            if prev.get(key) is None or cur.get(key) is None:
+                return None
+            return cur[key] - prev[key]
+
+        def _section(stats, key):
+            # a section is None or missing when its files are not available
+            return stats.get(key) or {}
+
+        _cpu_p, _cpu_c = _section(previous, "cpu"), _section(current, "cpu")
+        _throttled_time = _delta("throttled", _cpu_p, _cpu_c)
+        _memory = {}
+        for key in ("anon", "file", "kernel"):
+            _value = _section(current, "memory").get(key)
+            _memory[key] = (
+                round(_value / 1024 / 1024, 2) if _value is not None else None
+            )
+        _io = {}
+        for device, _io_c in _section(current, "io").items():
+            _io_p = _section(previous, "io").get(device)
+            if _io_p is None:
+                continue
+            _io[device] = {
+                "read": round(
+                    (_io_c["rbytes"] - _io_p["rbytes"]) / 1024 / 1024 / interval, 2
+                ),
+                "write": round(
+                    (_io_c["wbytes"] - _io_p["wbytes"]) / 1024 / 1024 / interval, 2
+                ),
+                "rios": round((_io_c["rios"] - _io_p["rios"]) / interval, 2),
+                "wios": round((_io_c["wios"] - _io_p["wios"]) / interval, 2),
+            }
+        _pressure = {}
+        for resource, _psi_c in _section(current, "pressure").items():
+            _psi_p = _section(previous, "pressure").get(resource)
+            if _psi_c is None or _psi_p is None:
+                _pressure[resource] = None
+                continue
+            _pressure[resource] = {
+                # the stall time is cumulative in us, it gives the exact share of the sample
+                kind: {
+                    "avg10": values["avg10"],
+                    "stall": round(
+                        (values["total"] - _psi_p[kind]["total"])
+                        / 1e6
+                        / interval
+                        * 100,
+                        2,
+                    ),
+                }
+                for kind, values in _psi_c.items()
+                if "total" in values and "total" in _psi_p.get(kind, {})
+            }
+        return {
+            "throttling": {
+                "periods": _delta("nr_periods", _cpu_p, _cpu_c),
+                "throttled": _delta("nr_throttled", _cpu_p, _cpu_c),
+                "throttled_time": (
+                    round(_throttled_time / 1000, 2)
+                    if _throttled_time is not None
+                    else None
+                ),
+            },
+            "memory": _memory,
+            "io": _io,
+            "pressure": _pressure,
+        }
+
     def to_json(self) -> dict:
         return {
             "cpu": {
@@ -0,0 +1,325 @@
+import bz2
+import json
+import lzma
+import mmap
+import os
+import struct
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .rollup import flatten_record
+
+Magic = b"STMONCOL"
+Version = 1
+ColumnarExtension = ".smc"
+# magic, version, length of the header
+Prefix = struct.Struct("<8sHI")
+# offset and length of the footer, magic
+Trailer = struct.Struct("<QI8s")
+
+_Codecs = {
+    "raw": (lambda data, level: data, lambda data: data),
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+def _shuffle(values: np.ndarray) -> bytes:
+    # grouping the n-th byte of every value makes the exponents and high mantissa bytes,
+    # which barely change between samples, contiguous for the compressor
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype: np.dtype) -> np.ndarray:
+    _dtype = np.dtype(dtype)
+    _bytes = np.frombuffer(data, dtype=np.uint8).reshape(_dtype.itemsize, -1)
+    return np.ascontiguousarray(_bytes.T).view(_dtype).reshape(-1)
+
+
+class ColumnarWriter:
+    def __init__(
+        self,
+        file_path: str,
+        columns: Sequence[str],
+        meta: Optional[dict] = None,
+        chunk_size: int = 4096,
+        compression: str = "zlib",
+        level: int = 6,
+        dtype: str = "float64",
+    ):
+        """Write metric rows into a chunked columnar file
+
+        The file starts with a fixed schema header, then every chunk stores the timestamps as
+        delta-encoded integer µs and every column as its own compressed block. A footer
+        indexes the blocks, so a reader maps the file and only decodes the columns it needs.
+
+        Args:
+            file_path (str): The file to write
+            columns (Sequence[str]): The names of the value columns
+            meta (dict, optional): Free-form JSON metadata saved in the header
+            chunk_size (int): The number of rows in a chunk. Defaults to 4096
+            compression (str): raw, zlib, bz2 or lzma. A raw file is read without a copy.
+                Defaults to zlib
+            level (int): The compression level. Defaults to 6
+            dtype (str): The dtype of the value columns, float64 or float32.
+                Defaults to float64
+        """
+        if compression not in _Codecs:
+            raise ValueError(
+                f"Unknown compression {compression}, use one of {list(_Codecs)}"
+            )
+        self.file_path = file_path
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.level = level
+        self.dtype = np.dtype(dtype)
+        self._compress = _Codecs[compression][0]
+        self._chunks: List[dict] = []
+        self._timestamps: List[np.ndarray] = []
+        self._values: List[np.ndarray] = []
+        self._buffered = 0
+        self._file = open(file_path, "wb")
+        _header = json.dumps(
+            {
+                "columns": self.columns,
+                "compression": compression,
+                "dtype": self.dtype.str,
+                "shuffle": compression != "raw",
+                "meta": meta or {},
+            }
+        ).encode()
+        self._file.write(Prefix.pack(Magic, Version, len(_header)))
+        self._file.write(_header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, timestamps: np.ndarray, values: np.ndarray):
+        """Append rows
+
+        Args:
+            timestamps (np.ndarray): The timestamps of the rows, in ms, shape (rows,)
+            values (np.ndarray): The values of the rows, shape (rows, columns), NaN if missing
+        """
+        _values = np.asarray(values, dtype=self.dtype)
+        if _values.ndim != 2 or _values.shape[1] != len(self.columns):
+            raise ValueError(
+                f"Expect values of shape (rows, {len(self.columns)}), got {_values.shape}"
+            )
+        self._timestamps.append(np.asarray(timestamps, dtype=np.float64))
+        self._values.append(_values)
+        self._buffered += len(_values)
+        while self._buffered >= self.chunk_size:
+            self._flush(self.chunk_size)
+
+    def _block(self, data: bytes) -> List[int]:
+        _data = self._compress(data, self.level)
+        _offset = self._file.tell()
+        self._file.write(_data)
+        return [_offset, len(_data)]
+
+    def _flush(self, rows: int):
+        _timestamps = np.concatenate(self._timestamps)
+        _values = np.concatenate(self._values)
+        self._timestamps = [_timestamps[rows:]]
+        self._values = [_values[rows:]]
+        self._buffered -= rows
+        _timestamps, _values = _timestamps[:rows], _values[:rows]
+        _us = np.round(_timestamps * 1000).astype(np.int64)
+        _chunk = {
+            "rows": rows,
+            "base": int(_us[0]),
+            "time": self._block(np.diff(_us, prepend=_us[0]).tobytes()),
+            "columns": [],
+        }
+        for i in range(len(self.columns)):
+            _column = np.ascontiguousarray(_values[:, i])
+            _data = (
+                _column.tobytes() if self.compression == "raw" else _shuffle(_column)
+            )
+            _chunk["columns"].append(self._block(_data))
+        self._chunks.append(_chunk)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffered > 0:
+            self._flush(self._buffered)
+        _footer = json.dumps({"chunks": self._chunks}).encode()
+        _offset = self._file.tell()
+        self._file.write(_footer)
+        self._file.write(Trailer.pack(_offset, len(_footer), Magic))
+        self._file.close()
+
+
+class ColumnarReader:
+    def __init__(self, file_path: str):
+        """Read a file written by `ColumnarWriter` through a memory map
+
+        Args:
+            file_path (str): The file to read
+
+        Examples:
+            with ColumnarReader("host_monitor.smc") as reader:
+                utilisation = reader.column("cpu.utilisation")
+                frame = reader.to_frame(["cpu.utilisation", "memory.usage"])
+        """
+        self.file_path = file_path
+        self._file = open(file_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"{file_path} is not a columnar monitor file")
+        if len(self._map) < Prefix.size + Trailer.size:
+            self.close()
+            raise ValueError(f"{file_path} is not a columnar monitor file")
+        _magic, _version, _length = Prefix.unpack_from(self._map, 0)
+        _offset, _footer_length, _end = Trailer.unpack_from(
+            self._map, len(self._map) - Trailer.size
+        )
+        if _magic != Magic or _end != Magic:
+            self.close()
+            raise ValueError(f"{file_path} is not a complete columnar monitor file")
+        if _version != Version:
+            self.close()
+            raise ValueError(f"Unsupported version {_version} of {file_path}")
+        _header = json.loads(self._map[Prefix.size : Prefix.size + _length])
+        self.columns: List[str] = _header["columns"]
+        self.meta: dict = _header["meta"]
+        self.compression: str = _header["compression"]
+        self.dtype = np.dtype(_header["dtype"])
+        self._shuffled: bool = _header["shuffle"]
+        self._decompress = _Codecs[self.compression][1]
+        self._chunks: List[dict] = json.loads(
+            self._map[_offset : _offset + _footer_length]
+        )["chunks"]
+        self._index = {name: i for i, name in enumerate(self.columns)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(chunk["rows"] for chunk in self._chunks)
+
+    def close(self):
+        if not self._map.closed:
+            try:
+                self._map.close()
+            except BufferError:
+                # a column returned without a copy still views the map, which is unmapped
+                # once the last of them is released
+                pass
+        self._file.close()
+
+    def _read(self, block: List[int]):
+        _offset, _length = block
+        _view = memoryview(self._map)[_offset : _offset + _length]
+        if self.compression == "raw":
+            return _view
+        return self._decompress(_view)
+
+    def timestamps(self) -> np.ndarray:
+        """The timestamps of all rows, in ms"""
+        _chunks = [
+            np.cumsum(np.frombuffer(self._read(chunk["time"]), dtype=np.int64))
+            + chunk["base"]
+            for chunk in self._chunks
+        ]
+        if len(_chunks) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return np.concatenate(_chunks) / 1000
+
+    def column(self, name: str) -> np.ndarray:
+        """The values of a column, NaN where a record did not have it
+
+        A raw file with a single chunk returns a read-only view of the memory map, which
+        stays valid after the reader is closed.
+        """
+        _i = self._index[name]
+        _chunks = []
+        for chunk in self._chunks:
+            _data = self._read(chunk["columns"][_i])
+            if self._shuffled:
+                _chunks.append(_unshuffle(_data, self.dtype))
+            else:
+                _chunks.append(np.frombuffer(_data, dtype=self.dtype))
+        if len(_chunks) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        if len(_chunks) == 1:
+            return _chunks[0]
+        return np.concatenate(_chunks)
+
+    def to_numpy(
+        self, columns: Optional[Sequence[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        """The timestamps and the requested columns
+
+        Args:
+            columns (Sequence[str], optional): The columns to read. Defaults to all of them
+
+        Returns:
+            Dict[str, np.ndarray]: The "timestamp" and every column
+        """
+        _data = {"timestamp": self.timestamps()}
+        for name in columns if columns is not None else self.columns:
+            _data[name] = self.column(name)
+        return _data
+
+    def to_frame(self, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """The requested columns indexed by the timestamp in ms
+
+        Args:
+            columns (Sequence[str], optional): The columns to read. Defaults to all of them
+        """
+        _data = self.to_numpy(columns)
+        _index = pd.Index(_data.pop("timestamp"), name="timestamp")
+        return pd.DataFrame(_data, index=_index)
+
+
+def write_records(
+    file_path: str, records: List[dict], meta: Optional[dict] = None, **kwargs
+):
+    """Write metric records into a columnar file
+
+    Only the numeric values are kept, under the dotted keys of `flatten_record`. The columns
+    are the union of the keys of all records, in the order they first appear.
+
+    Args:
+        file_path (str): The file to write
+        records (List[dict]): The metric records, each with a timestamp in ms
+        meta (dict, optional): Free-form JSON metadata saved in the header
+        **kwargs: The options of `ColumnarWriter`
+    """
+    _flat = [
+        flatten_record({k: v for k, v in record.items() if k != "timestamp"})
+        for record in records
+    ]
+    _columns: Dict[str, int] = {}
+    for values in _flat:
+        for key in values:
+            if key not in _columns:
+                _columns[key] = len(_columns)
+    _values = np.full((len(records), len(_columns)), np.nan, dtype=np.float64)
+    for i, values in enumerate(_flat):
+        _values[i, [_columns[k] for k in values]] = list(values.values())
+    _timestamps = np.array([r["timestamp"] for r in records], dtype=np.float64)
+    with ColumnarWriter(file_path, list(_columns), meta=meta, **kwargs) as writer:
+        if len(records) > 0:
+            writer.write(_timestamps, _values)
+
+
+def is_columnar(file_path: str) -> bool:
+    """Whether a file path names a columnar monitor file, by its extension"""
+    return os.path.splitext(file_path)[1] == ColumnarExtension
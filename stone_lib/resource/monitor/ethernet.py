@@ -1,9 +1,35 @@
+import fnmatch
 import logging
 import os
-from typing import Dict, List
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 logger = logging.getLogger()
 
+# the 16 counters of every interface in /proc/net/dev
+Counters = (
+    "r_bytes",
+    "r_packets",
+    "r_errs",
+    "r_drop",
+    "r_fifo",
+    "r_frame",
+    "r_compressed",
+    "r_multicast",
+    "t_bytes",
+    "t_packets",
+    "t_errs",
+    "t_drop",
+    "t_fifo",
+    "t_colls",
+    "t_carrier",
+    "t_compressed",
+)
+RxBytes = Counters.index("r_bytes")
+TxBytes = Counters.index("t_bytes")
+
 
 class EthernetMetrics:
     def __init__(self, data: str):
@@ -11,6 +37,8 @@ class EthernetMetrics:
         self.data: List[str] = data.split()
         if len(self.data) != 17:
             raise ValueError("Invalid data, the data should have 17 fields")
+        # convert once instead of in every property access
+        self._counters: Tuple[int, ...] = tuple(int(x) for x in self.data[1:])
 
     @property
     def interface(self) -> str:
@@ -18,67 +46,67 @@ class EthernetMetrics:
 
     @property
     def r_bytes(self) -> int:
-        return int(self.data[1])
+        return self._counters[0]
 
     @property
     def r_packets(self) -> int:
-        return int(self.data[2])
+        return self._counters[1]
 
     @property
     def r_errs(self) -> int:
-        return int(self.data[3])
+        return self._counters[2]
 
     @property
     def r_drop(self) -> int:
-        return int(self.data[4])
+        return self._counters[3]
 
     @property
     def r_fifo(self) -> int:
-        return int(self.data[5])
+        return self._counters[4]
 
     @property
     def r_frame(self) -> int:
-        return int(self.data[6])
+        return self._counters[5]
 
     @property
     def r_compressed(self) -> int:
-        return int(self.data[7])
+        return self._counters[6]
 
     @property
     def r_multicast(self) -> int:
-        return int(self.data[8])
+        return self._counters[7]
 
     @property
     def t_bytes(self) -> int:
-        return int(self.data[9])
+        return self._counters[8]
 
     @property
     def t_packets(self) -> int:
-        return int(self.data[10])
+        return self._counters[9]
 
     @property
     def t_errs(self) -> int:
-        return int(self.data[11])
+        return self._counters[10]
 
     @property
     def t_drop(self) -> int:
-        return int(self.data[12])
+        return self._counters[11]
 
     @property
     def t_fifo(self) -> int:
-        return int(self.data[13])
+        return self._counters[12]
 
     @property
     def t_colls(self) -> int:
-        return int(self.data[14])
+        return self._counters[13]
 
     @property
     def t_carrier(self) -> int:
-        return int(self.data[15])
+        return self._counters[14]
 
     @property
     def t_compressed(self) -> int:
-        return int(self.data[16])
+        return self._counters[15]
 
     def to_json(self) -> dict:
         return {
@@ -106,12 +134,105 @@ class EthernetMetrics:
         }
 
 
+class NetSnapshot:
+    def __init__(self, interfaces: Tuple[str, ...], counters: np.ndarray, time: int):
+        """All counters of /proc/net/dev read at once
+
+        Args:
+            interfaces (Tuple[str, ...]): The interface names, one per row of `counters`
+            counters (np.ndarray): The counters, shape (interfaces, 16), see `Counters`
+            time (int): The monotonic time the file was read at, in ns
+        """
+        self.interfaces = interfaces
+        self.counters = counters
+        self.time = time
+
+    def __len__(self):
+        return len(self.interfaces)
+
+    def get(self, interface: str) -> Dict[str, int]:
+        """Get the counters of a single interface
+
+        Args:
+            interface (str): The interface name
+
+        Returns:
+            Dict[str, int]: counter name to value
+        """
+        _row = self.counters[self.interfaces.index(interface)]
+        return {name: int(_row[i]) for i, name in enumerate(Counters)}
+
+
+def counter_delta(previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """Compute the increase of cumulative counters, handling wraps and resets
+
+    A counter lower than its previous value has either wrapped or been reset. Counters
+    below 2^32 are assumed to be 32-bit (some drivers expose 32-bit counters), the
+    others 64-bit. A wrap covering more than half of the counter range in one sample is
+    not plausible, so it is treated as a reset (e.g. a re-created interface) and the
+    increase is the new value.
+
+    Args:
+        previous (np.ndarray): The previous counters, dtype uint64
+        current (np.ndarray): The current counters, dtype uint64, same shape as previous
+
+    Returns:
+        np.ndarray: The increase of every counter, dtype uint64
+    """
+    # unsigned subtraction is modulo 2^64, which already handles 64-bit wraps
+    _delta = current - previous
+    _wrapped = current < previous
+    if not _wrapped.any():
+        return _delta
+    _is_32bit = previous < np.uint64(1 << 32)
+    _delta = np.where(
+        _wrapped & _is_32bit, current + np.uint64(1 << 32) - previous, _delta
+    )
+    _reset = _wrapped & np.where(
+        _is_32bit, _delta > np.uint64(1 << 31), _delta > np.uint64(1 << 63)
+    )
+    return np.where(_reset, current, _delta)
+
+
 class EthernetMonitor:
     NetDir = "/proc/net"
     CheckList = ["dev"]
 
-    def __init__(self):
-        self.net_dir = self.NetDir
+    def __init__(
+        self,
+        net_dir: Optional[str] = None,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        groups: Optional[Dict[str, List[str]]] = None,
+    ):
+        """Monitor the network interfaces from /proc/net/dev
+
+        An interface matching an `exclude` pattern is ignored. An interface matching the
+        patterns of a group is summed into that group, the first matching group wins. The
+        other interfaces are reported on their own when they match an `include` pattern.
+
+        Args:
+            net_dir (str, optional): The directory of the dev file. Defaults to /proc/net
+            include (List[str], optional): Glob patterns of the interfaces to report.
+                Defaults to None, which reports all of them.
+            exclude (List[str], optional): Glob patterns of the interfaces to ignore
+            groups (Dict[str, List[str]], optional): Group name to glob patterns, the rates of
+                the members are summed into the group
+
+        Examples:
+            EthernetMonitor(exclude=["lo"], groups={"veth": ["veth*", "cali*"]})
+        """
+        self.net_dir = net_dir or self.NetDir
+        self.include = include
+        self.exclude = exclude or []
+        self.groups = groups or {}
+        # the interface set rarely changes, the selection is only rebuilt when it does
+        self._all_interfaces: Tuple[str, ...] = ()
+        self._rows: List[int] = []
+        self._interfaces: Tuple[str, ...] = ()
+        self._outputs: Tuple[str, ...] = tuple(self.groups.keys())
+        self._slot_of: Dict[str, int] = {}
+        self._slots = np.zeros(0, dtype=np.intp)
 
     def _get_raw_data(self) -> List[str]:
         """Get the raw data from the dev file
@@ -124,6 +245,129 @@ class EthernetMonitor:
         logger.debug(f"Raw data from /proc/net/dev: {lines}")
         return lines
 
+    def _match(self, interface: str, patterns: List[str]) -> bool:
+        return any(fnmatch.fnmatchcase(interface, p) for p in patterns)
+
+    def _select(self, interfaces: Tuple[str, ...]):
+        """Rebuild the selected rows and the output slot of every selected interface"""
+        logger.info(f"Network interfaces changed to {list(interfaces)}")
+        self._all_interfaces = interfaces
+        _groups = list(self.groups.keys())
+        _individuals = []
+        _rows = []
+        _members = {}
+        for row, interface in enumerate(interfaces):
+            if self._match(interface, self.exclude):
+                continue
+            _group = next(
+                (g for g in _groups if self._match(interface, self.groups[g])), None
+            )
+            if _group is not None:
+                _members[interface] = _group
+            elif self.include is None or self._match(interface, self.include):
+                _individuals.append(interface)
+            else:
+                continue
+            _rows.append(row)
+        self._rows = _rows
+        self._interfaces = tuple(interfaces[row] for row in _rows)
+        self._outputs = tuple(_individuals) + tuple(_groups)
+        _slot = {name: i for i, name in enumerate(self._outputs)}
+        self._slot_of = {
+            interface: _slot[_members.get(interface, interface)]
+            for interface in self._interfaces
+        }
+        self._slots = np.array(
+            [self._slot_of[name] for name in self._interfaces], dtype=np.intp
+        )
+
+    def snapshot(self) -> NetSnapshot:
+        """Read /proc/net/dev once and parse the counters of the selected interfaces
+
+        Returns:
+            NetSnapshot: The counters of the selected interfaces
+        """
+        _time = time.monotonic_ns()
+        _lines = [line for line in self._get_raw_data()[2:] if line.strip() != ""]
+        _names = []
+        _values = []
+        for line in _lines:
+            _name, _, _data = line.partition(":")
+            _names.append(_name.strip())
+            _values.append(_data)
+        if tuple(_names) != self._all_interfaces:
+            self._select(tuple(_names))
+        # a single conversion for all the counters of the selected interfaces
+        _counters = np.array(
+            " ".join(_values[row] for row in self._rows).split(), dtype=np.uint64
+        )
+        if _counters.size != len(self._rows) * len(Counters):
+            raise ValueError(
+                f"Invalid data, every interface should have {len(Counters)} fields"
+            )
+        return NetSnapshot(
+            self._interfaces,
+            _counters.reshape(len(self._rows), len(Counters)),
+            _time,
+        )
+
+    def rates(
+        self, previous: NetSnapshot, current: NetSnapshot, interval: float
+    ) -> Dict[str, Dict[str, float]]:
+        """Compute the receive and transmit rates between two snapshots
+
+        Interfaces which appeared or disappeared between both snapshots are left out,
+        groups are always reported even when none of their members is present.
+
+        Args:
+            previous (NetSnapshot): The snapshot taken at the start of the sample
+            current (NetSnapshot): The snapshot taken at the end of the sample
+            interval (float): The elapsed time between both snapshots, in seconds
+
+        Returns:
+            Dict[str, Dict[str, float]]: interface or group to rx and tx in MB/s
+
+        Examples:
+            {
+                "eth0": {"rx": 0.5, "tx": 0.1},
+                "veth": {"rx": 10.2, "tx": 9.8}
+            }
+        """
+        _current = current.counters[:, [RxBytes, TxBytes]]
+        if previous.interfaces == current.interfaces:
+            _previous = previous.counters[:, [RxBytes, TxBytes]]
+            _slots = self._slots
+            if current.interfaces != self._interfaces:
+                _slots = np.array(
+                    [self._slot_of[name] for name in current.interfaces], dtype=np.intp
+                )
+        else:
+            # hot-plug: only the interfaces present in both snapshots have a rate
+            _index = {name: i for i, name in enumerate(previous.interfaces)}
+            _rows = [
+                i
+                for i, name in enumerate(current.interfaces)
+                if name in _index and name in self._slot_of
+            ]
+            _names = [current.interfaces[i] for i in _rows]
+            _current = _current[_rows]
+            _previous = previous.counters[[_index[name] for name in _names]][
+                :, [RxBytes, TxBytes]
+            ]
+            _slots = np.array([self._slot_of[name] for name in _names], dtype=np.intp)
+        _delta = counter_delta(_previous, _current).astype(np.float64)
+        _sum = np.zeros((len(self._outputs), 2), dtype=np.float64)
+        np.add.at(_sum, _slots, _delta)
+        _present = np.zeros(len(self._outputs), dtype=bool)
+        _present[_slots] = True
+        _present[len(self._outputs) - len(self.groups) :] = True
+        _rates = np.round(_sum / 1024 / 1024 / interval, 2).tolist()
+        return {
+            name: {"rx": rate[0], "tx": rate[1]}
+            for name, rate, present in zip(self._outputs, _rates, _present)
+            if present
+        }
+
     def _get_structured_data(self) -> Dict[str, EthernetMetrics]:
         """Get the structured data from the raw data
 
@@ -150,6 +394,9 @@ class EthernetMonitor:
     def interfaces(self) -> List[str]:
         """Get the list of interfaces
 
+        The interface set of the latest snapshot is reused, the file is only read when no
+        snapshot has been taken yet.
+
         Returns:
             List[str]: The list of interfaces
 
@@ -159,7 +406,9 @@ class EthernetMonitor:
                 "eth1"
             ]
         """
-        return list(self._get_structured_data().keys())
+        if len(self._interfaces) == 0:
+            self.snapshot()
+        return list(self._interfaces)
 
     def get_all_interfaces_data(self) -> Dict[str, EthernetMetrics]:
         """Get the data of all interfaces
@@ -187,11 +436,11 @@ class EthernetMonitor:
 
         """
         _data = self._get_structured_data()
-        if interface in self.interfaces:
+        if interface in _data:
             return _data[interface]
         else:
             raise KeyError(
-                f"Interface {interface} not found, only {self.interfaces} are available"
+                f"Interface {interface} not found, only {list(_data.keys())} are available"
             )
 
     def to_json(self) -> Dict[str, Dict]:
@@ -202,10 +451,4 @@ class EthernetMonitor:
 
         """
         _data = self._get_structured_data()
-        return {interface: _data[interface].to_json() for interface in self.interfaces}
-
-
-if __name__ == "__main__":
-    em = EthernetMonitor()
-    print(em.get_all_interfaces_data())
-    print(em.get_specific_interface_data("eth0").to_json())
+        return {interface: metric.to_json() for interface, metric in _data.items()}
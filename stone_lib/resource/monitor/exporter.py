@@ -0,0 +1,210 @@
+import logging
+import math
+import operator
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from .rollup import flatten_record
+
+logger = logging.getLogger(__name__)
+
+# the key of a record section mapped to the label of the key that follows it
+LabelKeys = {
+    "network": "interface",
+    "gpu": "gpu",
+    "processes": "pid",
+    "threads": "tid",
+    "cores": "core",
+    "io": "device",
+    "diskstats": "device",
+}
+
+ContentType = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _sanitise(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _format_value(value):
+    """Spell the non-finite floats as OpenMetrics does, the other values are left as is"""
+    if isinstance(value, float) and not math.isfinite(value):
+        if math.isnan(value):
+            return "NaN"
+        return "+Inf" if value > 0 else "-Inf"
+    return value
+
+
+def metric_name(key: str, prefix: str = "stone") -> Tuple[str, Dict[str, str]]:
+    """Map a dotted key of `flatten_record` to an OpenMetrics name and its labels
+
+    The key following a section of `LabelKeys` becomes a label, e.g. the interface of the
+    network section, the other numeric keys become an `index` label.
+
+    Args:
+        key (str): The dotted key
+        prefix (str): The prefix of the metric name
+
+    Returns:
+        Tuple[str, Dict[str, str]]: The metric name and its labels
+
+    Examples:
+        >>> metric_name("gpu.0.info.gpu_utilisation")
+        ("stone_gpu_info_gpu_utilisation", {"gpu": "0"})
+    """
+    _name = [prefix]
+    _labels = {}
+    _label = None
+    for segment in key.split("."):
+        if _label is not None:
+            _labels[_label] = segment
+            _label = None
+        elif segment.isdigit():
+            _labels["index"] = segment
+        else:
+            _name.append(segment)
+            _label = LabelKeys.get(segment)
+    return _sanitise("_".join(_name)), _labels
+
+
+class MetricsExporter:
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 9400, prefix: str = "stone"
+    ):
+        """Serve the latest metric record in the OpenMetrics text format
+
+        The text is rendered once per record from a template which is only rebuilt when the
+        set of metrics changes, so a scrape writes a ready buffer and never formats a metric.
+        It is a monitor sink, give it to `AsyncHostMonitor` or use the exporter options of
+        `HostMetrics`.
+
+        Args:
+            host (str): The address to listen on. Defaults to localhost
+            port (int): The port to listen on, 0 picks a free one. Defaults to 9400
+            prefix (str): The prefix of the metric names. Defaults to stone
+
+        Examples:
+            exporter = MetricsExporter(port=9400)
+            exporter.start()
+            exporter.update(metrics.get_records()[-1])
+            # curl http://127.0.0.1:9400/metrics
+        """
+        self.host = host
+        self.prefix = prefix
+        self._port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._schema: Optional[Tuple[str, ...]] = None
+        self._template = ""
+        self._getter = None
+        self._body = b"# EOF\n"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __call__(self, record: dict):
+        self.update(record)
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self._port}/metrics"
+
+    @property
+    def body(self) -> bytes:
+        """The text served to the next scrape"""
+        return self._body
+
+    def _build(self, keys: Tuple[str, ...]):
+        _families: Dict[str, List[Tuple[str, str]]] = {}
+        for key in keys:
+            _name, _labels = metric_name(key, self.prefix)
+            _label_text = ",".join(f'{k}="{v}"' for k, v in _labels.items())
+            _sample = f"{_name}{{{_label_text}}}" if _label_text else _name
+            _families.setdefault(_name, []).append((key, _sample))
+        _lines, _order = [], []
+        # the samples of a family must be contiguous
+        for name, samples in _families.items():
+            _lines.append(f"# TYPE {name} gauge")
+            for key, sample in samples:
+                # a label value may hold a "%", it must not be read as a placeholder
+                _lines.append(f"{sample.replace('%', '%%')} %s")
+                _order.append(key)
+        _lines.append("# EOF\n")
+        self._template = "\n".join(_lines)
+        _getter = operator.itemgetter(*_order) if len(_order) > 0 else None
+        if len(_order) == 1:
+            # itemgetter of one key returns the value instead of a tuple
+            self._getter = lambda flat: (_getter(flat),)
+        else:
+            self._getter = _getter
+        self._schema = keys
+
+    def update(self, record: dict):
+        """Render a metric record for the next scrapes
+
+        Args:
+            record (dict): The metric record
+        """
+        _flat = flatten_record({k: v for k, v in record.items() if k != "timestamp"})
+        _keys = tuple(_flat)
+        if _keys != self._schema:
+            self._build(_keys)
+        if self._getter is None:
+            self._body = self._template.encode()
+            return
+        # swapping the reference is atomic, a scrape sees either body
+        _values = tuple(map(_format_value, self._getter(_flat)))
+        self._body = (self._template % _values).encode()
+
+    def start(self):
+        if self._server is not None:
+            raise RuntimeError(f"The exporter is already serving on {self.url}")
+        exporter = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                _body = exporter.body
+                self.send_response(200)
+                self.send_header("Content-Type", ContentType)
+                self.send_header("Content-Length", str(len(_body)))
+                self.end_headers()
+                self.wfile.write(_body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"Exporter request: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self._port), _Handler)
+        self._server.daemon_threads = True
+        self._port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            # the poll interval bounds how long `stop` waits for the server
+            kwargs={"poll_interval": 0.1},
+            name="metrics_exporter",
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info(f"Serve the metrics on {self.url}")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
+        logger.info(f"Stop serving the metrics on {self.url}")
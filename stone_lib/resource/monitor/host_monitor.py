@@ -6,36 +6,121 @@ import time
 import uuid
 from typing import Dict, List, Optional
 
+from .adaptive import AdaptiveInterval
 from .cgroup import CGroupMonitor
 from .ethernet import EthernetMonitor
+from .overhead import SamplerStats
+from .rollup import RollupSink
+from .timeline import ClockAnchor
 
 logger = logging.getLogger(__name__)
 
 
 class HostMetrics:
+    # the interval never backs off beyond 10 s, unit: ms
+    MaxInterval = 10000
+
     def __init__(
-        self, interval: int = 10, gpu_enable: bool = True, uuid: Optional[str] = None
+        self,
+        interval: int = 10,
+        gpu_enable: bool = True,
+        uuid: Optional[str] = None,
+        process_enable: bool = False,
+        net_options: Optional[dict] = None,
+        gpu_options: Optional[dict] = None,
+        cgroup_stats: bool = False,
+        collectors: Optional[list] = None,
+        overhead_budget: Optional[float] = None,
+        adaptive_options: Optional[dict] = None,
+        rollup_windows: Optional[List[int]] = None,
+        exporter_options: Optional[dict] = None,
+        stream_options: Optional[dict] = None,
     ):
         """A host metrics class to monitor the host system
 
         Args:
             interval (int): The interval to monitor the system. Defaults to 10 ms
+            process_enable (bool): Whether to sample the GPU usage of every process and the
+                cgroup it belongs to. It requires the GPU monitoring. Defaults to False
+            net_options (dict, optional): The include/exclude filters and groups of the
+                network interfaces, see `EthernetMonitor`
+            gpu_options (dict, optional): The options of the GPU monitoring, e.g. the NVML
+                field values and sample buffer, see `HostGPUs`. Ignored when `gpu_enable`
+                is False
+            cgroup_stats (bool): Whether to sample the throttling, memory breakdown, io and
+                pressure stall statistics of the cgroup. Defaults to False
+            collectors (list, optional): Extra collectors sampled at every tick, e.g. the
+                node-wide collectors of `proc.default_collectors`. Each record holds the
+                output of a collector under its `name`
+            overhead_budget (float, optional): The share of one core the sampler may use,
+                e.g. 0.01 for 1 %. The interval is doubled, up to `MaxInterval`, while the
+                overhead exceeds it. Defaults to None, which never changes the interval
+            adaptive_options (dict, optional): Sample fast while the CPU or GPU utilisation
+                changes and slow down while it is steady, see `AdaptiveInterval` for the
+                options. `interval` is only the first interval then. Defaults to None, which
+                samples at a fixed interval
+            rollup_windows (List[int], optional): The window lengths in ms to summarise every
+                metric over while sampling, the rollups are saved alongside the records.
+                Defaults to None, which disables the rollups
+            exporter_options (dict, optional): Serve the latest record in the OpenMetrics
+                text format over HTTP until `close`, see `MetricsExporter` for the options.
+                Defaults to None, which disables the endpoint
+            stream_options (dict, optional): Stream every record to a `MonitorAggregator`
+                until `close`, see `MonitorStreamer` for the options. Defaults to None
         """
         self._id = uuid or str(uuid.uuid4())[:8]
         self.cgroup = CGroupMonitor()
-        self.net = EthernetMonitor()
+        self.net = EthernetMonitor(**(net_options or {}))
         if gpu_enable:
             from .nvml import HostGPUs
 
-            self.gpu = HostGPUs()
+            self.gpu = HostGPUs(**(gpu_options or {}))
             logger.info(f"[{self._id}]GPU monitoring is enabled.")
         else:
             self.gpu = None
         logger.info(f"[{self._id}]GPU monitoring is disabled.")
+        if process_enable and self.gpu is not None:
+            from .process import GPUProcessMonitor
+
+            self.process = GPUProcessMonitor(self.gpu)
+            logger.info(f"[{self._id}]Process monitoring is enabled.")
+        else:
+            if process_enable:
+                logger.warning(
+                    f"[{self._id}]Process monitoring requires the GPU monitoring."
+                )
+            self.process = None
+        self.collectors = list(collectors or [])
+        self.stats = SamplerStats(budget=overhead_budget)
+        self.adaptive = (
+            AdaptiveInterval(**adaptive_options)
+            if adaptive_options is not None
+            else None
+        )
+        self.rollup = RollupSink(rollup_windows) if rollup_windows is not None else None
+        if exporter_options is not None:
+            from .exporter import MetricsExporter
+
+            self.exporter = MetricsExporter(**exporter_options)
+            self.exporter.start()
+        else:
+            self.exporter = None
+        if stream_options is not None:
+            from .aggregator import MonitorStreamer
+
+            self.streamer = MonitorStreamer(**stream_options)
+            self.streamer.start()
+        else:
+            self.streamer = None
+        # pairs the wall clock of the records with the monotonic clock of a profiler
+        self.clock = ClockAnchor.capture()
         # convert to seconds
+        self._cgroup_stats = cgroup_stats
         self._interval = interval / 1000
         self._count = 0
         self._records = []
+        # the last snapshot, the start of the next record
+        self._previous = None
         logger.info(
             f"[{self._id}]Set the interval to monitor the system: {interval} ms"
         )
@@ -60,33 +145,90 @@ class HostMetrics:
     def get_records(self) -> List[dict]:
         return self._records
 
-    def record(self):
-        if self._count % (1 / self.interval) == 0:
-            logger.info(f"[{self._id}]Record the system metrics at {time.time_ns()}")
-        _cpu_time_p = self.cgroup.cpu_usage()
-        _ethernet_p = self.net.get_all_interfaces_data()
-        time.sleep(self.interval)
-        _cpu_time_c = self.cgroup.cpu_usage()
-        _ethernet_c = self.net.get_all_interfaces_data()
-        _cpu_time_ms = (_cpu_time_c - _cpu_time_p) / 1000000  # convert to ms
-        _net_utils = {}
-        interval_in_sec = self.interval * 1000
-        for interface in self.net.interfaces:
-            _net_p = _ethernet_p[interface]
-            _net_c = _ethernet_c[interface]
-            _utils = {
-                "rx": round(
-                    ((_net_c.r_bytes - _net_p.r_bytes) / 1024 / 1024) / interval_in_sec,
-                    2,
-                ),
-                "tx": round(
-                    ((_net_c.t_bytes - _net_p.t_bytes) / 1024 / 1024) / interval_in_sec,
-                    2,
-                ),
-            }
-            _net_utils[interface] = _utils
+    def snapshot(self) -> dict:
+        """Take a snapshot of the cumulative counters used to compute rates
 
-        _max_mem = self.cgroup.memory_max()
+        Returns:
+            dict: The raw counters and the monotonic time they were read at
+
+        """
+        _cpu = time.thread_time_ns()
+        _snapshot = {"time": time.monotonic_ns()}
+        with self.stats.timer("cgroup"):
+            if self._cgroup_stats:
+                # cpu.stat is read once for both the usage and the throttling
+                _snapshot["cgroup"] = self.cgroup.stats()
+                _snapshot["cpu"] = _snapshot["cgroup"]["cpu"]["usage"]
+            else:
+                _snapshot["cpu"] = self.cgroup.cpu_usage()
+        with self.stats.timer("network"):
+            _snapshot["network"] = self.net.snapshot()
+        if self.process is not None:
+            with self.stats.timer("processes"):
+                _snapshot["processes"] = self.process.snapshot()
+        if len(self.collectors) > 0:
+            _snapshot["collectors"] = []
+            for collector in self.collectors:
+                with self.stats.timer(collector.name):
+                    _snapshot["collectors"].append(collector.snapshot())
+        self.stats.add_cpu_time(time.thread_time_ns() - _cpu)
+        return _snapshot
+
+    def read_gpus(self) -> dict:
+        """Read the GPUs for a record
+
+        The NVML calls are the only reads of a sample which may block, the kernel serves
+        the cgroup and /proc files from memory, so they are kept apart from `compose`.
+
+        Returns:
+            dict: The NVML readings, the GPU record under "gpu" and the GPU processes under
+                "processes" with the process monitoring
+
+        """
+        _cpu = time.thread_time_ns()
+        _readings = {"gpu": {}}
+        if self.gpu is not None:
+            with self.stats.timer("gpu"):
+                _readings["gpu"] = self.gpu.to_json()
+        if self.process is not None:
+            with self.stats.timer("gpu_processes"):
+                _readings["processes"] = self.gpu.get_processes()
+        self.stats.add_cpu_time(time.thread_time_ns() - _cpu)
+        return _readings
+
+    def compose(
+        self,
+        previous: dict,
+        current: dict,
+        interval: float,
+        gpus: Optional[dict] = None,
+    ) -> dict:
+        """Build a metric record from two snapshots
+
+        Args:
+            previous (dict): The snapshot taken at the start of the sample
+            current (dict): The snapshot taken at the end of the sample
+            interval (float): The elapsed time between both snapshots, in seconds
+            gpus (dict, optional): The readings of `read_gpus` for the record. Defaults to
+                None, which reads the GPUs here
+
+        Returns:
+            dict: The metric record, see `to_json` for the format
+
+        """
+        if gpus is None:
+            gpus = self.read_gpus()
+        _cpu = time.thread_time_ns()
+        _cpu_time_ms = (current["cpu"] - previous["cpu"]) / 1000000  # convert to ms
+        _net_utils = self.net.rates(previous["network"], current["network"], interval)
+
+        if self._cgroup_stats:
+            # the memory files are already read by the statistics of the snapshot
+            _usage = current["cgroup"]["memory"]["usage"] or 0
+            _max_mem = current["cgroup"]["memory"]["max"]
+        else:
+            _usage = self.cgroup.memory_usage()
+            _max_mem = self.cgroup.memory_max()
         if _max_mem > 0:
             _max_mem = round(_max_mem / 1024 / 1024, 2)  # convert to MB
 
@@ -94,25 +236,109 @@ class HostMetrics:
             "timestamp": round(time.time_ns() / 1000000, 2),  # convert to ms
             "cpu": {
                 "utilisation": round(
-                    (_cpu_time_ms / self.interval) * 100, 2
+                    (_cpu_time_ms / interval) * 100, 2
                 ),  # convert to percentage
             },
             "memory": {
-                "usage": self.cgroup.memory_usage() / 1024 / 1024,  # convert to MB,
+                "usage": _usage / 1024 / 1024,  # convert to MB,
                 "max": _max_mem,
             },
             "network": _net_utils,
+            "interval": round(interval * 1000, 2),  # unit: ms
         }
-        if self.gpu is not None:
-            _metric["gpu"] = self.gpu.to_json()
-        else:
-            _metric["gpu"] = {}
-        self._records.append(_metric)
+        _metric["gpu"] = gpus["gpu"]
+        if self._cgroup_stats:
+            _metric["cgroup"] = self.cgroup.compose_stats(
+                previous["cgroup"], current["cgroup"], interval
+            )
+        if self.process is not None:
+            _metric["processes"] = self.process.compose(
+                previous["processes"],
+                current["processes"],
+                interval,
+                gpus["processes"],
+            )
+        for collector, _previous, _current in zip(
+            self.collectors,
+            previous.get("collectors", []),
+            current.get("collectors", []),
+        ):
+            _metric[collector.name] = collector.compose(_previous, _current, interval)
+        self.stats.add_cpu_time(time.thread_time_ns() - _cpu)
+        return _metric
+
+    def append(self, metric: dict):
+        """Store a metric record built by `compose`
+
+        Args:
+            metric (dict): The metric record
+
+        """
+        self._records.append(metric)
+        if self.rollup is not None:
+            self.rollup(metric)
+        if self.exporter is not None:
+            self.exporter.update(metric)
+        if self.streamer is not None:
+            self.streamer.send(metric)
         # this protected variable 'count' is used to save the memory for calculating the length of records
         # length of records will be called every time when the record method is called and the logger will
         # record a message when mod (length of record)%(1/interval) is 0
         self._count += 1
 
+    def end_sample(self, elapsed: float, metric: Optional[dict] = None):
+        """Account the cost of a sample and choose the interval of the next one
+
+        The interval backs off when the sampler is over budget, and then follows the
+        adaptive policy if there is one.
+
+        Args:
+            elapsed (float): The measured duration of the sample, in seconds
+            metric (dict, optional): The record of the sample, used by the adaptive policy
+
+        """
+        if self.stats.end_sample(elapsed, self._interval):
+            self._back_off()
+        if self.adaptive is not None and metric is not None:
+            _interval = self.adaptive.next_interval(metric, self._interval * 1000)
+            if _interval != self._interval * 1000:
+                logger.debug(f"[{self._id}]Adapt the interval to {_interval} ms")
+            self._interval = _interval / 1000
+
+    def _back_off(self):
+        _interval_ms = self._interval * 1000
+        if self.adaptive is not None:
+            _interval_ms = max(_interval_ms, self.adaptive.min_interval)
+        if _interval_ms >= self.MaxInterval:
+            return
+        logger.warning(
+            f"[{self._id}]Sampling overhead {self.stats.overhead:.4f} exceeds the budget "
+            f"{self.stats.budget}, back off the interval"
+        )
+        self.interval = min(_interval_ms * 2, self.MaxInterval)
+        if self.adaptive is not None:
+            # the adaptive policy must not sample faster than the budget allows
+            self.adaptive.min_interval = self.interval * 1000
+            self.adaptive.max_interval = max(
+                self.adaptive.max_interval, self.adaptive.min_interval
+            )
+        self.stats.reset_overhead()
+
+    def record(self):
+        if self._count % (1 / self.interval) == 0:
+            logger.info(f"[{self._id}]Record the system metrics at {time.time_ns()}")
+        if self._previous is None:
+            self._previous = self.snapshot()
+        _previous = self._previous
+        time.sleep(self.interval)
+        _current = self.snapshot()
+        self._previous = _current
+        # the measured interval includes the sampling cost and the oversleep of the timer
+        _elapsed = (_current["time"] - _previous["time"]) / 1e9
+        _metric = self.compose(_previous, _current, _elapsed)
+        self.append(_metric)
+        self.end_sample(_elapsed, _metric)
+
     def to_json(self):
         """Get the data in JSON format
 
@@ -140,9 +366,35 @@ class HostMetrics:
                                 "tx": 0.0   # unit: MB/s
                             }
                         },
+                        "interval": 10.0,  # unit: ms, measured length of this sample
                         "gpu": {}
                     }
-                ]
+                ],
+                "overhead": {
+                    "cpu_time": 12.5,  # unit: ms, spent by the sampler
+                    "cpu_utilisation": 0.2,  # unit: percentage of one core
+                    "overhead": 0.002,  # share of one core, moving average
+                    "budget": None,
+                    "jitter": {...},  # histogram of the drift from the interval, unit: µs
+                    "stages": {"cgroup": {...}, "network": {...}, "gpu": {...}},
+                },
+                "clock": {  # anchor pair to align a profiler, see `timeline.MonitorTimeline`
+                    "clock": "monotonic",
+                    "wall": 1630627339990.5,  # unit: ms
+                    "reference": 5310240.125,  # unit: µs
+                },
+                "rollups": {  # only with rollup windows, see `RollupSink`
+                    "1000": [
+                        {
+                            "start": 1630627340000,  # unit: ms
+                            "end": 1630627341000,  # unit: ms
+                            "count": 100,
+                            "metrics": {
+                                "cpu.utilisation": {"min": 0.0, "max": 50.0, "mean": 20.0, "p95": 45.0}
+                            },
+                        }
+                    ]
+                }
             }
 
         """
@@ -154,30 +406,69 @@ class HostMetrics:
                 (_records[-1]["timestamp"] - _records[0]["timestamp"]), 2
             ),  # unit: ms
             "records": _records,
+            "overhead": self.stats.to_json(),
+            "clock": self.clock.to_json(),
         }
+        if self.rollup is not None:
+            _data["rollups"] = self.rollup.to_json()
         return _data
 
-    def save(self, file_path: str):
+    def close(self):
+        """Release the resources held while sampling, e.g. the metrics endpoint"""
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.streamer is not None:
+            self.streamer.stop()
+
+    def save(self, file_path: str, file_format: Optional[str] = None):
         """Save the data to a file
 
         Args:
             file_path (str): The file path to save the data
+            file_format (str, optional): json, or columnar for the compact binary format of
+                `columnar.ColumnarWriter` which keeps everything but the records in its
+                metadata. Defaults to None, which picks columnar for the `.smc` extension
+                and json otherwise
 
         """
-        with open(file_path, "w") as f:
-            json.dump(self.to_json(), f, indent=4)
+        from .columnar import is_columnar, write_records
+
+        if file_format is None:
+            file_format = "columnar" if is_columnar(file_path) else "json"
+        if file_format not in ("json", "columnar"):
+            raise ValueError(f"Unknown file format: {file_format}")
+        # the serialisation of this save shows up in the overhead of the next one
+        with self.stats.timer("serialisation"):
+            _data = self.to_json()
+            if file_format == "columnar":
+                _records = _data.pop("records")
+                write_records(file_path, _records, meta=_data)
+            else:
+                with open(file_path, "w") as f:
+                    json.dump(_data, f, indent=4)
         logger.info(f"[{self._id}]Save the monitoring data to {file_path}")
 
 
 class _Template:
     @staticmethod
-    def monitor(interval: int, gpu_enable: bool, uuid: Optional[str] = None, **kwargs):
-        monitor = HostMetrics(interval=interval, gpu_enable=gpu_enable, uuid=uuid)
-        while not kwargs.get("signal").is_set():
-            monitor.record()
-        data_dir = kwargs.get("dir")
-        file_name = kwargs.get("file_name")
-        file_path = os.path.join(data_dir, file_name)
+    def monitor(
+        interval: int,
+        gpu_enable: bool,
+        uuid: Optional[str] = None,
+        signal: Optional[threading.Event] = None,
+        dir: Optional[str] = None,
+        file_name: Optional[str] = None,
+        **metrics_options,
+    ):
+        monitor = HostMetrics(
+            interval=interval, gpu_enable=gpu_enable, uuid=uuid, **metrics_options
+        )
+        try:
+            while not signal.is_set():
+                monitor.record()
+        finally:
+            monitor.close()
+        file_path = os.path.join(dir, file_name)
         monitor.save(file_path)
 
 
@@ -218,9 +509,23 @@ class HostMonitor:
         gpu_enable: bool = True,
         default_data_dir: Optional[str] = None,
         default_file_name: Optional[str] = None,
+        **metrics_options,
     ):
+        """Run the host monitors in threads, each saving its records when it stops
+
+        Args:
+            interval (int): The interval to monitor the system, in ms. Defaults to 10 ms
+            gpu_enable (bool): Whether to monitor the GPUs. Defaults to True
+            default_data_dir (str, optional): The directory of the saved records.
+                Defaults to /tmp
+            default_file_name (str, optional): The file name of the saved records.
+                Defaults to None, which generates a random name
+            **metrics_options: The options of the sampling, e.g. `process_enable` or
+                `cgroup_stats`, passed as they are to `HostMetrics`
+        """
         self._interval: int = interval
         self._gpu_enable: bool = gpu_enable
+        self._metrics_options: dict = metrics_options
         self._thread: Dict[str, MonitorThreading] = {}
         self._stopping_thread: Dict[str, MonitorThreading] = {}
         self._default_data_dir = default_data_dir or "/tmp"
@@ -233,7 +538,6 @@ class HostMonitor:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop_monitor("default")
-        time.sleep(0.5)
         self.cleanup()
 
     def start_new_monitor(
@@ -247,6 +551,7 @@ class HostMonitor:
             "file_name": file_name or self._default_file_name,
             "interval": self._interval,
             "gpu_enable": self._gpu_enable,
+            **self._metrics_options,
         }
         _thread = MonitorThreading(temp="monitor", name=monitor_name)
         _thread.run(**kwargs)
@@ -270,7 +575,8 @@ class HostMonitor:
             for monitor_name in _keys:
                 logger.warning(f"Stop running thread: {monitor_name} in Cleanup.")
                 self.stop_monitor(monitor_name)
-        time.sleep(0.5)
+        # a stopping thread finishes its current sample (at most one interval) and
+        # then saves its records, so joining it is bounded by the sample interval
         if len(self._stopping_thread) > 0:
             logger.warning("There are still stopping threads. Wait for them to stop.")
             for monitor_name in self._stopping_thread.keys():
@@ -289,7 +595,20 @@ def monitor(
     monitor_name: str = "host_monitor",
     data_dir: str = "/tmp",
     file_name: str = None,
+    **metrics_options,
 ):
+    """Monitor the host while the decorated function runs and save the records after it
+
+    Args:
+        interval (int): The interval to monitor the system, in ms. Defaults to 100 ms
+        gpu_enable (bool): Whether to monitor the GPUs. Defaults to False
+        monitor_name (str): The name of the monitoring thread
+        data_dir (str): The directory of the saved records. Defaults to /tmp
+        file_name (str, optional): The file name of the saved records. Defaults to None,
+            which generates a random name
+        **metrics_options: The options of the sampling, passed as they are to `HostMetrics`
+    """
+
     def decorator(func):
         def wrapper(*args, **kwargs):
             monitor_params = {
@@ -297,6 +616,7 @@ def monitor(
                 "file_name": file_name or f"host_monitor_{str(uuid.uuid4())[:10]}",
                 "interval": interval,
                 "gpu_enable": gpu_enable,
+                **metrics_options,
             }
             _thread = MonitorThreading(temp="monitor", name=monitor_name)
             _thread.run(**monitor_params)
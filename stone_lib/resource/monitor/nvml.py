@@ -1,15 +1,68 @@
 import logging
-from typing import Dict
+from typing import Dict, List, Optional
 
 import pynvml as nvml
 
 logger = logging.getLogger()
 
 
+def _default_field_ids() -> Dict[str, int]:
+    """Field ids fetched with a single `nvmlDeviceGetFieldValues` call per GPU.
+
+    Only the fields known by the installed pynvml are used.
+    """
+    _fields = {
+        "energy": "NVML_FI_DEV_TOTAL_ENERGY_CONSUMPTION",  # unit: mJ
+        "memory_temperature": "NVML_FI_DEV_MEMORY_TEMP",
+        "power_instant": "NVML_FI_DEV_POWER_INSTANT",  # unit: mW
+        # averaged over 1 s as `nvmlDeviceGetPowerUsage`, which it replaces, unit: mW
+        "power_average": "NVML_FI_DEV_POWER_AVERAGE",
+        "pcie_replay": "NVML_FI_DEV_PCIE_REPLAY_COUNTER",
+    }
+    return {
+        key: getattr(nvml, name) for key, name in _fields.items() if hasattr(nvml, name)
+    }
+
+
+def _nvml_value(value_type: int, value) -> Optional[float]:
+    """Read the NVML value union according to its value type, None for an unknown type"""
+    _attrs = {
+        nvml.NVML_VALUE_TYPE_DOUBLE: "dVal",
+        nvml.NVML_VALUE_TYPE_UNSIGNED_INT: "uiVal",
+        nvml.NVML_VALUE_TYPE_UNSIGNED_LONG: "ulVal",
+        nvml.NVML_VALUE_TYPE_UNSIGNED_LONG_LONG: "ullVal",
+        nvml.NVML_VALUE_TYPE_SIGNED_LONG_LONG: "sllVal",
+    }
+    _attr = _attrs.get(value_type)
+    if _attr is None:
+        return None
+    return getattr(value, _attr)
+
+
 class GPUMetric:
-    def __init__(self, index):
+    def __init__(
+        self,
+        index,
+        field_ids: Optional[Dict[str, int]] = None,
+        sample_buffer: bool = False,
+    ):
+        """Metrics of a single GPU
+
+        Args:
+            index (int): The index of the GPU
+            field_ids (Dict[str, int], optional): Name to NVML field id mapping, fetched in one
+                `nvmlDeviceGetFieldValues` call by `to_json`. Defaults to None, which disables it.
+            sample_buffer (bool): Whether to compute the utilisation from the NVML sample buffer,
+                which averages every sample taken by the driver since the previous call instead
+                of reading the last one only. Defaults to False.
+        """
         self.index = index
         self.handle = nvml.nvmlDeviceGetHandleByIndex(self.index)
+        self._field_ids = field_ids
+        self._sample_buffer = sample_buffer
+        self._last_sample_ts: Dict[int, int] = {}
+        self._last_process_ts = 0
+        self._static: Optional[dict] = None
 
     def __str__(self):
         return f"Name: {self.name}\n" f"Arch: {self.arch}\n" f"UUID: {self.uuid}\n"
@@ -45,7 +98,9 @@ class GPUMetric:
             result = func(self.handle, *args, **kwargs)
         except nvml.NVMLError as e:
             if e.value == nvml.NVML_ERROR_NOT_SUPPORTED:
-                logger.error(f"Function {func_name} is not supported on {self.name}")
+                logger.error(
+                    f"Function {func_name} is not supported on GPU {self.index}"
+                )
                 result = None
             else:
                 logger.error(f"Function {func_name} failed with error: {e}")
@@ -68,7 +123,7 @@ class GPUMetric:
         Returns: List[nvmlFriendlyObject]
             nvmlFriendlyObject:
                 pid: int
-                userGpuMemory: int
+                usedGpuMemory: int
                 gpuInstanceId: int
                 computeInstanceId: int
 
@@ -78,13 +133,65 @@ class GPUMetric:
             result = self._call_nvml("nvmlDeviceGetComputeRunningProcesses_v3")
         elif mode == 1:
             result = self._call_nvml("nvmlDeviceGetGraphicsRunningProcesses_v3")
-        elif mode == 3:
+        elif mode == 2:
             result = self._call_nvml("nvmlDeviceGetMPSComputeRunningProcesses_v3")
         else:
             logger.error(f"Get running processes failed with mode {mode}")
             raise ValueError(f"Get running processes failed with mode {mode}")
         return result
 
+    def get_process_memory(self) -> Dict[int, Optional[int]]:
+        """Get the GPU memory used by every compute, MPS client and graphics process, in bytes
+
+        A process listed more than once, e.g. by both the compute and the graphics lists,
+        holds one allocation, its first known memory is kept.
+
+        Returns:
+            Dict[int, Optional[int]]: pid to used memory, None when the driver cannot report it
+        """
+        _memory: Dict[int, Optional[int]] = {}
+        for mode in (0, 2, 1):
+            for p in self.get_running_processes(mode) or []:
+                if _memory.get(p.pid) is None:
+                    _memory[p.pid] = p.usedGpuMemory
+        return _memory
+
+    def get_process_utilisation(self) -> Dict[int, Dict[str, float]]:
+        """Get the SM and memory utilisation of every process since the previous call
+
+        Returns:
+            Dict[int, Dict[str, float]]: pid to the average sm and memory utilisation in percentage
+        """
+        try:
+            samples = nvml.nvmlDeviceGetProcessUtilization(
+                self.handle, self._last_process_ts
+            )
+        except nvml.NVMLError as e:
+            if e.value not in (
+                nvml.NVML_ERROR_NOT_FOUND,
+                nvml.NVML_ERROR_NOT_SUPPORTED,
+            ):
+                logger.error(
+                    f"Function nvmlDeviceGetProcessUtilization failed with error: {e}"
+                )
+            return {}
+        _sum: Dict[int, List[int]] = {}
+        for sample in samples:
+            if sample.timeStamp <= self._last_process_ts:
+                continue
+            _value = _sum.setdefault(sample.pid, [0, 0, 0])
+            _value[0] += sample.smUtil
+            _value[1] += sample.memUtil
+            _value[2] += 1
+        if len(samples) > 0:
+            self._last_process_ts = max(
+                self._last_process_ts, max(s.timeStamp for s in samples)
+            )
+        return {
+            pid: {"sm": round(v[0] / v[2], 2), "memory": round(v[1] / v[2], 2)}
+            for pid, v in _sum.items()
+        }
+
     def _get_clock_info(self, clock_type):
         return self._call_nvml("nvmlDeviceGetClockInfo", clock_type)
 
@@ -132,12 +239,82 @@ class GPUMetric:
     def get_memory_utilisation(self):
         return self._call_nvml("nvmlDeviceGetUtilizationRates").memory
 
+    def get_utilisation(self) -> Dict[str, Optional[float]]:
+        """Get the GPU and memory utilisation with a single NVML call
+
+        Returns:
+            Dict: gpu, memory in percentage
+        """
+        if self._sample_buffer:
+            _gpu = self.get_sample_average(nvml.NVML_GPU_UTILIZATION_SAMPLES)
+            _memory = self.get_sample_average(nvml.NVML_MEMORY_UTILIZATION_SAMPLES)
+            if _gpu is not None and _memory is not None:
+                return {"gpu": _gpu, "memory": _memory}
+        rates = self._call_nvml("nvmlDeviceGetUtilizationRates")
+        if rates is None:
+            return {"gpu": None, "memory": None}
+        return {"gpu": rates.gpu, "memory": rates.memory}
+
+    def get_sample_average(self, sampling_type: int) -> Optional[float]:
+        """Average all samples of the driver buffer taken since the previous call
+
+        Args:
+            sampling_type (int): The NVML sampling type, e.g. NVML_GPU_UTILIZATION_SAMPLES
+
+        Returns:
+            Optional[float]: The average value, None if no sample is available
+        """
+        _since = self._last_sample_ts.get(sampling_type, 0)
+        try:
+            value_type, samples = nvml.nvmlDeviceGetSamples(
+                self.handle, sampling_type, _since
+            )
+        except nvml.NVMLError as e:
+            if e.value not in (
+                nvml.NVML_ERROR_NOT_FOUND,
+                nvml.NVML_ERROR_NOT_SUPPORTED,
+            ):
+                logger.error(f"Function nvmlDeviceGetSamples failed with error: {e}")
+            return None
+        if len(samples) == 0:
+            return None
+        self._last_sample_ts[sampling_type] = max(s.timeStamp for s in samples)
+        # a sample of an unknown value type is skipped rather than summed
+        values = [_nvml_value(value_type, s.sampleValue) for s in samples]
+        values = [v for v in values if v is not None]
+        if len(values) == 0:
+            return None
+        return round(sum(values) / len(values), 2)
+
+    def get_field_values(self) -> Dict[str, Optional[float]]:
+        """Fetch all configured NVML fields with a single call
+
+        Returns:
+            Dict: field name to value, None when the field is not supported
+        """
+        if not self._field_ids:
+            return {}
+        _names = list(self._field_ids.keys())
+        values = self._call_nvml(
+            "nvmlDeviceGetFieldValues", [self._field_ids[n] for n in _names]
+        )
+        if values is None:
+            return {name: None for name in _names}
+        result = {}
+        for name, value in zip(_names, values):
+            if value.nvmlReturn != nvml.NVML_SUCCESS:
+                result[name] = None
+            else:
+                result[name] = _nvml_value(value.valueType, value.value)
+        return result
+
     def get_info(self):
+        _utilisation = self.get_utilisation()
         return {
             "temperature": self.get_temperature(),
             "fan_speed": self.get_fan_speed(),
-            "gpu_utilisation": self.get_gpu_utilisation(),
-            "memory_utilisation": self.get_memory_utilisation(),
+            "gpu_utilisation": _utilisation["gpu"],
+            "memory_utilisation": _utilisation["memory"],
         }
 
     def get_clock_info(self):
@@ -147,10 +324,20 @@ class GPUMetric:
             "sm_clock": self.get_sm_clock(),
         }
 
-    def get_power_info(self):
+    def get_power_info(self, fields: Optional[Dict[str, Optional[float]]] = None):
+        """Get the power usage, limit and state
+
+        Args:
+            fields (Dict[str, Optional[float]], optional): The field values of the sample,
+                their power average saves the `nvmlDeviceGetPowerUsage` call. Defaults to None
+
+        Returns:
+            Dict: usage, limit in mW and state
+        """
+        _usage = (fields or {}).get("power_average")
         return {
-            "usage": self.get_power_usage(),
-            "limit": self.get_power_limit(),
+            "usage": _usage if _usage is not None else self.get_power_usage(),
+            "limit": self.static_info["power_limit"],
             "state": self.get_power_state(),
         }
 
@@ -166,31 +353,107 @@ class GPUMetric:
             "bus_id_legacy": pci_info.busIdLegacy,
         }
 
+    @property
+    def static_info(self) -> dict:
+        """The device information which never changes, fetched once and cached
+
+        Returns:
+            dict: name, uuid, arch, pci_info, power_limit
+        """
+        if self._static is None:
+            self._static = {
+                "name": self.name,
+                "uuid": self.uuid,
+                "arch": self.arch,
+                "pci_info": self.get_pci_info(),
+                "power_limit": self.get_power_limit(),
+            }
+        return self._static
+
     def to_json(self):
-        return {
-            "name": self.name,
-            "uuid": self.uuid,
-            "arch": self.arch,
+        _static = self.static_info
+        # the field values are read first, the metrics among them skip their own call
+        _fields = self.get_field_values() if self._field_ids else None
+        _data = {
+            "name": _static["name"],
+            "uuid": _static["uuid"],
+            "arch": _static["arch"],
             "info": self.get_info(),
-            "pci_info": self.get_pci_info(),
+            "pci_info": _static["pci_info"],
             "memory": self.get_memory_info(),
-            "power": self.get_power_info(),
+            "power": self.get_power_info(_fields),
             "clock": self.get_clock_info(),
         }
+        if _fields is not None:
+            _data["fields"] = _fields
+        return _data
 
 
 class HostGPUs:
-    def __init__(self):
+    def __init__(
+        self,
+        field_values: bool = False,
+        sample_buffer: bool = False,
+        field_ids: Optional[Dict[str, int]] = None,
+    ):
+        """All GPUs of the host
+
+        Args:
+            field_values (bool): Whether to fetch extra metrics (energy, memory temperature,
+                ...) with one `nvmlDeviceGetFieldValues` call per GPU, which also replaces
+                the call of the power usage when the driver reports its average. Defaults to
+                False.
+            sample_buffer (bool): Whether to average the utilisation over the NVML sample
+                buffer. Defaults to False.
+            field_ids (Dict[str, int], optional): Name to NVML field id mapping used when
+                `field_values` is enabled. Defaults to the fields supported by pynvml.
+        """
         self._gpus = {}
         self._num_gpus = 0
+        self._field_ids: Optional[Dict[str, int]] = None
+        if field_values:
+            self._field_ids = field_ids or _default_field_ids()
+        self._sample_buffer = sample_buffer
         self.init()
 
+    @property
+    def gpus(self) -> List[GPUMetric]:
+        return [self._gpus[i] for i in sorted(self._gpus)]
+
     def init(self):
         nvml.nvmlInit()
         self._num_gpus = nvml.nvmlDeviceGetCount()
         for i in range(self._num_gpus):
-            self._gpus[i] = GPUMetric(i)
-            logger.info(f"GPU {i}: {self._gpus[i].name} is initialized")
+            self._gpus[i] = GPUMetric(
+                i, field_ids=self._field_ids, sample_buffer=self._sample_buffer
+            )
+            # the static information is cached once here instead of every sample
+            logger.info(f"GPU {i}: {self._gpus[i].static_info['name']} is initialized")
+
+    def get_processes(self) -> Dict[int, Dict[int, dict]]:
+        """Get the GPU memory and utilisation of every process on every GPU
+
+        Returns:
+            Dict[int, Dict[int, dict]]: pid to GPU index to the process metrics
+
+        Examples:
+            {
+                1234: {
+                    0: {"memory": 1024, "sm": 50.0, "memory_utilisation": 20.0}
+                }
+            }
+        """
+        _processes: Dict[int, Dict[int, dict]] = {}
+        for i, gpu in self._gpus.items():
+            _utilisation = gpu.get_process_utilisation()
+            for pid, memory in gpu.get_process_memory().items():
+                _util = _utilisation.get(pid, {})
+                _processes.setdefault(pid, {})[i] = {
+                    "memory": memory,
+                    "sm": _util.get("sm", 0.0),
+                    "memory_utilisation": _util.get("memory", 0.0),
+                }
+        return _processes
 
     def shutdown(self):
         logger.info("Shutting down NVML")
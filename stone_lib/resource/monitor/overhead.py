@@ -0,0 +1,190 @@
+import time
+from typing import Dict, Optional
+
+
+class LatencyHistogram:
+    # bucket i holds the durations in [2^(i-1), 2^i) µs, the last one everything above
+    NumBuckets = 26
+
+    def __init__(self):
+        """A constant-memory histogram of durations with power-of-two buckets"""
+        self.counts = [0] * self.NumBuckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, duration_ns: int):
+        """Add a duration
+
+        Args:
+            duration_ns (int): The duration, in ns. Negative values are counted as zero
+        """
+        _us = max(duration_ns, 0) // 1000
+        self.counts[min(_us.bit_length(), self.NumBuckets - 1)] += 1
+        self.count += 1
+        self.total += duration_ns
+        if duration_ns > self.max:
+            self.max = duration_ns
+
+    @staticmethod
+    def upper_bound(index: int) -> int:
+        """The upper bound of a bucket, in µs"""
+        return 1 << index
+
+    def percentile(self, q: float) -> Optional[int]:
+        """Approximate a percentile with the upper bound of its bucket
+
+        Args:
+            q (float): The percentile, between 0 and 100
+
+        Returns:
+            int: The upper bound of the bucket holding the percentile, in µs
+        """
+        if self.count == 0:
+            return None
+        _rank = q / 100 * self.count
+        _seen = 0
+        for i, count in enumerate(self.counts):
+            _seen += count
+            if _seen >= _rank and count > 0:
+                return self.upper_bound(i)
+        return self.upper_bound(self.NumBuckets - 1)
+
+    def to_json(self) -> dict:
+        """Get the histogram in JSON format
+
+        Examples:
+            {
+                "count": 100,
+                "mean": 35.5,  # unit: µs
+                "max": 120.0,  # unit: µs
+                "p50": 32,  # unit: µs, upper bound of the bucket
+                "p95": 64,
+                "p99": 128,
+                "buckets": {"32": 60, "64": 38, "128": 2},  # upper bound in µs: count
+            }
+        """
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count / 1000, 2) if self.count else None,
+            "max": round(self.max / 1000, 2),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {
+                str(self.upper_bound(i)): count
+                for i, count in enumerate(self.counts)
+                if count > 0
+            },
+        }
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: LatencyHistogram):
+        self._histogram = histogram
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.perf_counter_ns() - self._start)
+
+
+class SamplerStats:
+    def __init__(self, budget: Optional[float] = None, smoothing: float = 0.1):
+        """The cost of the monitor itself
+
+        It keeps a latency histogram per sampling stage, the CPU time spent by the sampler,
+        the jitter against the target cadence, and the sampler CPU cost per second of
+        sampling as an exponential moving average to compare against a budget.
+
+        Args:
+            budget (float, optional): The share of one core the sampler may use, e.g. 0.01
+                for 1 %. Defaults to None, which disables the budget.
+            smoothing (float): The weight of the last sample in the moving average
+        """
+        self.budget = budget
+        self.smoothing = smoothing
+        self.stages: Dict[str, LatencyHistogram] = {}
+        self._timers: Dict[str, _Timer] = {}
+        self.jitter = LatencyHistogram()
+        self.cpu_time = 0  # unit: ns
+        self.overhead: Optional[float] = None
+        self._samples = 0
+        self._sample_cpu = 0
+        self._start = time.monotonic_ns()
+
+    def timer(self, stage: str) -> _Timer:
+        """A context manager adding its duration to the histogram of `stage`"""
+        _timer = self._timers.get(stage)
+        if _timer is None:
+            self.stages[stage] = LatencyHistogram()
+            _timer = self._timers[stage] = _Timer(self.stages[stage])
+        return _timer
+
+    def add_cpu_time(self, cpu_ns: int):
+        """Account the CPU time the sampler spent in the current sample"""
+        self.cpu_time += cpu_ns
+        self._sample_cpu += cpu_ns
+
+    def end_sample(self, interval: float, target: float) -> bool:
+        """Close a sample and compare its cost against the budget
+
+        Args:
+            interval (float): The measured duration of the sample, in seconds
+            target (float): The target interval, in seconds
+
+        Returns:
+            bool: True when the moving average of the overhead exceeds the budget, it is only
+                checked once the average has seen `1 / smoothing` samples, so a costly first
+                sample does not trigger it
+        """
+        self.jitter.observe(abs(int((interval - target) * 1e9)))
+        _overhead = self._sample_cpu / 1e9 / interval if interval > 0 else 0.0
+        self._sample_cpu = 0
+        if self.overhead is None:
+            self.overhead = _overhead
+        else:
+            self.overhead += self.smoothing * (_overhead - self.overhead)
+        self._samples += 1
+        return (
+            self.budget is not None
+            and self._samples * self.smoothing >= 1
+            and self.overhead > self.budget
+        )
+
+    def reset_overhead(self):
+        """Forget the moving average, e.g. after the interval has changed"""
+        self.overhead = None
+        self._samples = 0
+
+    def to_json(self) -> dict:
+        """Get the statistics in JSON format
+
+        Examples:
+            {
+                "cpu_time": 12.5,  # unit: ms
+                "cpu_utilisation": 0.2,  # unit: percentage of one core
+                "overhead": 0.002,  # share of one core, moving average
+                "budget": 0.01,
+                "jitter": {...},  # histogram, unit: µs
+                "stages": {"cgroup": {...}, "network": {...}},  # histograms, unit: µs
+            }
+        """
+        _elapsed = (time.monotonic_ns() - self._start) / 1e9
+        return {
+            "cpu_time": round(self.cpu_time / 1e6, 2),
+            "cpu_utilisation": (
+                round(self.cpu_time / 1e9 / _elapsed * 100, 2) if _elapsed > 0 else 0.0
+            ),
+            "overhead": (
+                round(self.overhead, 6) if self.overhead is not None else None
+            ),
+            "budget": self.budget,
+            "jitter": self.jitter.to_json(),
+            "stages": {name: h.to_json() for name, h in self.stages.items()},
+        }
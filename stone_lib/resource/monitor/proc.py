@@ -0,0 +1,550 @@
+import fnmatch
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .ethernet import counter_delta
+
+logger = logging.getLogger()
+
+
+class _CollectorAbc(ABC):
+    """A collector plugged into the sample loop of `HostMetrics`
+
+    `snapshot` is called at every tick and must be cheap, `compose` turns the snapshots
+    taken at the start and the end of a sample into the entry `name` of the record.
+    """
+
+    name: str = ""
+
+    @abstractmethod
+    def snapshot(self):
+        pass
+
+    @abstractmethod
+    def compose(self, previous, current, interval: float) -> dict:
+        pass
+
+
+class _ProcCollectorAbc(_CollectorAbc):
+    ProcDir = "/proc"
+
+    def __init__(self, proc_dir: Optional[str] = None):
+        """
+        Args:
+            proc_dir (str, optional): The proc filesystem. Defaults to /proc
+        """
+        self.proc_dir = proc_dir or self.ProcDir
+
+    def _read(self, file_name: str) -> str:
+        with open(os.path.join(self.proc_dir, file_name), "r") as f:
+            return f.read()
+
+
+class _KeyedProcCollectorAbc(_ProcCollectorAbc):
+    """A collector of a "key value" file with a fixed set of keys
+
+    The line of every key is looked up once and reused while the file keeps the same
+    number of lines, so a snapshot only splits the lines of the tracked keys.
+    """
+
+    File = ""
+    Keys: Tuple[str, ...] = ()
+
+    def __init__(self, proc_dir: Optional[str] = None):
+        super().__init__(proc_dir)
+        self._num_lines = -1
+        self._lines: List[int] = []
+        self._keys: Tuple[str, ...] = ()
+
+    def _layout(self, lines: List[str]):
+        _index = {}
+        for i, line in enumerate(lines):
+            _key = line.split(None, 1)[0].rstrip(":") if line.strip() else ""
+            _index[_key] = i
+        self._keys = tuple(k for k in self.Keys if k in _index)
+        self._lines = [_index[k] for k in self._keys]
+        self._num_lines = len(lines)
+        missing = set(self.Keys) - set(self._keys)
+        if len(missing) > 0:
+            logger.debug(f"Keys {sorted(missing)} not found in {self.File}")
+
+    def snapshot(self) -> np.ndarray:
+        """Read the tracked keys
+
+        Returns:
+            np.ndarray: The values of `keys`, dtype uint64
+        """
+        _lines = self._read(self.File).splitlines()
+        if len(_lines) != self._num_lines:
+            self._layout(_lines)
+        return np.array([_lines[i].split()[1] for i in self._lines], dtype=np.uint64)
+
+    @property
+    def keys(self) -> Tuple[str, ...]:
+        """The tracked keys found in the file, in the order of the snapshot values"""
+        return self._keys
+
+
+class CpuStatMonitor(_ProcCollectorAbc):
+    name = "cpu_stat"
+    # the columns of the cpu lines used for the utilisation, guest time is part of user
+    Columns = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal")
+    Misc = ("ctxt", "intr", "procs_running", "procs_blocked")
+
+    def __init__(self, proc_dir: Optional[str] = None):
+        """Node-wide CPU utilisation per core, context switches and run queue from /proc/stat"""
+        super().__init__(proc_dir)
+        self._num_lines = -1
+        self._num_cpus = 0
+        self._misc_lines: List[int] = []
+
+    def _layout(self, lines: List[str]):
+        self._num_cpus = sum(1 for line in lines if line.startswith("cpu"))
+        _index = {line.split(None, 1)[0]: i for i, line in enumerate(lines) if line}
+        self._misc_lines = [_index[k] for k in self.Misc]
+        self._num_lines = len(lines)
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Read /proc/stat
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The `columns` of the aggregated line followed by one
+                line per core, shape (cores + 1, 8), and the values of `misc`
+        """
+        _lines = self._read("stat").splitlines()
+        if len(_lines) != self._num_lines:
+            self._layout(_lines)
+        _cpus = np.array(
+            " ".join(
+                " ".join(line.split()[1 : len(self.Columns) + 1])
+                for line in _lines[: self._num_cpus]
+            ).split(),
+            dtype=np.uint64,
+        ).reshape(self._num_cpus, len(self.Columns))
+        _misc = np.array(
+            [_lines[i].split()[1] for i in self._misc_lines], dtype=np.uint64
+        )
+        return _cpus, _misc
+
+    def compose(self, previous, current, interval: float) -> dict:
+        """Build the CPU record
+
+        Returns:
+            dict: The CPU record
+
+        Examples:
+            {
+                "utilisation": 12.5,  # unit: percentage of all cores
+                "iowait": 0.5,  # unit: percentage
+                "steal": 0.0,  # unit: percentage
+                "cores": [10.0, 15.0],  # unit: percentage
+                "context_switches": 1000.0,  # unit: per second
+                "interrupts": 500.0,  # unit: per second
+                "procs_running": 2,
+                "procs_blocked": 0,
+            }
+        """
+        _cpus_p, _misc_p = previous
+        _cpus_c, _misc_c = current
+        if _cpus_p.shape != _cpus_c.shape:
+            # a core went on- or offline, the sample cannot be compared
+            return {}
+        # the kernel lets iowait, and idle on some kernels, go backwards: such a field did
+        # not wrap, it counts nothing over the sample
+        _delta = np.where(_cpus_c >= _cpus_p, _cpus_c - _cpus_p, 0).astype(np.float64)
+        _total = _delta.sum(axis=1)
+        _total[_total == 0] = 1
+        _idle = _delta[:, 3] + _delta[:, 4]
+        _busy = np.round((1 - _idle / _total) * 100, 2)
+        _misc_delta = counter_delta(_misc_p[:2], _misc_c[:2]).astype(np.float64)
+        return {
+            "utilisation": float(_busy[0]),
+            "iowait": round(float(_delta[0, 4] / _total[0] * 100), 2),
+            "steal": round(float(_delta[0, 7] / _total[0] * 100), 2),
+            "cores": _busy[1:].tolist(),
+            "context_switches": round(float(_misc_delta[0]) / interval, 2),
+            "interrupts": round(float(_misc_delta[1]) / interval, 2),
+            "procs_running": int(_misc_c[2]),
+            "procs_blocked": int(_misc_c[3]),
+        }
+
+
+class MemInfoMonitor(_KeyedProcCollectorAbc):
+    name = "meminfo"
+    File = "meminfo"
+    Keys = (
+        "MemTotal",
+        "MemFree",
+        "MemAvailable",
+        "Buffers",
+        "Cached",
+        "SwapTotal",
+        "SwapFree",
+        "Dirty",
+        "Writeback",
+        "AnonPages",
+        "Shmem",
+        "Slab",
+    )
+
+    def compose(self, previous, current, interval: float) -> dict:
+        """Build the node memory record, in MB
+
+        Examples:
+            {"MemTotal": 16000.0, "MemFree": 1000.0, ...}
+        """
+        _mb = np.round(current.astype(np.float64) / 1024, 2).tolist()
+        return dict(zip(self.keys, _mb))
+
+
+class VmStatMonitor(_KeyedProcCollectorAbc):
+    name = "vmstat"
+    File = "vmstat"
+    Keys = (
+        "pgfault",
+        "pgmajfault",
+        "pgpgin",
+        "pgpgout",
+        "pswpin",
+        "pswpout",
+        "oom_kill",
+    )
+
+    def compose(self, previous, current, interval: float) -> dict:
+        """Build the paging record, in events per second
+
+        Examples:
+            {"pgfault": 1000.0, "pgmajfault": 0.0, ...}
+        """
+        if previous.shape != current.shape:
+            return {}
+        _rates = np.round(
+            counter_delta(previous, current).astype(np.float64) / interval, 2
+        ).tolist()
+        return dict(zip(self.keys, _rates))
+
+
+class LoadAvgMonitor(_ProcCollectorAbc):
+    name = "loadavg"
+
+    def snapshot(self) -> Tuple[float, float, float, int, int]:
+        """Read /proc/loadavg
+
+        Returns:
+            Tuple: load over 1, 5 and 15 minutes, runnable and total scheduling entities
+        """
+        _fields = self._read("loadavg").split()
+        _running, _, _total = _fields[3].partition("/")
+        return (
+            float(_fields[0]),
+            float(_fields[1]),
+            float(_fields[2]),
+            int(_running),
+            int(_total),
+        )
+
+    def compose(self, previous, current, interval: float) -> dict:
+        """Build the load record
+
+        Examples:
+            {"load1": 0.5, "load5": 0.4, "load15": 0.3, "running": 2, "threads": 300}
+        """
+        return dict(zip(("load1", "load5", "load15", "running", "threads"), current))
+
+
+class DiskStatsMonitor(_ProcCollectorAbc):
+    name = "diskstats"
+    # the first 11 counters of every device line, see Documentation/admin-guide/iostats.rst
+    Columns = (
+        "reads",
+        "reads_merged",
+        "sectors_read",
+        "read_ms",
+        "writes",
+        "writes_merged",
+        "sectors_written",
+        "write_ms",
+        "in_flight",
+        "io_ms",
+        "weighted_io_ms",
+    )
+    SectorSize = 512
+
+    def __init__(
+        self,
+        proc_dir: Optional[str] = None,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+    ):
+        """Per-disk IOPS, throughput, latency and utilisation from /proc/diskstats
+
+        Args:
+            proc_dir (str, optional): The proc filesystem. Defaults to /proc
+            include (List[str], optional): Glob patterns of the devices to report.
+                Defaults to None, which reports all of them.
+            exclude (List[str], optional): Glob patterns of the devices to ignore.
+                Defaults to loop and ram devices.
+        """
+        super().__init__(proc_dir)
+        self.include = include
+        self.exclude = ["loop*", "ram*"] if exclude is None else exclude
+        self._all_devices: Tuple[str, ...] = ()
+        self._rows: List[int] = []
+        self._devices: Tuple[str, ...] = ()
+
+    def _select(self, devices: Tuple[str, ...]):
+        self._all_devices = devices
+        self._rows = [
+            i
+            for i, device in enumerate(devices)
+            if not any(fnmatch.fnmatchcase(device, p) for p in self.exclude)
+            and (
+                self.include is None
+                or any(fnmatch.fnmatchcase(device, p) for p in self.include)
+            )
+        ]
+        self._devices = tuple(devices[i] for i in self._rows)
+
+    def snapshot(self) -> Tuple[Tuple[str, ...], np.ndarray]:
+        """Read /proc/diskstats
+
+        Returns:
+            Tuple[Tuple[str, ...], np.ndarray]: The device names and their `columns`,
+                shape (devices, 11)
+        """
+        _lines = [line.split() for line in self._read("diskstats").splitlines()]
+        _lines = [fields for fields in _lines if len(fields) >= 14]
+        _devices = tuple(fields[2] for fields in _lines)
+        if _devices != self._all_devices:
+            self._select(_devices)
+        _counters = np.array(
+            [_lines[i][3 : 3 + len(self.Columns)] for i in self._rows], dtype=np.uint64
+        ).reshape(len(self._rows), len(self.Columns))
+        return self._devices, _counters
+
+    def compose(self, previous, current, interval: float) -> dict:
+        """Build the disk record
+
+        Examples:
+            {
+                "sda": {
+                    "rios": 10.0,  # unit: per second
+                    "wios": 5.0,  # unit: per second
+                    "read": 1.0,  # unit: MB/s
+                    "write": 0.5,  # unit: MB/s
+                    "r_await": 0.2,  # unit: ms per read
+                    "w_await": 0.4,  # unit: ms per write
+                    "queue": 0.01,  # average number of requests in flight
+                    "utilisation": 1.5,  # unit: percentage of time busy
+                }
+            }
+        """
+        _devices_p, _counters_p = previous
+        _devices_c, _counters_c = current
+        if _devices_p != _devices_c:
+            _index = {device: i for i, device in enumerate(_devices_p)}
+            _rows = [i for i, device in enumerate(_devices_c) if device in _index]
+            _devices_c = tuple(_devices_c[i] for i in _rows)
+            _counters_c = _counters_c[_rows]
+            _counters_p = _counters_p[[_index[device] for device in _devices_c]]
+        _delta = counter_delta(_counters_p, _counters_c).astype(np.float64)
+        _reads = _delta[:, 0]
+        _writes = _delta[:, 4]
+        _interval_ms = interval * 1000
+        _stats = np.column_stack(
+            [
+                _reads / interval,
+                _writes / interval,
+                _delta[:, 2] * self.SectorSize / 1024 / 1024 / interval,
+                _delta[:, 6] * self.SectorSize / 1024 / 1024 / interval,
+                np.divide(
+                    _delta[:, 3], _reads, out=np.zeros_like(_reads), where=_reads > 0
+                ),
+                np.divide(
+                    _delta[:, 7], _writes, out=np.zeros_like(_writes), where=_writes > 0
+                ),
+                _delta[:, 10] / _interval_ms,
+                _delta[:, 9] / _interval_ms * 100,
+            ]
+        )
+        _keys = (
+            "rios",
+            "wios",
+            "read",
+            "write",
+            "r_await",
+            "w_await",
+            "queue",
+            "utilisation",
+        )
+        return {
+            device: dict(zip(_keys, row))
+            for device, row in zip(_devices_c, np.round(_stats, 2).tolist())
+        }
+
+
+class ThreadCpuMonitor(_ProcCollectorAbc):
+    name = "threads"
+    StatSize = 1024
+
+    def __init__(
+        self, pid: int, proc_dir: Optional[str] = None, top: Optional[int] = None
+    ):
+        """User and system CPU utilisation of every thread of a process
+
+        The stat file of every thread is opened once and read again with `pread` at every
+        tick, the task directory is only listed again when the number of threads of the
+        process changes or one of the threads has exited.
+
+        Args:
+            pid (int): The process to sample
+            proc_dir (str, optional): The proc filesystem. Defaults to /proc
+            top (int, optional): Only report the threads with the highest utilisation.
+                Defaults to None, which reports all of them.
+        """
+        super().__init__(proc_dir)
+        self.pid = pid
+        self.top = top
+        self._tick = os.sysconf("SC_CLK_TCK")
+        self._task_dir = os.path.join(self.proc_dir, str(pid), "task")
+        self._stat_fd: Optional[int] = None
+        self._tids: Tuple[int, ...] = ()
+        self._fds: List[int] = []
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Close the file descriptors of the stat files"""
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+        self._tids = ()
+        if self._stat_fd is not None:
+            os.close(self._stat_fd)
+            self._stat_fd = None
+
+    @staticmethod
+    def _parse(data: bytes) -> Tuple[str, List[bytes]]:
+        # the thread name may contain spaces and parentheses, it ends at the last ")"
+        _head, _, _tail = data.rpartition(b")")
+        return _head.partition(b"(")[2].decode(errors="replace"), _tail.split()
+
+    def _num_threads(self) -> int:
+        if self._stat_fd is None:
+            self._stat_fd = os.open(
+                os.path.join(self.proc_dir, str(self.pid), "stat"), os.O_RDONLY
+            )
+        return int(self._parse(os.pread(self._stat_fd, self.StatSize, 0))[1][17])
+
+    def _scan(self):
+        for fd in self._fds:
+            os.close(fd)
+        _tids, _fds = [], []
+        for entry in sorted(os.listdir(self._task_dir), key=int):
+            try:
+                _fds.append(
+                    os.open(os.path.join(self._task_dir, entry, "stat"), os.O_RDONLY)
+                )
+                _tids.append(int(entry))
+            except FileNotFoundError:
+                continue
+        self._tids = tuple(_tids)
+        self._fds = _fds
+
+    def _read_threads(self) -> Optional[Tuple[List[str], List[List[bytes]]]]:
+        _names, _fields = [], []
+        try:
+            for fd in self._fds:
+                _name, _values = self._parse(os.pread(fd, self.StatSize, 0))
+                _names.append(_name)
+                _fields.append(_values[11:13])
+        except ProcessLookupError:
+            # the thread has exited
+            return None
+        return _names, _fields
+
+    def snapshot(self) -> Tuple[Tuple[int, ...], Tuple[str, ...], np.ndarray]:
+        """Read the stat file of every thread
+
+        Returns:
+            Tuple: The thread ids, the thread names and the utime and stime of every
+                thread in clock ticks, shape (threads, 2). Empty when the process has exited.
+        """
+        try:
+            if self._num_threads() != len(self._tids):
+                self._scan()
+            _threads = self._read_threads()
+            if _threads is None:
+                self._scan()
+                _threads = self._read_threads() or ([], [])
+        except (FileNotFoundError, ProcessLookupError):
+            logger.warning(f"Process {self.pid} has exited")
+            self.close()
+            return (), (), np.zeros((0, 2), dtype=np.uint64)
+        _names, _fields = _threads
+        _times = np.array(_fields, dtype=np.uint64).reshape(len(_fields), 2)
+        return self._tids[: len(_names)], tuple(_names), _times
+
+    def compose(self, previous, current, interval: float) -> dict:
+        """Build the per-thread record, threads started during the sample count from zero
+
+        Examples:
+            {
+                "1235": {
+                    "name": "pt_data_worker",
+                    "user": 95.0,  # unit: percentage of one core
+                    "system": 3.0,  # unit: percentage of one core
+                }
+            }
+        """
+        _tids_p, _, _times_p = previous
+        _tids_c, _names, _times_c = current
+        if _tids_p == _tids_c:
+            _before = _times_p
+        else:
+            _index = {tid: i for i, tid in enumerate(_tids_p)}
+            _before = np.zeros_like(_times_c)
+            for i, tid in enumerate(_tids_c):
+                if tid in _index:
+                    _before[i] = _times_p[_index[tid]]
+        _utilisation = (
+            counter_delta(_before, _times_c).astype(np.float64)
+            / self._tick
+            / interval
+            * 100
+        )
+        _rows = range(len(_tids_c))
+        if self.top is not None:
+            _rows = np.argsort(-_utilisation.sum(axis=1), kind="stable")[: self.top]
+        _utilisation = np.round(_utilisation, 2).tolist()
+        return {
+            str(_tids_c[i]): {
+                "name": _names[i],
+                "user": _utilisation[i][0],
+                "system": _utilisation[i][1],
+            }
+            for i in _rows
+        }
+
+
+def default_collectors(proc_dir: Optional[str] = None) -> List[_CollectorAbc]:
+    """All the host-level collectors of /proc
+
+    Args:
+        proc_dir (str, optional): The proc filesystem. Defaults to /proc
+
+    Returns:
+        List[_CollectorAbc]: The collectors, to be passed to `HostMetrics`
+    """
+    return [
+        CpuStatMonitor(proc_dir),
+        MemInfoMonitor(proc_dir),
+        LoadAvgMonitor(proc_dir),
+        VmStatMonitor(proc_dir),
+        DiskStatsMonitor(proc_dir),
+    ]
@@ -0,0 +1,134 @@
+import logging
+from typing import Dict, Optional
+
+from .cgroup import CGroupMonitor
+
+logger = logging.getLogger()
+
+
+class GPUProcessMonitor:
+    def __init__(
+        self,
+        gpus,
+        cgroup_dir: Optional[str] = None,
+        proc_dir: str = "/proc",
+    ):
+        """Attribute the GPU usage to processes and join it with the cgroup of every process
+
+        Args:
+            gpus (HostGPUs): The GPUs to sample the processes from
+            cgroup_dir (str, optional): The root of the cgroup hierarchy. Defaults to /sys/fs/cgroup
+            proc_dir (str): The proc filesystem. Defaults to /proc
+        """
+        self.gpus = gpus
+        self._cgroup_dir = cgroup_dir
+        self._proc_dir = proc_dir
+        # the cgroup of a process never changes, resolve it once per pid
+        self._cgroups: Dict[int, Optional[CGroupMonitor]] = {}
+
+    def _get_cgroup(self, pid: int) -> Optional[CGroupMonitor]:
+        if pid not in self._cgroups:
+            try:
+                self._cgroups[pid] = CGroupMonitor(
+                    pid=pid, cgroup_dir=self._cgroup_dir, proc_dir=self._proc_dir
+                )
+            except (OSError, KeyError) as e:
+                logger.warning(f"Cannot resolve the cgroup of process {pid}: {e}")
+                self._cgroups[pid] = None
+        return self._cgroups[pid]
+
+    def _read(self, pid: int) -> dict:
+        """Read the cgroup counters of a process"""
+        _cgroup = self._get_cgroup(pid)
+        _data = {"cgroup": None, "cpu": None, "memory": None}
+        if _cgroup is not None:
+            try:
+                _data["cgroup"] = _cgroup.cgroup_dir
+                _data["cpu"] = _cgroup.cpu_usage()
+                _data["memory"] = _cgroup.memory_usage()
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"Cannot read the cgroup of process {pid}: {e}")
+        return _data
+
+    def snapshot(self) -> Dict[int, dict]:
+        """Read the cumulative CPU time and the memory of the cgroups of the GPU processes
+
+        The processes are those found on the GPUs by the previous `compose`, the GPUs are
+        queried once per record there.
+
+        Returns:
+            Dict[int, dict]: pid to the cgroup counters
+        """
+        return {pid: self._read(pid) for pid in self._cgroups}
+
+    def compose(
+        self,
+        previous: Dict[int, dict],
+        current: Dict[int, dict],
+        interval: float,
+        processes: Dict[int, Dict[int, dict]],
+    ):
+        """Build the per-process record from two snapshots and the GPU processes
+
+        The counters of a process new on the GPUs are read at once and added to `current`,
+        so its CPU utilisation is known from the next record on.
+
+        Args:
+            previous (Dict[int, dict]): The snapshot taken at the start of the sample
+            current (Dict[int, dict]): The snapshot taken at the end of the sample
+            interval (float): The elapsed time between both snapshots, in seconds
+            processes (Dict[int, Dict[int, dict]]): The GPU processes of the record, see
+                `HostGPUs.get_processes`
+
+        Returns:
+            dict: The per-process record
+
+        Examples:
+            {
+                "1234": {
+                    "cgroup": "/sys/fs/cgroup/system.slice/job.scope",
+                    "cpu": 95.5,  # unit: percentage of the cgroup
+                    "memory": 1024.0,  # unit: MB of the cgroup
+                    "gpu": {
+                        "0": [2048.0, 80.0, 35.0]  # memory in MB, sm and memory utilisation
+                    }
+                }
+            }
+        """
+        # forget the processes which have exited
+        for pid in list(self._cgroups.keys()):
+            if pid not in processes:
+                del self._cgroups[pid]
+        for pid in processes:
+            if pid not in current:
+                current[pid] = self._read(pid)
+        _record = {}
+        for pid, gpus in processes.items():
+            _current = current[pid]
+            _previous = previous.get(pid)
+            _cpu = None
+            if (
+                _previous is not None
+                and _previous["cpu"] is not None
+                and _current["cpu"] is not None
+            ):
+                # same unit conversion as the host cpu utilisation
+                _cpu = round(
+                    (_current["cpu"] - _previous["cpu"]) / 1000000 / interval * 100, 2
+                )
+            _memory = _current["memory"]
+            _gpus = {}
+            for index, gpu in gpus.items():
+                _gpu_memory = gpu["memory"]
+                if _gpu_memory is not None:
+                    _gpu_memory = round(_gpu_memory / 1024 / 1024, 2)
+                _gpus[str(index)] = [_gpu_memory, gpu["sm"], gpu["memory_utilisation"]]
+            _record[str(pid)] = {
+                "cgroup": _current["cgroup"],
+                "cpu": _cpu,
+                "memory": (
+                    round(_memory / 1024 / 1024, 2) if _memory is not None else None
+                ),
+                "gpu": _gpus,
+            }
+        return _record
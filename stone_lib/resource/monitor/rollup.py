@@ -0,0 +1,251 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# keys of a metric record which describe the sample instead of measuring something
+RecordKeys = ("timestamp", "interval")
+
+
+def flatten_record(record: dict, prefix: str = "") -> Dict[str, float]:
+    """Flatten the numeric values of a metric record into dotted keys
+
+    Strings, booleans and missing values are skipped, the items of lists are keyed by
+    their position.
+
+    Args:
+        record (dict): The metric record, or a part of it
+        prefix (str): The prefix of the keys
+
+    Returns:
+        Dict[str, float]: The dotted key of every numeric value
+
+    Examples:
+        >>> flatten_record({"cpu": {"utilisation": 10.0}, "gpu": {0: {"name": "A100"}}})
+        {"cpu.utilisation": 10.0}
+    """
+    _flat = {}
+    _items = record.items() if isinstance(record, dict) else enumerate(record)
+    for key, value in _items:
+        _key = f"{prefix}{key}"
+        if isinstance(value, bool) or value is None:
+            continue
+        if isinstance(value, (int, float)):
+            _flat[_key] = value
+        elif isinstance(value, (dict, list, tuple)):
+            _flat.update(flatten_record(value, f"{_key}."))
+    return _flat
+
+
+class P2Quantile:
+    # the values are kept and the quantile is exact until there are this many of them
+    ExactSize = 64
+
+    def __init__(self, q: float):
+        """Estimate a quantile in constant memory with the P² algorithm of Jain and Chlamtac
+
+        Args:
+            q (float): The quantile, between 0 and 1
+        """
+        self.q = q
+        self._initial: Optional[List[float]] = []
+        self._heights: List[float] = []
+        self._positions: List[float] = []
+        self._desired: List[float] = []
+        self._increments = (0, q / 2, q, (1 + q) / 2, 1)
+
+    def _init_markers(self):
+        _sorted = sorted(self._initial)
+        _n = len(_sorted)
+        self._desired = [1 + (_n - 1) * dn for dn in self._increments]
+        self._positions = [1] + [round(d) for d in self._desired[1:4]] + [_n]
+        self._heights = [_sorted[int(n) - 1] for n in self._positions]
+        self._initial = None
+
+    def add(self, x: float):
+        if self._initial is not None:
+            self._initial.append(x)
+            if len(self._initial) == self.ExactSize:
+                self._init_markers()
+            return
+        _h, _n = self._heights, self._positions
+        if x < _h[0]:
+            _h[0] = x
+            k = 0
+        elif x >= _h[4]:
+            _h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(1, 5) if x < _h[i]) - 1
+        for i in range(k + 1, 5):
+            _n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+        for i in range(1, 4):
+            d = self._desired[i] - _n[i]
+            if (d >= 1 and _n[i + 1] - _n[i] > 1) or (
+                d <= -1 and _n[i - 1] - _n[i] < -1
+            ):
+                d = 1 if d > 0 else -1
+                _height = self._parabolic(i, d)
+                if not _h[i - 1] < _height < _h[i + 1]:
+                    _height = _h[i] + d * (_h[i + d] - _h[i]) / (_n[i + d] - _n[i])
+                _h[i] = _height
+                _n[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        _h, _n = self._heights, self._positions
+        return _h[i] + d / (_n[i + 1] - _n[i - 1]) * (
+            (_n[i] - _n[i - 1] + d) * (_h[i + 1] - _h[i]) / (_n[i + 1] - _n[i])
+            + (_n[i + 1] - _n[i] - d) * (_h[i] - _h[i - 1]) / (_n[i] - _n[i - 1])
+        )
+
+    @property
+    def value(self) -> Optional[float]:
+        if self._initial is not None:
+            if len(self._initial) == 0:
+                return None
+            # linear interpolation between the closest ranks, as numpy does
+            _sorted = sorted(self._initial)
+            _rank = self.q * (len(_sorted) - 1)
+            _low = int(_rank)
+            _high = min(_low + 1, len(_sorted) - 1)
+            return _sorted[_low] + (_sorted[_high] - _sorted[_low]) * (_rank - _low)
+        return self._heights[2]
+
+
+class _Accumulator:
+    __slots__ = ("min", "max", "total", "count", "p95")
+
+    def __init__(self):
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.total = 0.0
+        self.count = 0
+        self.p95 = P2Quantile(0.95)
+
+    def add(self, value: float):
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total += value
+        self.count += 1
+        self.p95.add(value)
+
+    def to_json(self) -> dict:
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.total / self.count, 4),
+            "p95": round(self.p95.value, 4),
+        }
+
+
+class WindowRollup:
+    def __init__(self, window: int):
+        """Summarise the records falling into consecutive, aligned windows
+
+        Only the open window keeps state, a closed window is reduced to its summary.
+
+        Args:
+            window (int): The length of a window, in ms
+        """
+        if window <= 0:
+            raise ValueError(f"The window must be positive, got {window} ms")
+        self.window = window
+        self.rollups: List[dict] = []
+        self._start: Optional[float] = None
+        self._count = 0
+        self._metrics: Dict[str, _Accumulator] = {}
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        """Add the flattened values of a record
+
+        Args:
+            timestamp (float): The timestamp of the record, in ms
+            values (Dict[str, float]): The flattened values, see `flatten_record`
+        """
+        _start = timestamp - timestamp % self.window
+        if self._start is not None and _start != self._start:
+            self.close()
+        self._start = _start
+        self._count += 1
+        for key, value in values.items():
+            _accumulator = self._metrics.get(key)
+            if _accumulator is None:
+                _accumulator = self._metrics[key] = _Accumulator()
+            _accumulator.add(value)
+
+    def summary(self) -> Optional[dict]:
+        """The summary of the open window
+
+        Examples:
+            {
+                "start": 1630627340000,  # unit: ms
+                "end": 1630627341000,  # unit: ms
+                "count": 100,
+                "metrics": {
+                    "cpu.utilisation": {"min": 0.0, "max": 50.0, "mean": 20.0, "p95": 45.0}
+                },
+            }
+        """
+        if self._start is None:
+            return None
+        return {
+            "start": self._start,
+            "end": self._start + self.window,
+            "count": self._count,
+            "metrics": {key: acc.to_json() for key, acc in self._metrics.items()},
+        }
+
+    def close(self):
+        """Close the open window and keep its summary"""
+        _summary = self.summary()
+        if _summary is not None:
+            self.rollups.append(_summary)
+        self._start = None
+        self._count = 0
+        self._metrics = {}
+
+    def to_json(self, include_open: bool = True) -> List[dict]:
+        _rollups = list(self.rollups)
+        if include_open and self._start is not None:
+            _rollups.append(self.summary())
+        return _rollups
+
+
+class RollupSink:
+    def __init__(self, windows: Iterable[int] = (1000, 10000, 60000)):
+        """A monitor sink maintaining min/max/mean/p95 of every metric over several windows
+
+        It can be given to the `sinks` of `AsyncHostMonitor` or to the `rollup_windows` of
+        `HostMetrics`, which saves the rollups alongside the raw records.
+
+        Args:
+            windows (Iterable[int]): The window lengths, in ms. Defaults to 1 s, 10 s and 1 min
+        """
+        self.windows = {int(w): WindowRollup(int(w)) for w in windows}
+
+    def __call__(self, record: dict):
+        _values = flatten_record(
+            {k: v for k, v in record.items() if k not in RecordKeys}
+        )
+        for rollup in self.windows.values():
+            rollup.add(record["timestamp"], _values)
+
+    def flush(self):
+        """Close the open window of every length"""
+        for rollup in self.windows.values():
+            rollup.close()
+
+    def to_json(self, include_open: bool = True) -> Dict[str, List[dict]]:
+        """Get the rollups of every window length, keyed by the length in ms
+
+        Args:
+            include_open (bool): Whether to include the windows which are not closed yet
+        """
+        return {
+            str(window): rollup.to_json(include_open)
+            for window, rollup in self.windows.items()
+        }
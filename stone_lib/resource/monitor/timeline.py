@@ -0,0 +1,284 @@
+import json
+import logging
+import math
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .rollup import RecordKeys, flatten_record
+
+logger = logging.getLogger(__name__)
+
+# the user annotation the PyTorch profiler wraps every step in
+StepPattern = re.compile(r"^ProfilerStep#(\d+)$")
+
+
+class ClockAnchor:
+    def __init__(self, wall: float, reference: float, clock: str = "wall"):
+        """A pair of readings of the wall clock and a reference clock taken at the same time
+
+        The monitor stamps its records with the wall clock in ms, a profiler stamps its events
+        with its own clock in µs. One anchor pair is enough to map one onto the other, as both
+        clocks advance at the same rate during a run.
+
+        Args:
+            wall (float): The wall clock, in ms
+            reference (float): The reference clock, in µs
+            clock (str): The name of the reference clock. Defaults to wall, where the
+                reference is the wall clock in µs and the anchor maps 1:1
+        """
+        self.wall = wall
+        self.reference = reference
+        self.clock = clock
+
+    def __repr__(self):
+        return f"ClockAnchor(wall={self.wall}, reference={self.reference}, clock={self.clock})"
+
+    @classmethod
+    def capture(
+        cls,
+        clock: Callable[[], int] = time.monotonic_ns,
+        name: str = "monotonic",
+    ) -> "ClockAnchor":
+        """Read the wall clock and a reference clock now
+
+        The wall clock is read on both sides of the reference clock and the midpoint is kept,
+        so the error of the pair is half the cost of a clock read.
+
+        Args:
+            clock (Callable[[], int]): The reference clock, in ns. Defaults to the monotonic
+                clock, which the profiler of PyTorch also uses when it does not stamp the
+                events with the wall clock
+            name (str): The name of the reference clock. Defaults to monotonic
+
+        Returns:
+            ClockAnchor: The anchor pair
+        """
+        _before = time.time_ns()
+        _reference = clock()
+        _after = time.time_ns()
+        return cls((_before + _after) / 2e6, _reference / 1000, name)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "ClockAnchor":
+        return cls(data["wall"], data["reference"], data.get("clock", "wall"))
+
+    def to_json(self) -> dict:
+        return {"clock": self.clock, "wall": self.wall, "reference": self.reference}
+
+    def to_wall(self, reference: float) -> float:
+        """Convert a time of the reference clock in µs to the wall clock in ms"""
+        return self.wall + (reference - self.reference) / 1000
+
+    def to_reference(self, wall: float) -> float:
+        """Convert a time of the wall clock in ms to the reference clock in µs"""
+        return self.reference + (wall - self.wall) * 1000
+
+
+def step_windows(events: List[dict]) -> Dict[int, Tuple[int, int]]:
+    """Find the window of every training step in the events of a profiler trace
+
+    Args:
+        events (List[dict]): The `traceEvents` of a profiler trace
+
+    Returns:
+        Dict[int, Tuple[int, int]]: The start and end of every step, in µs of the profiler
+    """
+    _windows = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        _matcher = StepPattern.match(str(event.get("name", "")))
+        if _matcher is None:
+            continue
+        _windows[int(_matcher.group(1))] = (
+            event["ts"],
+            event["ts"] + event.get("dur", 0),
+        )
+    return dict(sorted(_windows.items()))
+
+
+class MonitorTimeline:
+    def __init__(self, records: List[dict], anchor: Optional[ClockAnchor] = None):
+        """Index the monitor records by time to query them with profiler time windows
+
+        Every record holds the rates over the interval before its timestamp, so a query
+        returns by default every sample whose interval overlaps the window, including the
+        one in progress at its end. An operator shorter than the interval still gets the
+        sample it ran in.
+
+        Args:
+            records (List[dict]): The monitor records, see `HostMetrics.get_records`
+            anchor (ClockAnchor, optional): Maps the profiler clock onto the wall clock of
+                the records. Defaults to None, for a profiler stamping its events with the
+                wall clock in µs
+
+        Examples:
+            timeline = MonitorTimeline.load("host_monitor.json", reference="monotonic")
+            for op in operators.search_ops_in_time_range(start, end):
+                print(op.name, timeline.summary_for(op).get("gpu.0.info.gpu_utilisation"))
+        """
+        _timestamps = np.array([r["timestamp"] for r in records], dtype=np.float64)
+        _order = np.argsort(_timestamps, kind="stable")
+        self.anchor = anchor if anchor is not None else ClockAnchor(0.0, 0.0)
+        self._timestamps = _timestamps[_order]
+        self._intervals = np.array(
+            [records[i].get("interval", math.nan) for i in _order], dtype=np.float64
+        )
+        self._records = [records[i] for i in _order]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @classmethod
+    def from_json(cls, data: dict, reference: str = "wall") -> "MonitorTimeline":
+        """Index the data of `HostMetrics.to_json`
+
+        Args:
+            data (dict): The monitor data
+            reference (str): The clock of the profiler events, wall or the clock anchored by
+                the monitor (monotonic). Defaults to wall
+        """
+        return cls(data["records"], cls._anchor(data, reference))
+
+    @classmethod
+    def load(cls, file_path: str, reference: str = "wall") -> "MonitorTimeline":
+        """Index a file saved by `HostMetrics.save`, in either format
+
+        The records of a columnar file hold the dotted keys of `flatten_record`.
+
+        Args:
+            file_path (str): The saved monitor data
+            reference (str): The clock of the profiler events, see `from_json`
+        """
+        from .columnar import ColumnarReader, is_columnar
+
+        if not is_columnar(file_path):
+            with open(file_path, "r") as f:
+                return cls.from_json(json.load(f), reference)
+        with ColumnarReader(file_path) as reader:
+            _data = reader.to_numpy()
+            _meta = reader.meta
+        _timestamps = _data.pop("timestamp")
+        _records = [{"timestamp": float(t)} for t in _timestamps]
+        for key, values in _data.items():
+            for record, value in zip(_records, values.tolist()):
+                if not math.isnan(value):
+                    record[key] = value
+        return cls(_records, cls._anchor(_meta, reference))
+
+    @staticmethod
+    def _anchor(data: dict, reference: str) -> Optional[ClockAnchor]:
+        if reference == "wall":
+            return None
+        _anchor = data.get("clock")
+        if _anchor is None or _anchor["clock"] != reference:
+            raise ValueError(f"The monitor data has no anchor of the {reference} clock")
+        return ClockAnchor.from_json(_anchor)
+
+    def _span(self, start: float, end: float, overlap: bool) -> Tuple[int, int]:
+        _start, _end = self.anchor.to_wall(start), self.anchor.to_wall(end)
+        if not overlap:
+            return (
+                int(np.searchsorted(self._timestamps, _start, side="left")),
+                int(np.searchsorted(self._timestamps, _end, side="right")),
+            )
+        _left = int(np.searchsorted(self._timestamps, _start, side="right"))
+        _right = int(np.searchsorted(self._timestamps, _end, side="left"))
+        # the first sample at or after the end covers it unless there is a gap before it
+        if (
+            _right < len(self._timestamps)
+            and self._timestamps[_right] - self._intervals[_right] < _end
+        ):
+            _right += 1
+        return _left, max(_left, _right)
+
+    def samples(self, start: float, end: float, overlap: bool = True) -> List[dict]:
+        """Get the samples of a window of the profiler clock
+
+        Args:
+            start (float): The start of the window, in µs of the profiler
+            end (float): The end of the window, in µs of the profiler
+            overlap (bool): Whether to get every sample whose interval overlaps the window,
+                otherwise only the samples taken within it. Defaults to True
+
+        Returns:
+            List[dict]: The monitor records, in time order
+        """
+        _left, _right = self._span(start, end, overlap)
+        return self._records[_left:_right]
+
+    def samples_for(self, node, overlap: bool = True) -> List[dict]:
+        """Get the samples of a profiler node, e.g. an `OperatorNode`
+
+        Args:
+            node (ProfilerNode): A node with the `start_time` and `end_time` in µs
+            overlap (bool): See `samples`. Defaults to True
+        """
+        return self.samples(node.start_time, node.end_time, overlap)
+
+    def summary(self, start: float, end: float, overlap: bool = True) -> dict:
+        """Average every metric over the samples of a window of the profiler clock
+
+        Args:
+            start (float): The start of the window, in µs of the profiler
+            end (float): The end of the window, in µs of the profiler
+            overlap (bool): See `samples`. Defaults to True
+
+        Returns:
+            dict: The mean of every metric under the dotted keys of `flatten_record`, and
+                the number of samples under `count`
+
+        Examples:
+            {"count": 3, "cpu.utilisation": 52.1, "gpu.0.info.gpu_utilisation": 12.0}
+        """
+        _totals: Dict[str, float] = {}
+        _counts: Dict[str, int] = {}
+        _samples = self.samples(start, end, overlap)
+        for record in _samples:
+            _values = flatten_record(
+                {k: v for k, v in record.items() if k not in RecordKeys}
+            )
+            for key, value in _values.items():
+                _totals[key] = _totals.get(key, 0.0) + value
+                _counts[key] = _counts.get(key, 0) + 1
+        _summary = {"count": len(_samples)}
+        for key, total in _totals.items():
+            _summary[key] = round(total / _counts[key], 4)
+        return _summary
+
+    def summary_for(self, node, overlap: bool = True) -> dict:
+        """Average every metric over the samples of a profiler node, see `summary`"""
+        return self.summary(node.start_time, node.end_time, overlap)
+
+    def steps(self, events: List[dict], overlap: bool = True) -> Dict[int, dict]:
+        """Summarise the monitor samples of every training step of a profiler trace
+
+        Args:
+            events (List[dict]): The `traceEvents` of a profiler trace
+            overlap (bool): See `samples`. Defaults to True
+
+        Returns:
+            Dict[int, dict]: The window, its duration in µs and the `summary` of every step
+
+        Examples:
+            {
+                2: {
+                    "start": 1724696154696971,  # unit: µs of the profiler
+                    "end": 1724696155007210,
+                    "duration": 310239,
+                    "metrics": {"count": 31, "cpu.utilisation": 97.5},
+                }
+            }
+        """
+        return {
+            step: {
+                "start": start,
+                "end": end,
+                "duration": end - start,
+                "metrics": self.summary(start, end, overlap),
+            }
+            for step, (start, end) in step_windows(events).items()
+        }
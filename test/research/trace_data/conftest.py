@@ -0,0 +1,258 @@
+import io
+import os
+import re
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stone_lib.research.trace_data.alibaba_gpu_2020 import Alibaba2020TraceData
+
+
+@pytest.fixture(scope="function")
+def trace_data(tmp_dir):
+    Alibaba2020TraceData._instances.clear()
+    yield Alibaba2020TraceData(str(tmp_dir))
+    Alibaba2020TraceData._instances.clear()
+
+
+@pytest.fixture(scope="function")
+def modified_merged():
+    """A synthetic modified merged table with the corner cases of the trace"""
+    _random = np.random.default_rng(0)
+    _rows = 200
+    _base = 1_580_000_000  # unit: s
+    start = _base + _random.integers(0, 3 * 86400, _rows)
+    start_task = start + _random.integers(0, 4 * 3600, _rows)
+    start_instance = start_task + _random.integers(0, 2 * 3600, _rows)
+    end = start_instance + _random.integers(0, 10 * 3600, _rows)
+    end_task = end - _random.integers(0, 600, _rows)
+    frame = pd.DataFrame(
+        {
+            "start_time": start.astype(float),
+            "end_time": end.astype(float),
+            "start_time_task": start_task.astype(float),
+            "end_time_task": end_task.astype(float),
+            "start_time_instance": start_instance.astype(float),
+            "status": _random.choice(["Terminated", "Running", "Waiting"], _rows),
+            "plan_gpu": _random.choice([25.0, 50.0, 100.0, 200.0, np.nan], _rows),
+            "plan_cpu": _random.choice([100.0, 600.0, 800.0], _rows),
+            "plan_mem": _random.choice([29.0, 58.5, 120.0], _rows),
+            "gpu_name": _random.choice(["V100", "T4", None], _rows),
+        }
+    )
+    # instances which never started, with or without the end of the task
+    frame.loc[::7, "start_time_instance"] = np.nan
+    frame.loc[::14, "end_time_task"] = np.nan
+    for column in [
+        c for c in frame.columns if c.startswith(("start_time", "end_time"))
+    ]:
+        frame[column.replace("time", "date")] = pd.to_datetime(
+            frame[column], unit="s", utc=True
+        ).dt.tz_convert("Asia/Shanghai")
+    return frame
+
+
+@pytest.fixture(scope="function")
+def trace_tables(trace_data):
+    """Write the csv and header files of a small synthetic trace with all merged tables"""
+    _random = np.random.default_rng(2)
+    _jobs = 120
+    # jobs from the 20th day of the year, some before the offset of 600 hours
+    start = 1_579_478_400 + _random.integers(0, 10 * 86400, _jobs).astype(float)
+    jobs = pd.DataFrame(
+        {
+            "job_name": [f"job{i}" for i in range(_jobs)],
+            "inst_id": [f"{i:016x}" for i in range(_jobs)],
+            "user": _random.choice(["alice", "bob", "carol"], _jobs),
+            "status": _random.choice(["Terminated", "Running", "Failed"], _jobs),
+            "start_time": start,
+            "end_time": start + _random.integers(60, 7200, _jobs),
+        }
+    )
+    jobs.loc[::11, "end_time"] = np.nan
+    tasks = pd.DataFrame(
+        {
+            "job_name": np.repeat(jobs["job_name"], 2).to_numpy(),
+            "task_name": ["worker", "ps"] * _jobs,
+            "inst_num": 1.0,
+            "status": _random.choice(["Terminated", "Running"], 2 * _jobs),
+            "start_time": np.repeat(start, 2) + 5,
+            "end_time": np.repeat(start, 2) + 3600,
+            "plan_cpu": _random.choice([100.0, 600.0], 2 * _jobs),
+            "plan_mem": _random.choice([29.0, 58.5], 2 * _jobs),
+            "plan_gpu": _random.choice([50.0, 100.0, np.nan], 2 * _jobs),
+            "gpu_type": _random.choice(["V100", "T4", "MISC"], 2 * _jobs),
+        }
+    )
+    # some tasks have no instance and some jobs have no task
+    tasks = tasks.drop(index=tasks.index[::13])
+    instances = pd.DataFrame(
+        {
+            "job_name": np.repeat(tasks["job_name"], 2).to_numpy(),
+            "task_name": np.repeat(tasks["task_name"], 2).to_numpy(),
+            "inst_name": [f"inst{i}" for i in range(2 * len(tasks))],
+            "worker_name": [f"worker{i}" for i in range(2 * len(tasks))],
+            "inst_id": np.repeat(tasks["job_name"].str[3:], 2).to_numpy(),
+            "status": _random.choice(["Terminated", "Running"], 2 * len(tasks)),
+            "start_time": np.repeat(tasks["start_time"], 2).to_numpy() + 30,
+            "end_time": np.repeat(tasks["end_time"], 2).to_numpy() - 30,
+            "machine": _random.choice([f"m{i}" for i in range(8)], 2 * len(tasks)),
+        }
+    )
+    instances = instances.drop(index=instances.index[::17])
+    machines = pd.DataFrame(
+        {
+            "machine": [f"m{i}" for i in range(6)],
+            "gpu_type": ["V100", "V100", "T4", "T4", "P100", "MISC"],
+            "cap_cpu": 96.0,
+            "cap_mem": 512.0,
+            "cap_gpu": [8.0, 8.0, 2.0, 2.0, 2.0, 0.0],
+        }
+    )
+    sensors = instances.iloc[::2][
+        ["job_name", "task_name", "worker_name", "inst_id", "machine"]
+    ].assign(
+        gpu_name=lambda d: _random.choice(["V100", "T4"], len(d)),
+        cpu_usage=lambda d: _random.uniform(0, 600, len(d)).round(2),
+        gpu_wrk_util=lambda d: _random.uniform(0, 100, len(d)).round(2),
+        avg_mem=1.5,
+        max_mem=2.5,
+        avg_gpu_wrk_mem=0.5,
+        max_gpu_wrk_mem=1.0,
+        read=1e9,
+        write=2e9,
+        read_count=10.0,
+        write_count=20.0,
+    )
+    groups = jobs.iloc[::3][["inst_id", "user"]].assign(
+        gpu_type_spec=lambda d: _random.choice(["", "V100"], len(d)),
+        group=lambda d: [f"g{i % 5}" for i in range(len(d))],
+        workload=lambda d: _random.choice(["bert", "ctr", "resnet"], len(d)),
+    )
+    tables = {
+        "pai_job_table": jobs,
+        "pai_task_table": tasks,
+        "pai_instance_table": instances,
+        "pai_machine_spec": machines,
+        "pai_sensor_table": sensors,
+        "pai_group_tag_table": groups,
+    }
+    for name, table in tables.items():
+        table.to_csv(
+            os.path.join(trace_data.target_dir, f"{name}.csv"),
+            header=False,
+            index=False,
+        )
+        with open(os.path.join(trace_data.target_dir, f"{name}.header"), "w") as f:
+            f.write(",".join(table.columns) + "\n")
+    return tables
+
+
+class TraceServer:
+    def __init__(self, files: dict):
+        """Serve files from memory over HTTP with range requests, like the trace hosts
+
+        Args:
+            files (dict): The body of every path
+        """
+        self.files = files
+        # the number of bytes after which the next response of a path is cut
+        self.drop = {}
+        self.ranges = True
+        self.delay = 0.0
+        self.requests = []
+        self.peak = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append((self.path, self.headers.get("Range")))
+                    server._active += 1
+                    server.peak = max(server.peak, server._active)
+                try:
+                    time.sleep(server.delay)
+                    self._send()
+                finally:
+                    with server._lock:
+                        server._active -= 1
+
+            def _send(self):
+                if self.path not in server.files:
+                    self.send_error(404)
+                    return
+                _body = server.files[self.path]
+                _start, _status = 0, 200
+                _range = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+                if _range is not None and server.ranges:
+                    _start, _status = int(_range.group(1)), 206
+                    if _start >= len(_body):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(_body)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                self.send_response(_status)
+                self.send_header("Content-Length", str(len(_body) - _start))
+                if _status == 206:
+                    self.send_header(
+                        "Content-Range", f"bytes {_start}-{len(_body) - 1}/{len(_body)}"
+                    )
+                self.end_headers()
+                _drop = server.drop.pop(self.path, None)
+                if _drop is not None:
+                    self.wfile.write(_body[_start : _start + _drop])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(_body[_start:])
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.1},
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+@pytest.fixture(scope="function")
+def trace_server(trace_data):
+    """Serve a fixture tarball and header of every table, the trace links point at it"""
+    _random = np.random.default_rng(3)
+    _files = {}
+    for name in trace_data._data_name.values():
+        # random rows, so the tarball does not compress below a few chunks
+        _csv = "\n".join(
+            f"{name},{v}" for v in _random.integers(0, 1 << 62, 2000)
+        ).encode()
+        _buffer = io.BytesIO()
+        with tarfile.open(fileobj=_buffer, mode="w:gz") as tar:
+            _info = tarfile.TarInfo(f"{name}.csv")
+            _info.size = len(_csv)
+            tar.addfile(_info, io.BytesIO(_csv))
+        _files[f"/traces/{name}.tar.gz"] = _buffer.getvalue()
+        _files[f"/headers/{name}.header"] = b"name,value\n"
+    server = TraceServer(_files)
+    trace_data.TraceLink = f"{server.url}/traces"
+    trace_data.HeaderLink = f"{server.url}/headers"
+    trace_data.DownloadChunkSize = 1024
+    yield server
+    server.stop()
@@ -0,0 +1,852 @@
+import hashlib
+import os
+import tarfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from unittest.mock import patch
+from stone_lib.research.trace_data.alibaba_gpu_2020 import Alibaba2020TraceData
+
+
+def _time_series_by_rows(new_data: pd.DataFrame) -> pd.DataFrame:
+    """The row by row construction the time series is checked against"""
+    new_data = new_data[new_data["status"] != "Waiting"]
+    time_range = pd.date_range(
+        new_data["start_date"].min(), new_data["end_date"].max(), freq="h"
+    ).strftime("%Y-%m-%d %H:00:00")
+    index_df = pd.DataFrame(index=time_range)
+    for column in ["gpu_counts", "cpu_counts", "memory_counts", "queue", "running"]:
+        index_df[column] = 0.0
+    for _, row in new_data.iterrows():
+        if pd.isnull(row["start_date_instance"]):
+            if pd.isnull(row["end_date_task"]):
+                end_date = row["start_date_task"]
+            else:
+                end_date = row["end_date_task"]
+        else:
+            end_date = row["start_date_instance"]
+        if pd.isnull(end_date):
+            end_date = row["end_date"]
+        q_time_range = pd.date_range(row["start_date"], end_date, freq="h")
+        index_df.loc[q_time_range.strftime("%Y-%m-%d %H:00:00"), "queue"] += 1
+        if pd.notnull(row["start_date_instance"]):
+            g_time_range = pd.date_range(
+                row["start_date_instance"], row["end_date"], freq="h"
+            ).strftime("%Y-%m-%d %H:00:00")
+            if pd.notnull(row["gpu_name"]):
+                if pd.isnull(row["plan_gpu"]):
+                    gpu_increment = 100
+                else:
+                    gpu_increment = 100 if row["plan_gpu"] >= 100 else row["plan_gpu"]
+            else:
+                gpu_increment = 0
+            index_df.loc[g_time_range, "gpu_counts"] += gpu_increment
+            index_df.loc[g_time_range, "cpu_counts"] += row.get("plan_cpu", 0)
+            index_df.loc[g_time_range, "memory_counts"] += row.get("plan_mem", 0)
+            index_df.loc[g_time_range, "running"] += 1
+    index_df = index_df.reset_index().rename(columns={"index": "time"})
+    index_df["time"] = pd.to_datetime(index_df["time"])
+    return index_df
+
+
+class TestTimeSeries:
+    def test_matches_rows(self, trace_data, modified_merged):
+        trace_data._cache["modified_merged"] = modified_merged
+        series = trace_data._get_time_series_data()
+        expected = _time_series_by_rows(modified_merged)
+        assert list(series.columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(series, expected, check_dtype=False)
+
+    def test_missing_plan(self, trace_data, modified_merged):
+        modified_merged.loc[modified_merged.index[:20], "plan_cpu"] = np.nan
+        trace_data._cache["modified_merged"] = modified_merged
+        series = trace_data._get_time_series_data()
+        expected = _time_series_by_rows(modified_merged)
+        assert series["cpu_counts"].isna().any()
+        pd.testing.assert_frame_equal(series, expected, check_dtype=False)
+
+    def test_bin_width(self, trace_data, modified_merged):
+        trace_data._cache["modified_merged"] = modified_merged
+        hourly = trace_data._get_time_series_data()
+        daily = trace_data.get_time_series("D")
+        assert (daily["time"] == daily["time"].dt.normalize()).all()
+        assert daily["time"].diff().dropna().eq(pd.Timedelta("1D")).all()
+        # a day holds at least the peak of its hours
+        _peak = hourly.groupby(hourly["time"].dt.normalize())["running"].max()
+        assert (daily.set_index("time")["running"] >= _peak).all()
+        assert trace_data._get_cache("time_series_D") is daily
+
+    def test_bin_width_invalid(self, trace_data, modified_merged):
+        trace_data._cache["modified_merged"] = modified_merged
+        with pytest.raises(ValueError):
+            trace_data._get_time_series_data("MS")
+
+
+class TestCache:
+    @pytest.fixture(scope="function")
+    def sources(self, trace_data):
+        for data_type in ["job", "task", "instance", "machine", "sensor", "group"]:
+            name = trace_data._data_name[data_type]
+            for ext in ["csv", "header"]:
+                with open(
+                    os.path.join(trace_data.target_dir, f"{name}.{ext}"), "w"
+                ) as f:
+                    f.write(f"{name},{ext}\n")
+        return trace_data
+
+    @pytest.mark.parametrize("parquet", [True, False])
+    def test_round_trip(self, sources, modified_merged, parquet):
+        with patch.object(
+            Alibaba2020TraceData, "_pyarrow_enabled", return_value=parquet
+        ):
+            sources._store_cache("modified_merged", modified_merged)
+            cache_file = sources._build_cache_file("modified_merged")
+            assert cache_file.endswith(".parquet" if parquet else ".pkl")
+            assert os.path.isfile(cache_file)
+            sources._cache.clear()
+            cache = sources._get_cache("modified_merged")
+        assert isinstance(cache["status"].dtype, pd.CategoricalDtype)
+        assert isinstance(cache["gpu_name"].dtype, pd.CategoricalDtype)
+        assert str(cache["start_date"].dt.tz) == "Asia/Shanghai"
+        expected = sources._typed(modified_merged)
+        for column in [c for c in expected.columns if "_date" in c]:
+            # parquet keeps the timestamps in ms at least
+            expected[column] = expected[column].dt.as_unit(cache[column].dt.unit)
+        pd.testing.assert_frame_equal(cache, expected)
+        # a full load is kept in memory
+        assert sources._cache["modified_merged"] is cache
+
+    def test_projection(self, sources, modified_merged):
+        sources._store_cache("modified_merged", modified_merged.iloc[3:])
+        sources._cache.clear()
+        with patch("pandas.read_parquet", wraps=pd.read_parquet) as mock_read:
+            cache = sources._get_cache("modified_merged", ["start_date", "status"])
+        assert mock_read.call_args.kwargs["columns"] == ["start_date", "status"]
+        assert list(cache.columns) == ["start_date", "status"]
+        assert cache.index.equals(modified_merged.index[3:])
+        assert "modified_merged" not in sources._cache
+        with patch.object(sources, "_get_merged_df") as mock_merged:
+            cache = sources.get_df("modified_merged", columns=["end_date"])
+            mock_merged.assert_not_called()
+        assert list(cache.columns) == ["end_date"]
+
+    def test_source_change(self, sources, modified_merged):
+        sources._store_cache("merged", modified_merged)
+        cache_file = sources._build_cache_file("merged")
+        sources._cache.clear()
+        job_csv = os.path.join(sources.target_dir, "pai_job_table.csv")
+        with open(job_csv, "a") as f:
+            f.write("new job\n")
+        assert sources._get_cache("merged") is None
+        sources._store_cache("merged", modified_merged)
+        # the cache file of the older sources is removed
+        assert not os.path.isfile(cache_file)
+        assert os.path.isfile(sources._build_cache_file("merged"))
+        # the other types of data are not affected
+        sources._store_cache("time_series_D", modified_merged[["start_date"]])
+        assert os.path.isfile(sources._build_cache_file("merged"))
+
+    def test_checksum_memo(self, sources):
+        job_csv = os.path.join(sources.target_dir, "pai_job_table.csv")
+        digest = sources._checksum(job_csv)
+        assert digest == hashlib.sha256(b"pai_job_table,csv\n").hexdigest()
+        with patch("hashlib.sha256", wraps=hashlib.sha256) as mock_hash:
+            assert sources._checksum(job_csv) == digest
+            mock_hash.assert_not_called()
+        assert sources._checksum(job_csv + ".missing") == "missing"
+
+
+class TestCsv:
+    @pytest.fixture(scope="function")
+    def tables(self, trace_data):
+        _random = np.random.default_rng(1)
+        _rows = 500
+        start = 1_580_000_000 + _random.integers(0, 86400, _rows).astype(float)
+        end = start + _random.integers(0, 3600, _rows)
+        end[::9] = np.nan
+        tables = {
+            "pai_instance_table": pd.DataFrame(
+                {
+                    "job_name": [f"job{i // 4}" for i in range(_rows)],
+                    "task_name": _random.choice(["worker", "ps", "tensorflow"], _rows),
+                    "inst_name": [f"inst{i}" for i in range(_rows)],
+                    "worker_name": [f"worker{i}" for i in range(_rows)],
+                    "inst_id": [f"{i:064x}" for i in range(_rows)],
+                    "status": _random.choice(
+                        ["Terminated", "Running", "Failed"], _rows
+                    ),
+                    "start_time": start,
+                    "end_time": end,
+                    "machine": [f"machine{i % 13}" for i in range(_rows)],
+                }
+            ),
+            "pai_machine_metric": pd.DataFrame(
+                {
+                    "worker_name": [f"worker{i}" for i in range(_rows)],
+                    # the machines of the first rows differ from the last ones
+                    "machine": [f"machine{i // 100}" for i in range(_rows)],
+                    "start_time": start,
+                    "end_time": end,
+                    "machine_cpu_iowait": _random.uniform(0, 10, _rows).round(2),
+                    "machine_cpu_kernel": _random.uniform(0, 10, _rows).round(2),
+                    "machine_cpu_usr": _random.uniform(0, 100, _rows).round(2),
+                    "machine_gpu": _random.uniform(0, 800, _rows).round(2),
+                    "machine_load_1": _random.uniform(0, 50, _rows).round(2),
+                    "machine_net_receive": _random.uniform(0, 1e6, _rows).round(2),
+                    "machine_num_worker": _random.integers(1, 8, _rows).astype(float),
+                    "machine_cpu": _random.uniform(0, 100, _rows).round(2),
+                }
+            ),
+        }
+        for name, table in tables.items():
+            table.to_csv(
+                os.path.join(trace_data.target_dir, f"{name}.csv"),
+                header=False,
+                index=False,
+            )
+            with open(os.path.join(trace_data.target_dir, f"{name}.header"), "w") as f:
+                f.write(",".join(table.columns) + "\n")
+        return tables
+
+    @pytest.mark.parametrize("pyarrow", [True, False])
+    def test_instance(self, trace_data, tables, pyarrow):
+        with patch.object(
+            Alibaba2020TraceData, "_pyarrow_enabled", return_value=pyarrow
+        ):
+            df = trace_data._get_df_from_csv("pai_instance_table")
+        csv_file = os.path.join(trace_data.target_dir, "pai_instance_table.csv")
+        untyped = pd.read_csv(
+            csv_file, header=None, names=tables["pai_instance_table"].columns
+        )
+        assert isinstance(df["status"].dtype, pd.CategoricalDtype)
+        assert isinstance(df["machine"].dtype, pd.CategoricalDtype)
+        assert df["start_time"].dtype == np.float64
+        for column in untyped.columns:
+            assert df[column].astype(untyped[column].dtype).equals(untyped[column])
+        for column, date_column in [
+            ("start_time", "start_date"),
+            ("end_time", "end_date"),
+        ]:
+            expected = untyped[column].apply(pd.Timestamp, unit="s", tz="Asia/Shanghai")
+            assert str(df[date_column].dt.tz) == "Asia/Shanghai"
+            assert (df[date_column].isna() == expected.isna()).all()
+            assert (df[date_column].dropna() == expected.dropna()).all()
+        assert df.memory_usage(deep=True).sum() < untyped.memory_usage(deep=True).sum()
+
+    def test_chunked(self, trace_data, tables):
+        with patch.object(Alibaba2020TraceData, "ChunkSize", 64):
+            df = trace_data._get_df_from_csv("pai_machine_metric")
+        expected = tables["pai_machine_metric"]
+        assert len(df) == len(expected)
+        assert isinstance(df["machine"].dtype, pd.CategoricalDtype)
+        assert df["machine"].astype(str).tolist() == expected["machine"].tolist()
+        assert df["machine_cpu"].dtype == np.float32
+        np.testing.assert_allclose(
+            df["machine_cpu"], expected["machine_cpu"], rtol=1e-6
+        )
+        np.testing.assert_array_equal(df["end_time"], expected["end_time"])
+        # only the job, task and instance tables get the dates
+        assert "start_date" not in df.columns
+
+    def test_unknown_columns(self, trace_data, tables):
+        header_file = os.path.join(trace_data.target_dir, "pai_instance_table.header")
+        with open(header_file, "w") as f:
+            f.write(
+                ",".join(
+                    ["new_column"] + list(tables["pai_instance_table"].columns[1:])
+                )
+            )
+        df = trace_data._get_df_from_csv("pai_instance_table")
+        assert (
+            df["new_column"].tolist()
+            == tables["pai_instance_table"]["job_name"].tolist()
+        )
+
+    @staticmethod
+    def _pack(trace_data, name: str):
+        """Replace the csv file of a table by its tarball, like a download without extraction"""
+        csv_file = os.path.join(trace_data.target_dir, f"{name}.csv")
+        with tarfile.open(
+            os.path.join(trace_data.target_dir, f"{name}.tar.gz"), "w:gz"
+        ) as tar:
+            tar.add(csv_file, arcname=f"data/{name}.csv")
+        os.remove(csv_file)
+
+    @pytest.mark.parametrize("pyarrow", [True, False])
+    def test_stream_tar(self, trace_data, tables, pyarrow):
+        expected = trace_data._get_df_from_csv("pai_instance_table")
+        self._pack(trace_data, "pai_instance_table")
+        with patch.object(
+            Alibaba2020TraceData, "_pyarrow_enabled", return_value=pyarrow
+        ):
+            df = trace_data.get_df("instance")
+            # the csv file is never written
+            assert sorted(os.listdir(trace_data.target_dir)) == [
+                "caches",
+                "pai_instance_table.header",
+                "pai_instance_table.tar.gz",
+                "pai_machine_metric.csv",
+                "pai_machine_metric.header",
+            ]
+            cache_file = trace_data._build_cache_file("instance")
+            assert os.path.isfile(cache_file) == pyarrow
+            if pyarrow:
+                # a new session reads the cache file and never opens the tarball
+                trace_data._cache.clear()
+                with patch("tarfile.open") as mock_open:
+                    assert trace_data.get_df("instance").equals(df)
+                    mock_open.assert_not_called()
+        for column in expected.columns:
+            if "_date" in column:
+                expected[column] = expected[column].dt.as_unit(df[column].dt.unit)
+        pd.testing.assert_frame_equal(df, expected, check_categorical=False)
+
+    def test_stream_tar_chunked(self, trace_data, tables):
+        pq = pytest.importorskip("pyarrow.parquet")
+        with patch.object(Alibaba2020TraceData, "ChunkSize", 64):
+            expected = trace_data._get_df_from_csv("pai_machine_metric")
+            self._pack(trace_data, "pai_machine_metric")
+            df = trace_data._get_df_from_csv("pai_machine_metric")
+        assert isinstance(df["machine"].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(df, expected, check_categorical=False)
+        # every chunk is a row group of the cache file
+        metadata = pq.ParquetFile(trace_data._build_cache_file("metric")).metadata
+        assert metadata.num_row_groups == int(np.ceil(len(expected) / 64))
+        assert not os.path.exists(trace_data._build_cache_file("metric") + ".tmp")
+
+    def test_stream_sources(self, trace_data, tables):
+        key = trace_data._cache_key("metric")
+        self._pack(trace_data, "pai_machine_metric")
+        assert trace_data._sources("metric")[0].endswith("pai_machine_metric.tar.gz")
+        assert trace_data._cache_key("metric") != key
+
+
+def _sorted(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.sort_values(list(frame.columns)).reset_index(drop=True)
+
+
+class TestQuery:
+    @pytest.fixture(scope="function")
+    def merged(self, trace_data, trace_tables):
+        merged = trace_data.get_df("merged")
+        # the queries start from the trace tables
+        os.remove(trace_data._build_cache_file("merged"))
+        trace_data._cache.clear()
+        return merged
+
+    @pytest.mark.parametrize(
+        "columns, filters",
+        [
+            (["job_name", "wait_time"], [("gpu_type", "==", "V100")]),
+            (["job_name", "status_instance", "hours"], [("status", "in", ["Running"])]),
+            (["worker_name", "workload", "cap_gpu"], [("workload", "!=", "ctr")]),
+            (["inst_name", "gpu_wrk_util"], [("gpu_wrk_util", ">", 50.0)]),
+            (["inst_name", "run_time"], [("run_time", "<", 3000.0)]),
+        ],
+    )
+    def test_pushdown(self, trace_data, merged, columns, filters):
+        query = trace_data.query().select(*columns)
+        expected = merged
+        for column, op, value in filters:
+            query = query.where(column, op, value)
+            expected = expected[query._compare(expected[column], op, value)]
+        with patch.object(trace_data, "_merge", wraps=trace_data._merge) as mock_merge:
+            result = query.collect()
+        assert "merged" not in trace_data._cache
+        assert len(result) > 0
+        pd.testing.assert_frame_equal(
+            _sorted(result), _sorted(expected[columns]), check_categorical=False
+        )
+        tables = mock_merge.call_args.args[0]
+        merged_tables = {"job", "task", "instance"}
+        if "workload" in columns:
+            merged_tables.add("group")
+        if "cap_gpu" in columns:
+            merged_tables.add("machine")
+        if "gpu_wrk_util" in columns:
+            merged_tables.add("sensor")
+        assert set(tables) == merged_tables
+        # only the jobs passing the filters of the inner tables are merged
+        if filters[0][0] == "gpu_type":
+            assert (tables["task"]["gpu_type"] == "V100").all()
+
+    def test_left_tables_not_loaded(self, trace_data, merged):
+        with patch.object(trace_data, "get_df", wraps=trace_data.get_df) as mock_get:
+            result = trace_data.query().select("job_name", "status").collect()
+        assert len(result) > 0
+        # only the keys of the left joined tables are read to check they are unique
+        loaded = {c.args[0] for c in mock_get.call_args_list}
+        assert loaded == {"job", "task", "instance"}
+        for data_type in ["machine", "sensor", "group"]:
+            assert data_type not in trace_data._cache
+
+    @pytest.mark.parametrize(
+        "column, op, value",
+        [
+            ("workload", "!=", "ctr"),
+            ("workload", "not in", ["ctr", "bert"]),
+            ("workload", "in", ["ctr"]),
+            ("cap_gpu", "!=", 8.0),
+            ("cap_gpu", "<", 4.0),
+        ],
+    )
+    def test_nulls(self, trace_data, merged, column, op, value):
+        # the left joins leave nulls in the columns of the group and machine tables
+        assert merged[column].isna().any()
+        query = trace_data.query().where(column, op, value).select("inst_name", column)
+        from_tables = query.collect()
+        trace_data._store_cache("merged", merged)
+        trace_data._cache.clear()
+        from_file = query.collect()
+        trace_data.get_df("merged")
+        from_memory = query.collect()
+        assert len(from_tables) > 0
+        assert from_tables[column].notna().all()
+        for result in [from_file, from_memory]:
+            pd.testing.assert_frame_equal(
+                _sorted(result), _sorted(from_tables), check_categorical=False
+            )
+
+    def test_all_columns(self, trace_data, merged):
+        result = trace_data.query().collect()
+        assert set(result.columns) == set(merged.columns)
+        pd.testing.assert_frame_equal(
+            _sorted(result[merged.columns]), _sorted(merged), check_categorical=False
+        )
+
+    def test_between(self, trace_data, merged):
+        start = pd.Timestamp("2020-01-26 12:00")
+        end = pd.Timestamp("2020-01-28", tz="Asia/Shanghai")
+        result = trace_data.query().between(start, end).select("job_name").collect()
+        expected = merged[
+            (merged.start_date >= start.tz_localize("Asia/Shanghai"))
+            & (merged.start_date < end)
+        ]
+        assert sorted(result["job_name"]) == sorted(expected["job_name"])
+        seconds = trace_data.query().between(
+            start.timestamp() - 8 * 3600, end.timestamp()
+        )
+        assert sorted(seconds.select("job_name").collect()["job_name"]) == sorted(
+            expected["job_name"]
+        )
+
+    def test_cached(self, trace_data, merged):
+        query = (
+            trace_data.query()
+            .where("gpu_type", "==", "T4")
+            .where("wait_time", ">=", 0)
+            .select("inst_name", "gpu_type")
+        )
+        expected = merged[(merged.gpu_type == "T4") & (merged.wait_time >= 0)]
+        expected = expected[["inst_name", "gpu_type"]]
+        trace_data._store_cache("merged", merged)
+        trace_data._cache.clear()
+        with patch.object(trace_data, "_merge") as mock_merge:
+            with patch("pandas.read_parquet", wraps=pd.read_parquet) as mock_read:
+                from_file = query.collect()
+            assert mock_read.call_args.kwargs["filters"] == [
+                ["gpu_type", "==", "T4"],
+                ["wait_time", ">=", 0],
+            ]
+            assert mock_read.call_args.kwargs["columns"] == [
+                "inst_name",
+                "gpu_type",
+                "wait_time",
+            ]
+            trace_data.get_df("merged")
+            from_memory = query.collect()
+            mock_merge.assert_not_called()
+        for result in [from_file, from_memory]:
+            pd.testing.assert_frame_equal(
+                _sorted(result), _sorted(expected), check_categorical=False
+            )
+
+    def test_invalid(self, trace_data, trace_tables):
+        with pytest.raises(ValueError):
+            trace_data.query().where("status", "~", "Running")
+        with pytest.raises(ValueError):
+            trace_data.query().select("no_such_column").collect()
+
+
+class TestMerge:
+    @staticmethod
+    def _merge_chain(trace_data) -> pd.DataFrame:
+        """The chain of merges the merged table is checked against"""
+        merged = trace_data.get_df("job")
+        for data_type, keys, how in trace_data.MergePlan:
+            merged = merged.merge(
+                trace_data.get_df(data_type),
+                on=list(keys),
+                how=how,
+                suffixes=("", f"_{data_type}"),
+            )
+        merged = merged.drop(columns=list(trace_data.MergedDropColumns))
+        merged["run_time"] = merged["end_time"] - merged["start_time"]
+        merged["wait_time"] = merged["start_time_instance"] - merged["start_time"]
+        merged["hours"] = merged.start_date.apply(lambda d: d.dayofyear * 24 + d.hour)
+        merged["end_hours"] = merged.end_date.apply(lambda d: d.dayofyear * 24 + d.hour)
+        return merged.query(f"hours >= {trace_data._offset}")
+
+    def test_matches_merge_chain(self, trace_data, trace_tables):
+        merged = trace_data._get_merged_df()
+        expected = self._merge_chain(trace_data)
+        assert len(merged) > 0
+        assert merged["gpu_type_spec"].isna().any()
+        # a merge on categoricals with different categories falls back to strings
+        assert isinstance(merged["machine"].dtype, pd.CategoricalDtype)
+        merged["machine"] = merged["machine"].astype(expected["machine"].dtype)
+        pd.testing.assert_frame_equal(
+            merged, expected.reset_index(drop=True), check_dtype=False
+        )
+
+    def test_duplicated_keys(self, trace_data, trace_tables):
+        sensor = trace_data.get_df("sensor")
+        trace_data._cache["sensor"] = pd.concat([sensor, sensor.iloc[:5]])
+        merged = trace_data._get_merged_df()
+        expected = self._merge_chain(trace_data)
+        assert len(merged) == len(expected)
+        # a merge on categoricals with different categories falls back to strings
+        assert isinstance(merged["machine"].dtype, pd.CategoricalDtype)
+        merged["machine"] = merged["machine"].astype(expected["machine"].dtype)
+        pd.testing.assert_frame_equal(
+            merged, expected.reset_index(drop=True), check_dtype=False
+        )
+
+
+def _modified_by_masks(merged: pd.DataFrame) -> pd.DataFrame:
+    """The mask by mask construction the modified table is checked against"""
+    merged = merged.copy()
+    max_time = merged["end_time"].max()
+    max_date = merged["end_date"].max()
+    running = (
+        (merged.status == "Running")
+        & (merged.status_task == "Running")
+        & (merged.status_instance == "Running")
+    )
+    for column, value in [
+        ("end_time", max_time),
+        ("end_date", max_date),
+        ("end_date_task", max_date),
+        ("end_time_task", max_time),
+        ("end_date_instance", max_date),
+        ("end_time_instance", max_time),
+    ]:
+        merged.loc[running, column] = value
+    merged = merged[~((merged.status == "Waiting") & pd.notna(merged.end_time))]
+    for target, candidates in [
+        (
+            "end_date",
+            [
+                "end_date_instance",
+                "end_date_task",
+                "start_date_instance",
+                "start_date_task",
+            ],
+        ),
+        (
+            "end_time",
+            [
+                "end_time_instance",
+                "end_time_task",
+                "start_time_instance",
+                "start_time_task",
+            ],
+        ),
+    ]:
+        for candidate in candidates:
+            mask = merged.end_date.isnull() & pd.notnull(merged[candidate])
+            merged.loc[mask, target] = merged.loc[mask, candidate]
+    merged["run_time"] = merged["end_time"] - merged["start_time"]
+    merged["wait_time"] = merged["start_time_instance"] - merged["start_time"]
+    interrupted = merged.status_instance == "Interrupted"
+    merged.loc[interrupted, "wait_time"] = (
+        merged.loc[interrupted, "start_time_task"]
+        - merged.loc[interrupted, "start_time"]
+    )
+    merged["pure_run_time"] = merged["run_time"] - merged["wait_time"]
+    return merged
+
+
+class TestModifiedMerged:
+    @pytest.fixture(scope="function")
+    def merged(self, modified_merged):
+        _random = np.random.default_rng(3)
+        merged = modified_merged.drop(columns=["start_time_task"]).copy()
+        _rows = len(merged)
+        merged["start_time_task"] = modified_merged["start_time_task"]
+        for suffix in ["_task", "_instance"]:
+            merged[f"status{suffix}"] = _random.choice(
+                ["Running", "Waiting", "Terminated", "Interrupted"], _rows
+            )
+            merged[f"end_time{suffix}"] = merged["end_time"] - 10
+        merged["end_time_instance"] = merged["end_time_instance"].mask(
+            merged["start_time_instance"].isna()
+        )
+        merged.loc[merged.index[::3], "end_time"] = np.nan
+        merged.loc[merged.index[::6], "end_time_task"] = np.nan
+        merged.loc[merged.index[::5], "status"] = "Running"
+        merged.loc[merged.index[::10], ["status_task", "status_instance"]] = "Running"
+        # no end and no start of the instance and the task
+        merged.loc[merged.index[1::21], "start_time_task"] = np.nan
+        merged.loc[merged.index[1::21], ["end_time_task", "start_time_instance"]] = (
+            np.nan
+        )
+        merged.loc[merged.index[1::21], ["end_time_instance", "end_time"]] = np.nan
+        merged.loc[merged.index[1::21], "status"] = "Terminated"
+        for column in [
+            c for c in merged.columns if c.startswith(("start_time", "end_time"))
+        ]:
+            merged[column.replace("time", "date")] = pd.to_datetime(
+                merged[column], unit="s", utc=True
+            ).dt.tz_convert("Asia/Shanghai")
+        # an end of the job without its date is only filled from the candidates in time
+        merged.loc[merged.index[1::42], "end_time"] = 1_580_000_000.0
+        return merged
+
+    def test_matches_masks(self, trace_data, merged):
+        trace_data._cache["merged"] = merged
+        modified = trace_data._get_modified_merged_df()
+        expected = _modified_by_masks(merged)
+        assert modified["end_date"].isna().any()
+        assert (modified.status_instance == "Interrupted").any()
+        pd.testing.assert_frame_equal(modified, expected)
+        # the cached merged table is left untouched
+        assert trace_data._cache["merged"] is merged
+        assert merged["end_date"].isna().sum() > modified["end_date"].isna().sum()
+        assert "pure_run_time" not in merged.columns
+
+
+class TestDownload:
+    def test_download_all_trace_data(self, trace_data, trace_server):
+        trace_server.delay = 0.2
+        _checksums = {
+            name: hashlib.sha256(
+                trace_server.files[f"/traces/{name}.tar.gz"]
+            ).hexdigest()
+            for name in trace_data._data_name.values()
+        }
+        trace_data.download_all_trace_data(max_workers=4, checksums=_checksums)
+        # the tables are fetched concurrently
+        assert trace_server.peak > 1
+        for name in trace_data._data_name.values():
+            _file = os.path.join(trace_data.target_dir, name)
+            with open(f"{_file}.csv", "rb") as f:
+                assert f.read().startswith(name.encode())
+            with open(f"{_file}.header", "rb") as f:
+                assert f.read() == b"name,value\n"
+            with open(f"{_file}.tar.gz", "rb") as f:
+                assert f.read() == trace_server.files[f"/traces/{name}.tar.gz"]
+        assert not any(f.endswith(".part") for f in os.listdir(trace_data.target_dir))
+        # nothing is fetched again once downloaded
+        _count = len(trace_server.requests)
+        trace_data.download_all_trace_data()
+        assert len(trace_server.requests) == _count
+
+    def test_resume_interrupted_download(self, trace_data, trace_server):
+        _path = "/traces/pai_job_table.tar.gz"
+        _body = trace_server.files[_path]
+        trace_server.drop[_path] = len(_body) // 2
+        _file = os.path.join(trace_data.target_dir, "pai_job_table.tar.gz")
+        trace_data.download(trace_server.url + _path, _file)
+        with open(_file, "rb") as f:
+            assert f.read() == _body
+        # the second request resumes after the chunks written before the cut
+        assert [r[0] for r in trace_server.requests] == [_path, _path]
+        assert trace_server.requests[0][1] is None
+        _offset = int(trace_server.requests[1][1][len("bytes=") : -1])
+        assert 0 < _offset <= len(_body) // 2
+
+    def test_resume_part_file(self, trace_data, trace_server):
+        _path = "/traces/pai_task_table.tar.gz"
+        _body = trace_server.files[_path]
+        _file = os.path.join(trace_data.target_dir, "pai_task_table.tar.gz")
+        with open(f"{_file}.part", "wb") as f:
+            f.write(_body[:1000])
+        trace_data.download(
+            trace_server.url + _path,
+            _file,
+            checksum=hashlib.sha256(_body).hexdigest(),
+        )
+        with open(_file, "rb") as f:
+            assert f.read() == _body
+        assert trace_server.requests == [(_path, "bytes=1000-")]
+        assert not os.path.exists(f"{_file}.part")
+
+    def test_complete_part_file(self, trace_data, trace_server):
+        _path = "/traces/pai_task_table.tar.gz"
+        _body = trace_server.files[_path]
+        _file = os.path.join(trace_data.target_dir, "pai_task_table.tar.gz")
+        with open(f"{_file}.part", "wb") as f:
+            f.write(_body)
+        trace_data.download(trace_server.url + _path, _file)
+        with open(_file, "rb") as f:
+            assert f.read() == _body
+
+    def test_server_without_ranges(self, trace_data, trace_server):
+        trace_server.ranges = False
+        _path = "/traces/pai_task_table.tar.gz"
+        _body = trace_server.files[_path]
+        _file = os.path.join(trace_data.target_dir, "pai_task_table.tar.gz")
+        with open(f"{_file}.part", "wb") as f:
+            f.write(b"stale bytes")
+        trace_data.download(trace_server.url + _path, _file)
+        with open(_file, "rb") as f:
+            assert f.read() == _body
+
+    def test_checksum_mismatch(self, trace_data, trace_server):
+        _path = "/traces/pai_task_table.tar.gz"
+        _file = os.path.join(trace_data.target_dir, "pai_task_table.tar.gz")
+        with pytest.raises(ValueError):
+            trace_data.download(trace_server.url + _path, _file, checksum="0" * 64)
+        assert not os.path.exists(_file)
+        assert not os.path.exists(f"{_file}.part")
+
+    def test_failed_table(self, trace_data, trace_server):
+        del trace_server.files["/traces/pai_machine_metric.tar.gz"]
+        with pytest.raises(RuntimeError, match="pai_machine_metric"):
+            trace_data.download_all_trace_data()
+        # the other tables are still downloaded and extracted
+        assert os.path.isfile(os.path.join(trace_data.target_dir, "pai_job_table.csv"))
+
+
+class TestGpuOccupancy:
+    @pytest.fixture(scope="function")
+    def occupancy_data(self, trace_data):
+        _random = np.random.default_rng(4)
+        _rows = 150
+        # on whole minutes, so the bins of a minute are aligned with the seconds
+        _base = 1_580_000_400
+        start = _base + _random.integers(0, 7200, _rows)
+        end = start + _random.integers(0, 3600, _rows)
+        frame = pd.DataFrame(
+            {
+                "machine": _random.choice(["m0", "m1", "m2", "unknown", None], _rows),
+                "plan_gpu": _random.choice(
+                    [25.0, 50.0, 100.0, 200.0, 400.0, np.nan], _rows
+                ),
+                "start_time_instance": start.astype(float),
+                "end_time_instance": end.astype(float),
+                "end_time": end.astype(float) + 60,
+            }
+        )
+        # instances without an end hold their GPUs until the end of their job
+        frame.loc[::9, "end_time_instance"] = np.nan
+        frame.loc[::11, "start_time_instance"] = np.nan
+        for column in ["start_time_instance", "end_time_instance", "end_time"]:
+            frame[column.replace("time", "date")] = pd.to_datetime(
+                frame[column], unit="s", utc=True
+            ).dt.tz_convert("Asia/Shanghai")
+        spec = pd.DataFrame(
+            {
+                "machine": ["m0", "m1", "m2", "m3"],
+                "gpu_type": ["V100", "V100", "T4", "T4"],
+                "cap_cpu": 96.0,
+                "cap_mem": 512.0,
+                "cap_gpu": [8.0, 2.0, 2.0, 1.0],
+            }
+        )
+        trace_data._cache["modified_merged"] = frame
+        trace_data._cache["machine"] = spec
+        # the local wall time of the instances in s, as the occupancy bins it
+        _end = frame["end_time_instance"].fillna(frame["end_time"])
+        valid = (
+            frame["machine"].isin(spec["machine"])
+            & (frame["plan_gpu"] > 0)
+            & frame["start_time_instance"].notna()
+        )
+        instances = pd.DataFrame(
+            {
+                "machine": frame["machine"],
+                "gpu": frame["plan_gpu"] / 100,
+                "start": frame["start_time_instance"] + 8 * 3600,
+                "end": _end + 8 * 3600,
+            }
+        )[valid]
+        return instances, spec
+
+    @staticmethod
+    def _states(instances, machine, seconds):
+        """The GPUs, shared GPUs and instances of a machine after the changes of every second"""
+        _on = instances[instances["machine"] == machine]
+        _running = (_on["start"].to_numpy()[:, None] <= seconds[None, :]) & (
+            seconds[None, :] < _on["end"].to_numpy()[:, None]
+        )
+        _gpu = _on["gpu"].to_numpy()[:, None]
+        return (
+            (_running * _gpu).sum(axis=0),
+            (_running * np.where(_gpu < 1, _gpu, 0)).sum(axis=0),
+            _running.sum(axis=0),
+        )
+
+    def test_machine_occupancy(self, trace_data, occupancy_data):
+        instances, spec = occupancy_data
+        occupancy = trace_data.get_df("machine_occupancy")
+        assert set(occupancy["machine"].astype(str)) == {"m0", "m1", "m2"}
+        for machine, rows in occupancy.groupby("machine", observed=True):
+            seconds = rows["time"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+            allocated, shared, count = self._states(instances, machine, seconds)
+            np.testing.assert_allclose(rows["allocated"], allocated, atol=1e-9)
+            np.testing.assert_allclose(rows["shared"], shared, atol=1e-9)
+            np.testing.assert_array_equal(rows["instances"], count)
+            assert (rows["time"].diff().dropna() > pd.Timedelta(0)).all()
+            assert (
+                rows["gpu_type"] == spec.set_index("machine")["gpu_type"][machine]
+            ).all()
+        # every machine is idle after its last instance
+        assert (
+            occupancy.groupby("machine", observed=True)["allocated"].last() == 0
+        ).all()
+
+    def test_machine_occupancy_without_capacity(self, trace_data, occupancy_data):
+        spec = trace_data._cache["machine"]
+        spec["cap_gpu"] = pd.array([8.0, None, 2.0, 1.0], dtype="Float32")
+        occupancy = trace_data.get_df("machine_occupancy")
+        capacity = occupancy.groupby("machine", observed=True)["capacity"].first()
+        assert capacity.to_dict() == {"m0": 8.0, "m1": 0.0, "m2": 2.0}
+
+    def test_gpu_occupancy(self, trace_data, occupancy_data):
+        instances, spec = occupancy_data
+        result = trace_data.get_gpu_occupancy("min")
+        _first = int(instances["start"].min()) // 60 * 60
+        _bins = (int(instances["end"].max()) - _first) // 60 + 1
+        seconds = _first + np.arange(_bins * 60)
+        for gpu_type, machines in spec.groupby("gpu_type"):
+            totals = {}
+            for machine, capacity in zip(machines["machine"], machines["cap_gpu"]):
+                allocated, shared, count = self._states(instances, machine, seconds)
+                idle = np.maximum(capacity - allocated, 0)
+                metrics = {
+                    "allocated": allocated,
+                    "idle": idle,
+                    "fragmented": idle % 1,
+                    "occupied": np.minimum(np.ceil(allocated), capacity),
+                    "shared": shared,
+                    "busy_machines": allocated > 0,
+                    "instances": count,
+                }
+                for name, values in metrics.items():
+                    totals[name] = totals.get(name, 0) + values
+            rows = result[result["gpu_type"] == gpu_type]
+            assert len(rows) == _bins
+            assert (
+                rows["time"].to_numpy(dtype="datetime64[s]").astype(np.int64)
+                == seconds[::60]
+            ).all()
+            assert (rows["capacity"] == machines["cap_gpu"].sum()).all()
+            for name, values in totals.items():
+                np.testing.assert_allclose(
+                    rows[name], values.reshape(_bins, 60).mean(axis=1), atol=1e-9
+                )
+        # the plans of the synthetic instances overcommit the machines at times
+        assert (result["utilisation"] >= 0).all()
+        assert (result["utilisation"] > 1).any()
+        assert (result["fragmentation"].dropna().between(0, 1)).all()
+        assert (result["sharing_ratio"].dropna().between(0, 1)).all()
+        # the occupancy is kept in a cache file for the bin width
+        assert os.path.isfile(trace_data._build_cache_file("gpu_occupancy_min"))
+
+    def test_from_trace(self, trace_data, trace_tables):
+        result = trace_data.get_gpu_occupancy("D")
+        assert set(result["gpu_type"]) == {"V100", "T4", "P100", "MISC"}
+        assert result.groupby("gpu_type")["allocated"].sum().sum() > 0
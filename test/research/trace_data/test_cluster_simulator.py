@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from stone_lib.research.trace_data.cluster_simulator import (
+    BestFitPolicy,
+    ClusterSimulator,
+    SchedulingPolicy,
+)
+
+
+def _machines(gpus, gpu_type="V100"):
+    return pd.DataFrame(
+        {
+            "machine": [f"m{i}" for i in range(len(gpus))],
+            "gpu_type": gpu_type,
+            "cap_cpu": 96.0,
+            "cap_mem": 512.0,
+            "cap_gpu": [float(g) for g in gpus],
+        }
+    )
+
+
+def _instances(arrival, duration, plan_gpu, gpu_type="V100"):
+    arrival = np.asarray(arrival, dtype=float)
+    return pd.DataFrame(
+        {
+            "job_name": [f"job{i}" for i in range(len(arrival))],
+            "start_time": arrival,
+            # the trace started the instances later, the replay only keeps the run time
+            "start_time_instance": arrival + 100,
+            "end_time_instance": arrival + 100 + np.asarray(duration, dtype=float),
+            "plan_cpu": 600.0,
+            "plan_mem": 29.0,
+            "plan_gpu": [float(g) for g in plan_gpu],
+            "gpu_type": gpu_type,
+        }
+    )
+
+
+def _replay_by_scans(simulator):
+    """Replay by sorting and trying every pending instance again at every event"""
+    cluster = simulator.cluster
+    cluster.reset()
+    priority = simulator.policy.priority(simulator.arrival, simulator.duration)
+    count = len(simulator.arrival)
+    start = np.full(count, np.nan)
+    machine = np.full(count, -1)
+    capacity = {
+        code: cluster.max_capacity(code) for code in np.unique(simulator.type_codes)
+    }
+    pending, running, upcoming = [], [], 0
+    while upcoming < count or len(running) > 0:
+        now = min(
+            simulator.arrival[upcoming] if upcoming < count else np.inf,
+            min(end for end, _ in running) if len(running) > 0 else np.inf,
+        )
+        for end, i in [r for r in running if r[0] <= now]:
+            cluster.release(machine[i], simulator.demand[:, i])
+            running.remove((end, i))
+        while upcoming < count and simulator.arrival[upcoming] <= now:
+            code = simulator.type_codes[upcoming]
+            if (simulator.demand[:, upcoming] <= capacity[code] + 1e-6).all():
+                pending.append(upcoming)
+            upcoming += 1
+        pending.sort(key=lambda i: (priority[i], simulator.arrival[i], i))
+        waiting, failures = [], 0
+        for k, i in enumerate(pending):
+            if simulator.window is not None and failures >= simulator.window:
+                waiting += pending[k:]
+                break
+            candidates = cluster.candidates(
+                simulator.demand[:, i], simulator.type_codes[i]
+            )
+            if len(candidates) == 0:
+                failures += 1
+                waiting.append(i)
+                continue
+            machine[i] = simulator.policy.place(
+                cluster, candidates, simulator.demand[:, i]
+            )
+            cluster.allocate(machine[i], simulator.demand[:, i])
+            start[i] = now
+            running.append((now + simulator.duration[i], i))
+        pending = waiting
+    return start, machine
+
+
+class TestClusterSimulator:
+    def test_fifo_and_sjf(self):
+        instances = _instances([0, 1, 2], [10, 5, 1], [200, 200, 200])
+        fifo = ClusterSimulator(instances, _machines([2]), policy="fifo").run()
+        assert fifo.instances["start"].tolist() == [0.0, 10.0, 15.0]
+        sjf = ClusterSimulator(instances, _machines([2]), policy="sjf").run()
+        assert sjf.instances["start"].tolist() == [0.0, 11.0, 10.0]
+        assert sjf.summary()["mean_wait"] < fifo.summary()["mean_wait"]
+        assert fifo.summary()["makespan"] == 16.0
+
+    def test_best_fit(self):
+        instances = _instances([0, 1], [100, 10], [400, 800])
+        fifo = ClusterSimulator(instances, _machines([8, 4]), policy="fifo").run()
+        assert fifo.instances["machine"].tolist() == ["m0", "m0"]
+        assert fifo.instances["start"].tolist() == [0.0, 100.0]
+        # the small instance fills the small machine and the large one runs at once
+        best_fit = ClusterSimulator(
+            instances, _machines([8, 4]), policy=BestFitPolicy()
+        ).run()
+        assert best_fit.instances["machine"].tolist() == ["m1", "m0"]
+        assert best_fit.instances["start"].tolist() == [0.0, 1.0]
+
+    def test_window(self):
+        instances = _instances([0, 1, 2], [10, 5, 1], [300, 200, 100])
+        blocked = ClusterSimulator(instances, _machines([4]), window=1).run()
+        assert blocked.instances["start"].tolist() == [0.0, 10.0, 10.0]
+        assert blocked.instances["machine"].tolist() == ["m0"] * 3
+        # the instance which fits runs ahead of the head of the queue
+        backfilled = ClusterSimulator(instances, _machines([4])).run()
+        assert backfilled.instances["start"].tolist() == [0.0, 10.0, 2.0]
+
+    def test_gpu_type_and_rejection(self):
+        machines = pd.concat(
+            [_machines([8], "V100"), _machines([4], "T4").assign(machine="m1")]
+        )
+        instances = _instances([0, 0, 0], [10, 10, 10], [200, 400, 1600])
+        instances["gpu_type"] = ["T4", "T4", "MISC"]
+        result = ClusterSimulator(instances, machines).run()
+        assert result.instances["machine"].tolist()[:2] == ["m1", "m1"]
+        assert result.instances["machine"].isna().tolist() == [False, False, True]
+        assert result.instances["start"].tolist()[:2] == [0.0, 10.0]
+        assert result.summary()["rejected"] == 1
+        # without the types both run at once on the first machine
+        result = ClusterSimulator(instances, machines, match_gpu_type=False).run()
+        assert result.instances["machine"].tolist()[:2] == ["m0", "m0"]
+        assert result.instances["start"].tolist()[:2] == [0.0, 0.0]
+
+    def test_custom_policy(self):
+        with pytest.raises(TypeError):
+            SchedulingPolicy()
+
+        class LongestFirst(SchedulingPolicy):
+            name = "longest_first"
+
+            def priority(self, arrival, duration):
+                return -duration
+
+        instances = _instances([0, 1, 2], [5, 10, 20], [800, 800, 800])
+        result = ClusterSimulator(instances, _machines([8]), LongestFirst()).run()
+        assert result.instances["start"].tolist() == [0.0, 25.0, 5.0]
+
+    def test_incomplete_instances(self):
+        instances = _instances([0, 1, 2], [10, 5, 1], [100, 100, 100])
+        instances.loc[1, "end_time_instance"] = np.nan
+        result = ClusterSimulator(instances, _machines([8])).run()
+        assert result.instances["job_name"].tolist() == ["job0", "job2"]
+
+    @pytest.mark.parametrize("policy", ["fifo", "sjf", "best_fit"])
+    def test_capacity(self, policy):
+        _random = np.random.default_rng(0)
+        _count = 2000
+        instances = _instances(
+            np.sort(_random.integers(0, 20_000, _count)),
+            _random.integers(1, 2000, _count),
+            _random.choice([25, 50, 100, 200, 400, 800, np.nan], _count),
+        )
+        instances["plan_cpu"] = _random.choice([100.0, 600.0, 1200.0], _count)
+        machines = _machines([8, 8, 4, 2, 2, 1])
+        result = ClusterSimulator(instances, machines, policy=policy).run()
+        placed = result.instances
+        assert placed["machine"].notna().all()
+        assert (placed["wait"] >= 0).all()
+        np.testing.assert_allclose(placed["end"] - placed["start"], placed["duration"])
+        # the gpu and the cpu in use never exceed the capacity of a machine
+        gpu = instances.set_index("job_name")["plan_gpu"].fillna(0) / 100
+        cpu = instances.set_index("job_name")["plan_cpu"] / 100
+        for demand, capacity in [
+            (gpu, machines["cap_gpu"]),
+            (cpu, machines["cap_cpu"]),
+        ]:
+            events = pd.DataFrame(
+                {
+                    "machine": np.concatenate([placed["machine"]] * 2),
+                    "time": np.concatenate([placed["start"], placed["end"]]),
+                    "demand": np.concatenate(
+                        [
+                            placed["job_name"].map(demand),
+                            -placed["job_name"].map(demand),
+                        ]
+                    ),
+                }
+            ).sort_values(["machine", "time", "demand"])
+            peak = (
+                events.groupby("machine")["demand"]
+                .cumsum()
+                .groupby(events["machine"])
+                .max()
+            )
+            limit = capacity.set_axis(machines["machine"])[peak.index]
+            assert (peak <= limit + 1e-6).all()
+        assert (result.usage["used_gpu"] <= machines["cap_gpu"].sum() + 1e-6).all()
+        assert 0 < result.summary()["utilisation"]["gpu"] <= 100
+        # the usage is back to nothing once every instance ended
+        assert result.usage["used_gpu"].iloc[-1] == pytest.approx(0.0, abs=1e-6)
+        assert result.usage["pending"].iloc[-1] == 0
+
+    def test_from_trace(self, trace_data, trace_tables):
+        simulator = ClusterSimulator.from_trace(trace_data, policy="best_fit")
+        merged = trace_data.get_df("merged")
+        valid = (
+            merged["start_time_instance"].notna() & merged["end_time_instance"].notna()
+        )
+        assert len(simulator.arrival) == valid.sum()
+        result = simulator.run()
+        summary = result.summary()
+        assert summary["instances"] == valid.sum()
+        assert summary["policy"] == "best_fit"
+        assert len(result.jobs()) > 0
+
+    @pytest.mark.parametrize("policy", ["fifo", "sjf", "best_fit"])
+    @pytest.mark.parametrize("window", [1, 3, None])
+    def test_reference(self, policy, window):
+        _random = np.random.default_rng(1)
+        _count = 600
+        instances = _instances(
+            np.sort(_random.integers(0, 3000, _count)),
+            _random.integers(1, 200, _count),
+            _random.choice([25, 50, 100, 200, 400, 800, np.nan], _count),
+            _random.choice(["V100", "T4", None], _count),
+        )
+        machines = pd.concat(
+            [_machines([8, 4, 2], "V100"), _machines([2, 1], "T4")], ignore_index=True
+        ).assign(machine=lambda d: [f"m{i}" for i in range(len(d))])
+        simulator = ClusterSimulator(instances, machines, policy=policy, window=window)
+        result = simulator.run()
+        start, machine = _replay_by_scans(simulator)
+        # the cluster is overloaded, the instances queue past the window
+        assert result.usage["pending"].max() > 3
+        np.testing.assert_array_equal(result.instances["start"], start)
+        names = simulator.cluster.names[np.maximum(machine, 0)]
+        expected = np.where(machine >= 0, names, "")
+        assert result.instances["machine"].fillna("").tolist() == list(expected)
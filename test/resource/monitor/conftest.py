@@ -0,0 +1,152 @@
+import types
+from unittest.mock import patch
+
+import pytest
+
+
+class _Struct:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeNVMLError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def _build_fake_nvml(num_gpus: int = 2):
+    """A pure python stand-in of pynvml, it counts every device call"""
+    calls = []
+    state = {
+        "processes": {i: [] for i in range(num_gpus)},
+        "mps_processes": {i: [] for i in range(num_gpus)},
+        "graphics_processes": {i: [] for i in range(num_gpus)},
+        "process_utilisation": {i: [] for i in range(num_gpus)},
+        "samples": {i: {} for i in range(num_gpus)},
+        "sample_value_type": 1,
+    }
+
+    def device_call(name, result):
+        def _call(handle, *args):
+            calls.append((name, handle))
+            return result(handle, *args) if callable(result) else result
+
+        return _call
+
+    def get_field_values(handle, field_ids):
+        return [
+            _Struct(
+                fieldId=field_id,
+                nvmlReturn=0,
+                valueType=3,
+                value=_Struct(ullVal=field_id * 10 + handle),
+            )
+            for field_id in field_ids
+        ]
+
+    def get_samples(handle, sampling_type, since):
+        _samples = [
+            s
+            for s in state["samples"][handle].get(sampling_type, [])
+            if s.timeStamp > since
+        ]
+        if len(_samples) == 0:
+            raise FakeNVMLError(6)
+        return state["sample_value_type"], _samples
+
+    def get_process_utilisation(handle, since):
+        _samples = [
+            s for s in state["process_utilisation"][handle] if s.timeStamp > since
+        ]
+        if len(_samples) == 0:
+            raise FakeNVMLError(6)
+        return _samples
+
+    fake = types.SimpleNamespace(
+        calls=calls,
+        state=state,
+        NVMLError=FakeNVMLError,
+        NVML_SUCCESS=0,
+        NVML_ERROR_NOT_SUPPORTED=3,
+        NVML_ERROR_NOT_FOUND=6,
+        NVML_VALUE_TYPE_DOUBLE=0,
+        NVML_VALUE_TYPE_UNSIGNED_INT=1,
+        NVML_VALUE_TYPE_UNSIGNED_LONG=2,
+        NVML_VALUE_TYPE_UNSIGNED_LONG_LONG=3,
+        NVML_VALUE_TYPE_SIGNED_LONG_LONG=4,
+        NVML_DEVICE_ARCH_KEPLER=2,
+        NVML_DEVICE_ARCH_MAXWELL=3,
+        NVML_DEVICE_ARCH_PASCAL=4,
+        NVML_DEVICE_ARCH_VOLTA=5,
+        NVML_DEVICE_ARCH_TURING=6,
+        NVML_DEVICE_ARCH_AMPERE=7,
+        NVML_DEVICE_ARCH_ADA=8,
+        NVML_DEVICE_ARCH_HOPPER=9,
+        NVML_CLOCK_GRAPHICS=0,
+        NVML_CLOCK_SM=1,
+        NVML_CLOCK_MEM=2,
+        NVML_TEMPERATURE_GPU=0,
+        NVML_GPU_UTILIZATION_SAMPLES=1,
+        NVML_MEMORY_UTILIZATION_SAMPLES=2,
+        NVML_FI_DEV_TOTAL_ENERGY_CONSUMPTION=83,
+        NVML_FI_DEV_MEMORY_TEMP=82,
+        NVML_FI_DEV_POWER_AVERAGE=185,
+        nvmlInit=lambda: None,
+        nvmlShutdown=lambda: None,
+        nvmlDeviceGetCount=lambda: num_gpus,
+        nvmlDeviceGetHandleByIndex=lambda index: index,
+        nvmlDeviceGetName=device_call("name", lambda h: f"GPU-{h}"),
+        nvmlDeviceGetUUID=device_call("uuid", lambda h: f"uuid-{h}"),
+        nvmlDeviceGetArchitecture=device_call("arch", 7),
+        nvmlDeviceGetPciInfo=device_call(
+            "pci",
+            lambda h: _Struct(
+                busId=f"0000:0{h}:00.0",
+                domain=0,
+                bus=h,
+                device=0,
+                pciDeviceId=1,
+                pciSubSystemId=2,
+                busIdLegacy=f"0000:0{h}:00.0",
+            ),
+        ),
+        nvmlDeviceGetTemperature=device_call("temperature", 40),
+        nvmlDeviceGetFanSpeed=device_call("fan", 30),
+        nvmlDeviceGetUtilizationRates=device_call(
+            "utilisation", _Struct(gpu=50, memory=25)
+        ),
+        nvmlDeviceGetMemoryInfo=device_call(
+            "memory", _Struct(total=100, free=60, used=40)
+        ),
+        nvmlDeviceGetPowerUsage=device_call("power_usage", 100000),
+        nvmlDeviceGetPowerManagementLimit=device_call("power_limit", 300000),
+        nvmlDeviceGetPowerState=device_call("power_state", 0),
+        nvmlDeviceGetClockInfo=device_call("clock", 1500),
+        nvmlDeviceGetFieldValues=device_call("field_values", get_field_values),
+        nvmlDeviceGetSamples=device_call("samples", get_samples),
+        nvmlDeviceGetComputeRunningProcesses_v3=device_call(
+            "compute_processes", lambda h: state["processes"][h]
+        ),
+        nvmlDeviceGetGraphicsRunningProcesses_v3=device_call(
+            "graphics_processes", lambda h: state["graphics_processes"][h]
+        ),
+        nvmlDeviceGetMPSComputeRunningProcesses_v3=device_call(
+            "mps_processes", lambda h: state["mps_processes"][h]
+        ),
+        nvmlDeviceGetProcessUtilization=device_call(
+            "process_utilisation", get_process_utilisation
+        ),
+    )
+    return fake
+
+
+@pytest.fixture(scope="function")
+def fake_nvml():
+    fake = _build_fake_nvml()
+    with patch("stone_lib.resource.monitor.nvml.nvml", fake):
+        yield fake
+
+
+@pytest.fixture(scope="function")
+def nvml_struct():
+    return _Struct
@@ -0,0 +1,41 @@
+import pytest
+from stone_lib.resource.monitor.adaptive import AdaptiveInterval
+
+
+def _metric(cpu, gpus=()):
+    return {
+        "cpu": {"utilisation": cpu},
+        "gpu": {i: {"info": {"gpu_utilisation": u}} for i, u in enumerate(gpus)},
+    }
+
+
+class TestAdaptiveInterval:
+    def test_init_invalid(self):
+        with pytest.raises(ValueError):
+            AdaptiveInterval(min_interval=0)
+        with pytest.raises(ValueError):
+            AdaptiveInterval(min_interval=100, max_interval=10)
+        with pytest.raises(ValueError):
+            AdaptiveInterval(decay=0.5)
+
+    def test_signals(self):
+        assert AdaptiveInterval.signals(_metric(50.0, [10, 20])) == [50.0, 10, 20]
+        assert AdaptiveInterval.signals({"cpu": {"utilisation": 1.0}}) == [1.0]
+
+    def test_decays_while_steady(self):
+        adaptive = AdaptiveInterval(min_interval=10, max_interval=40, decay=2)
+        assert adaptive.next_interval(_metric(50.0), 100) == 10
+        assert adaptive.next_interval(_metric(52.0), 10) == 20
+        assert adaptive.next_interval(_metric(51.0), 20) == 40
+        assert adaptive.next_interval(_metric(50.0), 40) == 40
+
+    def test_resets_on_burst(self):
+        adaptive = AdaptiveInterval(min_interval=10, max_interval=1000, threshold=5)
+        adaptive.next_interval(_metric(50.0, [0]), 10)
+        assert adaptive.next_interval(_metric(50.0, [0]), 500) == 750
+        assert adaptive.next_interval(_metric(50.0, [90]), 750) == 10
+
+    def test_resets_when_gpus_change(self):
+        adaptive = AdaptiveInterval(min_interval=10)
+        adaptive.next_interval(_metric(50.0), 10)
+        assert adaptive.next_interval(_metric(50.0, [0]), 100) == 10
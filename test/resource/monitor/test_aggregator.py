@@ -0,0 +1,242 @@
+import multiprocessing
+import os
+import socket
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from stone_lib.resource.monitor.aggregator import (
+    ColumnarStore,
+    FrameBatch,
+    FrameHeader,
+    FrameHello,
+    FrameSchema,
+    MaxFrameSize,
+    MonitorAggregator,
+    MonitorStreamer,
+    decode_batch,
+    encode_batch,
+    encode_frame,
+    parse_address,
+)
+from stone_lib.resource.monitor.host_monitor import HostMetrics
+
+
+def _stream_node(address, node, num_records, offset):
+    with MonitorStreamer(address, node=node, batch_size=4, flush_interval=0.05) as s:
+        for i in range(num_records):
+            s({"timestamp": i * 100.0 + offset, "cpu": {"utilisation": float(i)}})
+
+
+def _wait_for(predicate, timeout=5.0):
+    _deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > _deadline:
+            raise TimeoutError
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize(
+    "address, expected",
+    [
+        ("unix:///tmp/monitor.sock", (socket.AF_UNIX, "/tmp/monitor.sock")),
+        ("tcp://127.0.0.1:9500", (socket.AF_INET, ("127.0.0.1", 9500))),
+        ("localhost:9500", (socket.AF_INET, ("localhost", 9500))),
+        (("localhost", 9500), (socket.AF_INET, ("localhost", 9500))),
+    ],
+)
+def test_parse_address(address, expected):
+    assert parse_address(address) == expected
+
+
+def test_parse_address_invalid():
+    with pytest.raises(ValueError):
+        parse_address("localhost")
+
+
+def test_encode_batch():
+    timestamps = np.array([1.0, 2.0])
+    values = np.array([[1.0, np.nan], [3.0, 4.0]])
+    payload = encode_batch(7, timestamps, values)
+    assert len(payload) == 8 + 6 * 8
+    schema_id, _timestamps, _values = decode_batch(payload, 2)
+    assert schema_id == 7
+    assert _timestamps.tolist() == [1.0, 2.0]
+    np.testing.assert_array_equal(_values, values)
+
+
+class TestColumnarStore:
+    def test_to_frame(self):
+        store = ColumnarStore(resolution=100)
+        store.add(
+            "a", ("cpu",), np.array([0.0, 50.0, 120.0]), np.array([[1.0], [3.0], [5.0]])
+        )
+        store.add("b", ("cpu", "gpu"), np.array([110.0]), np.array([[7.0, 9.0]]))
+        frame = store.to_frame()
+        assert store.nodes == ["a", "b"]
+        assert store.num_rows("a") == 3
+        assert frame.index.tolist() == [0.0, 100.0]
+        assert frame[("a", "cpu")].tolist() == [2.0, 5.0]
+        assert np.isnan(frame[("b", "cpu")].iloc[0])
+        assert frame[("b", "gpu")].iloc[1] == 9.0
+
+    def test_to_frame_empty(self):
+        assert ColumnarStore().to_frame().empty
+
+
+class TestMonitorStreamer:
+    def test_send_batches_per_schema(self):
+        streamer = MonitorStreamer("tcp://127.0.0.1:1", batch_size=2)
+        streamer.send({"timestamp": 0, "cpu": {"utilisation": 1.0}})
+        assert len(streamer._queue) == 0
+        # a new metric starts a new batch
+        streamer.send({"timestamp": 1, "cpu": {"utilisation": 2.0}, "x": 1})
+        assert len(streamer._queue) == 1
+        streamer.send({"timestamp": 2, "cpu": {"utilisation": 3.0}, "x": 2})
+        assert len(streamer._queue) == 2
+        keys, timestamps, values = streamer._queue[1]
+        assert keys == ("cpu.utilisation", "x")
+        assert timestamps.tolist() == [1, 2]
+        assert values.tolist() == [[2.0, 1.0], [3.0, 2.0]]
+
+    def test_drop_oldest_when_queue_full(self):
+        streamer = MonitorStreamer("tcp://127.0.0.1:1", batch_size=1, queue_size=2)
+        for i in range(5):
+            streamer.send({"timestamp": i, "cpu": {"utilisation": 1.0}})
+        assert streamer.dropped == 3
+        assert [batch[1][0] for batch in streamer._queue] == [3, 4]
+
+    def test_reconnect(self, tmp_dir):
+        address = f"unix://{tmp_dir / 'monitor.sock'}"
+        streamer = MonitorStreamer(
+            address, node="a", batch_size=1, flush_interval=0.01, max_backoff=0.05
+        )
+        streamer.start()
+        try:
+            streamer.send({"timestamp": 0, "cpu": {"utilisation": 1.0}})
+            time.sleep(0.1)
+            assert not streamer.connected
+            with MonitorAggregator(address) as aggregator:
+                _wait_for(lambda: aggregator.store.num_rows("a") == 1)
+                streamer.send({"timestamp": 100, "cpu": {"utilisation": 2.0}})
+                _wait_for(lambda: aggregator.store.num_rows("a") == 2)
+            streamer.send({"timestamp": 200, "cpu": {"utilisation": 3.0}})
+            time.sleep(0.1)
+            with MonitorAggregator(address) as aggregator:
+                _wait_for(lambda: aggregator.store.num_rows("a") == 1)
+        finally:
+            streamer.stop()
+        assert streamer.sent == 3
+
+    def test_stop_without_aggregator(self):
+        streamer = MonitorStreamer("tcp://127.0.0.1:1", timeout=0.1, max_backoff=0.01)
+        streamer.start()
+        streamer.send({"timestamp": 0, "cpu": {"utilisation": 1.0}})
+        streamer.stop()
+        assert streamer.sent == 0
+        assert len(streamer._queue) == 1
+
+
+class TestMonitorAggregator:
+    @pytest.mark.parametrize("transport", ["tcp", "unix"])
+    def test_multiple_processes(self, transport, tmp_dir):
+        if transport == "tcp":
+            address = "tcp://127.0.0.1:0"
+        else:
+            address = f"unix://{tmp_dir / 'aggregator.sock'}"
+        context = multiprocessing.get_context("fork")
+        with MonitorAggregator(address, resolution=100) as aggregator:
+            nodes = [
+                context.Process(
+                    target=_stream_node,
+                    args=(aggregator.address, f"node{i}", 10, i * 10),
+                )
+                for i in range(3)
+            ]
+            for node in nodes:
+                node.start()
+            for node in nodes:
+                node.join(timeout=10)
+                assert node.exitcode == 0
+            _wait_for(lambda: aggregator.num_connections == 0)
+        frame = aggregator.store.to_frame()
+        assert aggregator.store.nodes == ["node0", "node1", "node2"]
+        assert len(frame) == 10
+        for i in range(3):
+            assert frame[(f"node{i}", "cpu.utilisation")].tolist() == [
+                float(j) for j in range(10)
+            ]
+        if transport == "unix":
+            assert not os.path.exists(str(tmp_dir / "aggregator.sock"))
+
+    def test_unknown_schema(self):
+        with MonitorAggregator("tcp://127.0.0.1:0") as aggregator:
+            _, address = parse_address(aggregator.address)
+            with socket.create_connection(address) as client:
+                _batch = {
+                    i: encode_batch(i, np.array([0.0]), np.array([[1.0]]))
+                    for i in (0, 7)
+                }
+                client.sendall(
+                    encode_frame(FrameHello, b'{"node": "a"}')
+                    + encode_frame(FrameBatch, _batch[7])
+                    + encode_frame(FrameSchema, b'{"id": 0, "keys": ["cpu"]}')
+                    + encode_frame(FrameBatch, _batch[0])
+                )
+                # the batch of the unknown schema is skipped, the connection is kept
+                _wait_for(lambda: aggregator.store.num_rows("a") == 1)
+                assert aggregator.num_connections == 1
+
+    def test_malformed_batches(self):
+        with MonitorAggregator("tcp://127.0.0.1:0") as aggregator:
+            _, address = parse_address(aggregator.address)
+            with socket.create_connection(address) as client:
+                client.sendall(
+                    encode_frame(FrameHello, b'{"node": "a"}')
+                    + encode_frame(FrameSchema, b'{"id": 0, "keys": ["cpu"]}')
+                    # shorter than the batch header
+                    + encode_frame(FrameBatch, b"\x00\x00")
+                    # two values for one row of one key
+                    + encode_frame(
+                        FrameBatch,
+                        encode_batch(0, np.array([0.0]), np.array([[1.0, 2.0]])),
+                    )
+                    + encode_frame(
+                        FrameBatch, encode_batch(0, np.array([0.0]), np.array([[1.0]]))
+                    )
+                )
+                # the malformed batches are skipped, the connection is kept
+                _wait_for(lambda: aggregator.store.num_rows("a") == 1)
+                assert aggregator.num_connections == 1
+
+    def test_frame_too_large(self):
+        with MonitorAggregator("tcp://127.0.0.1:0") as aggregator:
+            _, address = parse_address(aggregator.address)
+            with socket.create_connection(address) as client:
+                client.sendall(
+                    encode_frame(FrameHello, b'{"node": "a"}')
+                    + FrameHeader.pack(FrameBatch, MaxFrameSize + 1)
+                )
+                # the connection is dropped before the payload is received
+                assert client.recv(1) == b""
+                _wait_for(lambda: aggregator.num_connections == 0)
+
+    def test_start_twice(self):
+        with MonitorAggregator("tcp://127.0.0.1:0") as aggregator:
+            with pytest.raises(RuntimeError):
+                aggregator.start()
+
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_host_metrics(self, mock_cg, mock_eth):
+        with MonitorAggregator("tcp://127.0.0.1:0") as aggregator:
+            metrics = HostMetrics(
+                interval=10,
+                gpu_enable=False,
+                uuid="test",
+                stream_options={"address": aggregator.address, "node": "a"},
+            )
+            metrics.append({"timestamp": 0, "cpu": {"utilisation": 5.0}})
+            metrics.close()
+            assert aggregator.store.num_rows("a") == 1
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from stone_lib.resource.monitor.async_monitor import AsyncHostMonitor
+
+
+@pytest.fixture(scope="function")
+def mock_host():
+    with patch(
+        "stone_lib.resource.monitor.host_monitor.CGroupMonitor"
+    ) as mock_cg, patch(
+        "stone_lib.resource.monitor.host_monitor.EthernetMonitor"
+    ) as mock_net:
+        mock_cg.return_value.cpu_usage.return_value = 1000
+        mock_cg.return_value.memory_max.return_value = -1
+        mock_cg.return_value.memory_usage.return_value = 1024 * 1024
+        mock_net.return_value.rates.return_value = {"eth0": {"rx": 0, "tx": 0}}
+        yield mock_cg, mock_net
+
+
+class TestAsyncHostMonitor:
+    def test_init(self):
+        monitor = AsyncHostMonitor(interval=10, gpu_enable=False, name="test")
+        assert monitor.name == "test"
+        assert monitor.metrics is None
+        assert monitor.is_running is False
+        assert monitor.dropped == 0
+
+    def test_context_manager_records(self, mock_host):
+        async def run():
+            async with AsyncHostMonitor(interval=10, gpu_enable=False) as monitor:
+                assert monitor.is_running is True
+                await asyncio.sleep(0.1)
+            return monitor
+
+        monitor = asyncio.run(run())
+        assert monitor.is_running is False
+        records = monitor.metrics.get_records()
+        assert len(records) > 0
+        assert records[0]["cpu"] == {"utilisation": 0}
+        assert records[0]["network"] == {"eth0": {"rx": 0, "tx": 0}}
+        assert records[0]["gpu"] == {}
+
+    def test_stop_within_one_interval(self, mock_host):
+        async def run():
+            monitor = AsyncHostMonitor(interval=2000, gpu_enable=False)
+            await monitor.start()
+            await asyncio.sleep(0.01)
+            _start = time.monotonic()
+            await monitor.stop()
+            return time.monotonic() - _start
+
+        assert asyncio.run(run()) < 0.5
+
+    def test_sinks(self, mock_host):
+        received = []
+        awaited = []
+
+        async def async_sink(metric):
+            await asyncio.sleep(0)
+            awaited.append(metric)
+
+        def broken_sink(metric):
+            raise ValueError("broken")
+
+        async def run():
+            monitor = AsyncHostMonitor(
+                interval=10, gpu_enable=False, sinks=[received.append, broken_sink]
+            )
+            monitor.add_sink(async_sink)
+            async with monitor:
+                await asyncio.sleep(0.1)
+            return monitor
+
+        monitor = asyncio.run(run())
+        records = monitor.metrics.get_records()
+        assert received == records
+        assert awaited == records
+
+    def test_slow_sink_drops_oldest(self, mock_host):
+        async def slow_sink(metric):
+            await asyncio.sleep(0.05)
+
+        async def run():
+            monitor = AsyncHostMonitor(
+                interval=5, gpu_enable=False, sinks=[slow_sink], queue_size=1
+            )
+            async with monitor:
+                await asyncio.sleep(0.2)
+            return monitor
+
+        monitor = asyncio.run(run())
+        assert monitor.dropped > 0
+        assert len(monitor.metrics.get_records()) > monitor.dropped
+
+    @pytest.mark.parametrize("nvml_offload", [False, True])
+    def test_nvml_offload(self, mock_host, fake_nvml, nvml_offload):
+        from stone_lib.resource.monitor.host_monitor import HostMetrics
+
+        threads = {"snapshot": set(), "compose": set(), "read_gpus": set()}
+        _methods = {name: getattr(HostMetrics, name) for name in threads}
+
+        def _traced(name):
+            def _call(self, *args):
+                threads[name].add(threading.get_ident())
+                return _methods[name](self, *args)
+
+            return _call
+
+        async def run():
+            with patch.multiple(
+                HostMetrics, **{name: _traced(name) for name in threads}
+            ):
+                async with AsyncHostMonitor(
+                    interval=10, nvml_offload=nvml_offload
+                ) as monitor:
+                    await asyncio.sleep(0.05)
+            return monitor, threading.get_ident()
+
+        monitor, loop_thread = asyncio.run(run())
+        assert len(monitor.metrics.get_records()) > 0
+        assert monitor.metrics.get_records()[0]["gpu"][0]["name"] == "GPU-0"
+        # the cgroup and /proc reads always run on the event loop
+        assert threads["snapshot"] == threads["compose"] == {loop_thread}
+        if nvml_offload:
+            assert loop_thread not in threads["read_gpus"]
+        else:
+            assert threads["read_gpus"] == {loop_thread}
+
+    def test_stop_when_cancelled(self, mock_host):
+        async def run():
+            monitor = AsyncHostMonitor(interval=10, gpu_enable=False)
+
+            async def worker():
+                async with monitor:
+                    await asyncio.sleep(10)
+
+            task = asyncio.create_task(worker())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return monitor
+
+        monitor = asyncio.run(run())
+        assert monitor.is_running is False
+        assert len(monitor.metrics.get_records()) > 0
+
+    def test_save(self, mock_host, tmp_dir):
+        async def run():
+            async with AsyncHostMonitor(
+                interval=10, gpu_enable=False, data_dir=str(tmp_dir), file_name="test"
+            ):
+                await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        with open(os.path.join(str(tmp_dir), "test")) as f:
+            data = json.load(f)
+        assert data["num"] == len(data["records"])
+
+    def test_start_twice(self, mock_host):
+        async def run():
+            async with AsyncHostMonitor(interval=10, gpu_enable=False) as monitor:
+                with pytest.raises(RuntimeError):
+                    await monitor.start()
+
+        asyncio.run(run())
@@ -56,7 +56,9 @@ class TestCGroupAbc:
 class TestCGroupV1:
     def test_cpu_usage(self):
         cgroup = CGroupV1("/sys/fs/cgroup/v1")
-        with patch.object(cgroup, "_get_cgroup_data", return_value=100) as mock_method:
+        with patch.object(
+            cgroup, "_get_cgroup_data", return_value=100000
+        ) as mock_method:
             result = cgroup.cpu_usage()
             assert result == 100
             mock_method.assert_called_once_with("cpuacct/cpuacct.usage")
@@ -153,11 +155,65 @@ class TestCGroupMonitor:
             assert cgroup._cgroup == "/sys/fs/cgroup"
 
     def test_init_with_pid(self):
-        with patch("os.path.exists", return_value=False):
+        with patch("os.path.exists", return_value=False), patch(
+            "builtins.open",
+            new_callable=mock_open,
+            read_data="1:name=systemd:/job_a\n4:cpu,cpuacct:/job_a\n9:memory:/job_b\n",
+        ) as mock_file:
             _id = 123
             cgroup = CGroupMonitor(_id)
             assert cgroup._is_v2 is False
-            assert cgroup._cgroup == f"/proc/{_id}/cgroup"
+            assert cgroup._cgroup == "/sys/fs/cgroup"
+            assert cgroup.cgroup_dir == "/sys/fs/cgroup/cpuacct/job_a"
+            mock_file.assert_called_once_with("/proc/123/cgroup", "r")
+
+    def test_init_with_pid_v1_not_found(self):
+        with patch("os.path.exists", return_value=False), patch(
+            "builtins.open", new_callable=mock_open, read_data="1:name=systemd:/\n"
+        ):
+            with pytest.raises(KeyError):
+                CGroupMonitor(123)
+
+    def test_init_with_pid_v1_files(self, tmp_dir):
+        (tmp_dir / "proc" / "123").mkdir(parents=True)
+        (tmp_dir / "proc" / "123" / "cgroup").write_text(
+            "4:cpu,cpuacct:/job_a\n9:memory:/job_b\n"
+        )
+        (tmp_dir / "cpuacct" / "job_a").mkdir(parents=True)
+        (tmp_dir / "cpuacct" / "job_a" / "cpuacct.usage").write_text("2000\n")
+        (tmp_dir / "cpuacct" / "cpuacct.usage").write_text("9000\n")
+        (tmp_dir / "memory" / "job_b").mkdir(parents=True)
+        (tmp_dir / "memory" / "job_b" / "memory.usage_in_bytes").write_text("4096\n")
+        cgroup = CGroupMonitor(
+            123, cgroup_dir=str(tmp_dir), proc_dir=str(tmp_dir / "proc")
+        )
+        assert cgroup._is_v2 is False
+        assert cgroup.cpu_usage() == 2
+        assert cgroup.memory_usage() == 4096
+
+    def test_init_with_pid_v2(self):
+        with patch("os.path.exists", return_value=True), patch(
+            "builtins.open",
+            new_callable=mock_open,
+            read_data="0::/system.slice/job.scope\n",
+        ) as mock_file:
+            cgroup = CGroupMonitor(123)
+            assert cgroup._is_v2 is True
+            assert cgroup.cgroup_dir == "/sys/fs/cgroup/system.slice/job.scope"
+            mock_file.assert_called_once_with("/proc/123/cgroup", "r")
+
+    def test_init_with_pid_v2_not_found(self):
+        with patch("os.path.exists", return_value=True), patch(
+            "builtins.open", new_callable=mock_open, read_data="1:name=systemd:/\n"
+        ):
+            with pytest.raises(KeyError):
+                CGroupMonitor(123)
+
+    def test_init_with_cgroup_dir(self, tmp_dir):
+        (tmp_dir / "cgroup.controllers").write_text("cpu memory")
+        cgroup = CGroupMonitor(cgroup_dir=str(tmp_dir))
+        assert cgroup._is_v2 is True
+        assert cgroup.cgroup_dir == str(tmp_dir)
 
     def test_get_cgroup_v1(self):
         with patch("os.path.exists", return_value=False):
@@ -290,3 +346,185 @@ class TestCGroupMonitor:
                 result = cgroup.memory_max()
                 assert result == 100
                 mock_method.assert_called_once()
+
+
+@pytest.fixture(scope="function")
+def cgroup_v2_dir(tmp_dir):
+    (tmp_dir / "cgroup.controllers").write_text("cpu io memory")
+    (tmp_dir / "cpu.stat").write_text(
+        "usage_usec 1000\nuser_usec 800\nsystem_usec 200\n"
+        "nr_periods 10\nnr_throttled 2\nthrottled_usec 500\n"
+    )
+    (tmp_dir / "memory.current").write_text("4096\n")
+    (tmp_dir / "memory.max").write_text("max\n")
+    (tmp_dir / "memory.stat").write_text(
+        "anon 1048576\nfile 2097152\nkernel_stack 1024\nslab 1024\nsock 0\n"
+    )
+    (tmp_dir / "io.stat").write_text(
+        "8:0 rbytes=1048576 wbytes=0 rios=10 wios=0 dbytes=0 dios=0\n"
+    )
+    (tmp_dir / "cpu.pressure").write_text(
+        "some avg10=1.50 avg60=0.50 avg300=0.10 total=1000\n"
+        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+    )
+    return tmp_dir
+
+
+@pytest.fixture(scope="function")
+def cgroup_v1_dir(tmp_dir):
+    for controller in ["cpuacct", "cpu", "memory", "blkio"]:
+        (tmp_dir / controller).mkdir()
+    (tmp_dir / "cpuacct" / "cpuacct.usage").write_text("2000000\n")
+    (tmp_dir / "cpuacct" / "cpuacct.stat").write_text("user 10\nsystem 5\n")
+    (tmp_dir / "cpu" / "cpu.stat").write_text(
+        "nr_periods 10\nnr_throttled 3\nthrottled_time 7000\n"
+    )
+    (tmp_dir / "memory" / "memory.usage_in_bytes").write_text("4096\n")
+    (tmp_dir / "memory" / "memory.stat").write_text("cache 2048\nrss 1024\n")
+    (tmp_dir / "blkio" / "blkio.throttle.io_service_bytes").write_text(
+        "8:0 Read 4096\n8:0 Write 1024\n8:0 Total 5120\nTotal 5120\n"
+    )
+    (tmp_dir / "blkio" / "blkio.throttle.io_serviced").write_text(
+        "8:0 Read 4\n8:0 Write 1\n8:0 Total 5\nTotal 5\n"
+    )
+    return tmp_dir
+
+
+class TestCGroupStats:
+    def test_read_nested_keyed_missing(self, tmp_dir):
+        assert CGroupV2(str(tmp_dir))._read_nested_keyed("io.pressure") is None
+        assert CGroupV2(str(tmp_dir))._read_flat_keyed("cpu.stat") == {}
+
+    def test_v2_stats(self, cgroup_v2_dir):
+        cgroup = CGroupMonitor(cgroup_dir=str(cgroup_v2_dir))
+        stats = cgroup.stats()
+        assert stats["cpu"] == {
+            "usage": 1000,
+            "user": 800,
+            "system": 200,
+            "nr_periods": 10,
+            "nr_throttled": 2,
+            "throttled": 500,
+        }
+        assert stats["memory"] == {
+            "usage": 4096,
+            "max": -1,
+            "anon": 1048576,
+            "file": 2097152,
+            "kernel": 2048,
+        }
+        assert stats["io"] == {
+            "8:0": {"rbytes": 1048576, "wbytes": 0, "rios": 10, "wios": 0}
+        }
+        assert stats["pressure"]["cpu"]["some"] == {
+            "avg10": 1.5,
+            "avg60": 0.5,
+            "avg300": 0.1,
+            "total": 1000,
+        }
+        assert stats["pressure"]["memory"] is None
+        assert stats["pressure"]["io"] is None
+
+    def test_v2_stats_with_kernel_entry(self, cgroup_v2_dir):
+        (cgroup_v2_dir / "memory.stat").write_text("anon 1\nfile 2\nkernel 3\n")
+        assert CGroupV2(str(cgroup_v2_dir)).stats()["memory"]["kernel"] == 3
+
+    def test_v2_stats_reads_each_file_once(self, cgroup_v2_dir):
+        cgroup = CGroupV2(str(cgroup_v2_dir))
+        with patch.object(cgroup, "_read_file", wraps=cgroup._read_file) as mock_read:
+            cgroup.stats()
+        files = [c.args[0] for c in mock_read.call_args_list]
+        assert len(files) == len(set(files))
+
+    def test_v1_stats(self, cgroup_v1_dir):
+        with patch("os.sysconf", return_value=100):
+            stats = CGroupV1(str(cgroup_v1_dir)).stats()
+        assert stats["cpu"] == {
+            "usage": 2000,
+            "user": 100000,
+            "system": 50000,
+            "nr_periods": 10,
+            "nr_throttled": 3,
+            "throttled": 7,
+        }
+        assert stats["memory"] == {
+            "usage": 4096,
+            "max": -1,
+            "anon": 1024,
+            "file": 2048,
+            "kernel": None,
+        }
+        assert stats["io"] == {
+            "8:0": {"rbytes": 4096, "wbytes": 1024, "rios": 4, "wios": 1}
+        }
+        assert stats["pressure"] == {"cpu": None, "memory": None, "io": None}
+
+    def test_compose_stats(self, cgroup_v2_dir):
+        cgroup = CGroupMonitor(cgroup_dir=str(cgroup_v2_dir))
+        previous = cgroup.stats()
+        (cgroup_v2_dir / "cpu.stat").write_text(
+            "usage_usec 2000\nnr_periods 20\nnr_throttled 7\nthrottled_usec 2500\n"
+        )
+        (cgroup_v2_dir / "io.stat").write_text(
+            "8:0 rbytes=3145728 wbytes=1048576 rios=30 wios=5\n"
+            "8:16 rbytes=1 wbytes=1 rios=1 wios=1\n"
+        )
+        (cgroup_v2_dir / "cpu.pressure").write_text(
+            "some avg10=2.00 avg60=0.50 avg300=0.10 total=21000\n"
+            "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n"
+        )
+        record = cgroup.compose_stats(previous, cgroup.stats(), 2)
+        assert record == {
+            "throttling": {"periods": 10, "throttled": 5, "throttled_time": 2.0},
+            "memory": {"anon": 1.0, "file": 2.0, "kernel": 0.0},
+            "io": {"8:0": {"read": 1.0, "write": 0.5, "rios": 10.0, "wios": 2.5}},
+            "pressure": {
+                "cpu": {
+                    "some": {"avg10": 2.0, "stall": 1.0},
+                    "full": {"avg10": 0.0, "stall": 0.0},
+                },
+                "memory": None,
+                "io": None,
+            },
+        }
+
+    def test_compose_stats_without_psi(self, cgroup_v2_dir):
+        (cgroup_v2_dir / "cpu.pressure").unlink()
+        cgroup = CGroupMonitor(cgroup_dir=str(cgroup_v2_dir))
+        previous = cgroup.stats()
+        # the pressure file shows up and the cpu.stat file is gone in the next snapshot
+        (cgroup_v2_dir / "cpu.stat").unlink()
+        (cgroup_v2_dir / "cpu.pressure").write_text(
+            "some avg10=2.00 avg60=0.50 avg300=0.10 total=21000\n"
+        )
+        record = cgroup.compose_stats(previous, cgroup.stats(), 2)
+        assert record["throttling"] == {
+            "periods": None,
+            "throttled": None,
+            "throttled_time": None,
+        }
+        assert record["pressure"] == {"cpu": None, "memory": None, "io": None}
+        # a snapshot without any cpu or pressure section
+        del previous["pressure"]
+        previous["cpu"] = None
+        record = cgroup.compose_stats(previous, cgroup.stats(), 2)
+        assert record["throttling"]["periods"] is None
+        assert record["pressure"]["cpu"] is None
+
+    def test_host_metrics_with_cgroup_stats(self, cgroup_v2_dir):
+        from stone_lib.resource.monitor.host_monitor import HostMetrics
+
+        cgroup = CGroupMonitor(cgroup_dir=str(cgroup_v2_dir))
+        with patch(
+            "stone_lib.resource.monitor.host_monitor.CGroupMonitor",
+            return_value=cgroup,
+        ), patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor") as mock_net:
+            mock_net.return_value.rates.return_value = {}
+            metrics = HostMetrics(
+                interval=1, gpu_enable=False, uuid="test", cgroup_stats=True
+            )
+            metrics.record()
+        record = metrics.get_records()[0]
+        assert record["cpu"] == {"utilisation": 0.0}
+        assert record["cgroup"]["throttling"]["throttled"] == 0
+        assert record["cgroup"]["pressure"]["cpu"]["some"]["stall"] == 0.0
@@ -0,0 +1,166 @@
+import json
+
+import numpy as np
+import pytest
+from unittest.mock import patch
+from stone_lib.resource.monitor.columnar import (
+    ColumnarReader,
+    ColumnarWriter,
+    is_columnar,
+    write_records,
+)
+from stone_lib.resource.monitor.host_monitor import HostMetrics
+
+
+def _records(num):
+    _random = np.random.default_rng(0)
+    return [
+        {
+            "timestamp": round(1.7e12 + i * 100.0 + _random.uniform(0, 1), 2),
+            "cpu": {"utilisation": round(float(_random.uniform(0, 100)), 2)},
+            "memory": {"usage": 1024.0 + i % 7, "max": -1},
+            "network": {"eth0": {"rx": 0.0, "tx": round(float(i % 3), 2)}},
+            "interval": 100.0,
+            "gpu": {0: {"name": "A100", "info": {"gpu_utilisation": i % 100}}},
+        }
+        for i in range(num)
+    ]
+
+
+class TestColumnar:
+    @pytest.mark.parametrize("compression", ["raw", "zlib", "bz2", "lzma"])
+    def test_roundtrip(self, tmp_dir, compression):
+        file_path = str(tmp_dir / "records.smc")
+        records = _records(50)
+        write_records(
+            file_path,
+            records,
+            meta={"interval": 100},
+            compression=compression,
+            chunk_size=16,
+        )
+        with ColumnarReader(file_path) as reader:
+            assert len(reader) == 50
+            assert reader.meta == {"interval": 100}
+            assert reader.columns == [
+                "cpu.utilisation",
+                "memory.usage",
+                "memory.max",
+                "network.eth0.rx",
+                "network.eth0.tx",
+                "interval",
+                "gpu.0.info.gpu_utilisation",
+            ]
+            np.testing.assert_allclose(
+                reader.timestamps(), [r["timestamp"] for r in records]
+            )
+            assert reader.column("cpu.utilisation").tolist() == [
+                r["cpu"]["utilisation"] for r in records
+            ]
+
+    def test_missing_values(self, tmp_dir):
+        file_path = str(tmp_dir / "records.smc")
+        write_records(
+            file_path,
+            [
+                {"timestamp": 0, "cpu": {"utilisation": 1.0}},
+                {
+                    "timestamp": 10,
+                    "cpu": {"utilisation": 2.0},
+                    "processes": {"12": 5.0},
+                },
+            ],
+        )
+        with ColumnarReader(file_path) as reader:
+            frame = reader.to_frame()
+        assert frame.index.tolist() == [0.0, 10.0]
+        assert np.isnan(frame["processes.12"].iloc[0])
+        assert frame["processes.12"].iloc[1] == 5.0
+
+    def test_projection(self, tmp_dir):
+        file_path = str(tmp_dir / "records.smc")
+        write_records(file_path, _records(10))
+        with ColumnarReader(file_path) as reader:
+            data = reader.to_numpy(["memory.usage"])
+            with patch.object(reader, "_read", wraps=reader._read) as mock_read:
+                reader.column("memory.usage")
+                assert mock_read.call_count == 1
+        assert list(data) == ["timestamp", "memory.usage"]
+
+    def test_raw_is_memory_mapped(self, tmp_dir):
+        file_path = str(tmp_dir / "records.smc")
+        write_records(file_path, _records(10), compression="raw")
+        with ColumnarReader(file_path) as reader:
+            column = reader.column("cpu.utilisation")
+            assert not column.flags.writeable
+            assert not column.flags.owndata
+            del column
+
+    def test_raw_view_outlives_reader(self, tmp_dir):
+        file_path = str(tmp_dir / "records.smc")
+        write_records(file_path, _records(10), compression="raw")
+        with ColumnarReader(file_path) as reader:
+            column = reader.column("cpu.utilisation")
+        with ColumnarReader(file_path) as reader:
+            expected = reader.column("cpu.utilisation").copy()
+        assert reader._file.closed
+        np.testing.assert_array_equal(column, expected)
+
+    def test_float32(self, tmp_dir):
+        file_path = str(tmp_dir / "records.smc")
+        with ColumnarWriter(file_path, ["a"], dtype="float32", chunk_size=2) as writer:
+            writer.write(np.array([0.0, 1.0, 2.0]), np.array([[1.5], [2.5], [3.5]]))
+        with ColumnarReader(file_path) as reader:
+            assert reader.column("a").dtype == np.float32
+            assert reader.column("a").tolist() == [1.5, 2.5, 3.5]
+
+    def test_empty(self, tmp_dir):
+        file_path = str(tmp_dir / "records.smc")
+        write_records(file_path, [])
+        with ColumnarReader(file_path) as reader:
+            assert len(reader) == 0
+            assert reader.to_frame().empty
+
+    def test_smaller_than_json(self, tmp_dir):
+        records = _records(2000)
+        json_path = tmp_dir / "records.json"
+        json_path.write_text(json.dumps(records, indent=4))
+        file_path = tmp_dir / "records.smc"
+        write_records(str(file_path), records)
+        assert file_path.stat().st_size * 10 < json_path.stat().st_size
+
+    def test_writer_invalid(self, tmp_dir):
+        with pytest.raises(ValueError):
+            ColumnarWriter(str(tmp_dir / "a.smc"), ["a"], compression="zip")
+        with ColumnarWriter(str(tmp_dir / "a.smc"), ["a"]) as writer:
+            with pytest.raises(ValueError):
+                writer.write(np.zeros(1), np.zeros((1, 2)))
+
+    def test_reader_invalid(self, tmp_dir):
+        file_path = tmp_dir / "records.smc"
+        file_path.write_bytes(b"not a columnar file at all, clearly")
+        with pytest.raises(ValueError):
+            ColumnarReader(str(file_path))
+        file_path.write_bytes(b"")
+        with pytest.raises(ValueError):
+            ColumnarReader(str(file_path))
+
+    def test_is_columnar(self):
+        assert is_columnar("/tmp/monitor.smc")
+        assert not is_columnar("/tmp/monitor.json")
+
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_host_metrics_save(self, mock_cg, mock_eth, tmp_dir):
+        metrics = HostMetrics(interval=100, gpu_enable=False, uuid="test")
+        for record in _records(5):
+            metrics.append(record)
+        metrics.save(str(tmp_dir / "monitor.smc"))
+        with ColumnarReader(str(tmp_dir / "monitor.smc")) as reader:
+            assert len(reader) == 5
+            assert reader.meta["num"] == 5
+            assert "overhead" in reader.meta
+        metrics.save(str(tmp_dir / "monitor"), file_format="columnar")
+        ColumnarReader(str(tmp_dir / "monitor")).close()
+        with pytest.raises(ValueError):
+            metrics.save(str(tmp_dir / "monitor"), file_format="csv")
@@ -2,7 +2,13 @@ from unittest.mock import MagicMock, Mock, PropertyMock, mock_open, patch
 
 import pytest
 
-from stone_lib.resource.monitor.ethernet import EthernetMetrics, EthernetMonitor
+import numpy as np
+
+from stone_lib.resource.monitor.ethernet import (
+    EthernetMetrics,
+    EthernetMonitor,
+    counter_delta,
+)
 
 mock_data = """Inter-|   Receive                                                |  Transmit
 face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
@@ -150,13 +156,16 @@ class TestEthernetMonitor:
                             continue
                         mock_class.assert_any_call(line)
 
-    @patch.object(
-        EthernetMonitor,
-        "_get_structured_data",
-        return_value={"lo": MagicMock(), "eth0": MagicMock()},
-    )
-    def test_interfaces(self, mock_get_structured_data, instance):
-        assert instance.interfaces == list(mock_get_structured_data.return_value.keys())
+    def test_interfaces(self, instance, input_data):
+        with patch.object(
+            EthernetMonitor,
+            "_get_raw_data",
+            return_value=input_data.splitlines(keepends=True),
+        ) as mock_raw_data:
+            assert instance.interfaces == ["lo", "eth0"]
+            assert instance.interfaces == ["lo", "eth0"]
+            # the interface set is cached after the first read
+            mock_raw_data.assert_called_once()
 
     @patch.object(
         EthernetMonitor,
@@ -190,8 +199,141 @@ class TestEthernetMonitor:
     )
     def test_to_json(self, mock_get_structured_data, instance):
         assert instance.to_json() == {
-            interface: mock_get_structured_data.return_value[interface].to_json()
-            for interface in instance.interfaces
+            interface: metric.to_json()
+            for interface, metric in mock_get_structured_data.return_value.items()
         }
         mock_get_structured_data.return_value["lo"].to_json.assert_called()
         mock_get_structured_data.return_value["eth0"].to_json.assert_called()
+
+    def test_snapshot(self, instance, input_data):
+        with patch.object(
+            EthernetMonitor,
+            "_get_raw_data",
+            return_value=input_data.splitlines(keepends=True),
+        ):
+            snapshot = instance.snapshot()
+            assert snapshot.interfaces == ("lo", "eth0")
+            assert snapshot.counters.shape == (2, 16)
+            assert snapshot.counters.dtype == np.uint64
+            eth0 = EthernetMetrics(input_data.splitlines()[3])
+            assert snapshot.get("eth0") == {
+                "r_bytes": eth0.r_bytes,
+                "r_packets": eth0.r_packets,
+                "r_errs": eth0.r_errs,
+                "r_drop": eth0.r_drop,
+                "r_fifo": eth0.r_fifo,
+                "r_frame": eth0.r_frame,
+                "r_compressed": eth0.r_compressed,
+                "r_multicast": eth0.r_multicast,
+                "t_bytes": eth0.t_bytes,
+                "t_packets": eth0.t_packets,
+                "t_errs": eth0.t_errs,
+                "t_drop": eth0.t_drop,
+                "t_fifo": eth0.t_fifo,
+                "t_colls": eth0.t_colls,
+                "t_carrier": eth0.t_carrier,
+                "t_compressed": eth0.t_compressed,
+            }
+            # the same interface tuple is reused while the set does not change
+            assert instance.snapshot().interfaces is snapshot.interfaces
+
+    def test_snapshot_invalid(self, instance):
+        with patch.object(
+            EthernetMonitor,
+            "_get_raw_data",
+            return_value=["header\n", "header\n", "eth0: 1 2 3\n"],
+        ):
+            with pytest.raises(ValueError):
+                instance.snapshot()
+
+    def test_snapshot_from_net_dir(self, tmp_dir, input_data):
+        (tmp_dir / "dev").write_text(input_data)
+        monitor = EthernetMonitor(net_dir=str(tmp_dir))
+        assert monitor.snapshot().interfaces == ("lo", "eth0")
+
+    @staticmethod
+    def _snapshot(monitor, interfaces):
+        lines = mock_data.splitlines(keepends=True)[:2]
+        for name, (rx, tx) in interfaces.items():
+            counters = [rx] + [0] * 7 + [tx] + [0] * 7
+            lines.append(f"{name}: {' '.join(str(c) for c in counters)}\n")
+        with patch.object(EthernetMonitor, "_get_raw_data", return_value=lines):
+            return monitor.snapshot()
+
+    def test_rates(self, instance):
+        previous = self._snapshot(instance, {"lo": (0, 0), "eth0": (0, 0)})
+        current = self._snapshot(
+            instance, {"lo": (0, 0), "eth0": (2 * 1024 * 1024, 1024 * 1024)}
+        )
+        assert instance.rates(previous, current, 2) == {
+            "lo": {"rx": 0, "tx": 0},
+            "eth0": {"rx": 1, "tx": 0.5},
+        }
+
+    def test_rates_with_changed_interfaces(self, instance):
+        previous = self._snapshot(instance, {"lo": (1, 1), "eth0": (2, 2)})
+        current = self._snapshot(
+            instance, {"eth0": (2 + 1024 * 1024, 2), "veth1": (5, 5)}
+        )
+        assert instance.rates(previous, current, 1) == {"eth0": {"rx": 1, "tx": 0}}
+
+    def test_filters_and_groups(self):
+        monitor = EthernetMonitor(
+            include=["eth*"],
+            exclude=["lo", "veth9"],
+            groups={"veth": ["veth*"], "calico": ["cali*"]},
+        )
+        interfaces = {
+            "lo": (0, 0),
+            "eth0": (0, 0),
+            "docker0": (0, 0),
+            "veth1": (0, 0),
+            "veth2": (0, 0),
+            "veth9": (0, 0),
+        }
+        previous = self._snapshot(monitor, interfaces)
+        # excluded and not included interfaces are not parsed at all
+        assert previous.interfaces == ("eth0", "veth1", "veth2")
+        assert monitor.interfaces == ["eth0", "veth1", "veth2"]
+        interfaces.update(
+            {"veth1": (1024 * 1024, 0), "veth2": (1024 * 1024, 1024 * 1024)}
+        )
+        current = self._snapshot(monitor, interfaces)
+        assert monitor.rates(previous, current, 1) == {
+            "eth0": {"rx": 0, "tx": 0},
+            "veth": {"rx": 2, "tx": 1},
+            "calico": {"rx": 0, "tx": 0},
+        }
+
+    def test_group_with_hot_plug(self):
+        monitor = EthernetMonitor(groups={"veth": ["veth*"]})
+        previous = self._snapshot(monitor, {"eth0": (0, 0), "veth1": (0, 0)})
+        current = self._snapshot(
+            monitor,
+            {"eth0": (0, 0), "veth1": (1024 * 1024, 0), "veth2": (10**9, 10**9)},
+        )
+        # veth2 appeared during the sample, it has no rate yet
+        assert monitor.rates(previous, current, 1) == {
+            "eth0": {"rx": 0, "tx": 0},
+            "veth": {"rx": 1, "tx": 0},
+        }
+
+    def test_counter_delta(self):
+        _max_32 = (1 << 32) - 1
+        _max_64 = (1 << 64) - 1
+        previous = np.array(
+            [10, _max_32 - 9, _max_64 - 9, 1 << 31, 1 << 40], dtype=np.uint64
+        )
+        current = np.array([20, 10, 10, 5, 7], dtype=np.uint64)
+        assert counter_delta(previous, current).tolist() == [
+            10,  # no wrap
+            20,  # 32-bit wrap
+            20,  # 64-bit wrap
+            5,  # 32-bit reset
+            7,  # 64-bit reset
+        ]
+
+    def test_rates_with_wrapped_counter(self, instance):
+        previous = self._snapshot(instance, {"eth0": ((1 << 32) - 1024 * 1024, 0)})
+        current = self._snapshot(instance, {"eth0": (1024 * 1024, 0)})
+        assert instance.rates(previous, current, 1) == {"eth0": {"rx": 2, "tx": 0}}
@@ -0,0 +1,129 @@
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+from stone_lib.resource.monitor.exporter import (
+    ContentType,
+    MetricsExporter,
+    metric_name,
+)
+from stone_lib.resource.monitor.host_monitor import HostMetrics
+
+
+RECORD = {
+    "timestamp": 1000.0,
+    "interval": 10.0,
+    "cpu": {"utilisation": 50.0},
+    "network": {"eth0": {"rx": 1.5, "tx": 0.5}, "eth1": {"rx": 2.0, "tx": 0.0}},
+    "gpu": {0: {"name": "A100", "info": {"gpu_utilisation": 90}}},
+}
+
+
+@pytest.mark.parametrize(
+    "key, expected",
+    [
+        ("cpu.utilisation", ("stone_cpu_utilisation", {})),
+        ("network.eth0.rx", ("stone_network_rx", {"interface": "eth0"})),
+        (
+            "gpu.0.info.gpu_utilisation",
+            ("stone_gpu_info_gpu_utilisation", {"gpu": "0"}),
+        ),
+        (
+            "processes.1234.gpu.0.1",
+            ("stone_processes_gpu", {"pid": "1234", "gpu": "0", "index": "1"}),
+        ),
+        ("cgroup.io.8:0.read", ("stone_cgroup_io_read", {"device": "8:0"})),
+        ("cpu_stat.cores.3", ("stone_cpu_stat_cores", {"core": "3"})),
+    ],
+)
+def test_metric_name(key, expected):
+    assert metric_name(key) == expected
+
+
+class TestMetricsExporter:
+    def test_update(self):
+        exporter = MetricsExporter()
+        exporter.update(RECORD)
+        assert exporter.body.decode() == "\n".join(
+            [
+                "# TYPE stone_interval gauge",
+                "stone_interval 10.0",
+                "# TYPE stone_cpu_utilisation gauge",
+                "stone_cpu_utilisation 50.0",
+                "# TYPE stone_network_rx gauge",
+                'stone_network_rx{interface="eth0"} 1.5',
+                'stone_network_rx{interface="eth1"} 2.0',
+                "# TYPE stone_network_tx gauge",
+                'stone_network_tx{interface="eth0"} 0.5',
+                'stone_network_tx{interface="eth1"} 0.0',
+                "# TYPE stone_gpu_info_gpu_utilisation gauge",
+                'stone_gpu_info_gpu_utilisation{gpu="0"} 90',
+                "# EOF\n",
+            ]
+        )
+
+    def test_update_reuses_template(self):
+        exporter = MetricsExporter()
+        exporter.update(RECORD)
+        with patch.object(exporter, "_build") as mock_build:
+            exporter.update({**RECORD, "cpu": {"utilisation": 75.0}})
+            mock_build.assert_not_called()
+        assert b"stone_cpu_utilisation 75.0\n" in exporter.body
+
+    def test_update_non_finite_values(self):
+        exporter = MetricsExporter()
+        exporter.update(
+            {
+                "timestamp": 0,
+                "cpu": {"utilisation": float("nan")},
+                "network": {"eth0": {"rx": float("inf"), "tx": float("-inf")}},
+            }
+        )
+        _body = exporter.body.decode()
+        assert "stone_cpu_utilisation NaN\n" in _body
+        assert 'stone_network_rx{interface="eth0"} +Inf\n' in _body
+        assert 'stone_network_tx{interface="eth0"} -Inf\n' in _body
+
+    def test_update_rebuilds_on_new_metrics(self):
+        exporter = MetricsExporter()
+        exporter.update({"timestamp": 0, "cpu": {"utilisation": 1.0}})
+        assert exporter.body == (
+            b"# TYPE stone_cpu_utilisation gauge\nstone_cpu_utilisation 1.0\n# EOF\n"
+        )
+        exporter.update({"timestamp": 0})
+        assert exporter.body == b"# EOF\n"
+
+    def test_serve(self):
+        with MetricsExporter(port=0) as exporter:
+            assert exporter.port > 0
+            exporter(RECORD)
+            with urllib.request.urlopen(exporter.url, timeout=5) as response:
+                assert response.status == 200
+                assert response.headers["Content-Type"] == ContentType
+                assert response.read() == exporter.body
+            with pytest.raises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(
+                    exporter.url.replace("/metrics", "/other"), timeout=5
+                )
+            assert e.value.code == 404
+            with pytest.raises(RuntimeError):
+                exporter.start()
+        with pytest.raises(urllib.error.URLError):
+            urllib.request.urlopen(exporter.url, timeout=5)
+
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_host_metrics(self, mock_cg, mock_eth):
+        metrics = HostMetrics(
+            interval=10,
+            gpu_enable=False,
+            uuid="test",
+            exporter_options={"port": 0},
+        )
+        try:
+            metrics.append({"timestamp": 0, "cpu": {"utilisation": 5.0}})
+            with urllib.request.urlopen(metrics.exporter.url, timeout=5) as response:
+                assert b"stone_cpu_utilisation 5.0\n" in response.read()
+        finally:
+            metrics.close()
@@ -7,7 +7,9 @@ from stone_lib.resource.monitor.host_monitor import (
     _Template,
     threading,
 )
+from stone_lib.resource.monitor.adaptive import AdaptiveInterval
 from stone_lib.resource.monitor.nvml import HostGPUs
+from stone_lib.resource.monitor.rollup import RollupSink
 
 
 class TestHostMetrics:
@@ -27,9 +29,24 @@ class TestHostMetrics:
         assert host_metrics.net == mock_eth.return_value
         assert host_metrics.cgroup == mock_cg.return_value
         mock_cg.assert_called_once()
-        mock_eth.assert_called_once()
+        mock_eth.assert_called_once_with()
         mock_gpu.assert_not_called()
 
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_init_with_net_options(self, mock_cg, mock_eth):
+        options = {"exclude": ["lo"], "groups": {"veth": ["veth*"]}}
+        HostMetrics(interval=10, gpu_enable=False, uuid="test", net_options=options)
+        mock_eth.assert_called_once_with(**options)
+
+    @patch("stone_lib.resource.monitor.nvml.HostGPUs")
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_init_with_gpu_options(self, mock_cg, mock_eth, mock_gpu):
+        options = {"field_values": True, "sample_buffer": True}
+        HostMetrics(interval=10, gpu_enable=True, uuid="test", gpu_options=options)
+        mock_gpu.assert_called_once_with(**options)
+
     @patch("stone_lib.resource.monitor.nvml.HostGPUs")
     @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
     @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
@@ -91,18 +108,10 @@ class TestHostMetrics:
     def test_record(self, mock_time, instance):
         instance.cgroup.cpu_usage.side_effect = [100000, 200000]
 
-        mock_eth_1 = MagicMock()
-        mock_eth_1.r_bytes = 100
-        mock_eth_1.t_bytes = 100
-        mock_eth_2 = MagicMock()
-        mock_eth_2.r_bytes = 200
-        mock_eth_2.t_bytes = 200
-
-        instance.net.interfaces = ["eth0"]
-        instance.net.get_all_interfaces_data.side_effect = [
-            {"eth0": mock_eth_1},
-            {"eth0": mock_eth_2},
-        ]
+        mock_net_1 = MagicMock()
+        mock_net_2 = MagicMock()
+        instance.net.snapshot.side_effect = [mock_net_1, mock_net_2]
+        instance.net.rates.return_value = {"eth0": {"rx": 0, "tx": 0}}
 
         instance.cgroup.memory_max.return_value = -1
         instance.cgroup.memory_usage.return_value = 1024 * 1024
@@ -110,7 +119,12 @@ class TestHostMetrics:
         instance.gpu.to_json.return_value = {"gpu": "test"}
 
         mock_time.time_ns.return_value = 100
+        mock_time.thread_time_ns.return_value = 0
+        mock_time.monotonic_ns.side_effect = [0, 10**7]
         instance.record()
+        instance.net.rates.assert_called_once_with(
+            mock_net_1, mock_net_2, instance.interval
+        )
         assert instance._count == 1
         assert len(instance._records) == 1
         assert instance._records[0] == {
@@ -120,6 +134,7 @@ class TestHostMetrics:
             },
             "memory": {"max": -1, "usage": 1.0},
             "network": {"eth0": {"rx": 0, "tx": 0}},
+            "interval": 10.0,
             "gpu": {"gpu": "test"},
         }
 
@@ -128,24 +143,21 @@ class TestHostMetrics:
         instance.gpu = None
         instance.cgroup.cpu_usage.side_effect = [100000, 200000]
 
-        mock_eth_1 = MagicMock()
-        mock_eth_1.r_bytes = 100
-        mock_eth_1.t_bytes = 100
-        mock_eth_2 = MagicMock()
-        mock_eth_2.r_bytes = 200
-        mock_eth_2.t_bytes = 200
-
-        instance.net.interfaces = ["eth0"]
-        instance.net.get_all_interfaces_data.side_effect = [
-            {"eth0": mock_eth_1},
-            {"eth0": mock_eth_2},
-        ]
+        mock_net_1 = MagicMock()
+        mock_net_2 = MagicMock()
+        instance.net.snapshot.side_effect = [mock_net_1, mock_net_2]
+        instance.net.rates.return_value = {"eth0": {"rx": 0, "tx": 0}}
 
         instance.cgroup.memory_max.return_value = -1
         instance.cgroup.memory_usage.return_value = 1024 * 1024
 
         mock_time.time_ns.return_value = 100
+        mock_time.thread_time_ns.return_value = 0
+        mock_time.monotonic_ns.side_effect = [0, 10**7]
         instance.record()
+        instance.net.rates.assert_called_once_with(
+            mock_net_1, mock_net_2, instance.interval
+        )
         assert instance._count == 1
         assert len(instance._records) == 1
         assert instance._records[0] == {
@@ -155,6 +167,7 @@ class TestHostMetrics:
             },
             "memory": {"max": -1, "usage": 1.0},
             "network": {"eth0": {"rx": 0, "tx": 0}},
+            "interval": 10.0,
             "gpu": {},
         }
 
@@ -163,24 +176,21 @@ class TestHostMetrics:
         instance.gpu = None
         instance.cgroup.cpu_usage.side_effect = [100000, 200000]
 
-        mock_eth_1 = MagicMock()
-        mock_eth_1.r_bytes = 100
-        mock_eth_1.t_bytes = 100
-        mock_eth_2 = MagicMock()
-        mock_eth_2.r_bytes = 200
-        mock_eth_2.t_bytes = 200
-
-        instance.net.interfaces = ["eth0"]
-        instance.net.get_all_interfaces_data.side_effect = [
-            {"eth0": mock_eth_1},
-            {"eth0": mock_eth_2},
-        ]
+        mock_net_1 = MagicMock()
+        mock_net_2 = MagicMock()
+        instance.net.snapshot.side_effect = [mock_net_1, mock_net_2]
+        instance.net.rates.return_value = {"eth0": {"rx": 0, "tx": 0}}
 
         instance.cgroup.memory_max.return_value = 1024 * 1024
         instance.cgroup.memory_usage.return_value = 1024 * 1024
 
         mock_time.time_ns.return_value = 100
+        mock_time.thread_time_ns.return_value = 0
+        mock_time.monotonic_ns.side_effect = [0, 10**7]
         instance.record()
+        instance.net.rates.assert_called_once_with(
+            mock_net_1, mock_net_2, instance.interval
+        )
         assert instance._count == 1
         assert len(instance._records) == 1
         assert instance._records[0] == {
@@ -190,17 +200,112 @@ class TestHostMetrics:
             },
             "memory": {"max": 1.0, "usage": 1.0},
             "network": {"eth0": {"rx": 0, "tx": 0}},
+            "interval": 10.0,
             "gpu": {},
         }
 
     def test_to_json(self, instance):
         instance._records = [{"timestamp": 100}, {"timestamp": 200}]
-        assert instance.to_json() == {
-            "interval": 10,
-            "records": [{"timestamp": 100}, {"timestamp": 200}],
-            "num": 0,
-            "makespan": 100,
-        }
+        with patch.object(
+            instance.stats, "to_json", return_value={"cpu_time": 0.0}
+        ) as mock_stats:
+            assert instance.to_json() == {
+                "interval": 10,
+                "records": [{"timestamp": 100}, {"timestamp": 200}],
+                "num": 0,
+                "makespan": 100,
+                "overhead": {"cpu_time": 0.0},
+                "clock": instance.clock.to_json(),
+            }
+            mock_stats.assert_called_once()
+
+    def test_record_instruments_stages(self, instance):
+        instance.cgroup.cpu_usage.return_value = 0
+        instance.cgroup.memory_max.return_value = -1
+        instance.cgroup.memory_usage.return_value = 0
+        instance.net.rates.return_value = {}
+        instance.gpu.to_json.return_value = {}
+        instance.record()
+        stages = instance.stats.to_json()["stages"]
+        assert stages["cgroup"]["count"] == 2
+        assert stages["network"]["count"] == 2
+        assert stages["gpu"]["count"] == 1
+        assert instance.stats.jitter.count == 1
+        assert instance.stats.cpu_time > 0
+
+    def test_compose_with_cgroup_stats_reuses_memory(self, instance):
+        instance._cgroup_stats = True
+        instance.net.rates.return_value = {}
+        instance.cgroup.compose_stats.return_value = {}
+        _memory = {"usage": 2 * 1024 * 1024, "max": 50 * 1024 * 1024}
+        previous = {"cpu": 0, "network": {}, "cgroup": {"memory": _memory}}
+        current = {"cpu": 1000, "network": {}, "cgroup": {"memory": _memory}}
+        metric = instance.compose(previous, current, 1, gpus={"gpu": {}})
+        assert metric["memory"] == {"usage": 2.0, "max": 50.0}
+        instance.cgroup.memory_usage.assert_not_called()
+        instance.cgroup.memory_max.assert_not_called()
+
+    def test_record_reuses_last_snapshot(self, instance):
+        instance.cgroup.cpu_usage.return_value = 0
+        instance.cgroup.memory_max.return_value = -1
+        instance.cgroup.memory_usage.return_value = 0
+        instance.net.rates.return_value = {}
+        instance.gpu.to_json.return_value = {}
+        with patch.object(
+            instance, "snapshot", wraps=instance.snapshot
+        ) as mock_snapshot, patch.object(
+            instance, "compose", wraps=instance.compose
+        ) as mock_compose:
+            instance.record()
+            instance.record()
+        assert mock_snapshot.call_count == 3
+        assert (
+            mock_compose.call_args_list[1][0][0] is mock_compose.call_args_list[0][0][1]
+        )
+        assert len(instance._records) == 2
+
+    def test_end_sample_backs_off(self, instance):
+        instance.stats.budget = 0.01
+        instance.stats.overhead = 0.5
+        with patch.object(instance.stats, "end_sample", return_value=True):
+            instance.end_sample(instance.interval)
+            assert instance.interval == 20 / 1000
+            instance.interval = HostMetrics.MaxInterval
+            instance.end_sample(instance.interval)
+            assert instance.interval == HostMetrics.MaxInterval / 1000
+
+    def test_end_sample_adaptive(self, instance):
+        instance.adaptive = AdaptiveInterval(min_interval=10, max_interval=40, decay=2)
+        metric = {"cpu": {"utilisation": 10.0}, "gpu": {}}
+        instance.end_sample(instance.interval, metric)
+        assert instance.interval == 10 / 1000
+        instance.end_sample(instance.interval, metric)
+        assert instance.interval == 20 / 1000
+        instance.end_sample(instance.interval, {"cpu": {"utilisation": 90.0}})
+        assert instance.interval == 10 / 1000
+
+    def test_back_off_raises_adaptive_floor(self, instance):
+        instance.adaptive = AdaptiveInterval(min_interval=10, max_interval=1000)
+        instance.stats.overhead = 0.5
+        with patch.object(instance.stats, "end_sample", return_value=True):
+            instance.end_sample(instance.interval, {"cpu": {"utilisation": 0.0}})
+        assert instance.adaptive.min_interval == 20
+        assert instance.interval == 20 / 1000
+
+    def test_append_rollups(self, instance):
+        instance.rollup = RollupSink(windows=[1000])
+        instance._records = []
+        instance.append({"timestamp": 100, "cpu": {"utilisation": 10.0}})
+        instance.append({"timestamp": 200, "cpu": {"utilisation": 30.0}})
+        rollups = instance.to_json()["rollups"]
+        assert rollups["1000"][0]["count"] == 2
+        assert rollups["1000"][0]["metrics"]["cpu.utilisation"]["mean"] == 20.0
+
+    def test_end_sample_within_budget(self, instance):
+        instance.stats.budget = 0.5
+        for _ in range(20):
+            instance.end_sample(instance.interval)
+        assert instance.interval == 10 / 1000
 
     @patch.object(HostMetrics, "to_json", return_value={"test": "test"})
     @patch("builtins.open", new_callable=mock_open)
@@ -210,6 +315,27 @@ class TestHostMetrics:
         mock_file.assert_called_once_with("test", "w")
 
 
+class TestTemplate:
+    @patch("stone_lib.resource.monitor.host_monitor.HostMetrics")
+    def test_monitor_passes_metrics_options(self, mock_metrics):
+        signal = threading.Event()
+        signal.set()
+        _Template.monitor(
+            10,
+            False,
+            uuid="test",
+            signal=signal,
+            dir="/tmp",
+            file_name="test",
+            cgroup_stats=True,
+        )
+        mock_metrics.assert_called_once_with(
+            interval=10, gpu_enable=False, uuid="test", cgroup_stats=True
+        )
+        mock_metrics.return_value.close.assert_called_once()
+        mock_metrics.return_value.save.assert_called_once_with("/tmp/test")
+
+
 class TestMonitorThreading:
     def test_init(self):
         monitor = MonitorThreading()
@@ -296,6 +422,14 @@ class TestHostMonitor:
         mock_monitor_thread.return_value.run.assert_called_once_with(**kwargs)
         assert monitor._thread == {"test": mock_monitor_thread.return_value}
 
+    @patch("stone_lib.resource.monitor.host_monitor.MonitorThreading")
+    def test_start_new_monitor_with_metrics_options(self, mock_monitor_thread):
+        monitor = HostMonitor(cgroup_stats=True, overhead_budget=0.01)
+        monitor.start_new_monitor("test", "test", "test")
+        kwargs = mock_monitor_thread.return_value.run.call_args.kwargs
+        assert kwargs["cgroup_stats"] is True
+        assert kwargs["overhead_budget"] == 0.01
+
     def test_stop_monitor(self):
         monitor = HostMonitor()
         mock_class = MagicMock()
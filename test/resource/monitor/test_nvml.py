@@ -156,9 +156,9 @@ class TestGPUMetric:
         )
 
     @patch.object(GPUMetric, "_call_nvml")
-    def test_get_running_processes_with_mode_3(self, mock_call_nvml, instance):
+    def test_get_running_processes_with_mode_2(self, mock_call_nvml, instance):
         mock_call_nvml.return_value = "mock_result"
-        assert instance.get_running_processes(3) == "mock_result"
+        assert instance.get_running_processes(2) == "mock_result"
         mock_call_nvml.assert_called_once_with(
             "nvmlDeviceGetMPSComputeRunningProcesses_v3"
         )
@@ -166,7 +166,7 @@ class TestGPUMetric:
     @patch.object(GPUMetric, "_call_nvml")
     def test_get_running_processes_with_invalid_mode(self, mock_call_nvml, instance):
         with pytest.raises(ValueError):
-            instance.get_running_processes(2)
+            instance.get_running_processes(3)
 
     @patch.object(GPUMetric, "_call_nvml")
     def test_get_clock_info(self, mock_call_nvml, instance):
@@ -257,31 +257,36 @@ class TestGPUMetric:
 
     @patch.object(GPUMetric, "get_temperature")
     @patch.object(GPUMetric, "get_fan_speed")
-    @patch.object(GPUMetric, "get_gpu_utilisation")
-    @patch.object(GPUMetric, "get_memory_utilisation")
+    @patch.object(GPUMetric, "get_utilisation")
     def test_get_info(
         self,
-        mock_get_memory_utilisation,
-        mock_get_gpu_utilisation,
+        mock_get_utilisation,
         mock_get_fan_speed,
         mock_get_temperature,
         instance,
     ):
-        mock_get_memory_utilisation.return_value = "mock_memory_utilisation"
-        mock_get_gpu_utilisation.return_value = "mock_gpu_utilisation"
+        mock_get_utilisation.return_value = {
+            "gpu": "mock_gpu_utilisation",
+            "memory": "mock_memory_utilisation",
+        }
         mock_get_fan_speed.return_value = "mock_fan_speed"
         mock_get_temperature.return_value = "mock_temperature"
         assert instance.get_info() == {
             "temperature": mock_get_temperature.return_value,
             "fan_speed": mock_get_fan_speed.return_value,
-            "gpu_utilisation": mock_get_gpu_utilisation.return_value,
-            "memory_utilisation": mock_get_memory_utilisation.return_value,
+            "gpu_utilisation": "mock_gpu_utilisation",
+            "memory_utilisation": "mock_memory_utilisation",
         }
-        mock_get_memory_utilisation.assert_called_once()
-        mock_get_gpu_utilisation.assert_called_once()
+        mock_get_utilisation.assert_called_once()
         mock_get_fan_speed.assert_called_once()
         mock_get_temperature.assert_called_once()
 
+    @patch.object(GPUMetric, "_call_nvml")
+    def test_get_utilisation(self, mock_call_nvml, instance):
+        mock_call_nvml.return_value = MagicMock(gpu=10, memory=20)
+        assert instance.get_utilisation() == {"gpu": 10, "memory": 20}
+        mock_call_nvml.assert_called_once_with("nvmlDeviceGetUtilizationRates")
+
     @patch.object(GPUMetric, "get_graphics_clock")
     @patch.object(GPUMetric, "get_memory_clock")
     @patch.object(GPUMetric, "get_sm_clock")
@@ -305,21 +310,23 @@ class TestGPUMetric:
         mock_get_sm_clock.assert_called_once()
 
     @patch.object(GPUMetric, "get_power_usage")
-    @patch.object(GPUMetric, "get_power_limit")
+    @patch.object(GPUMetric, "static_info", new_callable=PropertyMock)
     @patch.object(GPUMetric, "get_power_state")
     def test_get_power_info(
-        self, mock_get_power_state, mock_get_power_limit, mock_get_power_usage, instance
+        self, mock_get_power_state, mock_static_info, mock_get_power_usage, instance
     ):
         mock_get_power_state.return_value = "mock_power_state"
-        mock_get_power_limit.return_value = "mock_power_limit"
+        mock_static_info.return_value = {"power_limit": "mock_power_limit"}
         mock_get_power_usage.return_value = "mock_power_usage"
         assert instance.get_power_info() == {
             "usage": mock_get_power_usage.return_value,
-            "limit": mock_get_power_limit.return_value,
+            "limit": "mock_power_limit",
             "state": mock_get_power_state.return_value,
         }
         mock_get_power_state.assert_called_once()
-        mock_get_power_limit.assert_called_once()
+        mock_get_power_usage.assert_called_once()
+        # the power average of the field values replaces the usage call
+        assert instance.get_power_info({"power_average": 100})["usage"] == 100
         mock_get_power_usage.assert_called_once()
 
     @patch.object(GPUMetric, "_call_nvml")
@@ -345,6 +352,7 @@ class TestGPUMetric:
         mock_call_nvml.assert_called_once_with("nvmlDeviceGetPciInfo")
 
     @patch.object(GPUMetric, "get_info")
+    @patch.object(GPUMetric, "get_power_limit")
     @patch.object(GPUMetric, "get_pci_info")
     @patch.object(GPUMetric, "get_memory_info")
     @patch.object(GPUMetric, "get_power_info")
@@ -361,6 +369,7 @@ class TestGPUMetric:
         mock_get_power_info,
         mock_get_memory_info,
         mock_get_pci_info,
+        mock_get_power_limit,
         mock_get_info,
         instance,
     ):
@@ -441,3 +450,82 @@ class TestHostGPUs:
             instance, "_gpus", new_callable=PropertyMock(return_value=_data)
         ) as mock_p_gpus:
             assert instance.to_json() == {0: "mock_result_0", 1: "mock_result_1"}
+
+
+class TestHostGPUsWithFakeNVML:
+    def test_static_info_cached_at_init(self, fake_nvml):
+        host = HostGPUs()
+        static_calls = [
+            c for c in fake_nvml.calls if c[0] in ("name", "uuid", "arch", "pci")
+        ]
+        assert len(static_calls) == 2 * 4
+        fake_nvml.calls.clear()
+        host.to_json()
+        host.to_json()
+        assert not [
+            c for c in fake_nvml.calls if c[0] in ("name", "uuid", "arch", "pci")
+        ]
+
+    def test_calls_per_sample(self, fake_nvml):
+        host = HostGPUs()
+        fake_nvml.calls.clear()
+        data = host.to_json()
+        # temperature, fan, utilisation, memory, power usage and state, 3 x clock
+        assert len(fake_nvml.calls) == 2 * 9
+        assert "power_limit" not in [c[0] for c in fake_nvml.calls]
+        assert [c[0] for c in fake_nvml.calls].count("utilisation") == 2
+        assert data[0]["name"] == "GPU-0"
+        assert data[1]["pci_info"]["bus"] == 1
+        assert data[0]["info"]["gpu_utilisation"] == 50
+        assert data[0]["info"]["memory_utilisation"] == 25
+        assert "fields" not in data[0]
+
+    def test_field_values(self, fake_nvml):
+        host = HostGPUs(field_values=True)
+        fake_nvml.calls.clear()
+        data = host.to_json()
+        _calls = [c[0] for c in fake_nvml.calls]
+        assert _calls.count("field_values") == 2
+        assert data[1]["fields"] == {
+            "energy": 831,
+            "memory_temperature": 821,
+            "power_average": 1851,
+        }
+        # the power usage comes with the field values
+        assert "power_usage" not in _calls
+        assert len(_calls) == 2 * 9
+        assert data[1]["power"]["usage"] == 1851
+
+    def test_field_values_with_custom_ids(self, fake_nvml):
+        host = HostGPUs(field_values=True, field_ids={"custom": 1})
+        data = host.to_json()
+        assert data[0]["fields"] == {"custom": 10}
+        # without the power average the usage is read on its own
+        assert data[0]["power"]["usage"] == 100000
+
+    def test_sample_buffer(self, fake_nvml, nvml_struct):
+        _samples = fake_nvml.state["samples"][0]
+        _samples[fake_nvml.NVML_GPU_UTILIZATION_SAMPLES] = [
+            nvml_struct(timeStamp=t, sampleValue=nvml_struct(uiVal=v))
+            for t, v in [(1, 10), (2, 20), (3, 60)]
+        ]
+        _samples[fake_nvml.NVML_MEMORY_UTILIZATION_SAMPLES] = [
+            nvml_struct(timeStamp=t, sampleValue=nvml_struct(uiVal=v))
+            for t, v in [(1, 5), (3, 15)]
+        ]
+        host = HostGPUs(sample_buffer=True)
+        gpu = host.gpus[0]
+        assert gpu.get_utilisation() == {"gpu": 30, "memory": 10}
+        # no new sample since the previous call, fall back to the utilisation rates
+        assert gpu.get_utilisation() == {"gpu": 50, "memory": 25}
+        # the GPU without samples always falls back
+        assert host.gpus[1].get_utilisation() == {"gpu": 50, "memory": 25}
+
+    def test_sample_buffer_unknown_value_type(self, fake_nvml, nvml_struct):
+        fake_nvml.state["sample_value_type"] = 99
+        fake_nvml.state["samples"][0][fake_nvml.NVML_GPU_UTILIZATION_SAMPLES] = [
+            nvml_struct(timeStamp=1, sampleValue=nvml_struct(uiVal=10))
+        ]
+        host = HostGPUs(sample_buffer=True)
+        # samples of an unknown type are skipped, the utilisation rates are used instead
+        assert host.gpus[0].get_utilisation() == {"gpu": 50, "memory": 25}
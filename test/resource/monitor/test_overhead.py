@@ -0,0 +1,83 @@
+from unittest.mock import patch
+from stone_lib.resource.monitor.overhead import LatencyHistogram, SamplerStats
+
+
+class TestLatencyHistogram:
+    def test_observe(self):
+        histogram = LatencyHistogram()
+        for duration in [500, 1500, 3000, 3500, 100000]:
+            histogram.observe(duration)
+        assert histogram.count == 5
+        assert histogram.max == 100000
+        assert histogram.counts[0] == 1  # below 1 µs
+        assert histogram.counts[1] == 1  # [1, 2) µs
+        assert histogram.counts[2] == 2  # [2, 4) µs
+        assert histogram.counts[7] == 1  # [64, 128) µs
+
+    def test_observe_overflow(self):
+        histogram = LatencyHistogram()
+        histogram.observe(10**15)
+        assert histogram.counts[-1] == 1
+
+    def test_percentile(self):
+        histogram = LatencyHistogram()
+        assert histogram.percentile(50) is None
+        for _ in range(95):
+            histogram.observe(3000)
+        for _ in range(5):
+            histogram.observe(100000)
+        assert histogram.percentile(50) == 4
+        assert histogram.percentile(95) == 4
+        assert histogram.percentile(99) == 128
+
+    def test_to_json(self):
+        histogram = LatencyHistogram()
+        histogram.observe(3000)
+        histogram.observe(5000)
+        assert histogram.to_json() == {
+            "count": 2,
+            "mean": 4.0,
+            "max": 5.0,
+            "p50": 4,
+            "p95": 8,
+            "p99": 8,
+            "buckets": {"4": 1, "8": 1},
+        }
+
+
+class TestSamplerStats:
+    def test_timer(self):
+        stats = SamplerStats()
+        with patch(
+            "stone_lib.resource.monitor.overhead.time.perf_counter_ns",
+            side_effect=[1000, 4000],
+        ):
+            with stats.timer("cgroup"):
+                pass
+        assert stats.stages["cgroup"].count == 1
+        assert stats.stages["cgroup"].total == 3000
+        assert stats.timer("cgroup") is stats.timer("cgroup")
+
+    def test_end_sample(self):
+        stats = SamplerStats(budget=0.01, smoothing=0.5)
+        stats.add_cpu_time(2 * 10**6)
+        # 2 ms of cpu in a sample of 100 ms, 10 ms late
+        assert stats.end_sample(0.1, 0.09) is False
+        assert stats.cpu_time == 2 * 10**6
+        assert round(stats.overhead, 6) == 0.02
+        assert stats.jitter.max == 10**7
+        stats.add_cpu_time(2 * 10**6)
+        assert stats.end_sample(0.1, 0.1) is True
+
+    def test_end_sample_without_budget(self):
+        stats = SamplerStats(smoothing=1)
+        stats.add_cpu_time(10**9)
+        assert stats.end_sample(0.1, 0.1) is False
+
+    def test_reset_overhead(self):
+        stats = SamplerStats(budget=0.01, smoothing=1)
+        stats.add_cpu_time(10**9)
+        stats.end_sample(0.1, 0.1)
+        stats.reset_overhead()
+        assert stats.overhead is None
+        assert stats.to_json()["overhead"] is None
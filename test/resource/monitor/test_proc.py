@@ -0,0 +1,328 @@
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+from stone_lib.resource.monitor.host_monitor import HostMetrics
+from stone_lib.resource.monitor.proc import (
+    CpuStatMonitor,
+    DiskStatsMonitor,
+    LoadAvgMonitor,
+    MemInfoMonitor,
+    ThreadCpuMonitor,
+    VmStatMonitor,
+    _CollectorAbc,
+    default_collectors,
+)
+
+
+def _write(proc_dir, file_name, content):
+    (proc_dir / file_name).write_text(content)
+
+
+def _stat(cpu0, cpu1, ctxt, procs_running=2):
+    _total = [a + b for a, b in zip(cpu0, cpu1)]
+    _line = lambda name, values: f"{name} {' '.join(str(v) for v in values)} 0 0"
+    return "\n".join(
+        [
+            _line("cpu ", _total),
+            _line("cpu0", cpu0),
+            _line("cpu1", cpu1),
+            "intr 1000 1 2 3",
+            f"ctxt {ctxt}",
+            "btime 1700000000",
+            "processes 500",
+            f"procs_running {procs_running}",
+            "procs_blocked 1",
+            "softirq 10 1 2 3",
+        ]
+    )
+
+
+def _diskstats(sda, loop0=(1,) * 11):
+    _line = lambda major, minor, name, values: (
+        f"{major:>4} {minor:>7} {name} {' '.join(str(v) for v in values)} 0 0 0 0"
+    )
+    return "\n".join([_line(7, 0, "loop0", loop0), _line(8, 0, "sda", sda)])
+
+
+@pytest.fixture(scope="function")
+def proc_dir(tmp_dir):
+    return tmp_dir
+
+
+class TestCollectorAbc:
+    def test_init(self):
+        with pytest.raises(TypeError):
+            _CollectorAbc()
+
+
+class TestCpuStatMonitor:
+    def test_snapshot(self, proc_dir):
+        _write(proc_dir, "stat", _stat([1, 2, 3, 4, 5, 6, 7, 8], [8] * 8, 300))
+        cpus, misc = CpuStatMonitor(str(proc_dir)).snapshot()
+        assert cpus.shape == (3, 8)
+        assert cpus[0].tolist() == [9, 10, 11, 12, 13, 14, 15, 16]
+        assert cpus[1].tolist() == [1, 2, 3, 4, 5, 6, 7, 8]
+        assert misc.tolist() == [300, 1000, 2, 1]
+
+    def test_compose(self, proc_dir):
+        monitor = CpuStatMonitor(str(proc_dir))
+        _write(proc_dir, "stat", _stat([0] * 8, [0] * 8, 100))
+        previous = monitor.snapshot()
+        # cpu0: 75 busy and 25 idle, cpu1: 10 iowait and 90 idle
+        _write(
+            proc_dir,
+            "stat",
+            _stat([50, 0, 25, 25, 0, 0, 0, 0], [0, 0, 0, 90, 10, 0, 0, 0], 300, 4),
+        )
+        current = monitor.snapshot()
+        assert monitor.compose(previous, current, 2) == {
+            "utilisation": 37.5,
+            "iowait": 5.0,
+            "steal": 0.0,
+            "cores": [75.0, 0.0],
+            "context_switches": 100.0,
+            "interrupts": 0.0,
+            "procs_running": 4,
+            "procs_blocked": 1,
+        }
+
+    def test_compose_iowait_decrease(self, proc_dir):
+        monitor = CpuStatMonitor(str(proc_dir))
+        _write(proc_dir, "stat", _stat([0, 0, 0, 0, 1000, 0, 0, 0], [0] * 8, 100))
+        previous = monitor.snapshot()
+        # the iowait of cpu0 goes backwards, it must not read as a wrapped counter
+        _write(
+            proc_dir,
+            "stat",
+            _stat([50, 0, 0, 50, 990, 0, 0, 0], [0, 0, 0, 100, 0, 0, 0, 0], 100),
+        )
+        current = monitor.snapshot()
+        record = monitor.compose(previous, current, 1)
+        assert record["cores"] == [50.0, 0.0]
+        assert record["utilisation"] == 25.0
+        assert record["iowait"] == 0.0
+
+    def test_compose_cpu_hotplug(self, proc_dir):
+        monitor = CpuStatMonitor(str(proc_dir))
+        _write(proc_dir, "stat", _stat([0] * 8, [0] * 8, 100))
+        previous = monitor.snapshot()
+        _write(proc_dir, "stat", "cpu  1 1 1 1 1 1 1 1\n" + _stat([1] * 8, [1] * 8, 1))
+        current = monitor.snapshot()
+        assert monitor.compose(previous, current, 1) == {}
+
+
+class TestMemInfoMonitor:
+    def test_snapshot_and_compose(self, proc_dir):
+        _write(
+            proc_dir,
+            "meminfo",
+            "MemTotal:        2048 kB\nMemFree:    1024 kB\nHugePages_Total:   0\n"
+            "MemAvailable:    1536 kB\n",
+        )
+        monitor = MemInfoMonitor(str(proc_dir))
+        snapshot = monitor.snapshot()
+        assert monitor.keys == ("MemTotal", "MemFree", "MemAvailable")
+        assert snapshot.tolist() == [2048, 1024, 1536]
+        assert monitor.compose(None, snapshot, 1) == {
+            "MemTotal": 2.0,
+            "MemFree": 1.0,
+            "MemAvailable": 1.5,
+        }
+
+    def test_layout_is_reused(self, proc_dir):
+        monitor = MemInfoMonitor(str(proc_dir))
+        _write(proc_dir, "meminfo", "MemTotal: 2048 kB\nMemFree: 1024 kB\n")
+        monitor.snapshot()
+        _write(proc_dir, "meminfo", "MemTotal: 2048 kB\nMemFree: 512 kB\n")
+        with patch.object(monitor, "_layout") as mock_layout:
+            assert monitor.snapshot().tolist() == [2048, 512]
+            mock_layout.assert_not_called()
+
+
+class TestVmStatMonitor:
+    def test_compose(self, proc_dir):
+        monitor = VmStatMonitor(str(proc_dir))
+        _write(proc_dir, "vmstat", "nr_free_pages 10\npgfault 100\npgmajfault 4\n")
+        previous = monitor.snapshot()
+        _write(proc_dir, "vmstat", "nr_free_pages 20\npgfault 300\npgmajfault 6\n")
+        current = monitor.snapshot()
+        assert monitor.compose(previous, current, 2) == {
+            "pgfault": 100.0,
+            "pgmajfault": 1.0,
+        }
+
+
+class TestLoadAvgMonitor:
+    def test_snapshot_and_compose(self, proc_dir):
+        _write(proc_dir, "loadavg", "0.50 0.40 0.30 3/250 12345\n")
+        monitor = LoadAvgMonitor(str(proc_dir))
+        assert monitor.compose(None, monitor.snapshot(), 1) == {
+            "load1": 0.5,
+            "load5": 0.4,
+            "load15": 0.3,
+            "running": 3,
+            "threads": 250,
+        }
+
+
+class TestDiskStatsMonitor:
+    def test_snapshot_excludes_loop(self, proc_dir):
+        _write(proc_dir, "diskstats", _diskstats(range(11)))
+        devices, counters = DiskStatsMonitor(str(proc_dir)).snapshot()
+        assert devices == ("sda",)
+        assert counters.tolist() == [list(range(11))]
+
+    def test_snapshot_include(self, proc_dir):
+        _write(proc_dir, "diskstats", _diskstats(range(11)))
+        devices, _ = DiskStatsMonitor(
+            str(proc_dir), include=["loop*"], exclude=[]
+        ).snapshot()
+        assert devices == ("loop0",)
+
+    def test_compose(self, proc_dir):
+        monitor = DiskStatsMonitor(str(proc_dir))
+        _write(proc_dir, "diskstats", _diskstats([0] * 11))
+        previous = monitor.snapshot()
+        # 20 reads of 2048 sectors taking 40 ms, 10 writes of 2048 sectors taking 50 ms
+        _write(
+            proc_dir,
+            "diskstats",
+            _diskstats([20, 0, 40960, 40, 10, 0, 20480, 50, 1, 500, 900]),
+        )
+        current = monitor.snapshot()
+        assert monitor.compose(previous, current, 2) == {
+            "sda": {
+                "rios": 10.0,
+                "wios": 5.0,
+                "read": 10.0,
+                "write": 5.0,
+                "r_await": 2.0,
+                "w_await": 5.0,
+                "queue": 0.45,
+                "utilisation": 25.0,
+            }
+        }
+
+    def test_compose_hotplug(self, proc_dir):
+        monitor = DiskStatsMonitor(str(proc_dir))
+        _write(proc_dir, "diskstats", _diskstats([0] * 11))
+        previous = monitor.snapshot()
+        _write(
+            proc_dir,
+            "diskstats",
+            _diskstats([2] + [0] * 10) + "\n   8      16 sdb " + "1 " * 15,
+        )
+        current = monitor.snapshot()
+        assert list(monitor.compose(previous, current, 1)) == ["sda"]
+        assert monitor.compose(previous, current, 1)["sda"]["rios"] == 2.0
+
+
+def _task_stat(tid, name, utime, stime, num_threads=1):
+    _fields = ["S"] + ["0"] * 10 + [str(utime), str(stime)] + ["0"] * 4
+    _fields += [str(num_threads)] + ["0"] * 10
+    return f"{tid} ({name}) {' '.join(_fields)}"
+
+
+def _threads(proc_dir, pid, threads):
+    _task_dir = proc_dir / str(pid) / "task"
+    _task_dir.mkdir(parents=True, exist_ok=True)
+    for tid, (name, utime, stime) in threads.items():
+        (_task_dir / str(tid)).mkdir(exist_ok=True)
+        (_task_dir / str(tid) / "stat").write_text(_task_stat(tid, name, utime, stime))
+    (proc_dir / str(pid) / "stat").write_text(
+        _task_stat(pid, "python", 0, 0, num_threads=len(threads))
+    )
+
+
+class TestThreadCpuMonitor:
+    @pytest.fixture(scope="function")
+    def monitor(self, proc_dir):
+        with patch("os.sysconf", return_value=100):
+            _monitor = ThreadCpuMonitor(100, proc_dir=str(proc_dir))
+        yield _monitor
+        _monitor.close()
+
+    def test_snapshot(self, monitor, proc_dir):
+        _threads(proc_dir, 100, {100: ("python", 5, 1), 101: ("pt worker (1)", 7, 2)})
+        tids, names, times = monitor.snapshot()
+        assert tids == (100, 101)
+        assert names == ("python", "pt worker (1)")
+        assert times.tolist() == [[5, 1], [7, 2]]
+
+    def test_snapshot_reuses_handles(self, monitor, proc_dir):
+        _threads(proc_dir, 100, {100: ("python", 5, 1)})
+        monitor.snapshot()
+        _threads(proc_dir, 100, {100: ("python", 6, 1)})
+        with patch.object(monitor, "_scan") as mock_scan:
+            assert monitor.snapshot()[2].tolist() == [[6, 1]]
+            mock_scan.assert_not_called()
+
+    def test_snapshot_rescans_new_threads(self, monitor, proc_dir):
+        _threads(proc_dir, 100, {100: ("python", 5, 1)})
+        monitor.snapshot()
+        _threads(proc_dir, 100, {100: ("python", 5, 1), 102: ("nccl", 1, 1)})
+        assert monitor.snapshot()[0] == (100, 102)
+
+    def test_snapshot_rescans_exited_threads(self, monitor, proc_dir):
+        _threads(proc_dir, 100, {100: ("python", 5, 1)})
+        monitor.snapshot()
+        _pread = os.pread
+        with patch(
+            "stone_lib.resource.monitor.proc.os.pread",
+            side_effect=[_pread(monitor._stat_fd, 1024, 0), ProcessLookupError()]
+            + [_pread(monitor._fds[0], 1024, 0)],
+        ), patch.object(monitor, "_scan") as mock_scan:
+            assert monitor.snapshot()[0] == (100,)
+            mock_scan.assert_called_once()
+
+    def test_snapshot_process_exited(self, monitor):
+        tids, names, times = monitor.snapshot()
+        assert tids == () and names == ()
+        assert times.shape == (0, 2)
+
+    def test_compose(self, monitor, proc_dir):
+        _threads(proc_dir, 100, {100: ("python", 0, 0), 101: ("loader", 10, 0)})
+        previous = monitor.snapshot()
+        _threads(
+            proc_dir,
+            100,
+            {100: ("python", 10, 5), 101: ("loader", 190, 10), 102: ("nccl", 20, 0)},
+        )
+        current = monitor.snapshot()
+        assert monitor.compose(previous, current, 2) == {
+            "100": {"name": "python", "user": 5.0, "system": 2.5},
+            "101": {"name": "loader", "user": 90.0, "system": 5.0},
+            "102": {"name": "nccl", "user": 10.0, "system": 0.0},
+        }
+        monitor.top = 1
+        assert list(monitor.compose(previous, current, 2)) == ["101"]
+
+
+class TestHostMetricsCollectors:
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_record(self, mock_cg, mock_eth, proc_dir):
+        _write(proc_dir, "loadavg", "0.50 0.40 0.30 3/250 12345\n")
+        mock_cg.return_value.cpu_usage.return_value = 0
+        mock_cg.return_value.memory_max.return_value = -1
+        mock_cg.return_value.memory_usage.return_value = 0
+        mock_eth.return_value.rates.return_value = {}
+        collector = MagicMock(wraps=LoadAvgMonitor(str(proc_dir)))
+        collector.name = "loadavg"
+        metrics = HostMetrics(
+            interval=1, gpu_enable=False, uuid="test", collectors=[collector]
+        )
+        metrics.record()
+        assert collector.snapshot.call_count == 2
+        assert metrics.get_records()[0]["loadavg"]["running"] == 3
+
+    def test_default_collectors(self, proc_dir):
+        collectors = default_collectors(str(proc_dir))
+        assert [c.name for c in collectors] == [
+            "cpu_stat",
+            "meminfo",
+            "loadavg",
+            "vmstat",
+            "diskstats",
+        ]
+        assert all(c.proc_dir == str(proc_dir) for c in collectors)
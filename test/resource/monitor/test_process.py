@@ -0,0 +1,197 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from stone_lib.resource.monitor.host_monitor import HostMetrics
+from stone_lib.resource.monitor.nvml import HostGPUs
+from stone_lib.resource.monitor.process import GPUProcessMonitor
+
+
+@pytest.fixture(scope="function")
+def fake_host(tmp_dir):
+    """A fake /proc and cgroup v2 tree with two processes in two cgroups"""
+    proc_dir = tmp_dir / "proc"
+    cgroup_dir = tmp_dir / "cgroup"
+    cgroup_dir.mkdir()
+    (cgroup_dir / "cgroup.controllers").write_text("cpu memory io")
+    for pid, job in [(100, "job_a"), (200, "job_b")]:
+        (proc_dir / str(pid)).mkdir(parents=True)
+        (proc_dir / str(pid) / "cgroup").write_text(f"0::/{job}\n")
+        (cgroup_dir / job).mkdir()
+        (cgroup_dir / job / "cpu.stat").write_text(
+            "usage_usec 1000000\nuser_usec 800000\nsystem_usec 200000\n"
+        )
+        (cgroup_dir / job / "memory.current").write_text(str(1024 * 1024 * 10))
+    return proc_dir, cgroup_dir
+
+
+def _set_processes(fake_nvml, nvml_struct, gpu, processes, utilisation):
+    fake_nvml.state["processes"][gpu] = [
+        nvml_struct(pid=pid, usedGpuMemory=memory) for pid, memory in processes
+    ]
+    fake_nvml.state["process_utilisation"][gpu] = [
+        nvml_struct(pid=pid, timeStamp=ts, smUtil=sm, memUtil=mem)
+        for pid, ts, sm, mem in utilisation
+    ]
+
+
+class TestHostGPUsProcesses:
+    def test_get_processes(self, fake_nvml, nvml_struct):
+        _set_processes(
+            fake_nvml,
+            nvml_struct,
+            0,
+            [(100, 1024), (200, 2048)],
+            [(100, 1, 40, 10), (100, 2, 60, 30), (200, 2, 20, 5)],
+        )
+        _set_processes(fake_nvml, nvml_struct, 1, [(100, 512)], [])
+        gpus = HostGPUs()
+        assert gpus.get_processes() == {
+            100: {
+                0: {"memory": 1024, "sm": 50.0, "memory_utilisation": 20.0},
+                1: {"memory": 512, "sm": 0.0, "memory_utilisation": 0.0},
+            },
+            200: {0: {"memory": 2048, "sm": 20.0, "memory_utilisation": 5.0}},
+        }
+        # utilisation samples already seen are not counted twice
+        assert gpus.gpus[0].get_process_utilisation() == {}
+
+    def test_get_processes_of_every_kind(self, fake_nvml, nvml_struct):
+        _set_processes(fake_nvml, nvml_struct, 0, [(100, 1024), (300, None)], [])
+        fake_nvml.state["mps_processes"][0] = [
+            nvml_struct(pid=200, usedGpuMemory=2048),
+            nvml_struct(pid=300, usedGpuMemory=4096),
+        ]
+        fake_nvml.state["graphics_processes"][0] = [
+            nvml_struct(pid=100, usedGpuMemory=1024),
+            nvml_struct(pid=400, usedGpuMemory=512),
+        ]
+        assert HostGPUs().gpus[0].get_process_memory() == {
+            100: 1024,
+            200: 2048,
+            300: 4096,
+            400: 512,
+        }
+
+
+class TestGPUProcessMonitor:
+    def test_snapshot_and_compose(self, fake_nvml, nvml_struct, fake_host):
+        proc_dir, cgroup_dir = fake_host
+        _set_processes(
+            fake_nvml,
+            nvml_struct,
+            0,
+            [(100, 1024 * 1024), (200, 2 * 1024 * 1024)],
+            [(100, 1, 10, 10), (200, 1, 10, 10)],
+        )
+        gpus = HostGPUs()
+        monitor = GPUProcessMonitor(
+            gpus, cgroup_dir=str(cgroup_dir), proc_dir=str(proc_dir)
+        )
+        # no process is known before the GPUs are queried by a record
+        previous = monitor.snapshot()
+        assert previous == {}
+        current = monitor.snapshot()
+        record = monitor.compose(previous, current, 1.0, gpus.get_processes())
+        assert record["100"]["cpu"] is None
+        assert record["100"]["memory"] == 10.0
+        # the counters of the new processes are kept for the next record
+        assert set(current) == {100, 200}
+        # only the samples taken during the interval are attributed
+        fake_nvml.state["process_utilisation"][0] += [
+            nvml_struct(pid=100, timeStamp=2, smUtil=40, memUtil=10),
+            nvml_struct(pid=200, timeStamp=2, smUtil=20, memUtil=5),
+        ]
+        (cgroup_dir / "job_a" / "cpu.stat").write_text(
+            "usage_usec 1500000\nuser_usec 1000000\nsystem_usec 500000\n"
+        )
+        previous, current = current, monitor.snapshot()
+        record = monitor.compose(previous, current, 1.0, gpus.get_processes())
+        assert record["100"] == {
+            "cgroup": str(cgroup_dir / "job_a"),
+            "cpu": 50.0,
+            "memory": 10.0,
+            "gpu": {"0": [1.0, 40.0, 10.0]},
+        }
+        assert record["200"]["cpu"] == 0.0
+        assert record["200"]["gpu"] == {"0": [2.0, 20.0, 5.0]}
+
+    def test_new_and_exited_process(self, fake_nvml, nvml_struct, fake_host):
+        proc_dir, cgroup_dir = fake_host
+        _set_processes(fake_nvml, nvml_struct, 0, [(100, None)], [])
+        gpus = HostGPUs()
+        monitor = GPUProcessMonitor(
+            gpus, cgroup_dir=str(cgroup_dir), proc_dir=str(proc_dir)
+        )
+        previous = {}
+        monitor.compose({}, previous, 1.0, gpus.get_processes())
+        _set_processes(fake_nvml, nvml_struct, 0, [(200, 1024 * 1024)], [])
+        current = monitor.snapshot()
+        record = monitor.compose(previous, current, 1.0, gpus.get_processes())
+        assert list(monitor._cgroups.keys()) == [200]
+        assert list(record.keys()) == ["200"]
+        assert record["200"]["cpu"] is None
+        assert record["200"]["gpu"] == {"0": [1.0, 0.0, 0.0]}
+        assert list(monitor.snapshot().keys()) == [200]
+
+    def test_unresolved_cgroup(self, fake_nvml, nvml_struct, fake_host):
+        proc_dir, cgroup_dir = fake_host
+        _set_processes(fake_nvml, nvml_struct, 0, [(300, 1024 * 1024)], [])
+        gpus = HostGPUs()
+        monitor = GPUProcessMonitor(
+            gpus, cgroup_dir=str(cgroup_dir), proc_dir=str(proc_dir)
+        )
+        snapshot = {}
+        record = monitor.compose({}, snapshot, 1.0, gpus.get_processes())
+        assert snapshot[300]["cgroup"] is None
+        assert record["300"]["cpu"] is None
+        assert record["300"]["memory"] is None
+
+
+class TestHostMetricsProcesses:
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_record_with_processes(self, mock_cg, mock_eth, fake_nvml):
+        mock_cg.return_value.cpu_usage.return_value = 0
+        mock_cg.return_value.memory_max.return_value = -1
+        mock_cg.return_value.memory_usage.return_value = 0
+        mock_eth.return_value.interfaces = []
+        metrics = HostMetrics(
+            interval=1, gpu_enable=True, uuid="test", process_enable=True
+        )
+        assert isinstance(metrics.process, GPUProcessMonitor)
+        metrics.record()
+        assert metrics.get_records()[0]["processes"] == {}
+
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_processes_queried_once_per_record(
+        self, mock_cg, mock_eth, fake_nvml, nvml_struct
+    ):
+        mock_cg.return_value.cpu_usage.return_value = 0
+        mock_cg.return_value.memory_max.return_value = -1
+        mock_cg.return_value.memory_usage.return_value = 0
+        mock_eth.return_value.interfaces = []
+        _set_processes(
+            fake_nvml, nvml_struct, 0, [(100, 1024 * 1024)], [(100, 1, 30, 10)]
+        )
+        metrics = HostMetrics(
+            interval=1, gpu_enable=True, uuid="test", process_enable=True
+        )
+        fake_nvml.calls.clear()
+        metrics.record()
+        _calls = [c[0] for c in fake_nvml.calls]
+        assert _calls.count("compute_processes") == 2
+        assert _calls.count("process_utilisation") == 2
+        # the utilisation samples of the interval end up in the record
+        assert metrics.get_records()[0]["processes"]["100"]["gpu"] == {
+            "0": [1.0, 30.0, 10.0]
+        }
+
+    @patch("stone_lib.resource.monitor.host_monitor.EthernetMonitor")
+    @patch("stone_lib.resource.monitor.host_monitor.CGroupMonitor")
+    def test_process_requires_gpu(self, mock_cg, mock_eth):
+        metrics = HostMetrics(
+            interval=1, gpu_enable=False, uuid="test", process_enable=True
+        )
+        assert metrics.process is None
@@ -0,0 +1,103 @@
+import random
+
+import numpy as np
+import pytest
+from stone_lib.resource.monitor.rollup import (
+    P2Quantile,
+    RollupSink,
+    WindowRollup,
+    flatten_record,
+)
+
+
+def test_flatten_record():
+    record = {
+        "cpu": {"utilisation": 10.0},
+        "gpu": {0: {"name": "A100", "info": {"gpu_utilisation": 50}}},
+        "cpu_stat": {"cores": [1.0, 2.0]},
+        "cgroup": {"pressure": None, "ok": True},
+    }
+    assert flatten_record(record) == {
+        "cpu.utilisation": 10.0,
+        "gpu.0.info.gpu_utilisation": 50,
+        "cpu_stat.cores.0": 1.0,
+        "cpu_stat.cores.1": 2.0,
+    }
+
+
+class TestP2Quantile:
+    def test_few_values(self):
+        quantile = P2Quantile(0.95)
+        assert quantile.value is None
+        for x in [3, 1, 2]:
+            quantile.add(x)
+        assert quantile.value == pytest.approx(2.9)
+
+    @pytest.mark.parametrize("q", [0.5, 0.95])
+    def test_estimate(self, q):
+        _random = random.Random(0)
+        values = [_random.expovariate(1) for _ in range(5000)]
+        quantile = P2Quantile(q)
+        for x in values:
+            quantile.add(x)
+        assert quantile.value == pytest.approx(np.quantile(values, q), rel=0.05)
+
+
+class TestWindowRollup:
+    def test_init_invalid(self):
+        with pytest.raises(ValueError):
+            WindowRollup(0)
+
+    def test_windows(self):
+        rollup = WindowRollup(1000)
+        rollup.add(1000, {"cpu": 1.0})
+        rollup.add(1500, {"cpu": 3.0, "gpu": 5.0})
+        rollup.add(2100, {"cpu": 10.0})
+        assert rollup.rollups == [
+            {
+                "start": 1000,
+                "end": 2000,
+                "count": 2,
+                "metrics": {
+                    "cpu": {"min": 1.0, "max": 3.0, "mean": 2.0, "p95": 2.9},
+                    "gpu": {"min": 5.0, "max": 5.0, "mean": 5.0, "p95": 5.0},
+                },
+            }
+        ]
+        assert len(rollup.to_json()) == 2
+        assert rollup.to_json()[1]["start"] == 2000
+        assert len(rollup.to_json(include_open=False)) == 1
+
+    def test_close(self):
+        rollup = WindowRollup(1000)
+        rollup.close()
+        assert rollup.rollups == []
+        rollup.add(1000, {"cpu": 1.0})
+        rollup.close()
+        assert rollup.summary() is None
+        assert len(rollup.rollups) == 1
+
+
+class TestRollupSink:
+    def test_call(self):
+        sink = RollupSink(windows=[1000, 10000])
+        for i in range(20):
+            sink(
+                {
+                    "timestamp": i * 100,
+                    "interval": 100,
+                    "cpu": {"utilisation": float(i)},
+                }
+            )
+        sink.flush()
+        rollups = sink.to_json()
+        assert list(rollups) == ["1000", "10000"]
+        assert [w["count"] for w in rollups["1000"]] == [10, 10]
+        assert rollups["10000"][0]["metrics"] == {
+            "cpu.utilisation": {
+                "min": 0.0,
+                "max": 19.0,
+                "mean": 9.5,
+                "p95": 18.05,
+            }
+        }
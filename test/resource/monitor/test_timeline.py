@@ -0,0 +1,174 @@
+import json
+
+import pytest
+from unittest.mock import patch
+from stone_lib.analyser.pytorch.profiler.node import OperatorNode
+from stone_lib.resource.monitor.columnar import write_records
+from stone_lib.resource.monitor.timeline import (
+    ClockAnchor,
+    MonitorTimeline,
+    step_windows,
+)
+
+
+def _records():
+    # a sample every 10 ms from 1000 ms, utilisation equal to its index
+    return [
+        {
+            "timestamp": 1000.0 + 10 * i,
+            "cpu": {"utilisation": float(i)},
+            "gpu": {0: {"name": "A100", "info": {"gpu_utilisation": 2 * i}}},
+            "interval": 10.0,
+        }
+        for i in range(10)
+    ]
+
+
+def _op(start, duration):
+    return OperatorNode(
+        {
+            "ph": "X",
+            "cat": "cpu_op",
+            "name": "aten::mm",
+            "pid": 0,
+            "tid": 0,
+            "ts": start,
+            "dur": duration,
+            "args": {},
+        }
+    )
+
+
+class TestClockAnchor:
+    def test_convert(self):
+        anchor = ClockAnchor(wall=1000.0, reference=50.0, clock="monotonic")
+        assert anchor.to_wall(2050.0) == 1002.0
+        assert anchor.to_reference(1002.0) == 2050.0
+        assert ClockAnchor.from_json(anchor.to_json()).to_json() == anchor.to_json()
+
+    @patch("stone_lib.resource.monitor.timeline.time")
+    def test_capture(self, mock_time):
+        mock_time.time_ns.side_effect = [10**9, 10**9 + 2000]
+        anchor = ClockAnchor.capture(clock=lambda: 5000, name="test")
+        assert anchor.wall == 1000.001
+        assert anchor.reference == 5.0
+        assert anchor.clock == "test"
+
+    def test_capture_monotonic(self):
+        import time
+
+        anchor = ClockAnchor.capture()
+        now = anchor.to_wall(time.monotonic_ns() / 1000)
+        assert abs(now - time.time_ns() / 1e6) < 50
+
+
+class TestMonitorTimeline:
+    def test_samples_overlap(self):
+        timeline = MonitorTimeline(_records())
+        assert len(timeline) == 10
+        # an operator of 1 ms runs within the sample at 1030 ms
+        samples = timeline.samples_for(_op(1_025_000, 1000))
+        assert [s["timestamp"] for s in samples] == [1030.0]
+        samples = timeline.samples(1_015_000, 1_035_000)
+        assert [s["timestamp"] for s in samples] == [1020.0, 1030.0, 1040.0]
+
+    def test_samples_within(self):
+        timeline = MonitorTimeline(_records())
+        assert timeline.samples_for(_op(1_025_000, 1000), overlap=False) == []
+        samples = timeline.samples(1_010_000, 1_030_000, overlap=False)
+        assert [s["timestamp"] for s in samples] == [1010.0, 1020.0, 1030.0]
+
+    def test_samples_outside(self):
+        timeline = MonitorTimeline(_records())
+        assert timeline.samples(0, 500_000) == []
+        # the window starts after the last sample, which does not cover it
+        assert timeline.samples(1_200_000, 1_300_000) == []
+        assert MonitorTimeline([]).samples(0, 10) == []
+
+    def test_samples_gap(self):
+        records = _records()
+        records[-1]["timestamp"] = 5000.0
+        timeline = MonitorTimeline(records)
+        # the sample after the gap only covers its own interval
+        assert timeline.samples(1_100_000, 1_200_000) == []
+
+    def test_unsorted(self):
+        records = _records()
+        timeline = MonitorTimeline(list(reversed(records)))
+        samples = timeline.samples(1_000_000, 1_020_000, overlap=False)
+        assert samples == records[:3]
+
+    def test_anchor(self):
+        anchor = ClockAnchor(wall=1000.0, reference=0.0, clock="monotonic")
+        timeline = MonitorTimeline(_records(), anchor)
+        samples = timeline.samples(10_000, 20_000, overlap=False)
+        assert [s["timestamp"] for s in samples] == [1010.0, 1020.0]
+
+    def test_summary(self):
+        timeline = MonitorTimeline(_records())
+        assert timeline.summary(1_015_000, 1_035_000) == {
+            "count": 3,
+            "cpu.utilisation": 3.0,
+            "gpu.0.info.gpu_utilisation": 6.0,
+        }
+        assert timeline.summary_for(_op(0, 10)) == {"count": 0}
+
+    def test_steps(self):
+        timeline = MonitorTimeline(
+            [
+                {"timestamp": 1724696154700.0, "cpu": {"utilisation": 10.0}},
+                {"timestamp": 1724696154900.0, "cpu": {"utilisation": 30.0}},
+                {"timestamp": 1724696155100.0, "cpu": {"utilisation": 90.0}},
+            ]
+        )
+        events = [
+            {
+                "ph": "X",
+                "cat": "user_annotation",
+                "name": "ProfilerStep#2",
+                "ts": 1724696154696971,
+                "dur": 310239,
+            },
+            {"ph": "X", "cat": "cpu_op", "name": "aten::to", "ts": 1724696154697016},
+        ]
+        steps = timeline.steps(events, overlap=False)
+        assert steps == {
+            2: {
+                "start": 1724696154696971,
+                "end": 1724696155007210,
+                "duration": 310239,
+                "metrics": {"count": 2, "cpu.utilisation": 20.0},
+            }
+        }
+
+    def test_step_windows(self):
+        events = [
+            {"ph": "X", "name": "ProfilerStep#3", "ts": 30, "dur": 10},
+            {"ph": "X", "name": "ProfilerStep#1", "ts": 10, "dur": 10},
+            {"ph": "X", "name": "aten::mm", "ts": 12, "dur": 1},
+            {"ph": "i", "name": "ProfilerStep#2", "ts": 20},
+        ]
+        assert step_windows(events) == {1: (10, 20), 3: (30, 40)}
+
+    def test_load(self, tmp_dir):
+        anchor = ClockAnchor(wall=1000.0, reference=0.0, clock="monotonic")
+        data = {"records": _records(), "clock": anchor.to_json()}
+        with open(tmp_dir / "monitor.json", "w") as f:
+            json.dump(data, f)
+        timeline = MonitorTimeline.load(str(tmp_dir / "monitor.json"), "monotonic")
+        assert timeline.summary(10_000, 10_000, overlap=False)["cpu.utilisation"] == 1.0
+        write_records(str(tmp_dir / "monitor.smc"), _records(), meta=data)
+        timeline = MonitorTimeline.load(str(tmp_dir / "monitor.smc"), "monotonic")
+        assert timeline.summary(10_000, 10_000, overlap=False) == {
+            "count": 1,
+            "cpu.utilisation": 1.0,
+            "gpu.0.info.gpu_utilisation": 2.0,
+        }
+        timeline = MonitorTimeline.load(str(tmp_dir / "monitor.smc"))
+        assert (
+            timeline.samples(1_010_000, 1_010_000, overlap=False)[0]["interval"] == 10
+        )
+
+    def test_missing_anchor(self):
+        with pytest.raises(ValueError):
+            MonitorTimeline.from_json({"records": []}, reference="monotonic")